@@ -0,0 +1,65 @@
+"""add chatwoot_outbox table
+
+Revision ID: o1p2q3r4s5t6
+Revises: n0o1p2q3r4s5
+Create Date: 2026-01-15 12:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = "o1p2q3r4s5t6"
+down_revision = "n0o1p2q3r4s5"
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, table_name: str, schema: str = "sys") -> bool:
+    """Проверяет существование таблицы"""
+    inspector = inspect(conn)
+    return inspector.has_table(table_name, schema=schema)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    op.execute("CREATE SCHEMA IF NOT EXISTS sys")
+
+    if not _table_exists(conn, "chatwoot_outbox", schema="sys"):
+        op.create_table(
+            "chatwoot_outbox",
+            sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+            sa.Column("conversation_id", sa.Text(), nullable=False),
+            sa.Column("event_type", sa.Text(), nullable=False),
+            sa.Column("payload", sa.dialects.postgresql.JSONB(), server_default=sa.text("'{}'::jsonb"), nullable=False),
+            sa.Column("status", sa.Text(), server_default="pending", nullable=False),
+            sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+            sa.Column("next_attempt_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.Column("last_error", sa.Text(), nullable=True),
+            sa.Column("processed_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+            schema="sys",
+        )
+
+        op.create_index(
+            "ix_chatwoot_outbox_conversation_id",
+            "chatwoot_outbox",
+            ["conversation_id"],
+            schema="sys",
+        )
+        # Диспетчер выбирает только pending записи, у которых наступило время попытки
+        op.create_index(
+            "ix_chatwoot_outbox_pending",
+            "chatwoot_outbox",
+            ["next_attempt_at", "id"],
+            schema="sys",
+            postgresql_where=sa.text("status = 'pending'"),
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_chatwoot_outbox_pending", table_name="chatwoot_outbox", schema="sys")
+    op.drop_index("ix_chatwoot_outbox_conversation_id", table_name="chatwoot_outbox", schema="sys")
+    op.drop_table("chatwoot_outbox", schema="sys")
@@ -0,0 +1,42 @@
+"""add rate_limit_buckets table
+
+Revision ID: p2q3r4s5t6u7
+Revises: o1p2q3r4s5t6
+Create Date: 2026-01-20 12:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = "p2q3r4s5t6u7"
+down_revision = "o1p2q3r4s5t6"
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, table_name: str, schema: str = "sys") -> bool:
+    """Проверяет существование таблицы"""
+    inspector = inspect(conn)
+    return inspector.has_table(table_name, schema=schema)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    op.execute("CREATE SCHEMA IF NOT EXISTS sys")
+
+    if not _table_exists(conn, "rate_limit_buckets", schema="sys"):
+        op.create_table(
+            "rate_limit_buckets",
+            sa.Column("key", sa.Text(), nullable=False),
+            sa.Column("tokens", sa.Float(), nullable=False),
+            sa.Column("allowed", sa.Boolean(), server_default=sa.text("true"), nullable=False),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.PrimaryKeyConstraint("key"),
+            schema="sys",
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("rate_limit_buckets", schema="sys")
@@ -0,0 +1,41 @@
+"""add cache_versions table
+
+Revision ID: q3r4s5t6u7v8
+Revises: p2q3r4s5t6u7
+Create Date: 2026-01-22 12:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = "q3r4s5t6u7v8"
+down_revision = "p2q3r4s5t6u7"
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, table_name: str, schema: str = "sys") -> bool:
+    """Проверяет существование таблицы"""
+    inspector = inspect(conn)
+    return inspector.has_table(table_name, schema=schema)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    op.execute("CREATE SCHEMA IF NOT EXISTS sys")
+
+    if not _table_exists(conn, "cache_versions", schema="sys"):
+        op.create_table(
+            "cache_versions",
+            sa.Column("name", sa.Text(), nullable=False),
+            sa.Column("version", sa.BigInteger(), server_default="0", nullable=False),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.PrimaryKeyConstraint("name"),
+            schema="sys",
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("cache_versions", schema="sys")
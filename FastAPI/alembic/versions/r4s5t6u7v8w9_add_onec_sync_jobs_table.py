@@ -0,0 +1,66 @@
+"""add onec_sync_jobs table
+
+Revision ID: r4s5t6u7v8w9
+Revises: q3r4s5t6u7v8
+Create Date: 2026-01-25 12:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = "r4s5t6u7v8w9"
+down_revision = "q3r4s5t6u7v8"
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, table_name: str, schema: str = "sys") -> bool:
+    """Проверяет существование таблицы"""
+    inspector = inspect(conn)
+    return inspector.has_table(table_name, schema=schema)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    op.execute("CREATE SCHEMA IF NOT EXISTS sys")
+
+    if not _table_exists(conn, "onec_sync_jobs", schema="sys"):
+        op.create_table(
+            "onec_sync_jobs",
+            sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+            sa.Column("cons_id", sa.Text(), nullable=False),
+            sa.Column("cl_ref_key", sa.Text(), nullable=False),
+            sa.Column("job_type", sa.Text(), nullable=False),
+            sa.Column("payload", sa.dialects.postgresql.JSONB(), server_default=sa.text("'{}'::jsonb"), nullable=False),
+            sa.Column("status", sa.Text(), server_default="pending", nullable=False),
+            sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+            sa.Column("next_attempt_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.Column("last_error", sa.Text(), nullable=True),
+            sa.Column("processed_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+            schema="sys",
+        )
+
+        op.create_index(
+            "ix_onec_sync_jobs_cons_id",
+            "onec_sync_jobs",
+            ["cons_id"],
+            schema="sys",
+        )
+        # Воркер группирует только pending задачи
+        op.create_index(
+            "ix_onec_sync_jobs_pending",
+            "onec_sync_jobs",
+            ["cons_id", "next_attempt_at", "id"],
+            schema="sys",
+            postgresql_where=sa.text("status = 'pending'"),
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_onec_sync_jobs_pending", table_name="onec_sync_jobs", schema="sys")
+    op.drop_index("ix_onec_sync_jobs_cons_id", table_name="onec_sync_jobs", schema="sys")
+    op.drop_table("onec_sync_jobs", schema="sys")
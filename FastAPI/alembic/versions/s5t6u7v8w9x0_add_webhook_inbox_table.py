@@ -0,0 +1,70 @@
+"""add webhook_inbox table
+
+Revision ID: s5t6u7v8w9x0
+Revises: r4s5t6u7v8w9
+Create Date: 2026-01-26 12:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = "s5t6u7v8w9x0"
+down_revision = "r4s5t6u7v8w9"
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, table_name: str, schema: str = "sys") -> bool:
+    """Проверяет существование таблицы"""
+    inspector = inspect(conn)
+    return inspector.has_table(table_name, schema=schema)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    op.execute("CREATE SCHEMA IF NOT EXISTS sys")
+
+    if not _table_exists(conn, "webhook_inbox", schema="sys"):
+        op.create_table(
+            "webhook_inbox",
+            sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+            sa.Column("source", sa.Text(), nullable=False),
+            sa.Column("event_id", sa.Text(), nullable=False),
+            sa.Column("event_type", sa.Text(), nullable=True),
+            sa.Column("ordering_key", sa.Text(), nullable=False),
+            sa.Column("payload", sa.dialects.postgresql.JSONB(), nullable=False),
+            sa.Column("status", sa.Text(), server_default="pending", nullable=False),
+            sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+            sa.Column("next_attempt_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.Column("last_error", sa.Text(), nullable=True),
+            sa.Column("processed_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("source", "event_id", name="uq_webhook_inbox_source_event"),
+            schema="sys",
+        )
+
+        # Воркер группирует только pending события
+        op.create_index(
+            "ix_webhook_inbox_pending",
+            "webhook_inbox",
+            ["ordering_key", "next_attempt_at", "id"],
+            schema="sys",
+            postgresql_where=sa.text("status = 'pending'"),
+        )
+        # Очистка обработанных событий по сроку хранения
+        op.create_index(
+            "ix_webhook_inbox_processed_at",
+            "webhook_inbox",
+            ["processed_at"],
+            schema="sys",
+            postgresql_where=sa.text("status <> 'pending'"),
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_webhook_inbox_processed_at", table_name="webhook_inbox", schema="sys")
+    op.drop_index("ix_webhook_inbox_pending", table_name="webhook_inbox", schema="sys")
+    op.drop_table("webhook_inbox", schema="sys")
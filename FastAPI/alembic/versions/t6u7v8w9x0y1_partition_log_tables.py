@@ -0,0 +1,122 @@
+"""partition log.consultation_change_log and log.webhook_log by created_at
+
+Существующая таблица переименовывается в <name>_legacy и подключается к новой
+партиционированной таблице как партиция FROM (MINVALUE) TO (начало следующего месяца):
+данные не копируются, а партиция целиком удалится обслуживанием, когда станет старше
+LOG_RETENTION_DAYS. Партиции следующих месяцев создает services.log_partitions
+(init_db при старте и планировщик).
+
+Revision ID: t6u7v8w9x0y1
+Revises: s5t6u7v8w9x0
+Create Date: 2026-01-27 12:00:00.000000
+"""
+from datetime import date, datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = "t6u7v8w9x0y1"
+down_revision = "s5t6u7v8w9x0"
+branch_labels = None
+depends_on = None
+
+# таблица -> индексы родительской таблицы (имя, колонка), кроме первичного ключа
+LOG_TABLES = {
+    "consultation_change_log": [("ix_log_consultation_change_log_cons_id", "cons_id")],
+    "webhook_log": [],
+}
+
+
+def _table_exists(conn, table_name: str, schema: str = "log") -> bool:
+    """Проверяет существование таблицы"""
+    inspector = inspect(conn)
+    return inspector.has_table(table_name, schema=schema)
+
+
+def _is_partitioned(conn, table_name: str, schema: str = "log") -> bool:
+    return conn.execute(sa.text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table p
+            JOIN pg_class c ON c.oid = p.partrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema AND c.relname = :table
+        )
+    """), {"schema": schema, "table": table_name}).scalar()
+
+
+def _next_month_start() -> date:
+    today = datetime.now(timezone.utc).date()
+    return date(today.year + today.month // 12, today.month % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    op.execute("CREATE SCHEMA IF NOT EXISTS log")
+    legacy_until = _next_month_start().isoformat()
+
+    for table, indexes in LOG_TABLES.items():
+        # Новая БД: таблицу создаст init_db сразу партиционированной
+        if not _table_exists(conn, table) or _is_partitioned(conn, table):
+            continue
+
+        legacy = f"{table}_legacy"
+        sequence = conn.execute(
+            sa.text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": f"log.{table}"}
+        ).scalar()
+
+        op.execute(f"ALTER TABLE log.{table} RENAME TO {legacy}")
+        # Первичный ключ партиции должен совпадать с ключом родителя (id, created_at)
+        pkey = conn.execute(sa.text("""
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = CAST(:table AS regclass) AND contype = 'p'
+        """), {"table": f"log.{legacy}"}).scalar()
+        if pkey:
+            op.execute(f'ALTER TABLE log.{legacy} DROP CONSTRAINT "{pkey}"')
+        # Освобождаем имена индексов для родительской таблицы
+        legacy_indexes = conn.execute(sa.text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = 'log' AND tablename = :table"
+        ), {"table": legacy}).scalars().all()
+        for index_name in legacy_indexes:
+            op.execute(f'ALTER INDEX log."{index_name}" RENAME TO "{index_name[:55]}_legacy"')
+
+        op.execute(
+            f"CREATE TABLE log.{table} (LIKE log.{legacy} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE (created_at)"
+        )
+        if sequence:
+            # Иначе последовательность удалится вместе с партицией *_legacy
+            op.execute(f"ALTER SEQUENCE {sequence} OWNED BY log.{table}.id")
+        op.execute(f"ALTER TABLE log.{table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, created_at)")
+        for index_name, column in indexes:
+            op.execute(f"CREATE INDEX {index_name} ON log.{table} ({column})")
+
+        op.execute(
+            f"ALTER TABLE log.{table} ATTACH PARTITION log.{legacy} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{legacy_until} 00:00:00+00')"
+        )
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+
+    for table, indexes in LOG_TABLES.items():
+        if not _table_exists(conn, table) or not _is_partitioned(conn, table):
+            continue
+
+        plain = f"{table}_plain"
+        sequence = conn.execute(
+            sa.text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": f"log.{table}"}
+        ).scalar()
+
+        op.execute(f"CREATE TABLE log.{plain} (LIKE log.{table} INCLUDING DEFAULTS)")
+        op.execute(f"INSERT INTO log.{plain} SELECT * FROM log.{table}")
+        if sequence:
+            op.execute(f"ALTER SEQUENCE {sequence} OWNED BY log.{plain}.id")
+        op.execute(f"DROP TABLE log.{table}")
+        op.execute(f"ALTER TABLE log.{plain} RENAME TO {table}")
+        op.execute(f"ALTER TABLE log.{table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)")
+        for index_name, column in indexes:
+            op.execute(f"CREATE INDEX {index_name} ON log.{table} ({column})")
@@ -0,0 +1,67 @@
+"""add consultation_create_sagas table
+
+Revision ID: u7v8w9x0y1z2
+Revises: t6u7v8w9x0y1
+Create Date: 2026-01-28 12:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = "u7v8w9x0y1z2"
+down_revision = "t6u7v8w9x0y1"
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, table_name: str, schema: str = "sys") -> bool:
+    """Проверяет существование таблицы"""
+    inspector = inspect(conn)
+    return inspector.has_table(table_name, schema=schema)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    op.execute("CREATE SCHEMA IF NOT EXISTS sys")
+
+    if not _table_exists(conn, "consultation_create_sagas", schema="sys"):
+        op.create_table(
+            "consultation_create_sagas",
+            sa.Column("id", sa.dialects.postgresql.UUID(as_uuid=True), nullable=False),
+            sa.Column("cons_id", sa.Text(), nullable=False),
+            sa.Column("client_id", sa.dialects.postgresql.UUID(as_uuid=True), nullable=True),
+            sa.Column("status", sa.Text(), server_default="pending", nullable=False),
+            sa.Column("steps", sa.dialects.postgresql.JSONB(), server_default="{}", nullable=False),
+            sa.Column("context", sa.dialects.postgresql.JSONB(), server_default="{}", nullable=False),
+            sa.Column("result", sa.dialects.postgresql.JSONB(), nullable=True),
+            sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+            sa.Column("next_attempt_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.Column("last_error", sa.Text(), nullable=True),
+            sa.Column("completed_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+            schema="sys",
+        )
+        op.create_index(
+            "ix_sys_consultation_create_sagas_cons_id",
+            "consultation_create_sagas",
+            ["cons_id"],
+            schema="sys",
+        )
+        # Воркер выбирает только незавершенные саги
+        op.create_index(
+            "ix_consultation_create_sagas_pending",
+            "consultation_create_sagas",
+            ["next_attempt_at"],
+            schema="sys",
+            postgresql_where=sa.text("status = 'pending'"),
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_consultation_create_sagas_pending", table_name="consultation_create_sagas", schema="sys")
+    op.drop_index("ix_sys_consultation_create_sagas_cons_id", table_name="consultation_create_sagas", schema="sys")
+    op.drop_table("consultation_create_sagas", schema="sys")
@@ -0,0 +1,53 @@
+"""add chatwoot_contacts table
+
+Revision ID: v8w9x0y1z2a3
+Revises: u7v8w9x0y1z2
+Create Date: 2026-01-29 12:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = "v8w9x0y1z2a3"
+down_revision = "u7v8w9x0y1z2"
+branch_labels = None
+depends_on = None
+
+
+def _table_exists(conn, table_name: str, schema: str = "sys") -> bool:
+    """Проверяет существование таблицы"""
+    inspector = inspect(conn)
+    return inspector.has_table(table_name, schema=schema)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    op.execute("CREATE SCHEMA IF NOT EXISTS sys")
+
+    if not _table_exists(conn, "chatwoot_contacts", schema="sys"):
+        op.create_table(
+            "chatwoot_contacts",
+            sa.Column("client_id", sa.dialects.postgresql.UUID(as_uuid=True), nullable=False),
+            sa.Column("contact_id", sa.BigInteger(), nullable=False),
+            sa.Column("source_id", sa.Text(), nullable=False),
+            sa.Column("pubsub_token", sa.Text(), nullable=True),
+            sa.Column("email", sa.Text(), nullable=True),
+            sa.Column("phone_number", sa.Text(), nullable=True),
+            sa.Column("verified_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+            sa.PrimaryKeyConstraint("client_id"),
+            schema="sys",
+        )
+        for column in ("contact_id", "email", "phone_number"):
+            op.create_index(f"ix_sys_chatwoot_contacts_{column}", "chatwoot_contacts", [column], schema="sys")
+
+        # Клиенты, для которых source_id уже известен, появятся в таблице при первой
+        # консультации (после поиска контакта) или по вебхуку contact.*
+
+
+def downgrade() -> None:
+    for column in ("phone_number", "email", "contact_id"):
+        op.drop_index(f"ix_sys_chatwoot_contacts_{column}", table_name="chatwoot_contacts", schema="sys")
+    op.drop_table("chatwoot_contacts", schema="sys")
@@ -0,0 +1,39 @@
+"""add cl_verified_at to clients
+
+Revision ID: w9x0y1z2a3b4
+Revises: v8w9x0y1z2a3
+Create Date: 2026-02-02 12:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = "w9x0y1z2a3b4"
+down_revision = "v8w9x0y1z2a3"
+branch_labels = None
+depends_on = None
+
+
+def _column_exists(conn, table_name: str, column_name: str, schema: str = "cons") -> bool:
+    """Проверяет существование колонки"""
+    inspector = inspect(conn)
+    columns = [col["name"] for col in inspector.get_columns(table_name, schema=schema)]
+    return column_name in columns
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    # Маркер проверки владельца в ЦЛ (папка CLOBUS). Существующие клиенты остаются
+    # непроверенными: маркер появится при первой консультации или загрузке ETL
+    if not _column_exists(conn, "clients", "cl_verified_at", schema="cons"):
+        op.add_column(
+            "clients",
+            sa.Column("cl_verified_at", sa.DateTime(timezone=True), nullable=True),
+            schema="cons",
+        )
+
+
+def downgrade() -> None:
+    op.drop_column("clients", "cl_verified_at", schema="cons")
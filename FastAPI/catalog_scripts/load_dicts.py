@@ -16,6 +16,7 @@
 
 from FastAPI import models
 from FastAPI.config import settings
+from FastAPI.services.dict_cache import bump_dict_version
 
 LOGGER = logging.getLogger("load_dicts")
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
@@ -116,6 +117,8 @@ async def upsert_rows(session: AsyncSession, table, rows: List[Dict[str, Any]],
         set_=update_columns,
     )
     await session.execute(stmt)
+    # Новая версия справочников станет видна воркерам API вместе с данными (после commit)
+    await bump_dict_version(session)
 
 
 async def load_po_types(client: ODataAsyncClient, session: AsyncSession):
@@ -18,21 +18,23 @@
 import logging
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, Any, List
-from urllib.parse import quote
-import requests
 from sqlalchemy import select, text
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 # Добавляем путь к проекту
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 
 from FastAPI.config import settings
 from FastAPI.models import Consultation, QAndA, Client
+from FastAPI.services.odata_client import PAGE_FETCH_ERRORS, ODataClient, ODataKeysetPaginator
+from FastAPI.utils.etl_pipeline import PagePrefetcher
+from FastAPI.utils.etl_runtime import create_etl_engine, dispose_etl_engine
 
 # Конфигурация
 LOG_LEVEL = os.getenv("ETL_LOG_LEVEL", "INFO")
 PAGE_SIZE = int(os.getenv("ODATA_PAGE_SIZE", "1000"))
 INITIAL_FROM_DATE = os.getenv("ETL_INITIAL_FROM_DATE", "2025-12-01")
+PREFETCH_DEPTH = settings.ETL_PREFETCH_DEPTH
 
 ENTITY = "Document_ТелефонныйЗвонок_ALL"  # Отдельная сущность для отслеживания синхронизации
 
@@ -93,39 +95,6 @@ def clean_datetime(dt_str: Optional[str]) -> Optional[datetime]:
         return None
 
 
-def http_get_with_backoff(url: str, auth: tuple, max_retries: int = 6, timeout: int = 120):
-    """HTTP GET с retry и backoff"""
-    headers = {
-        "User-Agent": "ETL-Consultations-All/1.0",
-        "Accept": "application/json",
-    }
-    s = requests.Session()
-    attempt = 0
-    while True:
-        try:
-            r = s.get(url, auth=auth, headers=headers, timeout=timeout)
-            if r.status_code in (429, 502, 503, 504):
-                if attempt >= max_retries:
-                    r.raise_for_status()
-                wait = min(2 ** attempt, 60)
-                logger.warning("HTTP %s — retry in %s sec (attempt %s)", r.status_code, wait, attempt+1)
-                import time
-                time.sleep(wait)
-                attempt += 1
-                continue
-            r.raise_for_status()
-            return r
-        except requests.RequestException as ex:
-            if attempt >= max_retries:
-                logger.error("HTTP error after %s attempts: %s", attempt+1, ex)
-                raise
-            wait = min(2 ** attempt, 60)
-            logger.warning("Request failed: %s — retry in %s sec (attempt %s)", ex, wait, attempt+1)
-            import time
-            time.sleep(wait)
-            attempt += 1
-
-
 async def get_last_sync_date(db: AsyncSession) -> Optional[datetime]:
     """Получить дату последней синхронизации для всех консультаций"""
     result = await db.execute(
@@ -256,9 +225,8 @@ async def pull_all_consultations():
         logger.error("ODATA config missing. Check ODATA_BASEURL_CL, ODATA_USER, ODATA_PASSWORD")
         sys.exit(1)
     
-    auth = (ODATA_USER, ODATA_PASSWORD)
     # ВАЖНО: Настраиваем пул соединений для ETL скрипта
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=2,
@@ -270,7 +238,7 @@ async def pull_all_consultations():
     AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
     
     try:
-        async with AsyncSessionLocal() as db:
+        async with AsyncSessionLocal() as db, ODataClient(user_agent="ETL-Consultations-All/1.0") as odata:
             # Получаем дату последней синхронизации
             last_sync = await get_last_sync_date(db)
             
@@ -288,87 +256,70 @@ async def pull_all_consultations():
             logger.info(f"Date filter: ДатаСоздания ge datetime'{from_date}'")
             
             total_processed = 0
-            skip = 0
             last_processed_at: Optional[datetime] = last_sync
             
-            while True:
-                # Формируем фильтр только по ДатаСоздания
-                # ВАЖНО: Используем только ДатаСоздания для фильтрации
-                filter_part = f"ДатаСоздания ge datetime'{from_date}'"
-                
-                # ВАЖНО: Правильное кодирование кириллицы для OData
-                encoded_filter = quote(filter_part, safe="'()=<>", encoding='utf-8')
-                encoded_orderby = quote("ДатаСоздания asc", safe=",", encoding='utf-8')
-                
-                url = (
-                    f"{ODATA_BASEURL}Document_ТелефонныйЗвонок?$format=json"
-                    f"&$filter={encoded_filter}"
-                    f"&$orderby={encoded_orderby}"
-                    f"&$top={PAGE_SIZE}&$skip={skip}"
-                )
-                
-                logger.debug(f"Fetching URL: {url}")
-                
-                try:
-                    resp = http_get_with_backoff(url, auth, timeout=120)
-                except Exception as e:
-                    logger.exception("Failed to fetch batch: %s", e)
-                    break
-                
-                response_data = resp.json()
-                batch = response_data.get("value", [])
-                
-                logger.info(f"📥 Fetched batch: {len(batch)} items (skip={skip})")
-                if len(batch) == 0:
-                    logger.info(f"⚠ No more items found. Filter: {filter_part[:100]}...")
-                    break
-                
-                logger.info(f"🔄 Processing batch: {len(batch)} items (skip={skip})")
+            # ВАЖНО: Используем только ДатаСоздания для фильтрации (keyset пагинация по ДатаСоздания, Ref_Key)
+            paginator = ODataKeysetPaginator(
+                entity_url=f"{ODATA_BASEURL}Document_ТелефонныйЗвонок",
+                seek_field="ДатаСоздания",
+                start_value=from_date,
+                tie_breakers=("Ref_Key",),
+                page_size=PAGE_SIZE,
+            )
+            
+            # Следующая страница скачивается из 1C, пока текущая пишется в БД
+            try:
+                async with PagePrefetcher(odata.iter_pages(paginator), depth=PREFETCH_DEPTH) as pages:
+                    async for batch in pages:
+                        logger.info(f"🔄 Processing batch: {len(batch)} items (page={pages.pages})")
                 
-                # Обрабатываем каждую консультацию
-                batch_created = 0
-                batch_updated = 0
-                batch_errors = 0
-                for idx, item in enumerate(batch):
-                    try:
-                        ref_key = item.get("Ref_Key")
-                        if not ref_key:
-                            logger.warning(f"⚠ Item {idx+1} in batch has no Ref_Key, skipping")
-                            batch_errors += 1
-                            continue
+                        # Обрабатываем каждую консультацию
+                        batch_created = 0
+                        batch_updated = 0
+                        batch_errors = 0
+                        for idx, item in enumerate(batch):
+                            try:
+                                ref_key = item.get("Ref_Key")
+                                if not ref_key:
+                                    logger.warning(f"⚠ Item {idx+1} in batch has no Ref_Key, skipping")
+                                    batch_errors += 1
+                                    continue
                         
-                        processed_at = await process_consultation_item(db, item)
+                                processed_at = await process_consultation_item(db, item)
                         
-                        if processed_at and (
-                            last_processed_at is None or processed_at > last_processed_at
-                        ):
-                            last_processed_at = processed_at
-                    except Exception as e:
-                        batch_errors += 1
-                        logger.error(f"✗ Error processing consultation {item.get('Ref_Key', 'N/A')[:20]}: {e}", exc_info=True)
-                        continue
-                
-                if batch_errors > 0:
-                    logger.error(f"✗ Batch had {batch_errors} errors out of {len(batch)} items")
+                                if processed_at and (
+                                    last_processed_at is None or processed_at > last_processed_at
+                                ):
+                                    last_processed_at = processed_at
+                            except Exception as e:
+                                batch_errors += 1
+                                logger.error(f"✗ Error processing consultation {item.get('Ref_Key', 'N/A')[:20]}: {e}", exc_info=True)
+                                continue
                 
-                await db.commit()
-                total_processed += len(batch)
-                logger.info("✓ Processed batch: %s items (total: %s)", len(batch), total_processed)
+                        if batch_errors > 0:
+                            logger.error(f"✗ Batch had {batch_errors} errors out of {len(batch)} items")
                 
-                # ВАЖНО: Сохраняем sync_state после каждого батча для устойчивости при прерывании
-                if last_processed_at:
-                    try:
-                        await save_sync_date(db, last_processed_at)
                         await db.commit()
-                        logger.debug(f"✓ Sync state saved after batch: {last_processed_at}")
-                    except Exception as sync_error:
-                        logger.warning(f"Failed to save sync state after batch: {sync_error}")
-                        # Не прерываем выполнение, продолжаем обработку
-                
-                if len(batch) < PAGE_SIZE:
-                    break
+                        total_processed += len(batch)
+                        logger.info("✓ Processed batch: %s items (total: %s)", len(batch), total_processed)
                 
-                skip += PAGE_SIZE
+                        # ВАЖНО: Сохраняем sync_state после каждого батча для устойчивости при прерывании
+                        if last_processed_at:
+                            try:
+                                await save_sync_date(db, last_processed_at)
+                                await db.commit()
+                                logger.debug(f"✓ Sync state saved after batch: {last_processed_at}")
+                            except Exception as sync_error:
+                                logger.warning(f"Failed to save sync state after batch: {sync_error}")
+                                # Не прерываем выполнение, продолжаем обработку
+            except PAGE_FETCH_ERRORS as e:
+                # Сеть или битая страница: логируем и завершаем проход, как раньше
+                logger.exception("Failed to fetch batch: %s", e)
+            
+            logger.info(
+                "Prefetch: %s pages, waited for 1C %.1f sec (depth=%s)",
+                pages.pages, pages.consumer_wait_seconds, pages.depth,
+            )
             
             # Финальное сохранение даты синхронизации (на случай если последний батч не сохранил)
             if last_processed_at:
@@ -381,13 +332,13 @@ async def pull_all_consultations():
             else:
                 logger.info("✓ Sync completed. Total processed: %s (for queue calculation)", total_processed)
     finally:
-        await engine.dispose()
+        await dispose_etl_engine(engine)
 
 
 if __name__ == "__main__":
     # Создаем таблицу sync_state если её нет
     async def ensure_sync_state_table():
-        engine = create_async_engine(
+        engine = create_etl_engine(
             DATABASE_URL,
             echo=False,
             pool_size=1,
@@ -401,7 +352,7 @@ async def ensure_sync_state_table():
                     last_synced_at TIMESTAMPTZ
                 )
             """))
-        await engine.dispose()
+        await dispose_etl_engine(engine)
     
     asyncio.run(ensure_sync_state_table())
     asyncio.run(pull_all_consultations())
@@ -11,10 +11,8 @@
 import logging
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, Any
-from urllib.parse import quote
-import requests
 from sqlalchemy import select, text
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.dialects.postgresql import insert
 
 # Добавляем путь к проекту
@@ -23,8 +21,10 @@
 from FastAPI.config import settings
 from FastAPI.models import Call, Consultation, Client, User
 from FastAPI.services.chatwoot_client import ChatwootClient
+from FastAPI.services.odata_client import ODataClient, ODataKeysetPaginator
 from FastAPI.utils.notification_helpers import check_and_log_notification
 from FastAPI.utils.etl_logging import ETLLogger
+from FastAPI.utils.etl_runtime import create_etl_engine, dispose_etl_engine
 
 # Конфигурация
 LOG_LEVEL = os.getenv("ETL_LOG_LEVEL", "INFO")
@@ -76,43 +76,6 @@ def clean_datetime(dt_str: Optional[str]) -> Optional[datetime]:
         return None
 
 
-def http_get_with_backoff(url: str, auth: tuple, max_retries: int = 6, timeout: int = 120):
-    """HTTP GET с retry и backoff. Детальное логирование только для ошибок."""
-    headers = {
-        "User-Agent": "ETL-Calls/1.0",
-        "Accept": "application/json",
-    }
-    s = requests.Session()
-    attempt = 0
-    
-    while True:
-        try:
-            r = s.get(url, auth=auth, headers=headers, timeout=timeout)
-            
-            if r.status_code in (429, 502, 503, 504):
-                if attempt >= max_retries:
-                    r.raise_for_status()
-                wait = min(2 ** attempt, 60)
-                logger.warning("⚠ HTTP %s — retry in %s sec (attempt %s/%s)", r.status_code, wait, attempt+1, max_retries+1)
-                import time
-                time.sleep(wait)
-                attempt += 1
-                continue
-            
-            r.raise_for_status()
-            return r
-        except requests.RequestException as ex:
-            if attempt >= max_retries:
-                logger.error("✗ HTTP error after %s attempts: %s", attempt+1, ex)
-                logger.error("  URL: %s", url[:500])
-                raise
-            wait = min(2 ** attempt, 60)
-            logger.debug("Request failed (attempt %s/%s): %s — retry in %s sec", attempt+1, max_retries+1, ex, wait)
-            import time
-            time.sleep(wait)
-            attempt += 1
-
-
 async def get_last_sync_date(db: AsyncSession) -> Optional[datetime]:
     """Получить дату последней синхронизации"""
     result = await db.execute(
@@ -294,9 +257,8 @@ async def pull_calls():
         "PAGE_SIZE": PAGE_SIZE
     })
     
-    auth = (ODATA_USER, ODATA_PASSWORD)
     # ВАЖНО: Настраиваем пул соединений для ETL скрипта
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=2,
@@ -308,7 +270,7 @@ async def pull_calls():
     AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
     
     try:
-        async with AsyncSessionLocal() as db:
+        async with AsyncSessionLocal() as db, ODataClient(user_agent="ETL-Calls/1.0") as odata:
             # Получаем дату последней синхронизации
             last_sync = await get_last_sync_date(db)
             
@@ -331,7 +293,15 @@ async def pull_calls():
                 from_date = from_dt.strftime("%Y-%m-%dT%H:%M:%S")
                 etl_logger.sync_info(None, from_date)
             
-            skip = 0
+            # Keyset пагинация по Period: у регистра сведений нет Ref_Key, поэтому
+            # порядок внутри одного Period фиксируем измерениями регистра
+            paginator = ODataKeysetPaginator(
+                entity_url=f"{ODATA_BASEURL}{ENTITY}",
+                seek_field="Period",
+                start_value=from_date,
+                tie_breakers=("ДокументОбращения_Key", "Абонент_Key", "Менеджер_Key"),
+                page_size=PAGE_SIZE,
+            )
             error_logs = 0
             last_processed_period: Optional[datetime] = last_sync
             
@@ -350,20 +320,14 @@ async def pull_calls():
             batch_errors = 0
             
             while True:
-                batch_num = skip // PAGE_SIZE + 1
-                filter_part = f"Period ge datetime'{from_date}'"
-                
-                url = (
-                    f"{ODATA_BASEURL}{ENTITY}?$format=json"
-                    f"&$filter={quote(filter_part)}"
-                    f"&$orderby=Period asc"
-                    f"&$top={PAGE_SIZE}&$skip={skip}"
-                )
+                batch_num = paginator.page_num
+                skip = paginator.skip
+                url = paginator.next_url()
                 
                 etl_logger.batch_start(batch_num, skip, PAGE_SIZE)
                 
                 try:
-                    resp = http_get_with_backoff(url, auth, timeout=120)
+                    resp = await odata.get(url)
                 except Exception as e:
                     etl_logger.batch_error(batch_num, e, skip)
                     break
@@ -423,10 +387,9 @@ async def pull_calls():
                     except Exception as sync_error:
                         logger.warning(f"[pull_calls_cl] Failed to save sync state after batch: {sync_error}")
                 
-                if len(batch) < PAGE_SIZE:
+                paginator.advance(batch)
+                if paginator.exhausted:
                     break
-                
-                skip += PAGE_SIZE
             
             # Финальное сохранение даты синхронизации
             # ВАЖНО: Сохраняем максимальную дату из обработанных записей или текущую дату
@@ -446,12 +409,12 @@ async def pull_calls():
         etl_logger.finish(success=False, error=e)
         sys.exit(1)
     finally:
-        await engine.dispose()
+        await dispose_etl_engine(engine)
 
 
 async def ensure_support_tables():
     """Создаем вспомогательные таблицы и индексы при необходимости."""
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=1,
@@ -469,7 +432,7 @@ async def ensure_support_tables():
             CREATE UNIQUE INDEX IF NOT EXISTS uq_calls_period_cons_manager
             ON cons.calls (period, cons_key, manager)
         """))
-    await engine.dispose()
+    await dispose_etl_engine(engine)
 
 
 if __name__ == "__main__":
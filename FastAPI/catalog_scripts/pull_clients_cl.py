@@ -10,6 +10,8 @@
 - заполняем org_inn из поля ИНН
 - заполняем code_abonent из поля КодАбонентаClobus
 - для всех клиентов из ЦЛ устанавливаем is_parent=true (в ЦЛ создаются только владельцы)
+- обновляем маркер проверки владельца cl_verified_at (services.owner_verification):
+  клиент из папки CLOBUS без пометки удаления считается проверенным, иначе маркер сбрасывается
 """
 from __future__ import annotations
 
@@ -18,20 +20,21 @@
 import asyncio
 import logging
 import re
-import time
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any, List, Tuple
-from urllib.parse import quote
 
-import requests
 from sqlalchemy import select, update, text
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 # Добавляем путь к проекту
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
 
 from FastAPI.config import settings
 from FastAPI.models import Client
+from FastAPI.services.odata_client import PAGE_FETCH_ERRORS, ODataClient, ODataKeysetPaginator, odata_string
+from FastAPI.services.owner_verification import onec_item_verifies_owner
+from FastAPI.utils.etl_pipeline import PagePrefetcher
+from FastAPI.utils.etl_runtime import create_etl_engine, dispose_etl_engine, report_etl_changes
 
 LOG_LEVEL = os.getenv("ETL_LOG_LEVEL", "INFO")
 PAGE_SIZE = int(os.getenv("ODATA_PAGE_SIZE", "1000"))
@@ -54,10 +57,7 @@
     f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
 )
 
-HEADERS = {
-    "User-Agent": "cons-middleware/clients-loader",
-    "Accept": "application/json",
-}
+USER_AGENT = "cons-middleware/clients-loader"
 
 
 def clean_uuid(value: Optional[str]) -> Optional[str]:
@@ -104,33 +104,6 @@ async def save_sync_code(db: AsyncSession, code: str):
     )
 
 
-def http_get_with_backoff(url: str, auth: Tuple[str, str], max_retries: int = 6, timeout: int = 120):
-    """HTTP GET с retry и backoff"""
-    session = requests.Session()
-    attempt = 0
-    while True:
-        try:
-            resp = session.get(url, auth=auth, headers=HEADERS, timeout=timeout)
-            if resp.status_code in (429, 502, 503, 504):
-                if attempt >= max_retries:
-                    resp.raise_for_status()
-                wait = min(2 ** attempt, 60)
-                logger.warning("HTTP %s — retry in %s sec (attempt=%s)", resp.status_code, wait, attempt + 1)
-                time.sleep(wait)
-                attempt += 1
-                continue
-            resp.raise_for_status()
-            return resp
-        except requests.RequestException as exc:
-            if attempt >= max_retries:
-                logger.error("HTTP error after %s attempts: %s", attempt + 1, exc)
-                raise
-            wait = min(2 ** attempt, 60)
-            logger.warning("Request failed: %s — retry in %s sec (attempt=%s)", exc, wait, attempt + 1)
-            time.sleep(wait)
-            attempt += 1
-
-
 def extract_contact_info(contact_list: List[Dict[str, Any]]) -> Tuple[Optional[str], Optional[str]]:
     """Извлечь email и телефон из КонтактнаяИнформация"""
     email = None
@@ -282,8 +255,14 @@ def clean_company_name(name_str: str) -> str:
     # В ЦЛ создаются только владельцы, пользователи создаются только через фронтенд
     is_parent = True
     
+    # Загрузка из ЦЛ подтверждает владельца: консультация не будет проверять его в 1C
+    # в пределах ONEC_OWNER_VERIFY_SECONDS
+    verified_at = datetime.now(timezone.utc) if onec_item_verifies_owner(item) else None
+    
     if existing_client:
         # Обновляем существующего клиента
+        # ВАЖНО: маркер проверки не считается изменением клиента (не влияет на счетчики ETL)
+        existing_client.cl_verified_at = verified_at
         updated = False
         if email and existing_client.email != email:
             existing_client.email = email
@@ -373,6 +352,7 @@ def clean_company_name(name_str: str) -> str:
         new_client = Client(
             cl_ref_key=ref_key,
             parent_key=parent_key,  # Сохраняем Parent_Key из ЦЛ
+            cl_verified_at=verified_at,
             email=email,
             phone_number=phone,
             org_inn=org_inn,
@@ -402,9 +382,8 @@ async def pull_clients():
         logger.error("ODATA config missing. Check ODATA_BASEURL_CL, ODATA_USER, ODATA_PASSWORD")
         sys.exit(1)
     
-    auth = (ODATA_USER, ODATA_PASSWORD)
     # ВАЖНО: Настраиваем пул соединений для ETL скрипта
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=2,
@@ -416,7 +395,7 @@ async def pull_clients():
     AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
     
     try:
-        async with AsyncSessionLocal() as db:
+        async with AsyncSessionLocal() as db, ODataClient(user_agent=USER_AGENT) as odata:
             # Получаем последний синхронизированный Code
             last_sync_code = await get_last_sync_code(db)
             
@@ -429,68 +408,59 @@ async def pull_clients():
             
             total_inserted = 0
             total_updated = 0
-            skip = 0
             last_code_in_batch = None
+            # Keyset пагинация по (Code, Ref_Key) вместо растущего $skip
+            paginator = ODataKeysetPaginator(
+                entity_url=f"{ODATA_BASEURL}{ENTITY}",
+                seek_field="Code",
+                start_value=from_code,
+                literal=odata_string,
+                tie_breakers=("Ref_Key",),
+                page_size=PAGE_SIZE,
+            )
             
-            while True:
-                # Инкрементальная загрузка по полю Code
-                filter_part = f"Code ge '{from_code}'"
-                url = (
-                    f"{ODATA_BASEURL}{ENTITY}?$format=json"
-                    f"&$filter={quote(filter_part)}"
-                    f"&$orderby=Code asc"
-                    f"&$top={PAGE_SIZE}&$skip={skip}"
-                )
-                
-                try:
-                    resp = http_get_with_backoff(url, auth, timeout=120)
-                except Exception as e:
-                    logger.exception("Failed to fetch batch: %s", e)
-                    break
-                
-                batch = resp.json().get("value", [])
-                if not batch:
-                    break
-                
-                logger.info("Processing batch: %s items (skip=%s)", len(batch), skip)
-                
-                # Обрабатываем каждый клиент
-                for item in batch:
-                    try:
-                        is_new, is_updated = await upsert_client(db, item)
-                        if is_new:
-                            total_inserted += 1
-                        elif is_updated:
-                            total_updated += 1
+            # Инкрементальная загрузка по полю Code; следующая страница качается, пока текущая пишется в БД
+            try:
+                async with PagePrefetcher(odata.iter_pages(paginator)) as pages:
+                    async for batch in pages:
+                        logger.info("Processing batch: %s items (page=%s)", len(batch), pages.pages)
                         
-                        # Сохраняем последний обработанный Code
-                        code = item.get("Code")
-                        if code:
-                            last_code_in_batch = code
-                    except Exception as e:
-                        logger.error("Error processing client %s: %s", item.get("Ref_Key"), e)
-                        continue
-                
-                await db.commit()
-                
-                # Сохраняем последний синхронизированный Code
-                if last_code_in_batch:
-                    await save_sync_code(db, last_code_in_batch)
-                    await db.commit()
+                        # Обрабатываем каждый клиент
+                        for item in batch:
+                            try:
+                                is_new, is_updated = await upsert_client(db, item)
+                                if is_new:
+                                    total_inserted += 1
+                                elif is_updated:
+                                    total_updated += 1
+                        
+                                # Сохраняем последний обработанный Code
+                                code = item.get("Code")
+                                if code:
+                                    last_code_in_batch = code
+                            except Exception as e:
+                                logger.error("Error processing client %s: %s", item.get("Ref_Key"), e)
+                                continue
                 
-                if len(batch) < PAGE_SIZE:
-                    break
+                        await db.commit()
                 
-                skip += PAGE_SIZE
+                        # Сохраняем последний синхронизированный Code
+                        if last_code_in_batch:
+                            await save_sync_code(db, last_code_in_batch)
+                            await db.commit()
+            except PAGE_FETCH_ERRORS as e:
+                # Сеть или битая страница: логируем и завершаем проход, как раньше
+                logger.exception("Failed to fetch batch: %s", e)
             
             logger.info("✓ Clients sync completed. Inserted: %s, Updated: %s", total_inserted, total_updated)
+            report_etl_changes(total_inserted + total_updated)
     finally:
-        await engine.dispose()
+        await dispose_etl_engine(engine)
 
 
 async def ensure_support_tables():
     """Создаем вспомогательные таблицы и индексы при необходимости."""
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=1,
@@ -510,7 +480,7 @@ async def ensure_support_tables():
             ALTER TABLE sys.sync_state 
             ADD COLUMN IF NOT EXISTS last_synced_code TEXT
         """))
-    await engine.dispose()
+    await dispose_etl_engine(engine)
 
 
 if __name__ == "__main__":
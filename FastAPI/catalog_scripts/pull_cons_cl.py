@@ -9,26 +9,41 @@
 Использует инкрементальную загрузку по полю ДатаИзменения.
 Это позволяет эффективно загружать только измененные документы,
 а не все новые и будущие консультации.
+
+Изменения для Chatwoot (статус, custom_attributes, уведомления о переназначении)
+не отправляются по HTTP внутри транзакции, а пишутся в sys.chatwoot_outbox
+(см. FastAPI/services/chatwoot_outbox.py).
 """
 import os
 import sys
 import asyncio
 import logging
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any, List
+from collections import Counter
+from typing import Optional, Dict, Any, FrozenSet, List, Set, Tuple
 from urllib.parse import quote, quote_plus
-import requests
 import httpx
-from sqlalchemy import select, text
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy import case, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 # Добавляем путь к проекту
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 
 from FastAPI.config import settings
 from FastAPI.models import Consultation, QAndA, Client
-from FastAPI.services.chatwoot_client import ChatwootClient
+from FastAPI.services.chatwoot_outbox import (
+    EVENT_CUSTOM_ATTRIBUTES,
+    EVENT_MANAGER_CHANGE,
+    EVENT_RECONCILE,
+    EVENT_STATUS,
+    enqueue_chatwoot_event,
+)
+from FastAPI.services.manager_load import stash_consultation_snapshots
+from FastAPI.services.consultation_events import publish_consultation_updates
+from FastAPI.services.odata_client import ODataClient, ODataKeysetPaginator
 from FastAPI.utils.etl_logging import ETLLogger
+from FastAPI.utils.etl_runtime import create_etl_engine, dispose_etl_engine
 
 # Конфигурация
 LOG_LEVEL = os.getenv("ETL_LOG_LEVEL", "INFO")
@@ -39,6 +54,10 @@
 REF_KEY_BATCH_SIZE = int(os.getenv("ETL_CONS_REF_KEY_BATCH_SIZE", "50"))  # Размер батча для запросов по Ref_Key
 # Ограничиваем длину URL: при слишком большом батче IIS/1C возвращает 404. Значение 40 ~ 1.6KB фильтр.
 MAX_REF_KEYS_PER_REQUEST = int(os.getenv("ETL_CONS_MAX_KEYS_PER_REQUEST", "40"))
+# Batch-режим: страница OData обрабатывается set-based запросами (см. process_consultation_batch)
+BATCH_UPSERT = os.getenv("ETL_CONS_BATCH_UPSERT", "true").lower() in ("1", "true", "yes")
+# Строк в одном INSERT (лимит asyncpg — 32767 параметров на запрос)
+BATCH_UPSERT_CHUNK = int(os.getenv("ETL_CONS_BATCH_UPSERT_CHUNK", "500"))
 
 # Режим работы ETL: "incremental" (по умолчанию) или "open_update"
 ETL_MODE = os.getenv("ETL_CONS_MODE", "incremental")
@@ -167,62 +186,6 @@ def is_valid_chatwoot_conversation_id(cons_id: Optional[str]) -> bool:
     return cons_id.isdigit()
 
 
-def http_get_with_backoff(url: str, auth: tuple, max_retries: int = 6, timeout: int = 120):
-    """HTTP GET с retry и backoff. Детальное логирование только для ошибок."""
-    headers = {
-        "User-Agent": "ETL-Consultations/1.0",
-        "Accept": "application/json",
-    }
-    s = requests.Session()
-    attempt = 0
-    
-    while True:
-        try:
-            r = s.get(url, auth=auth, headers=headers, timeout=timeout)
-            
-            # Ошибки 4xx (кроме 429) - это клиентские ошибки, не ретраим
-            if 400 <= r.status_code < 500 and r.status_code != 429:
-                logger.error("✗ HTTP %s Client Error (no retry): %s", r.status_code, r.reason)
-                logger.error("  URL: %s", url[:500])
-                try:
-                    error_body = r.text[:1000]
-                    logger.error("  Error response: %s", error_body)
-                except:
-                    pass
-                r.raise_for_status()
-            
-            # Ошибки 5xx и 429 - ретраим
-            if r.status_code in (429, 502, 503, 504):
-                if attempt >= max_retries:
-                    r.raise_for_status()
-                wait = min(2 ** attempt, 60)
-                logger.warning("⚠ HTTP %s — retry in %s sec (attempt %s/%s)", r.status_code, wait, attempt+1, max_retries+1)
-                import time
-                time.sleep(wait)
-                attempt += 1
-                continue
-            
-            r.raise_for_status()
-            return r
-        except requests.RequestException as ex:
-            # Для 4xx ошибок не ретраим - логируем детально
-            if hasattr(ex, 'response') and ex.response is not None and 400 <= ex.response.status_code < 500:
-                logger.error("✗ HTTP %s Client Error: %s", ex.response.status_code, ex)
-                logger.error("  URL: %s", url[:500])
-                if hasattr(ex.response, 'text'):
-                    logger.error("  Response: %s", ex.response.text[:500])
-                raise
-            if attempt >= max_retries:
-                logger.error("✗ HTTP error after %s attempts: %s", attempt+1, ex)
-                logger.error("  URL: %s", url[:500])
-                raise
-            wait = min(2 ** attempt, 60)
-            logger.debug("Request failed (attempt %s/%s): %s — retry in %s sec", attempt+1, max_retries+1, ex, wait)
-            import time
-            time.sleep(wait)
-            attempt += 1
-
-
 async def get_last_sync_date(db: AsyncSession) -> Optional[datetime]:
     """Получить дату последней синхронизации. Всегда возвращает offset-aware datetime (UTC)."""
     result = await db.execute(
@@ -316,6 +279,138 @@ async def get_con_calls_aggregated(db: AsyncSession, cons_ref_key: str) -> Optio
         return None
 
 
+def format_chatwoot_datetime(value: Any) -> Optional[str]:
+    """Дата/время для custom_attributes Chatwoot (naive UTC, ISO без зоны)"""
+    if isinstance(value, datetime):
+        if value.tzinfo:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime("%Y-%m-%dT%H:%M:%S")
+    if hasattr(value, "strftime"):
+        # Это date - просто форматируем
+        return value.strftime("%Y-%m-%dT00:00:00")
+    return None
+
+
+def build_chatwoot_custom_attributes(consultation: Consultation) -> Dict[str, Any]:
+    """custom_attributes conversation из полей консультации (номер, даты, перенос, вид обращения)"""
+    custom_attrs = {}
+
+    # Номер консультации (используем правильный ключ number_con)
+    if consultation.number:
+        custom_attrs["number_con"] = str(consultation.number)
+
+    # Дата консультации (date_con) и дата окончания (con_end)
+    if consultation.start_date and format_chatwoot_datetime(consultation.start_date):
+        custom_attrs["date_con"] = format_chatwoot_datetime(consultation.start_date)
+    if consultation.end_date and format_chatwoot_datetime(consultation.end_date):
+        custom_attrs["con_end"] = format_chatwoot_datetime(consultation.end_date)
+
+    # Перенос (дата) - redate_con из etl_redate_cl
+    # ВАЖНО: redate имеет тип Date (не DateTime), поэтому нет tzinfo
+    if consultation.redate and format_chatwoot_datetime(consultation.redate):
+        custom_attrs["redate_con"] = format_chatwoot_datetime(consultation.redate)
+
+    # Перенос (время) - retime_con из etl_redate_cl
+    if consultation.redate_time:
+        if hasattr(consultation.redate_time, 'strftime'):
+            custom_attrs["retime_con"] = consultation.redate_time.strftime("%H:%M")
+        else:
+            # Если это строка или другой формат
+            custom_attrs["retime_con"] = str(consultation.redate_time)
+
+    # Вид обращения (consultation_type)
+    if consultation.consultation_type:
+        custom_attrs["consultation_type"] = str(consultation.consultation_type)
+
+    # Закрыто без консультации - closed_without_con из etl_cons_cl
+    if consultation.denied is not None:
+        custom_attrs["closed_without_con"] = bool(consultation.denied)
+
+    return custom_attrs
+
+
+def closed_duration_message(consultation: Consultation) -> str:
+    """Сообщение о закрытии менеджером с длительностью разговора"""
+    if consultation.start_date and consultation.end_date:
+        duration_minutes = int((consultation.end_date - consultation.start_date).total_seconds() / 60)
+        if duration_minutes > 0:
+            return f"Заявка была закрыта менеджером. Разговор состоялся {duration_minutes} минут."
+    return "Заявка была закрыта менеджером."
+
+
+def reconcile_terminal_status_in_chatwoot(db: AsyncSession, consultation: Consultation, old_status: Optional[str]):
+    """
+    Reconciliation: если статус terminal, но Chatwoot conversation может быть ещё открыта
+    (например, cancelled был записан в БД до того, как handler был добавлен).
+    Диспетчер outbox закроет conversation, только если она действительно open/pending.
+    """
+    if old_status not in ("cancelled", "closed") or not is_valid_chatwoot_conversation_id(consultation.cons_id):
+        return
+    msg = "Заявка закрыта без консультации." if old_status == "cancelled" else "Заявка была закрыта менеджером."
+    enqueue_chatwoot_event(db, consultation.cons_id, EVENT_RECONCILE, {"message": msg})
+
+
+def sync_status_to_chatwoot(db: AsyncSession, consultation: Consultation, old_status: Optional[str], status: str):
+    """
+    Ставит в outbox изменение статуса консультации из ЦЛ для Chatwoot (закрытие/открытие/pending).
+
+    ВАЖНО: событие пишется в той же транзакции, что и консультация; HTTP вызов делает
+    диспетчер outbox уже после commit.
+    """
+    if not is_valid_chatwoot_conversation_id(consultation.cons_id):
+        if consultation.cons_id:
+            # Логируем, если cons_id есть, но невалидный (UUID или временный)
+            logger.debug(
+                f"Skipping Chatwoot status sync for consultation {consultation.cl_ref_key}: "
+                f"cons_id={consultation.cons_id} is not a valid Chatwoot conversation ID (UUID or temporary)"
+            )
+        return
+    if status == old_status:
+        return
+
+    payload = None
+    if status == "closed":
+        # Закрываем с сообщением о длительности разговора
+        payload = {"status": "resolved", "message": closed_duration_message(consultation)}
+    elif status in ("open", "pending"):
+        # open - КонсультацияИТС с пустым Конец
+        payload = {"status": status}
+    elif status == "cancelled":
+        # ЗакрытоБезКонсультации
+        payload = {
+            "status": "resolved",
+            "custom_attributes": {"closed_without_con": True},
+            "message": "Заявка была закрыта без консультации.",
+        }
+    elif status == "other":
+        # ВидОбращения=Другое
+        payload = {"status": "resolved", "message": "Заявка была закрыта."}
+
+    if payload:
+        enqueue_chatwoot_event(db, consultation.cons_id, EVENT_STATUS, payload)
+
+
+def sync_fields_to_chatwoot(db: AsyncSession, consultation: Consultation):
+    """Ставит в outbox синхронизацию номера консультации и других полей в Chatwoot custom_attributes"""
+    if not is_valid_chatwoot_conversation_id(consultation.cons_id):
+        if consultation.cons_id:
+            logger.debug(
+                f"Skipping Chatwoot custom_attributes sync for consultation {consultation.cl_ref_key}: "
+                f"cons_id={consultation.cons_id} is not a valid Chatwoot conversation ID (UUID or temporary)"
+            )
+        return
+    custom_attrs = build_chatwoot_custom_attributes(consultation)
+    if custom_attrs:
+        enqueue_chatwoot_event(db, consultation.cons_id, EVENT_CUSTOM_ATTRIBUTES, {"custom_attributes": custom_attrs})
+
+
+def notify_manager_change(db: AsyncSession, consultation: Consultation, old_manager: Optional[str]):
+    """Ставит в outbox уведомления о переназначении менеджера и об изменении очереди"""
+    enqueue_chatwoot_event(db, consultation.cons_id, EVENT_MANAGER_CHANGE, {
+        "old_manager_key": old_manager,
+        "new_manager_key": consultation.manager,
+        "reason": "Переназначено в ЦЛ",
+    })
 
 
 async def process_consultation_item(
@@ -430,232 +525,14 @@ async def process_consultation_item(
                 f"current status '{old_status}' is terminal, not updating to '{status}' from ЦЛ"
             )
             # Reconciliation: если статус terminal, но Chatwoot conversation может быть ещё открыта
-            # (например, cancelled был записан в БД до того, как handler был добавлен)
-            if old_status in ("cancelled", "closed") and is_valid_chatwoot_conversation_id(consultation.cons_id):
-                try:
-                    chatwoot_client = ChatwootClient()
-                    conv_data = await chatwoot_client.get_conversation(conversation_id=consultation.cons_id)
-                    chatwoot_status = conv_data.get("status") if conv_data else None
-                    if chatwoot_status in ("open", "pending"):
-                        await chatwoot_client.toggle_conversation_status(
-                            conversation_id=consultation.cons_id,
-                            status="resolved"
-                        )
-                        msg = "Заявка закрыта без консультации." if old_status == "cancelled" else "Заявка была закрыта менеджером."
-                        await chatwoot_client.send_message(
-                            conversation_id=consultation.cons_id,
-                            content=msg,
-                            message_type="outgoing"
-                        )
-                        logger.info(f"Reconciliation: closed Chatwoot conversation {consultation.cons_id} (DB status was already '{old_status}')")
-                except Exception as recon_error:
-                    logger.debug(f"Reconciliation check failed for {consultation.cons_id}: {recon_error}")
+            reconcile_terminal_status_in_chatwoot(db, consultation, old_status)
             # Пропускаем обновление статуса, но продолжаем обновлять другие поля
         elif consultation.status != status:
             consultation.status = status
             has_changes = True
             
-            # ВАЖНО: Синхронизируем статус с Chatwoot при изменении
-            # Если статус изменился и есть валидный cons_id, обновляем в Chatwoot
-            if is_valid_chatwoot_conversation_id(consultation.cons_id):
-                try:
-                    chatwoot_client = ChatwootClient()
-                    # Если статус "closed" - закрываем в Chatwoot с сообщением о длительности разговора
-                    if status == "closed" and old_status != "closed":
-                        # Вычисляем длительность разговора
-                        duration_message = ""
-                        if consultation.start_date and consultation.end_date:
-                            duration = consultation.end_date - consultation.start_date
-                            duration_minutes = int(duration.total_seconds() / 60)
-                            if duration_minutes > 0:
-                                duration_message = f" Заявка была закрыта менеджером. Разговор состоялся {duration_minutes} минут."
-                            else:
-                                duration_message = " Заявка была закрыта менеджером."
-                        else:
-                            duration_message = " Заявка была закрыта менеджером."
-                        
-                        # Закрываем беседу через toggle_status
-                        await chatwoot_client.toggle_conversation_status(
-                            conversation_id=consultation.cons_id,
-                            status="resolved"
-                        )
-                        
-                        # Отправляем сообщение о закрытии
-                        if duration_message:
-                            await chatwoot_client.send_message(
-                                conversation_id=consultation.cons_id,
-                                content=duration_message.strip(),
-                                message_type="outgoing"
-                            )
-                        
-                        logger.info(f"Automatically closed consultation {consultation.cons_id} in Chatwoot (closed in 1C:ЦЛ) with message")
-                    # Если статус "open" (КонсультацияИТС с пустым Конец) - открываем в Chatwoot
-                    elif status == "open" and old_status != "open":
-                        await chatwoot_client.update_conversation(
-                            conversation_id=consultation.cons_id,
-                            status="open"  # Открываем заявку в Chatwoot
-                        )
-                        logger.info(f"Automatically opened consultation {consultation.cons_id} in Chatwoot (opened in 1C:ЦЛ)")
-                    # Если статус "pending" - устанавливаем pending в Chatwoot
-                    elif status == "pending" and old_status != "pending":
-                        await chatwoot_client.update_conversation(
-                            conversation_id=consultation.cons_id,
-                            status="pending"  # Устанавливаем статус pending в Chatwoot
-                        )
-                        logger.info(f"Automatically set pending status for consultation {consultation.cons_id} in Chatwoot")
-                    # Если статус "cancelled" (ЗакрытоБезКонсультации) - закрываем в Chatwoot
-                    elif status == "cancelled" and old_status != "cancelled":
-                        await chatwoot_client.toggle_conversation_status(
-                            conversation_id=consultation.cons_id,
-                            status="resolved"
-                        )
-                        # Обновляем custom_attribute closed_without_con
-                        await chatwoot_client.update_conversation_custom_attributes(
-                            conversation_id=consultation.cons_id,
-                            custom_attributes={"closed_without_con": True}
-                        )
-                        await chatwoot_client.send_message(
-                            conversation_id=consultation.cons_id,
-                            content="Заявка была закрыта без консультации.",
-                            message_type="outgoing"
-                        )
-                        logger.info(f"Automatically cancelled consultation {consultation.cons_id} in Chatwoot (cancelled in 1C:ЦЛ)")
-                    # Если статус "other" (ВидОбращения=Другое) - закрываем в Chatwoot
-                    elif status == "other" and old_status != "other":
-                        await chatwoot_client.toggle_conversation_status(
-                            conversation_id=consultation.cons_id,
-                            status="resolved"
-                        )
-                        await chatwoot_client.send_message(
-                            conversation_id=consultation.cons_id,
-                            content="Заявка была закрыта.",
-                            message_type="outgoing"
-                        )
-                        logger.info(f"Automatically resolved consultation {consultation.cons_id} in Chatwoot (status 'other' in 1C:ЦЛ)")
-                except Exception as sync_error:
-                    # ВАЖНО: Не прерываем обработку консультации из-за ошибок Chatwoot
-                    # Логируем ошибку, но продолжаем обработку остальных полей
-                    error_msg = str(sync_error)
-                    if "ConnectError" in error_msg or "connection" in error_msg.lower():
-                        logger.warning(
-                            f"Chatwoot connection error while syncing consultation status {consultation.cons_id}: {sync_error}. "
-                            f"Chatwoot may be unavailable. Continuing ETL process..."
-                        )
-                    else:
-                        logger.warning(f"Failed to sync consultation status {consultation.cons_id} in Chatwoot: {sync_error}")
-            elif consultation.cons_id:
-                # Логируем, если cons_id есть, но невалидный (UUID или временный)
-                logger.debug(
-                    f"Skipping Chatwoot status sync for consultation {consultation.cl_ref_key}: "
-                    f"cons_id={consultation.cons_id} is not a valid Chatwoot conversation ID (UUID or temporary)"
-                )
-        
-        # Синхронизируем номер консультации и другие поля в Chatwoot custom_attributes
-        if is_valid_chatwoot_conversation_id(consultation.cons_id):
-            try:
-                chatwoot_client = ChatwootClient()
-                custom_attrs_to_update = {}
-                
-                # Номер консультации (используем правильный ключ number_con)
-                if consultation.number:
-                    custom_attrs_to_update["number_con"] = str(consultation.number)
-                
-                # Дата консультации (date_con) - всегда обновляем если есть
-                if consultation.start_date:
-                    # Проверяем тип: может быть datetime или date
-                    dt = consultation.start_date
-                    if isinstance(dt, datetime):
-                        # Это datetime - обрабатываем timezone
-                        if dt.tzinfo:
-                            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
-                        custom_attrs_to_update["date_con"] = dt.strftime("%Y-%m-%dT%H:%M:%S")
-                    elif hasattr(dt, 'strftime'):
-                        # Это date - просто форматируем
-                        custom_attrs_to_update["date_con"] = dt.strftime("%Y-%m-%dT00:00:00")
-                
-                # Дата окончания (con_end из etl_cons_cl) - всегда обновляем если есть
-                if consultation.end_date:
-                    dt = consultation.end_date
-                    if isinstance(dt, datetime):
-                        if dt.tzinfo:
-                            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
-                        custom_attrs_to_update["con_end"] = dt.strftime("%Y-%m-%dT%H:%M:%S")
-                    elif hasattr(dt, 'strftime'):
-                        custom_attrs_to_update["con_end"] = dt.strftime("%Y-%m-%dT00:00:00")
-                
-                # Перенос (дата) - redate_con из etl_redate_cl
-                # ВАЖНО: redate имеет тип Date (не DateTime), поэтому нет tzinfo
-                if consultation.redate:
-                    # redate - это date объект, не datetime
-                    if isinstance(consultation.redate, datetime):
-                        dt = consultation.redate
-                        if dt.tzinfo:
-                            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
-                        custom_attrs_to_update["redate_con"] = dt.strftime("%Y-%m-%dT%H:%M:%S")
-                    elif hasattr(consultation.redate, 'strftime'):
-                        # Это date объект
-                        custom_attrs_to_update["redate_con"] = consultation.redate.strftime("%Y-%m-%dT00:00:00")
-                
-                # Перенос (время) - retime_con из etl_redate_cl - всегда обновляем если есть
-                if consultation.redate_time:
-                    if hasattr(consultation.redate_time, 'strftime'):
-                        custom_attrs_to_update["retime_con"] = consultation.redate_time.strftime("%H:%M")
-                    else:
-                        # Если это строка или другой формат
-                        custom_attrs_to_update["retime_con"] = str(consultation.redate_time)
-                
-                # Вид обращения (consultation_type) - всегда обновляем если есть
-                if consultation.consultation_type:
-                    custom_attrs_to_update["consultation_type"] = str(consultation.consultation_type)
-                
-                # Закрыто без консультации - closed_without_con из etl_cons_cl
-                if consultation.denied is not None:
-                    custom_attrs_to_update["closed_without_con"] = bool(consultation.denied)
-                
-                # Обновляем только если есть изменения
-                if custom_attrs_to_update:
-                    try:
-                        await chatwoot_client.update_conversation_custom_attributes(
-                            conversation_id=consultation.cons_id,
-                            custom_attributes=custom_attrs_to_update
-                        )
-                        logger.info(f"Synced consultation fields to Chatwoot for {consultation.cons_id}: {list(custom_attrs_to_update.keys())}")
-                    except httpx.HTTPStatusError as http_error:
-                        # Обработка ошибок HTTP (404, 403 и т.д.)
-                        if http_error.response.status_code == 404:
-                            # Conversation не найдена в Chatwoot (возможно, была удалена)
-                            logger.warning(
-                                f"Conversation {consultation.cons_id} not found in Chatwoot (404). "
-                                f"Possibly deleted. Skipping custom_attributes update."
-                            )
-                        else:
-                            # Другие HTTP ошибки
-                            logger.warning(
-                                f"HTTP error {http_error.response.status_code} while updating custom_attributes "
-                                f"for conversation {consultation.cons_id}: {http_error}"
-                            )
-                    except Exception as update_error:
-                        logger.warning(
-                            f"Failed to update custom_attributes for conversation {consultation.cons_id}: {update_error}",
-                            exc_info=True
-                        )
-            except Exception as sync_error:
-                # ВАЖНО: Не прерываем обработку консультации из-за ошибок Chatwoot
-                # Логируем ошибку, но продолжаем обработку остальных полей
-                error_msg = str(sync_error)
-                if "ConnectError" in error_msg or "connection" in error_msg.lower():
-                    logger.warning(
-                        f"Chatwoot connection error while syncing consultation fields {consultation.cons_id}: {sync_error}. "
-                        f"Chatwoot may be unavailable. Continuing ETL process..."
-                    )
-                else:
-                    logger.warning(f"Failed to sync consultation fields to Chatwoot {consultation.cons_id}: {sync_error}", exc_info=True)
-        elif consultation.cons_id:
-            # Логируем, если cons_id есть, но невалидный (UUID или временный)
-            logger.debug(
-                f"Skipping Chatwoot custom_attributes sync for consultation {consultation.cl_ref_key}: "
-                f"cons_id={consultation.cons_id} is not a valid Chatwoot conversation ID (UUID or temporary)"
-            )
+            # ВАЖНО: Синхронизируем статус с Chatwoot при изменении (через outbox)
+            sync_status_to_chatwoot(db, consultation, old_status, status)
         
         if client_key and consultation.client_key != client_key:
             consultation.client_key = client_key
@@ -732,31 +609,15 @@ async def process_consultation_item(
         if not has_changes:
             return
         
+        # Синхронизируем номер консультации и другие поля в Chatwoot custom_attributes
+        # (после обновления полей, чтобы в Chatwoot ушли новые значения)
+        sync_fields_to_chatwoot(db, consultation)
+        
         # Если менеджер изменился, отправляем уведомление
         # ВАЖНО: Проверяем изменение менеджера ДО обновления consultation.manager
         # Используем manager_changed флаг и проверяем что новый менеджер не None
         if manager_changed and consultation.manager:
-            try:
-                from ..services.manager_notifications import (
-                    send_manager_reassignment_notification,
-                    send_queue_update_notification
-                )
-                await send_manager_reassignment_notification(
-                    db=db,
-                    consultation=consultation,
-                    old_manager_key=old_manager,
-                    new_manager_key=consultation.manager,
-                    reason="Переназначено в ЦЛ"
-                )
-                
-                # Отправляем информацию об изменении очереди
-                await send_queue_update_notification(
-                    db=db,
-                    consultation=consultation,
-                    manager_key=consultation.manager,
-                )
-            except Exception as e:
-                logger.warning(f"Failed to send manager reassignment notification: {e}")
+            notify_manager_change(db, consultation, old_manager)
     
     await db.flush()
     
@@ -815,7 +676,367 @@ async def process_consultation_item(
     return result_date
 
 
-async def pull_open_consultations_by_ref_key(db: AsyncSession, auth: tuple):
+# ═══════════════════════════════════════════════════════════════════════════
+# Batch-режим: обработка целой страницы OData несколькими set-based запросами
+# ═══════════════════════════════════════════════════════════════════════════
+
+TERMINAL_STATUSES = ("closed", "resolved", "cancelled")
+
+# Поля cons.cons, которые ETL пишет через INSERT ... ON CONFLICT DO UPDATE
+UPSERT_COLUMNS = (
+    "cl_ref_key", "client_key", "client_id", "number", "status", "org_inn",
+    "consultation_type", "denied", "start_date", "end_date", "comment", "manager",
+    "author", "online_question_cat", "online_question", "con_blocks", "con_calls", "source",
+)
+
+# Поля cons.q_and_a, по которым сравниваются табличные части документа
+Q_AND_A_COLUMNS = (
+    "cons_id", "line_number", "po_type_key", "po_section_key", "con_blocks_key",
+    "manager_help_key", "is_repeat", "question", "answer",
+)
+
+# Поля, изменение которых синхронизируется в Chatwoot custom_attributes
+CHATWOOT_ATTR_COLUMNS = ("number", "start_date", "end_date", "consultation_type", "denied")
+
+
+def build_q_and_a_rows(item: Dict[str, Any], cons_id: str) -> List[Dict[str, Any]]:
+    """Строки cons.q_and_a из табличных частей КонсультацииИТС и ВопросыИОтветы"""
+    ref_key = item.get("Ref_Key")
+    rows = []
+    for idx, consult in enumerate(item.get("КонсультацииИТС", []), 1):
+        rows.append({
+            "cons_ref_key": ref_key,
+            "cons_id": cons_id,
+            "line_number": int(consult.get("LineNumber", idx)),
+            "po_type_key": clean_uuid(consult.get("ВидПО_Key")),
+            "po_section_key": clean_uuid(consult.get("РазделПО_Key")),
+            "con_blocks_key": clean_uuid(consult.get("НаличиеПомех_Key")),
+            "manager_help_key": clean_uuid(consult.get("ПомощьМенеджера_Key")),
+            "is_repeat": consult.get("ПовторноеОбращение", False),
+            "question": consult.get("Вопрос"),
+            "answer": consult.get("Ответ"),
+        })
+    # Начинаем с 1000 чтобы не пересекаться
+    for idx, qa_item in enumerate(item.get("ВопросыИОтветы", []), 1000):
+        rows.append({
+            "cons_ref_key": ref_key,
+            "cons_id": cons_id,
+            "line_number": int(qa_item.get("LineNumber", idx)),
+            "po_type_key": None,
+            "po_section_key": None,
+            "con_blocks_key": None,
+            "manager_help_key": None,
+            "is_repeat": False,
+            "question": qa_item.get("Вопрос"),
+            "answer": qa_item.get("Ответ"),
+        })
+    return rows
+
+
+def merge_consultation_row(
+    item: Dict[str, Any],
+    before: Optional[Dict[str, Any]],
+    client_info: Optional[Tuple[Any, Optional[str]]],
+    con_calls: Optional[Any],
+) -> Dict[str, Any]:
+    """
+    Строит итоговую строку cons.cons для документа из ЦЛ.
+
+    Правила те же, что в process_consultation_item: терминальный статус не меняется,
+    пустые comment/author/вопросы не затирают заполненные, менеджер не сбрасывается в NULL,
+    con_blocks берется из новых строк q_and_a, con_calls — из cons.calls.
+    """
+    ref_key = item.get("Ref_Key")
+    client_key = clean_uuid(item.get("Абонент_Key"))
+    client_id, org_inn = client_info if client_info else (None, None)
+    manager_key = clean_uuid(item.get("Менеджер_Key"))
+    author_key = clean_uuid(item.get("Автор_Key"))
+    online_question_cat = clean_uuid(item.get("КатегорияВопроса_Key"))
+    online_question = clean_uuid(item.get("ВопросНаКонсультацию_Key"))
+    create_date = clean_datetime(item.get("ДатаСоздания"))
+    start_date = clean_datetime(item.get("ДатаКонсультации"))
+    end_date = clean_datetime(item.get("Конец"))
+    denied = bool(item.get("ЗакрытоБезКонсультации", False))
+    vid_obrascheniya = item.get("ВидОбращения")
+    status = map_status(vid_obrascheniya, end_date, denied)
+    comment = item.get("Описание") or item.get("Вопрос") or ""
+
+    con_blocks = next(
+        (clean_uuid(c.get("НаличиеПомех_Key")) for c in item.get("КонсультацииИТС", []) if clean_uuid(c.get("НаличиеПомех_Key"))),
+        None,
+    )
+
+    if before is None:
+        return {
+            "cons_id": f"cl_{ref_key}",  # временный ID до синхронизации с Chatwoot
+            "cl_ref_key": ref_key,
+            "client_key": client_key,
+            "client_id": client_id,
+            "number": item.get("Number"),
+            "status": status,
+            "org_inn": org_inn,
+            "consultation_type": map_consultation_type(vid_obrascheniya),
+            "denied": denied,
+            "create_date": create_date or datetime.now(timezone.utc),
+            "start_date": start_date,
+            "end_date": end_date,
+            "comment": comment,
+            "manager": manager_key,
+            "author": author_key,
+            "online_question_cat": online_question_cat,
+            "online_question": online_question,
+            "con_blocks": con_blocks,
+            "con_calls": con_calls,
+            "source": "1C_CL",
+        }
+
+    after = dict(before)
+    after["number"] = item.get("Number")
+    if before.get("status") not in TERMINAL_STATUSES:
+        after["status"] = status
+    if client_key:
+        after["client_key"] = client_key
+    if client_id:
+        after["client_id"] = client_id
+    # org_inn обновляем если его нет или если клиент изменился
+    if org_inn and (not before.get("org_inn") or str(before.get("client_id")) != str(client_id)):
+        after["org_inn"] = org_inn
+    after["consultation_type"] = map_consultation_type(vid_obrascheniya)
+    after["denied"] = denied
+    after["start_date"] = start_date
+    after["end_date"] = end_date
+    if comment:
+        after["comment"] = comment
+    if manager_key:
+        after["manager"] = manager_key
+    if author_key:
+        after["author"] = author_key
+    if online_question_cat:
+        after["online_question_cat"] = online_question_cat
+    if online_question:
+        after["online_question"] = online_question
+    if not before.get("source"):
+        after["source"] = "ETL"
+    if con_blocks:
+        after["con_blocks"] = con_blocks
+    if con_calls:
+        after["con_calls"] = con_calls
+    return after
+
+
+def diff_consultation_row(before: Dict[str, Any], after: Dict[str, Any]) -> Set[str]:
+    """Множество полей UPSERT_COLUMNS, значения которых изменились"""
+    changed = set()
+    for column in UPSERT_COLUMNS:
+        old, new = before.get(column), after.get(column)
+        if column == "client_id":
+            old, new = (str(old) if old else None), (str(new) if new else None)
+        if old != new:
+            changed.add(column)
+    return changed
+
+
+def q_and_a_signature(rows: List[Dict[str, Any]]) -> Counter:
+    """Сравнимое представление строк cons.q_and_a документа (порядок строк не важен)"""
+    return Counter(tuple(row.get(column) for column in Q_AND_A_COLUMNS) for row in rows)
+
+
+async def load_consultation_page_context(db: AsyncSession, items: List[Dict[str, Any]]):
+    """
+    Загружает все, что нужно для обработки страницы, четырьмя запросами с ANY(:keys):
+    клиентов (client_id, org_inn), текущие строки cons.cons, агрегаты cons.calls
+    и текущие строки cons.q_and_a (чтобы не пересобирать неизмененные табличные части).
+    """
+    ref_keys = [item["Ref_Key"] for item in items]
+    client_keys = list({k for k in (clean_uuid(item.get("Абонент_Key")) for item in items) if k})
+
+    clients: Dict[str, Tuple[Any, Optional[str]]] = {}
+    if client_keys:
+        result = await db.execute(
+            select(Client.cl_ref_key, Client.client_id, Client.org_inn).where(Client.cl_ref_key.in_(client_keys))
+        )
+        for cl_ref_key, client_id, org_inn in result.all():
+            clients.setdefault(cl_ref_key, (client_id, org_inn or None))
+
+    columns = [Consultation.__table__.c[name] for name in ("cons_id", "create_date", *UPSERT_COLUMNS)]
+    result = await db.execute(select(*columns).where(Consultation.cl_ref_key.in_(ref_keys)))
+    existing: Dict[str, Dict[str, Any]] = {}
+    for row in result.mappings().all():
+        existing.setdefault(row["cl_ref_key"], dict(row))
+
+    result = await db.execute(
+        text("""
+            SELECT cons_key, json_agg(
+                json_build_object(
+                    'period', period,
+                    'manager', manager
+                )
+                ORDER BY period
+            )
+            FROM cons.calls
+            WHERE cons_key = ANY(:keys)
+            GROUP BY cons_key
+        """),
+        {"keys": ref_keys}
+    )
+    calls = {row[0]: row[1] for row in result.all() if row[1] and row[1] != [None]}
+
+    qa_columns = [QAndA.__table__.c[name] for name in ("cons_ref_key", *Q_AND_A_COLUMNS)]
+    result = await db.execute(select(*qa_columns).where(QAndA.cons_ref_key.in_(ref_keys)))
+    q_and_a: Dict[str, List[Dict[str, Any]]] = {}
+    for row in result.mappings().all():
+        q_and_a.setdefault(row["cons_ref_key"], []).append(dict(row))
+
+    return clients, existing, calls, q_and_a
+
+
+async def process_consultation_batch(db: AsyncSession, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Set-based обработка страницы документов вместо process_consultation_item по одному.
+
+    Вместо 7+ запросов на строку: 4 SELECT с ANY(:keys), INSERT ... ON CONFLICT DO UPDATE
+    по cons.cons, один DELETE + один INSERT по cons.q_and_a. Побочные эффекты (Chatwoot,
+    уведомления о переназначении) вычисляются из diff до/после и пишутся в sys.chatwoot_outbox
+    в той же транзакции — в Chatwoot их доставляет диспетчер outbox после commit.
+
+    ВАЖНО: существующие строки обновляются только по изменившимся колонкам (UPSERT группами
+    с одинаковым набором изменений). Снимок читается в начале страницы, и запись всех
+    UPSERT_COLUMNS затерла бы то, что API успел записать за это время (manager, comment,
+    con_calls). cons.q_and_a пересобирается только у документов, чьи строки отличаются.
+
+    Возвращает статистику: created/updated/unchanged и processed_at (ДатаИзменения по строкам).
+    """
+    # Последняя версия документа побеждает, если Ref_Key повторяется в странице
+    by_ref_key: Dict[str, Dict[str, Any]] = {}
+    for item in items:
+        if item.get("Ref_Key"):
+            by_ref_key[item["Ref_Key"]] = item
+    stats: Dict[str, Any] = {"created": 0, "updated": 0, "unchanged": 0, "skipped": len(items) - len(by_ref_key), "processed_at": []}
+    if not by_ref_key:
+        return stats
+
+    page = list(by_ref_key.values())
+    clients, existing, calls, existing_q_and_a = await load_consultation_page_context(db, page)
+
+    upsert_rows: List[Dict[str, Any]] = []
+    # Новые строки пишутся всеми колонками (ключ None), существующие — группами по набору изменений
+    upsert_groups: Dict[Optional[FrozenSet[str]], List[Dict[str, Any]]] = {}
+    qa_rows: List[Dict[str, Any]] = []
+    qa_ref_keys: List[str] = []
+    diffs: List[Tuple[Dict[str, Any], Dict[str, Any], Set[str]]] = []
+
+    for item in page:
+        ref_key = item["Ref_Key"]
+        before = existing.get(ref_key)
+        client_key = clean_uuid(item.get("Абонент_Key"))
+        after = merge_consultation_row(item, before, clients.get(client_key), calls.get(ref_key))
+
+        if before is None:
+            stats["created"] += 1
+            upsert_rows.append(after)
+            upsert_groups.setdefault(None, []).append(after)
+        else:
+            changed = diff_consultation_row(before, after)
+            if changed:
+                stats["updated"] += 1
+                upsert_rows.append(after)
+                upsert_groups.setdefault(frozenset(changed), []).append(after)
+            else:
+                stats["unchanged"] += 1
+            diffs.append((before, after, changed))
+
+        # Изменение табличных частей не видно по полям шапки — сравниваем сами строки
+        new_qa_rows = build_q_and_a_rows(item, after["cons_id"])
+        if q_and_a_signature(new_qa_rows) != q_and_a_signature(existing_q_and_a.get(ref_key, [])):
+            qa_ref_keys.append(ref_key)
+            qa_rows.extend(new_qa_rows)
+
+        processed_at = (
+            clean_datetime(item.get("ДатаИзменения"))
+            or clean_datetime(item.get("ДатаСоздания"))
+            or clean_datetime(item.get("ДатаКонсультации"))
+            or datetime.now(timezone.utc)
+        )
+        if processed_at.tzinfo is None:
+            processed_at = processed_at.replace(tzinfo=timezone.utc)
+        stats["processed_at"].append(processed_at)
+
+    table = Consultation.__table__
+    for changed, group in upsert_groups.items():
+        # Конфликт у новой строки — ее вставили после чтения: тогда пишем все колонки, как раньше
+        set_columns = [c for c in UPSERT_COLUMNS if changed is None or c in changed]
+        for start in range(0, len(group), BATCH_UPSERT_CHUNK):
+            chunk = group[start:start + BATCH_UPSERT_CHUNK]
+            stmt = insert(table).values([
+                {"cons_id": row["cons_id"], "create_date": row["create_date"], **{c: row.get(c) for c in UPSERT_COLUMNS}}
+                for row in chunk
+            ])
+            set_ = {c: stmt.excluded[c] for c in set_columns}
+            if "status" in set_:
+                # GUARD: терминальный статус не перетираем, даже если он поменялся после чтения
+                set_["status"] = case(
+                    (table.c.status.in_(TERMINAL_STATUSES), table.c.status),
+                    else_=stmt.excluded.status,
+                )
+            set_["updated_at"] = func.now()
+            await db.execute(stmt.on_conflict_do_update(index_elements=[table.c.cons_id], set_=set_))
+
+    if qa_ref_keys:
+        await db.execute(
+            text("DELETE FROM cons.q_and_a WHERE cons_ref_key = ANY(:keys)"),
+            {"keys": qa_ref_keys}
+        )
+    for start in range(0, len(qa_rows), BATCH_UPSERT_CHUNK):
+        await db.execute(insert(QAndA.__table__).values(qa_rows[start:start + BATCH_UPSERT_CHUNK]))
+
+    await apply_consultation_side_effects(db, diffs)
+    # Индекс загрузки менеджеров (если ETL работает в процессе API) обновится после commit
+    stash_consultation_snapshots(db, upsert_rows)
+    await publish_consultation_updates(db, [row["cons_id"] for row in upsert_rows])
+    return stats
+
+
+async def apply_consultation_side_effects(
+    db: AsyncSession,
+    diffs: List[Tuple[Dict[str, Any], Dict[str, Any], Set[str]]],
+):
+    """Побочные эффекты по diff до/после: события в outbox Chatwoot (статус, поля, уведомления менеджерам)"""
+    pending = []
+    for before, after, changed in diffs:
+        old_status = before.get("status")
+        needs_reconcile = old_status in ("cancelled", "closed") and is_valid_chatwoot_conversation_id(after["cons_id"])
+        status_changed = "status" in changed
+        fields_changed = bool(changed & set(CHATWOOT_ATTR_COLUMNS))
+        manager_changed = "manager" in changed and bool(after.get("manager"))
+        if needs_reconcile or status_changed or fields_changed or manager_changed:
+            pending.append((before, after, status_changed, fields_changed, manager_changed))
+    if not pending:
+        return
+
+    # ORM объекты нужны хелперам уведомлений; populate_existing — после core UPSERT
+    result = await db.execute(
+        select(Consultation)
+        .where(Consultation.cons_id.in_([after["cons_id"] for _, after, *_ in pending]))
+        .execution_options(populate_existing=True)
+    )
+    consultations = {c.cons_id: c for c in result.scalars().all()}
+
+    for before, after, status_changed, fields_changed, manager_changed in pending:
+        consultation = consultations.get(after["cons_id"])
+        if consultation is None:
+            continue
+        old_status = before.get("status")
+        if old_status in TERMINAL_STATUSES:
+            reconcile_terminal_status_in_chatwoot(db, consultation, old_status)
+        elif status_changed:
+            sync_status_to_chatwoot(db, consultation, old_status, after["status"])
+        if fields_changed:
+            sync_fields_to_chatwoot(db, consultation)
+        if manager_changed:
+            notify_manager_change(db, consultation, before.get("manager"))
+
+
+async def pull_open_consultations_by_ref_key(db: AsyncSession, odata: ODataClient):
     """
     Обновление открытых консультаций по Ref_Key из БД.
     
@@ -872,40 +1093,50 @@ async def pull_open_consultations_by_ref_key(db: AsyncSession, auth: tuple):
         )
         
         try:
-            resp = http_get_with_backoff(url, auth, timeout=120)
+            resp = await odata.get(url)
             response_data = resp.json()
             batch = response_data.get("value", [])
             
             logger.info(f"Batch {batch_num}: fetched {len(batch)} consultations from OData")
             
             # Собираем Ref_Key из ответа
-            returned_ref_keys = set()
+            returned_ref_keys = {item["Ref_Key"] for item in batch if item.get("Ref_Key")}
             
-            for item in batch:
+            batch_stats: Optional[Dict[str, Any]] = None
+            if BATCH_UPSERT and batch:
                 try:
-                    ref_key = item.get("Ref_Key")
-                    if not ref_key:
-                        continue
-                    
-                    returned_ref_keys.add(ref_key)
+                    batch_stats = await process_consultation_batch(db, batch)
+                    total_created += batch_stats["created"]
+                    total_updated += batch_stats["updated"] + batch_stats["unchanged"]
+                except Exception as e:
+                    logger.warning(f"Batch {batch_num}: batch upsert failed, falling back to per-item processing: {e}")
+                    await db.rollback()
+                    batch_stats = None
+            
+            if batch_stats is None:
+                for item in batch:
+                    try:
+                        ref_key = item.get("Ref_Key")
+                        if not ref_key:
+                            continue
                     
-                    # Проверяем существование перед обработкой
-                    existing_check = await db.execute(
-                        select(Consultation).where(Consultation.cl_ref_key == ref_key).limit(1)
-                    )
-                    was_existing = existing_check.scalar_one_or_none() is not None
+                        # Проверяем существование перед обработкой
+                        existing_check = await db.execute(
+                            select(Consultation).where(Consultation.cl_ref_key == ref_key).limit(1)
+                        )
+                        was_existing = existing_check.scalar_one_or_none() is not None
                     
-                    await process_consultation_item(db, item)
+                        await process_consultation_item(db, item)
                     
-                    if was_existing:
-                        total_updated += 1
-                    else:
-                        total_created += 1
+                        if was_existing:
+                            total_updated += 1
+                        else:
+                            total_created += 1
                         
-                except Exception as e:
-                    total_errors += 1
-                    logger.warning(f"Error processing consultation {item.get('Ref_Key', 'N/A')}: {e}")
-                    continue
+                    except Exception as e:
+                        total_errors += 1
+                        logger.warning(f"Error processing consultation {item.get('Ref_Key', 'N/A')}: {e}")
+                        continue
             
             # Проверяем консультации, которые были в БД, но не вернулись в ответе от ЦЛ
             # Это означает, что они были удалены в ЦЛ
@@ -926,21 +1157,12 @@ async def pull_open_consultations_by_ref_key(db: AsyncSession, auth: tuple):
                             if old_status not in ("closed", "resolved", "cancelled"):
                                 consultation.status = "cancelled"
                                 
-                                # Закрываем в Chatwoot
-                                try:
-                                    chatwoot_client = ChatwootClient()
-                                    await chatwoot_client.toggle_conversation_status(
-                                        conversation_id=consultation.cons_id,
-                                        status="resolved"
-                                    )
-                                    await chatwoot_client.send_message(
-                                        conversation_id=consultation.cons_id,
-                                        content="Заявка была удалена в системе.",
-                                        message_type="outgoing"
-                                    )
-                                    logger.info(f"Marked consultation {ref_key} as cancelled and closed in Chatwoot (deleted in ЦЛ)")
-                                except Exception as sync_error:
-                                    logger.warning(f"Failed to close consultation {ref_key} in Chatwoot: {sync_error}")
+                                # Закрываем в Chatwoot (через outbox, в той же транзакции)
+                                enqueue_chatwoot_event(db, consultation.cons_id, EVENT_STATUS, {
+                                    "status": "resolved",
+                                    "message": "Заявка была удалена в системе.",
+                                })
+                                logger.info(f"Marked consultation {ref_key} as cancelled, Chatwoot close queued (deleted in ЦЛ)")
                     except Exception as e:
                         logger.warning(f"Error processing deleted consultation {ref_key}: {e}")
             
@@ -957,7 +1179,7 @@ async def pull_open_consultations_by_ref_key(db: AsyncSession, auth: tuple):
     logger.info(f"Open consultations update completed: updated={total_updated}, created={total_created}, errors={total_errors}")
 
 
-async def pull_consultations_incremental(db: AsyncSession, auth: tuple):
+async def pull_consultations_incremental(db: AsyncSession, odata: ODataClient):
     """
     Инкрементальная загрузка консультаций по дате изменения.
     
@@ -1003,7 +1225,15 @@ async def pull_consultations_incremental(db: AsyncSession, auth: tuple):
         "field": "ДатаИзменения"
     })
     
-    skip = 0
+    # Keyset пагинация по (ДатаИзменения, Ref_Key): нижняя граница фильтра сдвигается
+    # на последнюю строку страницы, поэтому 1C не пересканирует уже отданные строки
+    paginator = ODataKeysetPaginator(
+        entity_url=f"{ODATA_BASEURL}{ENTITY}",
+        seek_field="ДатаИзменения",
+        start_value=from_date,
+        tie_breakers=("Ref_Key",),
+        page_size=PAGE_SIZE,
+    )
     last_processed_at: Optional[datetime] = None
     if effective_last_sync:
         # Используем effective_last_sync (уже ограниченный current_time выше)
@@ -1017,26 +1247,16 @@ async def pull_consultations_incremental(db: AsyncSession, auth: tuple):
     while True:
         # Используем новое поле ДатаИзменения для инкрементального обновления
         # Это позволяет загружать только измененные документы, что более эффективно
-        filter_part = f"ДатаИзменения ge datetime'{from_date}'"
+        url = paginator.next_url()
         
-        # ВАЖНО: OData требует правильного кодирования кириллицы
-        encoded_filter = quote(filter_part, safe="'()=<>", encoding='utf-8')
-        encoded_orderby = quote("ДатаИзменения asc", safe=",", encoding='utf-8')
-        
-        url = (
-            f"{ODATA_BASEURL}{ENTITY}?$format=json"
-            f"&$filter={encoded_filter}"
-            f"&$orderby={encoded_orderby}"
-            f"&$top={PAGE_SIZE}&$skip={skip}"
-        )
-        
-        batch_num = skip // PAGE_SIZE + 1
+        batch_num = paginator.page_num
+        skip = paginator.skip
         etl_logger.batch_start(batch_num, skip, PAGE_SIZE)
         
         try:
-            resp = http_get_with_backoff(url, auth, timeout=120)
-        except requests.HTTPError as e:
-            if hasattr(e, 'response') and e.response is not None and e.response.status_code == 400:
+            resp = await odata.get(url)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 400:
                 etl_logger.critical_error("400 Bad Request - stopping execution. Check OData filter syntax.", e)
                 sys.exit(1)
             etl_logger.batch_error(batch_num, e, skip)
@@ -1059,63 +1279,81 @@ async def pull_consultations_incremental(db: AsyncSession, auth: tuple):
                 etl_logger.batch_error(batch_num, Exception(f"OData error: {response_data.get('error')}"), skip)
             break
         
-        # Обрабатываем каждую консультацию
+        # Обрабатываем страницу set-based запросами; если batch-режим упал — по одной записи
         batch_created = 0
         batch_updated = 0
         batch_errors = 0
-        for idx, item in enumerate(batch):
+        processed_dates: List[datetime] = []
+        batch_stats: Optional[Dict[str, Any]] = None
+        if BATCH_UPSERT:
             try:
-                ref_key = item.get("Ref_Key")
-                if not ref_key:
-                    batch_errors += 1
-                    continue
-                
-                # Проверяем существование перед обработкой
-                existing_check = await db.execute(
-                    select(Consultation).where(Consultation.cl_ref_key == ref_key).limit(1)
+                batch_stats = await process_consultation_batch(db, batch)
+            except Exception as e:
+                logger.warning(
+                    f"[pull_cons_cl] Batch upsert failed for batch {batch_num}, falling back to per-item processing: {e}",
+                    exc_info=True
                 )
-                was_existing = existing_check.scalar_one_or_none() is not None
-                
-                processed_at = await process_consultation_item(db, item)
-                
-                if was_existing:
-                    batch_updated += 1
-                else:
-                    batch_created += 1
-                
-                if processed_at:
-                    if processed_at.tzinfo is None:
-                        processed_at = processed_at.replace(tzinfo=timezone.utc)
+                await db.rollback()
+        
+        if batch_stats is not None:
+            batch_created = batch_stats["created"]
+            batch_updated = batch_stats["updated"] + batch_stats["unchanged"]
+            batch_errors = batch_stats["skipped"]
+            processed_dates = batch_stats["processed_at"]
+        else:
+            for idx, item in enumerate(batch):
+                try:
+                    ref_key = item.get("Ref_Key")
+                    if not ref_key:
+                        batch_errors += 1
+                        continue
                     
-                    # ВАЖНО: Ограничиваем last_processed_at текущей датой/временем
-                    # Это предотвращает сдвиг last_sync в будущее из-за запланированных консультаций
-                    # Если ДатаИзменения в будущем, мы обрабатываем запись, но не используем её дату для last_sync
-                    if processed_at <= current_time:
-                        if last_processed_at is None or processed_at > last_processed_at:
-                            last_processed_at = processed_at
+                    # Проверяем существование перед обработкой
+                    existing_check = await db.execute(
+                        select(Consultation).where(Consultation.cl_ref_key == ref_key).limit(1)
+                    )
+                    was_existing = existing_check.scalar_one_or_none() is not None
+                    
+                    processed_at = await process_consultation_item(db, item)
+                    
+                    if was_existing:
+                        batch_updated += 1
                     else:
-                        # Если processed_at в будущем, логируем это для отладки
-                        logger.debug(
-                            f"Skipping future date for last_sync: {processed_at} (current: {current_time}) "
-                            f"for consultation {item.get('Ref_Key', 'N/A')[:20]}"
-                        )
-                        # Если processed_at в будущем, но last_processed_at еще не установлен,
-                        # устанавливаем его на текущее время (но не больше)
-                        if last_processed_at is None:
-                            last_processed_at = current_time
-                        # Если last_processed_at уже установлен, но меньше current_time, обновляем до current_time
-                        elif last_processed_at < current_time:
-                            last_processed_at = current_time
-                else:
+                        batch_created += 1
+                    
+                    if processed_at:
+                        processed_dates.append(processed_at)
+                    else:
+                        batch_errors += 1
+                except Exception as e:
                     batch_errors += 1
-            except Exception as e:
-                batch_errors += 1
-                error_logs += 1
-                if error_logs <= MAX_ERROR_LOGS:
-                    etl_logger.item_error(item.get('Ref_Key', 'N/A'), e, "consultation", full_traceback=True)
-                elif error_logs == MAX_ERROR_LOGS + 1:
-                    logger.warning(f"[pull_cons_cl] Further processing errors suppressed (showing first {MAX_ERROR_LOGS} errors)")
-                continue
+                    error_logs += 1
+                    if error_logs <= MAX_ERROR_LOGS:
+                        etl_logger.item_error(item.get('Ref_Key', 'N/A'), e, "consultation", full_traceback=True)
+                    elif error_logs == MAX_ERROR_LOGS + 1:
+                        logger.warning(f"[pull_cons_cl] Further processing errors suppressed (showing first {MAX_ERROR_LOGS} errors)")
+                    continue
+        
+        for processed_at in processed_dates:
+            if processed_at.tzinfo is None:
+                processed_at = processed_at.replace(tzinfo=timezone.utc)
+            
+            # ВАЖНО: Ограничиваем last_processed_at текущей датой/временем
+            # Это предотвращает сдвиг last_sync в будущее из-за запланированных консультаций
+            # Если ДатаИзменения в будущем, мы обрабатываем запись, но не используем её дату для last_sync
+            if processed_at <= current_time:
+                if last_processed_at is None or processed_at > last_processed_at:
+                    last_processed_at = processed_at
+            else:
+                # Если processed_at в будущем, логируем это для отладки
+                logger.debug(f"Skipping future date for last_sync: {processed_at} (current: {current_time})")
+                # Если processed_at в будущем, но last_processed_at еще не установлен,
+                # устанавливаем его на текущее время (но не больше)
+                if last_processed_at is None:
+                    last_processed_at = current_time
+                # Если last_processed_at уже установлен, но меньше current_time, обновляем до current_time
+                elif last_processed_at < current_time:
+                    last_processed_at = current_time
         
         # Коммитим транзакцию
         try:
@@ -1137,10 +1375,9 @@ async def pull_consultations_incremental(db: AsyncSession, auth: tuple):
             except Exception as sync_error:
                 logger.warning(f"[pull_cons_cl] Failed to save sync state after batch: {sync_error}")
         
-        if len(batch) < PAGE_SIZE:
+        paginator.advance(batch)
+        if paginator.exhausted:
             break
-        
-        skip += PAGE_SIZE
     
     # Финальное сохранение даты синхронизации
     if last_processed_at:
@@ -1155,15 +1392,20 @@ async def pull_consultations_incremental(db: AsyncSession, auth: tuple):
     etl_logger.finish(success=True)
 
 
-async def pull_consultations():
-    """Основная функция загрузки консультаций"""
+async def pull_consultations(mode: Optional[str] = None):
+    """
+    Основная функция загрузки консультаций.
+
+    mode: "incremental" или "open_update"; по умолчанию из ETL_CONS_MODE
+    (in-process запуск передает режим явно — env читается один раз при импорте).
+    """
+    mode = mode or ETL_MODE
     if not (ODATA_BASEURL and ODATA_USER and ODATA_PASSWORD):
         logger.error("ODATA config missing. Check ODATA_BASEURL_CL, ODATA_USER, ODATA_PASSWORD")
         sys.exit(1)
     
-    auth = (ODATA_USER, ODATA_PASSWORD)
     # ВАЖНО: Настраиваем пул соединений для ETL скрипта
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=2,
@@ -1175,39 +1417,39 @@ async def pull_consultations():
     AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
     
     try:
-        async with AsyncSessionLocal() as db:
-            if ETL_MODE == "open_update":
+        async with AsyncSessionLocal() as db, ODataClient(user_agent="ETL-Consultations/1.0") as odata:
+            if mode == "open_update":
                 # Режим обновления открытых консультаций
-                await pull_open_consultations_by_ref_key(db, auth)
+                await pull_open_consultations_by_ref_key(db, odata)
             else:
                 # Режим инкрементальной загрузки (по умолчанию)
-                await pull_consultations_incremental(db, auth)
+                await pull_consultations_incremental(db, odata)
     except Exception as e:
         logger.error(f"ETL failed: {e}", exc_info=True)
         sys.exit(1)
     finally:
-        await engine.dispose()
+        await dispose_etl_engine(engine)
+
+
+async def ensure_sync_state_table():
+    """Создаем таблицу sync_state если её нет"""
+    engine = create_etl_engine(
+        DATABASE_URL,
+        echo=False,
+        pool_size=1,
+        max_overflow=1,
+        pool_pre_ping=True
+    )
+    async with engine.begin() as conn:
+        await conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS sys.sync_state (
+                entity_name TEXT PRIMARY KEY,
+                last_synced_at TIMESTAMPTZ
+            )
+        """))
+    await dispose_etl_engine(engine)
 
 
 if __name__ == "__main__":
-    # Создаем таблицу sync_state если её нет
-    async def ensure_sync_state_table():
-        engine = create_async_engine(
-            DATABASE_URL,
-            echo=False,
-            pool_size=1,
-            max_overflow=1,
-            pool_pre_ping=True
-        )
-        async with engine.begin() as conn:
-            await conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS sys.sync_state (
-                    entity_name TEXT PRIMARY KEY,
-                    last_synced_at TIMESTAMPTZ
-                )
-            """))
-        await engine.dispose()
-    
     asyncio.run(ensure_sync_state_table())
     asyncio.run(pull_consultations())
-
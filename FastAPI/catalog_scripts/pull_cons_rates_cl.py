@@ -15,16 +15,14 @@
 import sys
 import asyncio
 import logging
-import time
 import json
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, Any, List, Tuple, Set
 from urllib.parse import quote
 
-import requests
 from sqlalchemy import select, text, func
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
 
@@ -37,7 +35,9 @@
 )
 from FastAPI.services.consultation_ratings import recalc_consultation_ratings
 from FastAPI.services.chatwoot_client import ChatwootClient
+from FastAPI.services.odata_client import ODataClient
 from FastAPI.utils.notification_helpers import check_and_log_notification
+from FastAPI.utils.etl_runtime import create_etl_engine, dispose_etl_engine, report_etl_changes
 
 LOG_LEVEL = os.getenv("ETL_LOG_LEVEL", "INFO")
 PAGE_SIZE = int(os.getenv("ODATA_PAGE_SIZE", "1000"))
@@ -68,10 +68,7 @@ def format_manager_name(full_name):
     f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
 )
 
-HEADERS = {
-    "User-Agent": "cons-middleware/rates-loader",
-    "Accept": "application/json",
-}
+USER_AGENT = "cons-middleware/rates-loader"
 
 
 def clean_uuid(value: Optional[str]) -> Optional[str]:
@@ -99,34 +96,8 @@ def clean_datetime(value: Optional[str]) -> Optional[datetime]:
         return None
 
 
-def http_get_with_backoff(url: str, auth: tuple, max_retries: int = 6, timeout: int = 120) -> requests.Response:
-    session = requests.Session()
-    attempt = 0
-    while True:
-        try:
-            resp = session.get(url, auth=auth, headers=HEADERS, timeout=timeout)
-            if resp.status_code in (429, 502, 503, 504):
-                if attempt >= max_retries:
-                    resp.raise_for_status()
-                wait = min(2 ** attempt, 60)
-                logger.warning("HTTP %s — retry in %s sec (attempt=%s)", resp.status_code, wait, attempt + 1)
-                time.sleep(wait)
-                attempt += 1
-                continue
-            resp.raise_for_status()
-            return resp
-        except requests.RequestException as exc:
-            if attempt >= max_retries:
-                logger.error("HTTP error after %s attempts: %s", attempt + 1, exc)
-                raise
-            wait = min(2 ** attempt, 60)
-            logger.warning("Request failed: %s — retry in %s sec (attempt=%s)", exc, wait, attempt + 1)
-            time.sleep(wait)
-            attempt += 1
-
-
 async def ensure_support_objects():
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=1,
@@ -171,7 +142,7 @@ async def ensure_support_objects():
                 """
             )
         )
-    await engine.dispose()
+    await dispose_etl_engine(engine)
 
 
 async def get_last_sync_key(db: AsyncSession) -> Optional[str]:
@@ -496,9 +467,8 @@ async def pull_cons_rates():
         logger.error("ODATA config missing. Check ODATA_BASEURL_CL, ODATA_USER, ODATA_PASSWORD")
         sys.exit(1)
 
-    auth = (ODATA_USER, ODATA_PASSWORD)
     # ВАЖНО: Настраиваем пул соединений для ETL скрипта
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=2,
@@ -510,7 +480,7 @@ async def pull_cons_rates():
     AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
     try:
-        async with AsyncSessionLocal() as db:
+        async with AsyncSessionLocal() as db, ODataClient(user_agent=USER_AGENT) as odata:
             # Получаем последний обработанный ключ для инкрементальной загрузки
             last_synced_key = await get_last_sync_key(db)
             last_synced_date = await get_last_sync_date(db)
@@ -538,7 +508,7 @@ async def pull_cons_rates():
                 )
 
                 try:
-                    resp = http_get_with_backoff(url, auth)
+                    resp = await odata.get(url)
                 except Exception as exc:
                     logger.exception("Failed to fetch batch: %s", exc)
                     break
@@ -603,6 +573,8 @@ async def pull_cons_rates():
                     break
                 skip += PAGE_SIZE
 
+            report_etl_changes(total_processed)
+
             # Финальное сохранение состояния синхронизации
             if last_processed_key:
                 await save_sync_state(db, last_key=last_processed_key, last_date=last_period_processed)
@@ -619,7 +591,7 @@ async def pull_cons_rates():
                     total_processed,
                 )
     finally:
-        await engine.dispose()
+        await dispose_etl_engine(engine)
 
 
 if __name__ == "__main__":
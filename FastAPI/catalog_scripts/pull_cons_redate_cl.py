@@ -16,16 +16,13 @@
 import sys
 import asyncio
 import logging
-import time
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, Any, List, Set
-from urllib.parse import quote
 
-import requests
 import asyncpg
 from sqlalchemy import select, text, update
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.exc import OperationalError
 
 # Добавляем корень проекта для корректного импорта
@@ -35,7 +32,9 @@
 from FastAPI.models import ConsRedate, Consultation, User
 from FastAPI.services.chatwoot_client import ChatwootClient
 from FastAPI.services.onec_client import OneCClient
+from FastAPI.services.odata_client import ODataClient, ODataKeysetPaginator
 from FastAPI.utils.etl_logging import ETLLogger
+from FastAPI.utils.etl_runtime import create_etl_engine, dispose_etl_engine
 
 LOG_LEVEL = os.getenv("ETL_LOG_LEVEL", "INFO")
 INITIAL_FROM_DATE = os.getenv("ETL_REDATE_INITIAL_FROM", "2025-12-01")
@@ -68,10 +67,7 @@ def format_manager_name(full_name):
     f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
 )
 
-HEADERS = {
-    "User-Agent": "cons-middleware/redate-loader",
-    "Accept": "application/json",
-}
+USER_AGENT = "cons-middleware/redate-loader"
 
 
 def clean_uuid(value: Optional[str]) -> Optional[str]:
@@ -95,32 +91,6 @@ def clean_datetime(value: Optional[str]) -> Optional[datetime]:
         return None
 
 
-def http_get_with_backoff(url: str, auth: tuple, max_retries: int = 6, timeout: int = 120) -> requests.Response:
-    session = requests.Session()
-    attempt = 0
-    while True:
-        try:
-            resp = session.get(url, auth=auth, headers=HEADERS, timeout=timeout)
-            if resp.status_code in (429, 502, 503, 504):
-                if attempt >= max_retries:
-                    resp.raise_for_status()
-                wait = min(2 ** attempt, 60)
-                logger.warning("HTTP %s — retry in %s sec (attempt=%s)", resp.status_code, wait, attempt + 1)
-                time.sleep(wait)
-                attempt += 1
-                continue
-            resp.raise_for_status()
-            return resp
-        except requests.RequestException as exc:
-            if attempt >= max_retries:
-                logger.error("HTTP error after %s attempts: %s", attempt + 1, exc)
-                raise
-            wait = min(2 ** attempt, 60)
-            logger.warning("Request failed: %s — retry in %s sec (attempt=%s)", exc, wait, attempt + 1)
-            time.sleep(wait)
-            attempt += 1
-
-
 async def get_last_sync_date(db: AsyncSession) -> Optional[datetime]:
     """Получить дату последней синхронизации, убедившись что она offset-aware"""
     result = await db.execute(
@@ -152,7 +122,7 @@ async def save_sync_date(db: AsyncSession, value: datetime):
 
 async def ensure_support_objects():
     """Создает необходимые индексы/таблицы перед загрузкой."""
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=1,
@@ -179,7 +149,7 @@ async def ensure_support_objects():
                 """
             )
         )
-    await engine.dispose()
+    await dispose_etl_engine(engine)
 
 
 async def upsert_redate_rows(db: AsyncSession, rows: List[Dict[str, Any]]) -> Set[tuple]:
@@ -438,9 +408,8 @@ async def pull_cons_redate():
         "PAGE_SIZE": PAGE_SIZE
     })
 
-    auth = (ODATA_USER, ODATA_PASSWORD)
     # ВАЖНО: Настраиваем пул соединений для ETL скрипта
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=2,
@@ -452,7 +421,7 @@ async def pull_cons_redate():
     AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
     try:
-        async with AsyncSessionLocal() as db:
+        async with AsyncSessionLocal() as db, ODataClient(user_agent=USER_AGENT) as odata:
             last_sync = await get_last_sync_date(db)
             if last_sync:
                 from_dt = last_sync - timedelta(hours=6)
@@ -462,24 +431,26 @@ async def pull_cons_redate():
                 from_date = f"{INITIAL_FROM_DATE}T00:00:00"
                 etl_logger.sync_info(None, from_date)
 
-            skip = 0
+            # Keyset пагинация по Period (порядок внутри Period фиксируем измерениями регистра)
+            paginator = ODataKeysetPaginator(
+                entity_url=f"{ODATA_BASEURL}{ENTITY}",
+                seek_field="Period",
+                start_value=from_date,
+                tie_breakers=("ДокументОбращения_Key", "Абонент_Key", "Менеджер_Key"),
+                page_size=PAGE_SIZE,
+            )
             error_logs = 0
             last_period_processed: Optional[datetime] = last_sync
 
             while True:
-                batch_num = skip // PAGE_SIZE + 1
-                filter_part = f"Period ge datetime'{from_date}'"
-                url = (
-                    f"{ODATA_BASEURL}{ENTITY}?$format=json"
-                    f"&$filter={quote(filter_part)}"
-                    f"&$orderby=Period asc"
-                    f"&$top={PAGE_SIZE}&$skip={skip}"
-                )
+                batch_num = paginator.page_num
+                skip = paginator.skip
+                url = paginator.next_url()
 
                 etl_logger.batch_start(batch_num, skip, PAGE_SIZE)
 
                 try:
-                    resp = http_get_with_backoff(url, auth)
+                    resp = await odata.get(url)
                 except Exception as exc:
                     etl_logger.batch_error(batch_num, exc, skip)
                     break
@@ -567,9 +538,9 @@ async def pull_cons_redate():
                     except Exception as sync_error:
                         logger.warning(f"[pull_cons_redate_cl] Failed to save sync state after batch: {sync_error}")
 
-                if len(batch) < PAGE_SIZE:
+                paginator.advance(batch)
+                if paginator.exhausted:
                     break
-                skip += PAGE_SIZE
 
             # Финальное сохранение даты синхронизации
             if last_period_processed:
@@ -582,7 +553,7 @@ async def pull_cons_redate():
         etl_logger.finish(success=False, error=e)
         sys.exit(1)
     finally:
-        await engine.dispose()
+        await dispose_etl_engine(engine)
 
 
 if __name__ == "__main__":
@@ -9,13 +9,11 @@
 import sys
 import asyncio
 import logging
-import time
 from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict, Any, List
 from urllib.parse import quote
-import requests
 from sqlalchemy import select, text, func
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.dialects.postgresql import insert
 
 # Добавляем путь к проекту
@@ -24,7 +22,9 @@
 from FastAPI.config import settings
 from FastAPI.models import QueueClosing, Consultation, User
 from FastAPI.services.chatwoot_client import ChatwootClient
+from FastAPI.services.odata_client import ODataClient
 from FastAPI.services.manager_notifications import send_queue_update_notification
+from FastAPI.utils.etl_runtime import create_etl_engine, dispose_etl_engine, report_etl_changes
 
 # Конфигурация
 LOG_LEVEL = os.getenv("ETL_LOG_LEVEL", "INFO")
@@ -48,10 +48,7 @@
     f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
 )
 
-HEADERS = {
-    "User-Agent": "cons-middleware/queue-closing-loader",
-    "Accept": "application/json",
-}
+USER_AGENT = "cons-middleware/queue-closing-loader"
 
 
 def clean_uuid(val: Optional[str]) -> Optional[str]:
@@ -74,33 +71,6 @@ def clean_datetime(dt_str: Optional[str]) -> Optional[datetime]:
         return None
 
 
-def http_get_with_backoff(url: str, auth: tuple, max_retries: int = 6, timeout: int = 120):
-    """HTTP GET с retry и backoff"""
-    session = requests.Session()
-    attempt = 0
-    while True:
-        try:
-            resp = session.get(url, auth=auth, headers=HEADERS, timeout=timeout)
-            if resp.status_code in (429, 502, 503, 504):
-                if attempt >= max_retries:
-                    resp.raise_for_status()
-                wait = min(2 ** attempt, 60)
-                logger.warning("HTTP %s — retry in %s sec (attempt %s)", resp.status_code, wait, attempt + 1)
-                time.sleep(wait)
-                attempt += 1
-                continue
-            resp.raise_for_status()
-            return resp
-        except requests.RequestException as ex:
-            if attempt >= max_retries:
-                logger.error("HTTP error after %s attempts: %s", attempt + 1, ex)
-                raise
-            wait = min(2 ** attempt, 60)
-            logger.warning("Request failed: %s — retry in %s sec (attempt %s)", ex, wait, attempt + 1)
-            time.sleep(wait)
-            attempt += 1
-
-
 async def get_last_sync_date(db: AsyncSession) -> Optional[datetime]:
     """Получить дату последней синхронизации"""
     result = await db.execute(
@@ -255,9 +225,8 @@ async def pull_queue_closing():
         logger.error("ODATA config missing. Check ODATA_BASEURL_CL, ODATA_USER, ODATA_PASSWORD")
         sys.exit(1)
     
-    auth = (ODATA_USER, ODATA_PASSWORD)
     # ВАЖНО: Настраиваем пул соединений для ETL скрипта
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=2,
@@ -269,7 +238,7 @@ async def pull_queue_closing():
     AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
     
     try:
-        async with AsyncSessionLocal() as db:
+        async with AsyncSessionLocal() as db, ODataClient(user_agent=USER_AGENT) as odata:
             # Получаем дату последней синхронизации
             last_sync = await get_last_sync_date(db)
             
@@ -327,7 +296,7 @@ async def pull_queue_closing():
                 )
                 
                 try:
-                    resp = http_get_with_backoff(url, auth, timeout=120)
+                    resp = await odata.get(url)
                 except Exception as e:
                     logger.exception("Failed to fetch batch: %s", e)
                     error_logs += 1
@@ -407,12 +376,13 @@ async def pull_queue_closing():
                 logger.info("✓ Final sync date saved: %s", sync_date_to_save)
             
             logger.info("Queue closing sync completed. Total processed: %s", total_processed)
+            report_etl_changes(total_processed)
     
     except Exception as e:
         logger.exception("Fatal error in pull_queue_closing: %s", e)
         sys.exit(1)
     finally:
-        await engine.dispose()
+        await dispose_etl_engine(engine)
 
 
 if __name__ == "__main__":
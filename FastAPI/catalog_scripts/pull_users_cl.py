@@ -13,18 +13,18 @@
 import logging
 import os
 import sys
-import time
 from datetime import datetime, time as dtime
 from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
-import requests
 from sqlalchemy import delete, select, update, or_
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
 
 from FastAPI.config import settings
 from FastAPI.models import User, UserSkill
+from FastAPI.services.odata_client import ODataClient
+from FastAPI.utils.etl_runtime import create_etl_engine, dispose_etl_engine
 
 LOG_LEVEL = os.getenv("ETL_LOG_LEVEL", "INFO")
 PAGE_SIZE = int(os.getenv("ODATA_PAGE_SIZE", "1000"))
@@ -43,10 +43,7 @@
     f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
 )
 
-HEADERS = {
-    "User-Agent": "cons-middleware/users-loader",
-    "Accept": "application/json",
-}
+USER_AGENT = "cons-middleware/users-loader"
 
 
 def clean_uuid(value: Optional[str]) -> Optional[str]:
@@ -67,33 +64,7 @@ def parse_time_field(raw: Optional[str]) -> Optional[dtime]:
             return None
 
 
-def http_get_with_backoff(url: str, auth: Tuple[str, str], max_retries: int = 6, timeout: int = 120):
-    session = requests.Session()
-    attempt = 0
-    while True:
-        try:
-            resp = session.get(url, auth=auth, headers=HEADERS, timeout=timeout)
-            if resp.status_code in (429, 502, 503, 504):
-                if attempt >= max_retries:
-                    resp.raise_for_status()
-                wait = min(2 ** attempt, 60)
-                logger.warning("HTTP %s — retry in %s sec (attempt=%s)", resp.status_code, wait, attempt + 1)
-                time.sleep(wait)
-                attempt += 1
-                continue
-            resp.raise_for_status()
-            return resp
-        except requests.RequestException as exc:
-            if attempt >= max_retries:
-                logger.error("HTTP error after %s attempts: %s", attempt + 1, exc)
-                raise
-            wait = min(2 ** attempt, 60)
-            logger.warning("Request failed: %s — retry in %s sec (attempt=%s)", exc, wait, attempt + 1)
-            time.sleep(wait)
-            attempt += 1
-
-
-def fetch_entity(entity: str, auth: Tuple[str, str], orderby: Optional[str] = None) -> List[Dict[str, Any]]:
+async def fetch_entity(entity: str, odata: ODataClient, orderby: Optional[str] = None) -> List[Dict[str, Any]]:
     if not ODATA_BASEURL:
         raise RuntimeError("ODATA_BASEURL_CL is not configured")
     base = f"{ODATA_BASEURL}{entity}?$format=json"
@@ -104,7 +75,7 @@ def fetch_entity(entity: str, auth: Tuple[str, str], orderby: Optional[str] = No
     skip = 0
     while True:
         page_url = f"{base}&$top={PAGE_SIZE}&$skip={skip}"
-        resp = http_get_with_backoff(page_url, auth)
+        resp = await odata.get(page_url)
         batch = resp.json().get("value", [])
         if not batch:
             break
@@ -128,18 +99,18 @@ def extract_contact_info(contact_list: Sequence[Dict[str, Any]]) -> Tuple[Option
     return email, phone
 
 
-def build_reference_maps(auth: Tuple[str, str]) -> Dict[str, Any]:
-    departments = fetch_entity("Catalog_Отделы", auth)
+async def build_reference_maps(odata: ODataClient) -> Dict[str, Any]:
+    departments = await fetch_entity("Catalog_Отделы", odata)
     dept_map = {item["Ref_Key"]: item.get("Description") for item in departments if not item.get("DeletionMark")}
 
-    user_dept = fetch_entity("InformationRegister_ОтделыПользователей", auth)
+    user_dept = await fetch_entity("InformationRegister_ОтделыПользователей", odata)
     user_dept_map = {
         item.get("Менеджер_Key"): item.get("Отдел_Key")
         for item in user_dept
         if item.get("Менеджер_Key") and item.get("Отдел_Key")
     }
 
-    user_lang = fetch_entity("InformationRegister_ЯзыкиПользователей", auth)
+    user_lang = await fetch_entity("InformationRegister_ЯзыкиПользователей", odata)
     user_lang_map: Dict[str, set] = {}
     for item in user_lang:
         user_key = item.get("Менеджер_Key")
@@ -147,9 +118,9 @@ def build_reference_maps(auth: Tuple[str, str]) -> Dict[str, Any]:
         if user_key and lang_key:
             user_lang_map.setdefault(user_key, set()).add(lang_key)
 
-    consultant_rows = fetch_entity(
+    consultant_rows = await fetch_entity(
         "InformationRegister_СписокКонсультантовДляЗаявок",
-        auth,
+        odata,
         orderby="Менеджер_Key asc, Period desc",
     )
     consultant_map: Dict[str, Dict[str, Any]] = {}
@@ -373,17 +344,17 @@ async def pull_users():
         logger.error("ODATA config missing. Check ODATA_BASEURL_CL, ODATA_USER, ODATA_PASSWORD")
         sys.exit(1)
 
-    auth = (ODATA_USER, ODATA_PASSWORD)
-    refs = build_reference_maps(auth)
-    users_raw = fetch_entity("Catalog_Пользователи", auth)
-    skills_raw = fetch_entity("InformationRegister_КатегорииВопросовМенеджеров", auth)
+    async with ODataClient(user_agent=USER_AGENT) as odata:
+        refs = await build_reference_maps(odata)
+        users_raw = await fetch_entity("Catalog_Пользователи", odata)
+        skills_raw = await fetch_entity("InformationRegister_КатегорииВопросовМенеджеров", odata)
 
     user_rows = transform_users(users_raw, refs)
     skill_rows = transform_skills(skills_raw)
     logger.info("Prepared %s users and %s skill links", len(user_rows), len(skill_rows))
 
     # ВАЖНО: Настраиваем пул соединений для ETL скрипта
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=2,
@@ -414,7 +385,7 @@ async def pull_users():
             logger.error(f"Failed to sync users with Chatwoot: {sync_error}", exc_info=True)
             # Не прерываем выполнение, так как основная задача (загрузка из ЦЛ) выполнена
     finally:
-        await engine.dispose()
+        await dispose_etl_engine(engine)
 
 
 if __name__ == "__main__":
@@ -9,6 +9,9 @@
 Перед созданием проверяет существование пользователя в Chatwoot по email.
 Сохраняет маппинг chatwoot_user_id в БД.
 
+Поиск агентов идет по справочнику Chatwoot (services.chatwoot_directory): список
+агентов загружается один раз за прогон, а не на каждую проверку каждого оператора.
+
 Логирует только ошибки, успешные операции не логируются.
 """
 import os
@@ -22,12 +25,13 @@
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 
 from sqlalchemy import select, or_, and_, func
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.dialects.postgresql import insert
 
 from FastAPI.config import settings
 from FastAPI.models import User, UserMapping
 from FastAPI.services.chatwoot_client import ChatwootClient
+from FastAPI.utils.etl_runtime import create_etl_engine, dispose_etl_engine
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger("sync_users_to_chatwoot")
@@ -362,7 +366,7 @@ async def sync_all_users():
         sys.exit(1)
     
     # ВАЖНО: Настраиваем пул соединений для ETL скрипта
-    engine = create_async_engine(
+    engine = create_etl_engine(
         DATABASE_URL,
         echo=False,
         pool_size=2,
@@ -445,7 +449,7 @@ async def sync_all_users():
             if failed > 0:
                 logger.error(f"Sync completed with errors. Synced: {synced}, Failed: {failed}")
     finally:
-        await engine.dispose()
+        await dispose_etl_engine(engine)
 
 
 if __name__ == "__main__":
@@ -35,6 +35,18 @@ class Settings(BaseSettings):
     # Rate Limiting
     RATE_LIMIT_PER_MINUTE: int = Field(default=100, description="Общий лимит запросов в минуту")
     RATE_LIMIT_CREATE_PER_MINUTE: int = Field(default=10, description="Лимит создания консультаций в минуту")
+    RATE_LIMIT_ENABLED: bool = Field(default=True, description="Включить rate limiting для /api/*")
+    RATE_LIMIT_STORE: str = Field(default="memory", description="Хранилище корзин rate limiting: memory (на воркер) или postgres (общее)")
+    
+    # Кэш справочников /api/dicts
+    DICT_CACHE_MAX_ENTRIES: int = Field(default=256, description="Максимум закэшированных ответов справочников в воркере")
+    DICT_VERSION_CHECK_SECONDS: float = Field(default=5.0, description="Как часто воркер сверяет версию справочников с БД (секунды)")
+    
+    # Idempotency keys
+    IDEMPOTENCY_CACHE_SIZE: int = Field(default=1024, description="Размер LRU завершенных ответов по Idempotency-Key в процессе (0 - отключить)")
+    IDEMPOTENCY_LEASE_SECONDS: int = Field(default=300, description="Время резерва Idempotency-Key выполняющимся запросом (секунды)")
+    IDEMPOTENCY_SWEEP_INTERVAL_SECONDS: int = Field(default=300, description="Период фоновой очистки истекших idempotency keys (секунды, 0 - отключить)")
+    IDEMPOTENCY_SWEEP_BATCH_SIZE: int = Field(default=1000, description="Размер пачки удаления истекших idempotency keys")
     
     # Chatwoot Bot ID (опционально, будет определен автоматически если не указан)
     CHATWOOT_BOT_ID: Optional[int] = None
@@ -46,10 +58,59 @@ class Settings(BaseSettings):
     CHATWOOT_INBOX_ID: Optional[int] = None  # ID inbox для создания conversations (Application API)
     CHATWOOT_INBOX_IDENTIFIER: Optional[str] = None  # Identifier inbox для Public API (используется для создания contacts и conversations)
     CHATWOOT_AGENT_BOT_TOKEN: Optional[str] = None  # Токен Agent Bot для отправки автосообщений (не влияет на SLA)
+    CHATWOOT_OUTBOX_POLL_SECONDS: int = Field(default=5, description="Период опроса outbox Chatwoot диспетчером (секунды, 0 — диспетчер выключен)")
+    CHATWOOT_OUTBOX_BATCH_SIZE: int = Field(default=200, description="Сколько conversations (со всеми их записями) outbox диспетчер забирает за один проход")
+    CHATWOOT_OUTBOX_CONCURRENCY: int = Field(default=5, description="Сколько conversations диспетчер outbox обрабатывает параллельно")
+    CHATWOOT_OUTBOX_MAX_ATTEMPTS: int = Field(default=8, description="Число попыток доставки события outbox до перевода в failed")
+    
+    # Очередь синхронизации в 1C:ЦЛ (sys.onec_sync_jobs)
+    ONEC_SYNC_POLL_SECONDS: float = Field(default=2.0, description="Период опроса очереди синхронизации в ЦЛ воркером (секунды, 0 — воркер выключен)")
+    ONEC_SYNC_BATCH_SIZE: int = Field(default=50, description="Сколько консультаций воркер забирает из очереди за проход")
+    ONEC_SYNC_CONCURRENCY: int = Field(default=4, description="Сколько PATCH в ЦЛ выполняется параллельно")
+    ONEC_SYNC_MAX_ATTEMPTS: int = Field(default=8, description="Число попыток синхронизации в ЦЛ до перевода задачи в failed")
+    
+    # Входящие вебхуки: прием в sys.webhook_inbox, обработка воркером
+    WEBHOOK_INBOX_POLL_SECONDS: float = Field(default=1.0, description="Период опроса очереди входящих вебхуков воркером (секунды, 0 — воркер выключен)")
+    WEBHOOK_INBOX_BATCH_SIZE: int = Field(default=100, description="Сколько разговоров/консультаций воркер забирает из очереди вебхуков за проход")
+    WEBHOOK_INBOX_CONCURRENCY: int = Field(default=8, description="Сколько разговоров обрабатывается параллельно (события одного разговора — по порядку)")
+    WEBHOOK_INBOX_MAX_ATTEMPTS: int = Field(default=5, description="Число попыток обработки вебхука до перевода в failed")
+    WEBHOOK_INBOX_RETENTION_DAYS: int = Field(default=7, description="Сколько дней хранить обработанные вебхуки (дедупликация повторных доставок)")
+    
+    # Асинхронное создание консультаций (Prefer: respond-async): шаги Chatwoot / 1C:ЦЛ выполняет сага в фоне
+    CONSULTATION_SAGA_POLL_SECONDS: float = Field(default=1.0, description="Период опроса саг создания консультаций воркером (секунды, 0 — воркер и асинхронный режим выключены)")
+    CONSULTATION_SAGA_BATCH_SIZE: int = Field(default=20, description="Сколько саг воркер забирает за проход")
+    CONSULTATION_SAGA_CONCURRENCY: int = Field(default=4, description="Сколько саг выполняется параллельно (шаги одной саги — по порядку)")
+    CONSULTATION_SAGA_MAX_ATTEMPTS: int = Field(default=6, description="Число попыток шага саги до перевода шага в failed")
+
+    # Контакты Chatwoot клиентов (sys.chatwoot_contacts + LRU процесса)
+    CHATWOOT_CONTACT_CACHE_SIZE: int = Field(default=10000, description="Размер LRU контактов Chatwoot в процессе (0 — только таблица sys.chatwoot_contacts)")
+    CHATWOOT_CONTACT_VERIFY_SECONDS: int = Field(default=900, description="Сколько секунд после проверки контакт используется без запроса к Chatwoot (дальше — один GET контакта)")
+    
+    # Справочник Chatwoot: агенты, команды, inbox'ы, метки (кэш процесса)
+    CHATWOOT_DIRECTORY_TTL_SECONDS: int = Field(default=600, description="Через сколько секунд справочник агентов/команд/inbox'ов/меток Chatwoot загружается заново")
+    CHATWOOT_DIRECTORY_MISS_REFRESH_SECONDS: int = Field(default=60, description="При промахе поиска раздел справочника перезагружается, если загружен раньше этого срока (секунды)")
+    
+    # Проверенные владельцы в 1C:ЦЛ (cons.clients.cl_verified_at + LRU процесса)
+    ONEC_OWNER_VERIFY_SECONDS: int = Field(default=86400, description="Сколько секунд проверка владельца в папке CLOBUS действует без запроса к 1C (0 — проверять каждый раз)")
+    ONEC_OWNER_CACHE_SIZE: int = Field(default=10000, description="Размер LRU проверенных владельцев (code_abonent, org_inn) в процессе (0 — только маркер в cons.clients)")
+    
+    # Журналы log.consultation_change_log / log.webhook_log (помесячные партиции по created_at)
+    LOG_RETENTION_DAYS: int = Field(default=180, description="Сколько дней хранить журналы: партиции целиком старше срока удаляются (0 — хранить бессрочно)")
+    LOG_PARTITION_PREMAKE_MONTHS: int = Field(default=2, description="На сколько месяцев вперед заранее создаются партиции журналов")
+    LOG_PARTITION_MAINTENANCE_HOURS: int = Field(default=24, description="Период обслуживания партиций журналов планировщиком (часы, 0 — выключено)")
+    LOG_PAYLOAD_COMPRESSION: str = Field(default="", description="Метод сжатия TOAST для payload в новых партициях log.webhook_log: pglz, lz4 (PostgreSQL 14+) или пусто — по умолчанию сервера")
+    CHATWOOT_HTTP_MAX_CONNECTIONS: int = Field(default=20, description="Размер общего пула HTTP соединений к Chatwoot")
+    CHATWOOT_HTTP_KEEPALIVE_EXPIRY: float = Field(default=30.0, description="Время жизни keep-alive соединения к Chatwoot (секунды)")
+    CHATWOOT_HTTP_TIMEOUT: float = Field(default=30.0, description="Таймаут запроса к Chatwoot (секунды)")
+    CHATWOOT_HTTP2: bool = Field(default=True, description="Использовать HTTP/2 к Chatwoot (нужен пакет h2, иначе HTTP/1.1 keep-alive)")
     
     # 1C:ЦЛ API
     ONEC_API_URL: str = ""
     ONEC_API_TOKEN: str = ""
+    ONEC_HTTP_MAX_CONNECTIONS: int = Field(default=10, description="Размер общего пула HTTP соединений OneCClient к 1C:ЦЛ")
+    ONEC_HTTP_KEEPALIVE_EXPIRY: float = Field(default=30.0, description="Время жизни keep-alive соединения OneCClient к 1C (секунды)")
+    ONEC_HTTP_TIMEOUT: float = Field(default=30.0, description="Таймаут запроса OneCClient к 1C (секунды)")
+    ONEC_LOG_SAMPLE_RATE: float = Field(default=0.1, description="Доля успешных запросов OneCClient, которые логируются на INFO (ошибки и повторы логируются всегда)")
     
     # OData (1C:CL)
     # Поддержка ODATA_BASEURL (без подчеркивания) для совместимости
@@ -58,7 +119,16 @@ class Settings(BaseSettings):
     ODATA_USER: str = ""
     ODATA_PASSWORD: str = ""
     ODATA_PAGE_SIZE: int = 1000
-    
+    ODATA_TIMEOUT: float = Field(default=120.0, description="Таймаут одного OData запроса в ETL (секунды)")
+    ODATA_MAX_RETRIES: int = Field(default=6, description="Максимальное количество повторов OData запроса при 429/5xx и сетевых ошибках")
+    ODATA_MAX_CONNECTIONS: int = Field(default=10, description="Размер пула HTTP соединений к OData 1C:ЦЛ")
+    ODATA_KEEPALIVE_EXPIRY: float = Field(default=30.0, description="Время жизни keep-alive соединения к OData (секунды)")
+    ETL_PREFETCH_DEPTH: int = Field(default=2, description="Сколько страниц OData ETL скачивает заранее, пока обрабатывается текущая")
+    ETL_JOB_TIMEOUT_SECONDS: int = Field(default=1800, description="Таймаут одного прогона ETL задачи в in-process режиме планировщика (0 — без таймаута)")
+    ETL_DB_POOL_SIZE: int = Field(default=5, description="Размер общего пула соединений к БД для ETL задач in-process режима")
+    ETL_DB_MAX_OVERFLOW: int = Field(default=5, description="Дополнительные соединения общего пула ETL при перегрузке")
+    ETL_WEBHOOK_TRIGGER: bool = Field(default=True, description="Вебхук 1C:ЦЛ запускает ETL консультаций немедленно (NOTIFY etl_trigger), не дожидаясь интервала")
+
     def __init__(self, **kwargs):
         """Инициализация с поддержкой ODATA_BASEURL"""
         super().__init__(**kwargs)
@@ -84,6 +154,13 @@ def __init__(self, **kwargs):
     # Отправка сообщения об примерном времени ожидания в очереди
     SEND_QUEUE_WAIT_TIME_MESSAGE: bool = Field(default=True, description="Отправлять ли сообщение об примерном времени ожидания в очереди (если false, отправляется только номер очереди)")
     
+    # In-memory индекс загрузки менеджеров (services.manager_load)
+    MANAGER_LOAD_INDEX_ENABLED: bool = Field(default=True, description="Считать очереди менеджеров по in-memory индексу вместо COUNT по cons.cons")
+    MANAGER_LOAD_RECONCILE_SECONDS: int = Field(default=60, description="Период сверки индекса загрузки менеджеров с БД (секунды)")
+    SSE_HEARTBEAT_SECONDS: int = Field(default=15, description="Интервал heartbeat SSE потока консультации без обновлений (секунды)")
+    WS_SEND_QUEUE_SIZE: int = Field(default=32, description="Размер очереди исходящих сообщений WebSocket соединения; при переполнении клиент отключается")
+    WS_SEND_TIMEOUT_SECONDS: float = Field(default=10.0, description="Максимальное время отправки одного сообщения WebSocket клиенту (секунды)")
+    
     # Автор по умолчанию для создания ТелефонныйЗвонок в ЦЛ
     ONEC_DEFAULT_AUTHOR_NAME: str = Field(default="<не определено>", description="Название менеджера (description) из справочника users для использования как Автор_Key при создании консультаций в ЦЛ")
     
@@ -6,6 +6,7 @@
 )
 from sqlalchemy.orm import DeclarativeBase
 from .config import settings
+from .utils.db_phases import instrument_pool
 
 # Async database URL для asyncpg
 DATABASE_URL = (
@@ -33,6 +34,8 @@
     pool_recycle=settings.DB_POOL_RECYCLE,  # Переиспользование соединений
     pool_timeout=settings.DB_POOL_TIMEOUT,  # Таймаут ожидания соединения из пула
 )
+# Загрузка пула и время удержания соединений — GET /health/db-pool
+instrument_pool(engine, capacity=settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW)
 
 # Async session factory
 AsyncSessionLocal = async_sessionmaker(
@@ -106,6 +106,14 @@ async def create_tables():
         print("✓ Таблицы созданы")
 
 
+async def create_log_partitions():
+    """Создает партиции журналов log.* на текущий и следующие месяцы (идемпотентно)"""
+    from .services.log_partitions import maintain_log_partitions
+
+    report = await maintain_log_partitions(engine)
+    print(f"✓ Партиции журналов: {', '.join(report) or 'нет'}")
+
+
 async def seed_initial_data():
     """Заполняет начальные справочные данные (идемпотентно)"""
     async with engine.begin() as conn:
@@ -140,7 +148,8 @@ async def init_db():
     Выполняет:
     1. Создание схем
     2. Создание таблиц
-    3. Заполнение начальных данных
+    3. Создание партиций журналов
+    4. Заполнение начальных данных
     
     Идемпотентна - можно запускать многократно.
     """
@@ -155,6 +164,7 @@ async def init_db():
         print("Начало инициализации БД...")
         await create_schemas()
         await create_tables()
+        await create_log_partitions()
         await seed_initial_data()
         print("✓ Инициализация БД завершена успешно")
     except Exception as e:
@@ -28,8 +28,15 @@
 from .init_db import init_db, check_db_connection
 from .routers import auth, webhooks, health, consultations, clients, dicts, managers, telegram, notifications
 from .routers import websocket as ws_router
-from .scheduler import setup_scheduler, start_scheduler, shutdown_scheduler
+from .scheduler import setup_scheduler, start_scheduler, shutdown_scheduler, shutdown_etl_runtime
 from .services.chatwoot_client import ChatwootClient
+from .utils.http_pool import start_http_clients, close_http_clients
+from .middleware.rate_limit import RateLimitMiddleware
+from .services.manager_load import start_manager_load_index, stop_manager_load_index
+from .services.consultation_events import start_consultation_events, stop_consultation_events
+from .services.onec_sync_queue import start_onec_sync_worker, stop_onec_sync_worker
+from .services.webhook_inbox import start_webhook_inbox_worker, stop_webhook_inbox_worker
+from .services.consultation_saga import start_consultation_saga_worker, stop_consultation_saga_worker
 from .services.telegram_bot import TelegramBotService
 from .exceptions import (
     ConsultationError,
@@ -65,9 +72,22 @@ async def lifespan(app: FastAPI):
     if await check_db_connection():
         # Инициализация БД (идемпотентная)
         await init_db()
+        # In-memory индекс загрузки менеджеров (очереди для маршрутизации и дашбордов)
+        await start_manager_load_index()
+        # Публикация изменений консультаций и LISTEN для SSE потоков
+        await start_consultation_events()
+        # Очередь синхронизации статусов/менеджеров в 1C:ЦЛ (sys.onec_sync_jobs)
+        await start_onec_sync_worker()
+        # Обработка принятых вебхуков Chatwoot / 1C:ЦЛ (sys.webhook_inbox)
+        await start_webhook_inbox_worker()
+        # Асинхронное создание консультаций: шаги Chatwoot / 1C:ЦЛ (sys.consultation_create_sagas)
+        await start_consultation_saga_worker()
     else:
         print("⚠️  Предупреждение: не удалось подключиться к БД")
     
+    # Общие пулы HTTP соединений к внешним сервисам (keep-alive / HTTP/2)
+    await start_http_clients()
+    
     # Инициализация labels в Chatwoot (создаем заранее только необходимые метки)
     try:
         chatwoot_client = ChatwootClient()
@@ -178,6 +198,12 @@ async def lifespan(app: FastAPI):
     # Shutdown
     print("🛑 Остановка приложения...")
     shutdown_scheduler()
+    await shutdown_etl_runtime()
+    await stop_manager_load_index()
+    await stop_consultation_events()
+    await stop_consultation_saga_worker()
+    await stop_webhook_inbox_worker()
+    await stop_onec_sync_worker()
     
     # Остановка Telegram бота
     if telegram_bot_service:
@@ -186,6 +212,8 @@ async def lifespan(app: FastAPI):
             print("✓ Telegram bot остановлен")
         except Exception as e:
             logger.error(f"Ошибка остановки Telegram бота: {e}", exc_info=True)
+    
+    await close_http_clients()
 
 
 # Создаем приложение
@@ -201,6 +229,8 @@ async def lifespan(app: FastAPI):
     - Общие endpoints: 100 запросов/минуту
     - Создание консультаций: 10 запросов/минуту
     
+    При превышении возвращается `429 Too Many Requests` с заголовком `Retry-After` (секунды).
+    
     ## Idempotency
     Для предотвращения дублирования операций используйте заголовок `Idempotency-Key`.
     
@@ -219,6 +249,11 @@ async def lifespan(app: FastAPI):
     redirect_slashes=False
 )
 
+# Rate limiting (token bucket по клиенту и группе маршрутов)
+# ВАЖНО: добавляется до CORS, чтобы ответы 429 тоже получали CORS заголовки
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+
 # CORS middleware
 # Парсим ALLOWED_ORIGINS из env (через запятую) или используем "*" если не указано
 allowed_origins = settings.ALLOWED_ORIGINS.split(",") if settings.ALLOWED_ORIGINS != "*" else ["*"]
@@ -0,0 +1,207 @@
+"""
+Rate limiting (token bucket) для HTTP API.
+
+Корзина на пару (группа маршрутов, клиент): емкость = лимит в минуту, пополнение
+лимит/60 токенов в секунду. Состояние корзины — несколько чисел, проверка O(1) без
+фоновых задач: пополнение считается лениво при обращении.
+
+Группы:
+- create  — POST /api/consultations/create (RATE_LIMIT_CREATE_PER_MINUTE);
+- default — остальные /api/* (RATE_LIMIT_PER_MINUTE).
+Вебхуки (/webhook), health, документация и WebSocket не ограничиваются. Вебхуки,
+смонтированные под /api (Telegram, Chatwoot для Telegram — /api/telegram/webhook*),
+исключаются по маршруту: эндпоинт помечается декоратором rate_limit_exempt, и
+middleware сверяет путь с шаблонами помеченных маршрутов приложения.
+
+Хранилища:
+- InMemoryRateLimitStore — в процессе (по умолчанию), единицы микросекунд на запрос;
+  при нескольких воркерах лимит действует на каждый воркер отдельно;
+- PostgresRateLimitStore — общий для всех воркеров (RATE_LIMIT_STORE=postgres),
+  один атомарный UPSERT в sys.rate_limit_buckets на запрос. При ошибке БД запрос
+  пропускается (fail open).
+
+Клиент определяется по адресу из ASGI scope; за reverse proxy запускайте uvicorn с
+--proxy-headers --forwarded-allow-ips, чтобы адрес брался из X-Forwarded-For.
+"""
+import json
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Pattern, Sequence, Tuple
+
+from sqlalchemy import text
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+CREATE_PATH = "/api/consultations/create"
+EXEMPT_PREFIXES = ("/api/health", "/webhook", "/docs", "/redoc", "/openapi.json")
+# Период очистки простаивающих корзин in-memory хранилища (секунды)
+SWEEP_INTERVAL_SECONDS = 60.0
+# Атрибут эндпоинта, помеченного rate_limit_exempt
+EXEMPT_ATTR = "__rate_limit_exempt__"
+
+
+def rate_limit_exempt(endpoint):
+    """Маршрут без лимита: вебхуки внешних систем, смонтированные под /api"""
+    setattr(endpoint, EXEMPT_ATTR, True)
+    return endpoint
+
+
+def exempt_route_patterns(app) -> List[Pattern]:
+    """Шаблоны путей маршрутов приложения, помеченных rate_limit_exempt"""
+    return [
+        route.path_regex
+        for route in getattr(app, "routes", [])
+        if getattr(getattr(route, "endpoint", None), EXEMPT_ATTR, False) and hasattr(route, "path_regex")
+    ]
+
+
+def route_group(method: str, path: str, exempt_routes: Sequence[Pattern] = ()) -> Optional[str]:
+    """Группа лимита для запроса; None — запрос не ограничивается"""
+    if not path.startswith("/api/") or path.startswith(EXEMPT_PREFIXES):
+        return None
+    if any(pattern.match(path) for pattern in exempt_routes):
+        return None
+    if method == "POST" and path.rstrip("/") == CREATE_PATH:
+        return "create"
+    return "default"
+
+
+class InMemoryRateLimitStore:
+    """Корзины в памяти процесса: {ключ: [токены, время пополнения, время полного наполнения]}"""
+
+    def __init__(self):
+        self._buckets: Dict[Tuple[str, str], List[float]] = {}
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL_SECONDS
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def take(self, key: Tuple[str, str], capacity: float, rate: float) -> Tuple[bool, float, float]:
+        """
+        Забирает токен из корзины.
+
+        Returns:
+            (разрешено, остаток токенов, через сколько секунд появится токен)
+        """
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [capacity - 1, now, capacity / rate]
+            return True, capacity - 1, 0.0
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True, tokens - 1, 0.0
+        bucket[0] = tokens
+        return False, tokens, (1 - tokens) / rate
+
+    def _sweep(self, now: float):
+        """Удаляет корзины, которые успели наполниться: они не отличаются от новых"""
+        self._next_sweep = now + SWEEP_INTERVAL_SECONDS
+        full = [key for key, (_, updated, refill_time) in self._buckets.items() if now - updated >= refill_time]
+        for key in full:
+            del self._buckets[key]
+
+
+class PostgresRateLimitStore:
+    """Корзины в sys.rate_limit_buckets, общие для всех воркеров и контейнеров"""
+
+    _REFILLED = "LEAST(:capacity, b.tokens + EXTRACT(EPOCH FROM now() - b.updated_at) * :rate)"
+    _TAKE_SQL = text(f"""
+        INSERT INTO sys.rate_limit_buckets AS b (key, tokens, allowed, updated_at)
+        VALUES (:key, :capacity - 1, true, now())
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = CASE WHEN {_REFILLED} >= 1 THEN {_REFILLED} - 1 ELSE {_REFILLED} END,
+            allowed = {_REFILLED} >= 1,
+            updated_at = now()
+        RETURNING tokens, allowed
+    """)
+    # Полная корзина не отличается от отсутствующей: строки простаивающих клиентов удаляются
+    _SWEEP_SQL = text("""
+        DELETE FROM sys.rate_limit_buckets
+        WHERE updated_at < now() - make_interval(secs => :idle_seconds)
+    """)
+
+    def __init__(self, engine=None):
+        if engine is None:
+            from ..database import engine as default_engine
+            engine = default_engine
+        self.engine = engine
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL_SECONDS
+
+    async def take(self, key: Tuple[str, str], capacity: float, rate: float) -> Tuple[bool, float, float]:
+        params = {"key": f"{key[0]}:{key[1]}", "capacity": float(capacity), "rate": float(rate)}
+        try:
+            async with self.engine.begin() as conn:
+                tokens, allowed = (await conn.execute(self._TAKE_SQL, params)).one()
+                now = time.monotonic()
+                if now >= self._next_sweep:
+                    self._next_sweep = now + SWEEP_INTERVAL_SECONDS
+                    await conn.execute(self._SWEEP_SQL, {"idle_seconds": capacity / rate})
+        except Exception as e:
+            logger.warning(f"Rate limit store unavailable, request allowed: {e}")
+            return True, capacity, 0.0
+        if allowed:
+            return True, tokens, 0.0
+        return False, tokens, (1 - tokens) / rate
+
+
+def create_rate_limit_store():
+    if settings.RATE_LIMIT_STORE == "postgres":
+        return PostgresRateLimitStore()
+    return InMemoryRateLimitStore()
+
+
+class RateLimitMiddleware:
+    """ASGI middleware: 429 Too Many Requests с Retry-After при пустой корзине"""
+
+    def __init__(self, app, store=None, limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.store = store if store is not None else create_rate_limit_store()
+        limits = limits or {
+            "default": settings.RATE_LIMIT_PER_MINUTE,
+            "create": settings.RATE_LIMIT_CREATE_PER_MINUTE,
+        }
+        # группа -> (емкость, пополнение в секунду)
+        self.buckets = {group: (float(limit), limit / 60.0) for group, limit in limits.items() if limit > 0}
+        # Маршруты приложения известны только после подключения роутеров — собираем при первом запросе
+        self._exempt_routes: Optional[List[Pattern]] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self._exempt_routes is None:
+            self._exempt_routes = exempt_route_patterns(scope.get("app"))
+        group = route_group(scope["method"], scope["path"], self._exempt_routes)
+        bucket = self.buckets.get(group) if group else None
+        if bucket is None:
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        capacity, rate = bucket
+        allowed, _, retry_after = await self.store.take((group, client[0] if client else "-"), capacity, rate)
+        if allowed:
+            await self.app(scope, receive, send)
+            return
+
+        logger.warning(f"Rate limit exceeded: group={group} client={client[0] if client else '-'} path={scope['path']}")
+        body = json.dumps({"detail": "Too many requests", "retry_after": math.ceil(retry_after)}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+                (b"x-ratelimit-limit", str(int(capacity)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -12,7 +12,7 @@
 from sqlalchemy import (
     Column, String, Boolean, Integer, BigInteger, DateTime, ForeignKey, Text, 
     JSON, SmallInteger, Time, Date, Sequence, PrimaryKeyConstraint,
-    UniqueConstraint
+    UniqueConstraint, Float
 )
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import UUID, JSONB
@@ -32,6 +32,7 @@ class Client(Base):
     client_id_hash = Column(Text, unique=True, nullable=True)
     cl_ref_key = Column(Text, nullable=True)  # TEXT из ЦЛ (Ref_Key)
     parent_key = Column(Text, nullable=True)  # Parent_Key из ЦЛ (папка контрагента)
+    cl_verified_at = Column(DateTime(timezone=True), nullable=True)  # Когда cl_ref_key/parent_key последний раз подтверждены в ЦЛ
     email = Column(Text, nullable=True)
     phone_number = Column(Text, nullable=True)
     country = Column(Text, nullable=True)
@@ -350,19 +351,133 @@ class UserMapping(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
 
+class ChatwootOutbox(Base):
+    """Transactional outbox: побочные эффекты в Chatwoot, записанные в одной транзакции с консультацией"""
+    __tablename__ = "chatwoot_outbox"
+    __table_args__ = {"schema": "sys"}
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    conversation_id = Column(Text, nullable=False, index=True)  # ID conversation в Chatwoot (= cons_id)
+    event_type = Column(Text, nullable=False)  # status, custom_attributes, reconcile, manager_change
+    payload = Column(JSONB, nullable=False, server_default="{}")
+    status = Column(Text, nullable=False, server_default="pending")  # pending, done, failed
+    attempts = Column(Integer, nullable=False, server_default="0")
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_error = Column(Text, nullable=True)
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class OneCSyncJob(Base):
+    """Очередь синхронизации изменений консультаций в 1C:ЦЛ (статус/менеджер из Chatwoot)"""
+    __tablename__ = "onec_sync_jobs"
+    __table_args__ = {"schema": "sys"}
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    cons_id = Column(Text, nullable=False, index=True)  # ID консультации (порядок задач — внутри одной консультации)
+    cl_ref_key = Column(Text, nullable=False)  # Ref_Key документа в ЦЛ
+    job_type = Column(Text, nullable=False)  # status, manager
+    payload = Column(JSONB, nullable=False, server_default="{}")
+    status = Column(Text, nullable=False, server_default="pending")  # pending, done, failed
+    attempts = Column(Integer, nullable=False, server_default="0")
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_error = Column(Text, nullable=True)
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class WebhookInbox(Base):
+    """Очередь входящих вебхуков (Chatwoot, 1C:ЦЛ): прием в запросе, обработка воркером"""
+    __tablename__ = "webhook_inbox"
+    __table_args__ = (
+        UniqueConstraint("source", "event_id", name="uq_webhook_inbox_source_event"),
+        {"schema": "sys"},
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    source = Column(Text, nullable=False)  # CHATWOOT, 1C_CL, CHATWOOT_TELEGRAM
+    event_id = Column(Text, nullable=False)  # Ключ дедупликации: id доставки отправителя (или уникальный, если его нет)
+    event_type = Column(Text, nullable=True)
+    ordering_key = Column(Text, nullable=False)  # События с одним ключом (разговор/консультация) обрабатываются по порядку
+    payload = Column(JSONB, nullable=False)
+    status = Column(Text, nullable=False, server_default="pending")  # pending, done, failed
+    attempts = Column(Integer, nullable=False, server_default="0")
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_error = Column(Text, nullable=True)
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class ConsultationCreateSaga(Base):
+    """Сага асинхронного создания консультации: шаги Chatwoot / 1C:ЦЛ с контрольными точками"""
+    __tablename__ = "consultation_create_sagas"
+    __table_args__ = {"schema": "sys"}
+
+    id = Column(UUID(as_uuid=True), primary_key=True)  # saga_id из ответа 202
+    cons_id = Column(Text, nullable=False, index=True)  # Текущий ID консультации (меняется на ID беседы Chatwoot)
+    client_id = Column(UUID(as_uuid=True), nullable=True)
+    status = Column(Text, nullable=False, server_default="pending")  # pending, done, compensated
+    steps = Column(JSONB, nullable=False, server_default="{}")  # шаг -> {"status": done|skipped|failed|pending, "attempts", "error", "at"}
+    context = Column(JSONB, nullable=False, server_default="{}")  # входные данные запроса и результаты шагов
+    result = Column(JSONB, nullable=True)  # ConsultationResponse после завершения
+    attempts = Column(Integer, nullable=False, server_default="0")
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_error = Column(Text, nullable=True)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class ChatwootContact(Base):
+    """Контакт Chatwoot клиента: без поиска по identifier/email/телефону при каждой консультации"""
+    __tablename__ = "chatwoot_contacts"
+    __table_args__ = {"schema": "sys"}
+
+    client_id = Column(UUID(as_uuid=True), primary_key=True)  # cons.clients.client_id (identifier контакта)
+    contact_id = Column(BigInteger, nullable=False, index=True)  # ID контакта в Chatwoot
+    source_id = Column(Text, nullable=False)  # source_id контакта в inbox (для беседы через Public API)
+    pubsub_token = Column(Text, nullable=True)  # pubsub_token контакта (WebSocket виджета)
+    email = Column(Text, nullable=True, index=True)
+    phone_number = Column(Text, nullable=True, index=True)
+    verified_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)  # последняя проверка в Chatwoot
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class RateLimitBucket(Base):
+    """Корзины rate limiting (token bucket), общие для воркеров (RATE_LIMIT_STORE=postgres)"""
+    __tablename__ = "rate_limit_buckets"
+    __table_args__ = {"schema": "sys"}
+
+    key = Column(Text, primary_key=True)  # "<группа>:<клиент>"
+    tokens = Column(Float, nullable=False)
+    allowed = Column(Boolean, nullable=False, server_default="true")  # результат последнего списания
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class CacheVersion(Base):
+    """Версии данных для кэшей API (dicts — справочники, увеличивает load_dicts)"""
+    __tablename__ = "cache_versions"
+    __table_args__ = {"schema": "sys"}
+
+    name = Column(Text, primary_key=True)
+    version = Column(BigInteger, nullable=False, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
 # ============================================================================
 # SCHEMA: log (логирование)
 # ============================================================================
 
 class WebhookLog(Base):
-    """Логи вебхуков"""
+    """Логи вебхуков (помесячные партиции по created_at, см. services.log_partitions)"""
     __tablename__ = "webhook_log"
-    __table_args__ = {"schema": "log"}
+    __table_args__ = {"schema": "log", "postgresql_partition_by": "RANGE (created_at)"}
 
     id = Column(Integer, primary_key=True, autoincrement=True)  # SERIAL
     source = Column(Text, nullable=True)  # Источник: CHATWOOT, 1C_CL и т.д.
     payload = Column(JSONB, nullable=True)  # Полный payload вебхука
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Ключ партиционирования входит в первичный ключ
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now(), nullable=False)
 
 
 class NotificationLog(Base):
@@ -378,9 +493,9 @@ class NotificationLog(Base):
 
 
 class ConsultationChangeLog(Base):
-    """Лог изменений консультаций для отслеживания синхронизации"""
+    """Лог изменений консультаций для отслеживания синхронизации (помесячные партиции по created_at)"""
     __tablename__ = "consultation_change_log"
-    __table_args__ = {"schema": "log"}
+    __table_args__ = {"schema": "log", "postgresql_partition_by": "RANGE (created_at)"}
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     cons_id = Column(Text, nullable=False, index=True)  # ID консультации
@@ -390,7 +505,8 @@ class ConsultationChangeLog(Base):
     source = Column(Text, nullable=False)  # Источник изменения: CHATWOOT, 1C_CL, API, ETL
     synced_to_chatwoot = Column(Boolean, default=False, nullable=False)  # Синхронизировано в Chatwoot
     synced_to_1c = Column(Boolean, default=False, nullable=False)  # Синхронизировано в 1C:ЦЛ
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Ключ партиционирования входит в первичный ключ
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now(), nullable=False)
 
 
 class IdempotencyKey(Base):
@@ -519,6 +519,7 @@ async def _sync_client_to_onec(
     - Если найденный клиент имеет другой Parent_Key, создаем дубль с нужным Parent_Key
     """
     from ..services.onec_client import OneCClient
+    from ..services.owner_verification import forget_owner_verification, mark_owner_verified
     from ..routers.consultations import _build_client_display_name
     
     # Синхронизируем только владельцев (is_parent=True)
@@ -598,9 +599,8 @@ async def _sync_client_to_onec(
                         f"updating to correct Ref_Key={existing_ref_key[:20]} found by INN+code"
                     )
                 
-                # Сохраняем cl_ref_key и parent_key
-                client.cl_ref_key = existing_ref_key
-                client.parent_key = existing_parent_key
+                # Сохраняем cl_ref_key, parent_key и время проверки (консультация не проверит повторно)
+                mark_owner_verified(client, existing_ref_key)
                 await db.flush()
                 
                 display_name = _build_client_display_name(client)
@@ -622,8 +622,9 @@ async def _sync_client_to_onec(
                     f"Parent_Key={existing_parent_key} (incorrect, required: {REQUIRED_PARENT_KEY}). "
                     f"Creating duplicate client with correct Parent_Key."
                 )
-                # Сбрасываем cl_ref_key перед созданием нового
+                # Сбрасываем cl_ref_key и маркер проверки перед созданием нового
                 client.cl_ref_key = None
+                forget_owner_verification(client)
                 await db.flush()
                 # Продолжаем выполнение - создадим нового клиента ниже
         else:
@@ -648,8 +649,7 @@ async def _sync_client_to_onec(
         # Сохраняем Ref_Key из ответа 1C
         ref_key = response.get("Ref_Key")
         if ref_key:
-            client.cl_ref_key = ref_key
-            client.parent_key = REQUIRED_PARENT_KEY  # Сохраняем parent_key после создания
+            mark_owner_verified(client, ref_key)  # cl_ref_key, parent_key и время проверки
             await db.flush()
             logger.info(f"✓ Created client {client.client_id} in 1C:ЦЛ (Ref_Key={ref_key[:20]}, Parent_Key={REQUIRED_PARENT_KEY})")
         else:
@@ -1,13 +1,15 @@
 """Роуты для создания консультаций и управления атрибутами (переносы, оценки)."""
 import logging
+import sys
 import uuid
+from time import perf_counter
 from datetime import datetime, timezone, timedelta, date, time
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, NamedTuple, Tuple
 
 import httpx
 from fastapi import APIRouter, Depends, HTTPException, Header, Body, Request
-from fastapi.responses import StreamingResponse
-from sqlalchemy import select, func, cast, Date, case, or_, and_
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select, delete, func, cast, Date, case, or_, and_
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased
@@ -27,6 +29,7 @@
     UserMapping,
     TelegramUser,
     QueueClosing,
+    ConsultationCreateSaga,
 )
 from ..schemas.tickets import (
     ConsultationWithClient,
@@ -34,6 +37,8 @@
     ConsultationResponse,
     ConsultationRead,
     ConsultationListResponse,
+    ConsultationCreateAccepted,
+    ConsultationCreateStatus,
     ConsultationCreateSimple,  # Алиас для обратной совместимости
     ConsultationUpdate,
     parse_datetime_flexible,
@@ -56,9 +61,27 @@
 from ..i18n import format_cancellation_message
 from ..services.consultation_ratings import recalc_consultation_ratings
 from ..services.manager_selector import ManagerSelector
+from ..services.consultation_saga import prefers_respond_async, start_consultation_saga
+from ..services.chatwoot_contacts import (
+    ContactRef,
+    contact_is_fresh,
+    find_known_contact,
+    forget_contact,
+    remember_contact,
+    verify_contact,
+)
+from ..services.owner_verification import (
+    CLOBUS_PARENT_KEY,
+    find_owner_verification,
+    forget_owner_verification,
+    mark_owner_verified,
+)
+from ..utils.step_graph import Step, TOTAL_STEP, record_step_timing, run_step_graph, timed_step
+from ..utils.db_phases import external_phase, flush_changes, use_short_transactions
 from ..config import get_settings
 from ..utils.idempotency import (
-    check_idempotency_key,
+    reserve_idempotency_key,
+    release_idempotency_key,
     store_idempotency_key,
     generate_request_hash
 )
@@ -72,6 +95,9 @@
 logger = logging.getLogger(__name__)
 router = APIRouter(dependencies=[Depends(verify_front_secret)])
 
+# Поток метрик длительности шагов создания консультации (GET /health/steps)
+CREATE_CONSULTATION_FLOW = "create_consultation"
+
 
 async def _get_manager_name(db: AsyncSession, manager_key: Optional[str]) -> Optional[str]:
     """
@@ -738,11 +764,11 @@ async def _ensure_owner_synced_with_cl(
     Убеждаемся, что владелец создан в 1С и имеет Ref_Key.
     
     ВАЖНО: Проверяет Parent_Key найденного клиента в ЦЛ.
-    Если Parent_Key != "7ccd31ca-887b-11eb-938b-00e04cd03b68", создает дубль с правильным Parent_Key.
-    """
-    # Нужный Parent_Key для клиентов из Clobus
-    REQUIRED_PARENT_KEY = "7ccd31ca-887b-11eb-938b-00e04cd03b68"
+    Если Parent_Key != CLOBUS_PARENT_KEY, создает дубль с правильным Parent_Key.
     
+    Владелец, проверенный менее ONEC_OWNER_VERIFY_SECONDS назад (маркер cl_verified_at,
+    LRU или клиент с тем же кодом абонента и ИНН), в 1C не проверяется повторно.
+    """
     logger.info(f"=== Ensuring owner client is synced with 1C ===")
     logger.info(f"  Owner client_id: {owner.client_id}")
     logger.info(f"  Owner cl_ref_key: {owner.cl_ref_key}")
@@ -753,20 +779,29 @@ async def _ensure_owner_synced_with_cl(
         logger.error(f"✗ Owner client {owner.client_id} has no org_inn - cannot sync with 1C")
         raise HTTPException(status_code=400, detail="Owner client requires INN")
 
+    verification = await find_owner_verification(db, owner)
+    if verification is not None:
+        if owner.cl_ref_key != verification.ref_key or owner.cl_verified_at != verification.verified_at:
+            mark_owner_verified(owner, verification.ref_key, verification.code_abonent, verification.verified_at)
+            await db.flush()
+        logger.info(f"✓ Owner verified in 1C at {verification.verified_at.isoformat()}, skipping lookup: {verification.ref_key}")
+        return owner
+
     # ВАЖНО: Всегда ищем клиента по коду абонента и ИНН, НЕ по cl_ref_key
     # cl_ref_key может указывать на удаленного дубля в ЦЛ
     try:
-        # Ищем клиента по коду абонента и ИНН в папке CLOBUS (приоритетно)
-        if owner.code_abonent:
-            logger.info(f"Searching for existing client in 1C by code_abonent={owner.code_abonent} and INN={owner.org_inn}")
-            existing = await onec_client.find_client_by_code_and_inn(
-                code_abonent=owner.code_abonent,
-                org_inn=owner.org_inn,
-                parent_key=REQUIRED_PARENT_KEY  # Ищем ТОЛЬКО в папке CLOBUS
-            )
-        else:
-            logger.info(f"Searching for existing client in 1C by INN: {owner.org_inn}")
-            existing = await onec_client.find_client_by_inn(owner.org_inn)
+        async with external_phase(db, "owner_sync"):
+            # Ищем клиента по коду абонента и ИНН в папке CLOBUS (приоритетно)
+            if owner.code_abonent:
+                logger.info(f"Searching for existing client in 1C by code_abonent={owner.code_abonent} and INN={owner.org_inn}")
+                existing = await onec_client.find_client_by_code_and_inn(
+                    code_abonent=owner.code_abonent,
+                    org_inn=owner.org_inn,
+                    parent_key=CLOBUS_PARENT_KEY  # Ищем ТОЛЬКО в папке CLOBUS
+                )
+            else:
+                logger.info(f"Searching for existing client in 1C by INN: {owner.org_inn}")
+                existing = await onec_client.find_client_by_inn(owner.org_inn)
     except Exception as e:
         logger.warning(
             "Failed to fetch client from 1C by INN %s: %s. Proceeding without sync.",
@@ -780,7 +815,7 @@ async def _ensure_owner_synced_with_cl(
         ref_key = existing.get("Ref_Key")
         
         # Проверяем Parent_Key найденного клиента
-        if existing_parent_key == REQUIRED_PARENT_KEY:
+        if existing_parent_key == CLOBUS_PARENT_KEY:
             logger.info(f"✓ Found existing client in 1C with Ref_Key: {ref_key}, Parent_Key: {existing_parent_key} (correct)")
             
             # Проверяем, изменился ли cl_ref_key
@@ -790,10 +825,8 @@ async def _ensure_owner_synced_with_cl(
                     f"updating to correct Ref_Key={ref_key[:20]} found by INN+code"
                 )
             
-            # Сохраняем cl_ref_key и parent_key
-            owner.cl_ref_key = ref_key
-            owner.parent_key = existing_parent_key
-            owner.code_abonent = owner.code_abonent or existing.get("КодАбонентаClobus")
+            # Сохраняем cl_ref_key, parent_key и время проверки
+            mark_owner_verified(owner, ref_key, existing.get("КодАбонентаClobus"))
             await db.flush()
             logger.info(f"✓ Saved cl_ref_key and parent_key to owner: {ref_key}")
             return owner
@@ -801,11 +834,12 @@ async def _ensure_owner_synced_with_cl(
             # Parent_Key не тот - создаем дубль с правильным Parent_Key
             logger.warning(
                 f"Found existing client in 1C with Ref_Key: {ref_key}, "
-                f"Parent_Key: {existing_parent_key} (incorrect, required: {REQUIRED_PARENT_KEY}). "
+                f"Parent_Key: {existing_parent_key} (incorrect, required: {CLOBUS_PARENT_KEY}). "
                 f"Creating duplicate client with correct Parent_Key."
             )
-            # Сбрасываем cl_ref_key перед созданием нового
+            # Сбрасываем cl_ref_key и маркер проверки перед созданием нового
             owner.cl_ref_key = None
+            forget_owner_verification(owner)
             await db.flush()
             # Продолжаем выполнение - создадим нового клиента ниже
 
@@ -818,13 +852,14 @@ async def _ensure_owner_synced_with_cl(
 
     try:
         logger.info(f"Creating new client in 1C: org_inn={owner.org_inn}, code_abonent={owner.code_abonent}")
-        created = await onec_client.create_client_odata(
-            name=_build_client_display_name(owner),
-            org_inn=owner.org_inn,
-            code_abonent=owner.code_abonent,
-            phone=owner.phone_number,
-            email=owner.email,
-        )
+        async with external_phase(db, "owner_sync"):
+            created = await onec_client.create_client_odata(
+                name=_build_client_display_name(owner),
+                org_inn=owner.org_inn,
+                code_abonent=owner.code_abonent,
+                phone=owner.phone_number,
+                email=owner.email,
+            )
         logger.info(f"✓ Created client in 1C, response: {created}")
     except Exception as e:
         logger.error(
@@ -840,12 +875,11 @@ async def _ensure_owner_synced_with_cl(
         logger.error(f"✗ 1C returned response without Ref_Key: {created}")
         return owner
     
-    # Сохраняем cl_ref_key и parent_key
-    owner.cl_ref_key = ref_key
-    owner.parent_key = REQUIRED_PARENT_KEY
+    # Сохраняем cl_ref_key, parent_key и время проверки
     owner.code_abonent = created.get("КодАбонентаClobus") or owner.code_abonent
+    mark_owner_verified(owner, ref_key)
     await db.flush()
-    logger.info(f"✓ Saved cl_ref_key and parent_key to owner: {ref_key}, {REQUIRED_PARENT_KEY}")
+    logger.info(f"✓ Saved cl_ref_key and parent_key to owner: {ref_key}, {CLOBUS_PARENT_KEY}")
     return owner
 
 
@@ -1231,13 +1265,981 @@ async def _process_onec_response(
     logger.debug(f"Processed 1C response for consultation: Ref_Key={consultation.cl_ref_key}, Number={consultation.number}")
 
 
+async def _build_conversation_custom_attrs(
+    db: AsyncSession,
+    owner_client: Client,
+    payload: ConsultationWithClient,
+    consultation: Consultation,
+) -> Dict[str, Any]:
+    """custom_attributes беседы Chatwoot с обязательным code_abonent"""
+    custom_attrs = await _build_chatwoot_custom_attrs(db, owner_client, payload, consultation=consultation)
+
+    # Валидация обязательного поля для Chatwoot
+    # Если code_abonent пустой, используем дефолтное значение
+    # ВАЖНО: это поле должно быть непустым, иначе Chatwoot может вернуть ошибку
+    code_abonent_value = custom_attrs.get("code_abonent")
+    if not code_abonent_value or code_abonent_value == "":
+        logger.warning(f"code_abonent is empty for client {owner_client.client_id}, using default 'N/A'")
+        custom_attrs["code_abonent"] = "N/A"  # Дефолтное значение вместо пустой строки
+
+    # Логируем финальные custom_attrs перед отправкой
+    logger.info(f"Final custom_attrs for Chatwoot: {custom_attrs}")
+    return custom_attrs
+
+
+class OwnerSnapshot(NamedTuple):
+    """
+    Значения владельца абонента, нужные после начала работы с внешними системами.
+
+    ВАЖНО: снимок делается до возможного rollback — после него к атрибутам объектов
+    сессии обращаться нельзя. Тот же снимок хранит контекст саги создания консультации.
+    """
+    client_id: str
+    org_inn: Optional[str]
+    code_abonent: Optional[str]
+    name: Optional[str]
+    contact_name: Optional[str]
+    company_name: Optional[str]
+
+    @classmethod
+    def from_client(cls, owner: Client) -> "OwnerSnapshot":
+        return cls(
+            client_id=str(owner.client_id),
+            org_inn=owner.org_inn,
+            code_abonent=owner.code_abonent,
+            name=owner.name,
+            contact_name=owner.contact_name,
+            company_name=owner.company_name,
+        )
+
+
+async def _resolve_chatwoot_contact(
+    db: AsyncSession,
+    chatwoot_client: ChatwootClient,
+    client: Client,
+    owner_client: Client,
+) -> Tuple[Optional[Any], Optional[str], Optional[str]]:
+    """
+    Контакт Chatwoot клиента: известный (services.chatwoot_contacts) или найденный/созданный.
+
+    Известный контакт, проверенный недавно, используется без запросов к Chatwoot, более
+    старый — после одного GET контакта. Устаревший забывается, и контакт ищется заново;
+    найденный или созданный запоминается для следующих консультаций.
+
+    Returns:
+        (contact_id, contact_source_id, pubsub_token)
+    """
+    contact_email = client.email or owner_client.email
+    if contact_email and not is_valid_email(contact_email):
+        contact_email = None
+    contact_phone = client.phone_number or owner_client.phone_number
+
+    known = await find_known_contact(db, client.client_id, email=contact_email, phone=contact_phone)
+    if known:
+        try:
+            if contact_is_fresh(known):
+                verified = known
+            else:
+                async with external_phase(db, "chatwoot_contact"):
+                    verified = await verify_contact(chatwoot_client, known)
+        except Exception as e:
+            # Chatwoot недоступен — поиск контакта тоже не удастся, используем известный
+            logger.warning(f"Failed to verify Chatwoot contact {known.contact_id}: {e}. Using known contact")
+            verified = known
+        if verified:
+            logger.info(f"Using known Chatwoot contact {verified.contact_id} for client {client.client_id}")
+            client.source_id = verified.source_id
+            if verified.pubsub_token and not client.chatwoot_pubsub_token:
+                client.chatwoot_pubsub_token = verified.pubsub_token
+            if verified is not known or verified.client_id != str(client.client_id):
+                await remember_contact(
+                    db,
+                    verified._replace(client_id=str(client.client_id), pubsub_token=verified.pubsub_token or client.chatwoot_pubsub_token),
+                    email=contact_email,
+                    phone=contact_phone,
+                )
+            await db.flush()
+            return verified.contact_id, verified.source_id, verified.pubsub_token
+        logger.info(f"Known Chatwoot contact {known.contact_id} is stale, searching contact for client {client.client_id}")
+        await forget_contact(db, known.contact_id)
+
+    # Изменения клиента (source_id, pubsub_token) во внешней фазе сохраняются следующей DB-фазой
+    async with external_phase(db, "chatwoot_contact"):
+        contact_id, contact_source_id, pubsub_token = await _search_chatwoot_contact(db, chatwoot_client, client, owner_client)
+    if contact_id and contact_source_id:
+        await remember_contact(
+            db,
+            ContactRef(
+                client_id=str(client.client_id),
+                contact_id=int(contact_id),
+                source_id=contact_source_id,
+                pubsub_token=pubsub_token or client.chatwoot_pubsub_token,
+                verified_at=datetime.now(timezone.utc),
+            ),
+            email=contact_email,
+            phone=contact_phone,
+        )
+    return contact_id, contact_source_id, pubsub_token
+
+
+async def _search_chatwoot_contact(
+    db: AsyncSession,
+    chatwoot_client: ChatwootClient,
+    client: Client,
+    owner_client: Client,
+) -> Tuple[Optional[Any], Optional[str], Optional[str]]:
+    """
+    Находит (по source_id из БД, identifier, email, телефону) или создает контакт Chatwoot.
+
+    source_id и pubsub_token сохраняются в клиенте (flush, без commit). Ошибки Chatwoot
+    логируются и не пробрасываются: без contact_source_id беседа не будет создана.
+
+    Returns:
+        (contact_id, contact_source_id, pubsub_token) — pubsub_token только если он получен
+        при создании контакта или для найденного после 422 контакта.
+    """
+    settings = get_settings()
+    pubsub_token = None
+
+    # Подготавливаем данные контакта (используются для поиска, создания контакта и conversation)
+    contact_name = client.name or client.contact_name or owner_client.name or owner_client.contact_name or "Клиент"
+    contact_email = client.email or owner_client.email
+    contact_phone = client.phone_number or owner_client.phone_number
+
+    # Валидируем email перед использованием
+    if contact_email and not is_valid_email(contact_email):
+        logger.warning(f"Invalid email format '{contact_email}' for client {client.client_id}, skipping email field")
+        contact_email = None  # Не отправляем невалидный email
+
+    # custom_attributes контакта (атрибуты беседы передаются при ее создании)
+    from ..routers.clients import _build_chatwoot_contact_additional_attrs
+    contact_custom_attrs = _build_chatwoot_contact_custom_attrs(owner_client, client)
+    contact_additional_attrs = _build_chatwoot_contact_additional_attrs(owner_client, client)
+
+    # ВАЖНО: Используем source_id из БД клиента, если он уже есть
+    # Контакт должен быть создан при создании клиента, и source_id сохранен в БД
+    contact_id = None
+    contact_source_id = None
+
+    # Проверяем, есть ли source_id в БД клиента
+    if client.source_id:
+        logger.info(f"Using source_id from DB for client {client.client_id}: {client.source_id}")
+        contact_source_id = client.source_id
+
+        # Проверяем, что contact существует в Chatwoot (получаем contact_id)
+        try:
+            existing_contact = await chatwoot_client.find_contact_by_identifier(str(client.client_id))
+            if existing_contact:
+                contact_id = existing_contact.get("id")
+                logger.info(f"Found existing Chatwoot contact by identifier: {contact_id} for client {client.client_id}")
+
+                # ВАЖНО: Получаем pubsub_token для существующего contact через Public API
+                if not client.chatwoot_pubsub_token:
+                    try:
+                        logger.info(f"Getting pubsub_token for existing contact (found by identifier) via Public API: source_id={client.source_id}")
+                        contact_public_data = await chatwoot_client.get_contact_via_public_api(client.source_id)
+
+                        existing_pubsub_token = chatwoot_client._extract_pubsub_token(contact_public_data)
+                        if existing_pubsub_token:
+                            client.chatwoot_pubsub_token = existing_pubsub_token
+                            await flush_changes(db)
+                            logger.info(f"✓ Retrieved pubsub_token for existing contact (found by identifier): {existing_pubsub_token[:20]}...")
+                        else:
+                            logger.warning(f"⚠ pubsub_token not found in Public API response for existing contact (found by identifier)")
+                    except Exception as get_pubsub_error:
+                        logger.warning(f"Failed to get pubsub_token for existing contact (found by identifier) via Public API: {get_pubsub_error}")
+            else:
+                logger.warning(f"source_id exists in DB but contact not found in Chatwoot for client {client.client_id}")
+                # source_id может быть устаревшим, нужно обновить
+                contact_source_id = None
+        except Exception as contact_error:
+            logger.error(f"Failed to verify contact in Chatwoot: {contact_error}", exc_info=True)
+            contact_source_id = None
+
+    # Если source_id нет в БД или contact не найден, ищем существующий contact
+    if not contact_source_id:
+        try:
+            # Ищем контакт по identifier (client_id UUID)
+            existing_contact = await chatwoot_client.find_contact_by_identifier(str(client.client_id))
+            if existing_contact:
+                contact_id = existing_contact.get("id")
+                logger.info(f"Found existing Chatwoot contact by identifier: {contact_id} for client {client.client_id}")
+
+                # Извлекаем source_id из существующего contact
+                contact_inboxes = existing_contact.get("contact_inboxes", [])
+                if isinstance(contact_inboxes, list) and len(contact_inboxes) > 0:
+                    for ci in contact_inboxes:
+                        if ci.get("inbox_id") == settings.CHATWOOT_INBOX_ID:
+                            contact_source_id = ci.get("source_id")
+                            break
+                    if not contact_source_id and len(contact_inboxes) > 0:
+                        contact_source_id = contact_inboxes[0].get("source_id")
+
+                # Сохраняем source_id в БД клиента для будущего использования
+                if contact_source_id:
+                    client.source_id = contact_source_id
+                    await flush_changes(db)
+                    logger.info(f"✓ Saved source_id to DB: {contact_source_id} for client {client.client_id}")
+            else:
+                logger.warning(f"Contact not found in Chatwoot for client {client.client_id}. Contact should be created when client is created.")
+                # Пробуем найти по email или phone как fallback
+
+                if contact_email:
+                    existing_contact = await chatwoot_client.find_contact_by_email(contact_email)
+                    if existing_contact:
+                        contact_id = existing_contact.get("id")
+                        logger.info(f"Found existing Chatwoot contact by email: {contact_id}")
+
+                        # Извлекаем source_id
+                        contact_inboxes = existing_contact.get("contact_inboxes", [])
+                        if isinstance(contact_inboxes, list) and len(contact_inboxes) > 0:
+                            for ci in contact_inboxes:
+                                if ci.get("inbox_id") == settings.CHATWOOT_INBOX_ID:
+                                    contact_source_id = ci.get("source_id")
+                                    break
+                            if not contact_source_id and len(contact_inboxes) > 0:
+                                contact_source_id = contact_inboxes[0].get("source_id")
+
+                        if contact_source_id:
+                            client.source_id = contact_source_id
+
+                            # ВАЖНО: Получаем pubsub_token для существующего contact через Public API
+                            if not client.chatwoot_pubsub_token:
+                                try:
+                                    logger.info(f"Getting pubsub_token for existing contact (found by email) via Public API: source_id={contact_source_id}")
+                                    contact_public_data = await chatwoot_client.get_contact_via_public_api(
+                                        source_id=contact_source_id
+                                    )
+
+                                    existing_pubsub_token = chatwoot_client._extract_pubsub_token(contact_public_data)
+                                    if existing_pubsub_token:
+                                        client.chatwoot_pubsub_token = existing_pubsub_token
+                                        logger.info(f"✓ Retrieved pubsub_token for existing contact (found by email): {existing_pubsub_token[:20]}...")
+                                    else:
+                                        logger.warning(f"⚠ pubsub_token not found in Public API response for existing contact (found by email)")
+                                except Exception as get_pubsub_error:
+                                    logger.warning(f"Failed to get pubsub_token for existing contact (found by email) via Public API: {get_pubsub_error}")
+
+                            await flush_changes(db)
+
+                if not contact_id and contact_phone:
+                    existing_contact = await chatwoot_client.find_contact_by_phone(contact_phone)
+                    if existing_contact:
+                        contact_id = existing_contact.get("id")
+                        logger.info(f"Found existing Chatwoot contact by phone: {contact_id}")
+
+                        # Извлекаем source_id
+                        contact_inboxes = existing_contact.get("contact_inboxes", [])
+                        if isinstance(contact_inboxes, list) and len(contact_inboxes) > 0:
+                            for ci in contact_inboxes:
+                                if ci.get("inbox_id") == settings.CHATWOOT_INBOX_ID:
+                                    contact_source_id = ci.get("source_id")
+                                    break
+                            if not contact_source_id and len(contact_inboxes) > 0:
+                                contact_source_id = contact_inboxes[0].get("source_id")
+
+                        if contact_source_id:
+                            client.source_id = contact_source_id
+
+                            # ВАЖНО: Получаем pubsub_token для существующего contact через Public API
+                            if not client.chatwoot_pubsub_token:
+                                try:
+                                    logger.info(f"Getting pubsub_token for existing contact (found by phone) via Public API: source_id={contact_source_id}")
+                                    contact_public_data = await chatwoot_client.get_contact_via_public_api(
+                                        source_id=contact_source_id
+                                    )
+
+                                    existing_pubsub_token = chatwoot_client._extract_pubsub_token(contact_public_data)
+                                    if existing_pubsub_token:
+                                        client.chatwoot_pubsub_token = existing_pubsub_token
+                                        logger.info(f"✓ Retrieved pubsub_token for existing contact (found by phone): {existing_pubsub_token[:20]}...")
+                                    else:
+                                        logger.warning(f"⚠ pubsub_token not found in Public API response for existing contact (found by phone)")
+                                except Exception as get_pubsub_error:
+                                    logger.warning(f"Failed to get pubsub_token for existing contact (found by phone) via Public API: {get_pubsub_error}")
+
+                            await flush_changes(db)
+
+                if not contact_id:
+                    logger.warning(f"No contact found in Chatwoot for client {client.client_id}. Will create contact before conversation.")
+        except Exception as contact_error:
+            logger.error(f"Failed to find contact in Chatwoot: {contact_error}", exc_info=True)
+            # Продолжаем - попробуем создать контакт явно
+            contact_id = None
+
+    # ВАЖНО: Если контакт не найден, создаем его явно перед созданием conversation
+    # Это более надежный подход, чем полагаться на автоматическое создание через payload
+    if not contact_id:
+        try:
+            logger.info(f"Contact not found, creating new contact in Chatwoot for client {client.client_id}")
+            # Данные контакта уже подготовлены выше
+
+            # Проверяем, что есть хотя бы email или phone для создания контакта
+            if contact_email or contact_phone:
+                # ВАЖНО: Используем Public API для создания contact, чтобы получить pubsub_token
+                try:
+                    new_contact = await chatwoot_client.create_contact_via_public_api(
+                        name=contact_name,
+                        identifier=str(client.client_id),  # Глобальный внешний ID (UUID)
+                        email=contact_email,
+                        phone_number=contact_phone,
+                        custom_attributes=contact_custom_attrs,
+                        additional_attributes=contact_additional_attrs
+                    )
+
+                    # Извлекаем contact_id из ответа Public API
+                    contact_id = new_contact.get("id")
+                    if not contact_id:
+                        contact_id = new_contact.get("payload", {}).get("contact", {}).get("id") if isinstance(new_contact.get("payload"), dict) else None
+
+                    # Извлекаем source_id из ответа Public API
+                    # source_id создается автоматически Chatwoot при создании contact через Public API
+                    new_contact_source_id = chatwoot_client._extract_source_id(
+                        new_contact,
+                        inbox_id=settings.CHATWOOT_INBOX_ID
+                    )
+
+                    if new_contact_source_id:
+                        logger.info(f"✓ Extracted source_id from Public API response: {new_contact_source_id}")
+                    else:
+                        # Если source_id не найден в ответе создания, получаем contact через GET для извлечения source_id
+                        if contact_id:
+                            try:
+                                logger.info(f"source_id not found in create response, fetching contact {contact_id} to get source_id")
+                                fetched_contact = await chatwoot_client.get_contact(contact_id)
+
+                                # Извлекаем source_id из ответа GET запроса Application API
+                                new_contact_source_id = chatwoot_client._extract_source_id(
+                                    fetched_contact,
+                                    inbox_id=settings.CHATWOOT_INBOX_ID
+                                )
+
+                                if new_contact_source_id:
+                                    logger.info(f"✓ Retrieved source_id from GET contact: {new_contact_source_id}")
+                            except Exception as get_contact_error:
+                                logger.warning(f"Failed to get contact {contact_id} to extract source_id: {get_contact_error}")
+
+                    # Извлекаем pubsub_token из ответа создания contact
+                    # ВАЖНО: pubsub_token принадлежит контакту (Contact), а не беседе (Conversation)
+                    logger.info(f"=== Extracting pubsub_token from contact creation response ===")
+                    logger.info(f"  Contact response keys: {list(new_contact.keys()) if isinstance(new_contact, dict) else 'not a dict'}")
+
+                    contact_pubsub_token = chatwoot_client._extract_pubsub_token(new_contact)
+                    if contact_pubsub_token:
+                        logger.info(f"✓ Extracted pubsub_token from contact creation response: {contact_pubsub_token[:20]}...")
+                        # Сохраняем pubsub_token в БД клиента (он принадлежит контакту)
+                        client.chatwoot_pubsub_token = contact_pubsub_token
+                        pubsub_token = contact_pubsub_token  # Используем для ответа
+                        logger.info(f"✓ Saved pubsub_token to client DB: {contact_pubsub_token[:20]}...")
+                    else:
+                        logger.warning(f"⚠ pubsub_token not found in contact creation response")
+                        # Логируем полную структуру ответа для отладки
+                        import json
+                        logger.warning(f"  Full contact response structure: {json.dumps(new_contact, ensure_ascii=False, indent=2)}")
+
+                    # Сохраняем source_id в БД клиента
+                    if new_contact_source_id:
+                        contact_source_id = new_contact_source_id
+                        client.source_id = new_contact_source_id
+                        await flush_changes(db)
+                        logger.info(f"✓ Created Chatwoot contact via Public API: {contact_id}, source_id: {new_contact_source_id} for client {client.client_id}")
+                        logger.info(f"✓ Saved source_id to DB: {new_contact_source_id} for client {client.client_id}")
+                    else:
+                        logger.warning(f"Created Chatwoot contact {contact_id} but source_id not found in response or get_contact for client {client.client_id}")
+                        logger.warning(f"Response structure: {list(new_contact.keys()) if isinstance(new_contact, dict) else 'not a dict'}")
+                        logger.warning("source_id will remain null - frontend will handle this case")
+
+                    if not contact_id:
+                        logger.warning(f"Failed to extract contact_id from Chatwoot response: {new_contact}")
+                except httpx.HTTPStatusError as http_error:
+                    # Обработка ошибки 422 - контакт уже существует
+                    if http_error.response.status_code == 422:
+                        logger.warning(f"Contact already exists in Chatwoot (422), trying to find existing contact for client {client.client_id}")
+
+                        # Пытаемся найти существующий contact
+                        existing_contact = None
+                        if str(client.client_id):
+                            existing_contact = await chatwoot_client.find_contact_by_identifier(str(client.client_id))
+
+                        if not existing_contact and contact_email:
+                            existing_contact = await chatwoot_client.find_contact_by_email(contact_email)
+
+                        if not existing_contact and contact_phone:
+                            existing_contact = await chatwoot_client.find_contact_by_phone(contact_phone)
+
+                        if existing_contact:
+                            # Извлекаем contact_id из найденного контакта
+                            contact_id = existing_contact.get("id")
+                            if not contact_id:
+                                contact_id = existing_contact.get("payload", {}).get("contact", {}).get("id")
+
+                            # Извлекаем source_id из найденного contact
+                            # Используем универсальный метод для извлечения source_id
+                            contact_source_id = chatwoot_client._extract_source_id(
+                                existing_contact,
+                                inbox_id=settings.CHATWOOT_INBOX_ID
+                            )
+
+                            # Если source_id не найден в ответе find, получаем contact через GET
+                            if not contact_source_id and contact_id:
+                                try:
+                                    logger.info(f"source_id not found in find response, fetching contact {contact_id} to get source_id")
+                                    fetched_contact = await chatwoot_client.get_contact(contact_id)
+
+                                    # Извлекаем source_id из ответа GET запроса Application API
+                                    contact_source_id = chatwoot_client._extract_source_id(
+                                        fetched_contact,
+                                        inbox_id=settings.CHATWOOT_INBOX_ID
+                                    )
+
+                                    if contact_source_id:
+                                        logger.info(f"✓ Retrieved source_id from GET contact: {contact_source_id}")
+                                except Exception as get_contact_error:
+                                    logger.warning(f"Failed to get contact {contact_id} to extract source_id: {get_contact_error}")
+
+                            # Сохраняем source_id в БД клиента
+                            if contact_source_id:
+                                client.source_id = contact_source_id
+
+                                # ВАЖНО: Для существующего contact нужно получить pubsub_token через GET запрос к Public API
+                                # pubsub_token не возвращается в Application API ответе, только в Public API
+                                if not client.chatwoot_pubsub_token:
+                                    try:
+                                        logger.info(f"Getting pubsub_token for existing contact via Public API: source_id={contact_source_id}")
+                                        contact_public_data = await chatwoot_client.get_contact_via_public_api(
+                                            source_id=contact_source_id
+                                        )
+
+                                        existing_pubsub_token = chatwoot_client._extract_pubsub_token(contact_public_data)
+                                        if existing_pubsub_token:
+                                            client.chatwoot_pubsub_token = existing_pubsub_token
+                                            pubsub_token = existing_pubsub_token
+                                            logger.info(f"✓ Retrieved pubsub_token for existing contact: {existing_pubsub_token[:20]}...")
+                                        else:
+                                            logger.warning(f"⚠ pubsub_token not found in Public API response for existing contact")
+                                            import json
+                                            logger.warning(f"  Full Public API response: {json.dumps(contact_public_data, ensure_ascii=False, indent=2)}")
+                                    except Exception as get_pubsub_error:
+                                        logger.warning(f"Failed to get pubsub_token for existing contact via Public API: {get_pubsub_error}")
+                                        # Продолжаем без pubsub_token - frontend может получить его сам
+                                else:
+                                    pubsub_token = client.chatwoot_pubsub_token
+                                    logger.info(f"✓ Using existing pubsub_token from client DB: {pubsub_token[:20]}...")
+
+                                await flush_changes(db)
+                                logger.info(f"✓ Found existing Chatwoot contact: {contact_id}, source_id: {contact_source_id} for client {client.client_id}")
+                                logger.info(f"✓ Saved source_id to DB: {contact_source_id} for client {client.client_id}")
+                            else:
+                                logger.warning(f"Found existing contact {contact_id} but source_id not found for client {client.client_id}")
+                        else:
+                            logger.error(f"Contact exists (422) but cannot be found by identifier/email/phone for client {client.client_id}")
+                            raise ValueError("Contact exists but cannot be found")
+                    else:
+                        # Другие HTTP ошибки - пробрасываем дальше
+                        raise
+            else:
+                logger.warning(f"Cannot create contact: no valid email or phone for client {client.client_id}")
+        except Exception as create_contact_error:
+            logger.error(f"Failed to create contact in Chatwoot: {create_contact_error}", exc_info=True)
+            # Продолжаем без contact_id - попробуем создать conversation с объектом contact (fallback)
+            contact_id = None
+
+    return contact_id, contact_source_id, pubsub_token
+
+
+async def _find_chatwoot_team(chatwoot_client: ChatwootClient, consultation_type: Optional[str]) -> Optional[int]:
+    """
+    Команда Chatwoot для consultation_type (None — без команды).
+
+    ВАЖНО: Сначала делаем GET команд, сравниваем что подходит, обновляем названия при необходимости
+    """
+    team_name = {
+        "Консультация по ведению учёта": "консультация по ведению учета",
+        "Техническая поддержка": "техническая поддержка",
+    }.get(consultation_type)
+    if not team_name:
+        return None
+    # Ищем команду с любым похожим названием и обновляем до правильного
+    team_id = await chatwoot_client.find_team_by_name(team_name=team_name, expected_name=team_name)
+    if not team_id:
+        logger.warning(f"Team '{team_name}' not found in Chatwoot, conversation will be created without team")
+    return team_id
+
+
+async def _open_chatwoot_conversation(
+    db: AsyncSession,
+    chatwoot_client: ChatwootClient,
+    payload: ConsultationWithClient,
+    *,
+    consultation_type: Optional[str],
+    source: str,
+    selected_manager_key: Optional[str],
+    contact_id: Optional[Any],
+    contact_source_id: Optional[str],
+    custom_attrs: Dict[str, Any],
+    team_id: Optional[int],
+) -> Tuple[str, Optional[str]]:
+    """
+    Создает беседу Chatwoot через Public API, назначает команду и агента, добавляет labels.
+
+    team_id — результат _find_chatwoot_team (не зависит от контакта, ищется параллельно).
+
+    Ошибка создания беседы пробрасывается; ошибки назначения и labels только логируются.
+
+    Returns:
+        (ID беседы, source_id для виджета)
+    """
+    settings = get_settings()
+
+    # Формируем labels для language, source, consultation_type и selected_software (типовое поле Chatwoot)
+    selected_software_for_labels = None
+    if hasattr(payload.consultation, "selected_software") and payload.consultation.selected_software:
+        selected_software_for_labels = payload.consultation.selected_software
+
+    labels = _build_chatwoot_labels(
+        language=payload.consultation.lang,
+        source=source,  # TELEGRAM, SITE, BACKEND
+        consultation_type=consultation_type,
+        selected_software=selected_software_for_labels
+    )
+
+    # Назначаем менеджера в Chatwoot (если выбран)
+    assignee_id = None
+    if selected_manager_key:
+        # Ищем chatwoot_user_id через user_mapping или напрямую в users
+        mapping_result = await db.execute(
+            select(UserMapping).where(UserMapping.cl_manager_key == selected_manager_key).limit(1)
+        )
+        mapping = mapping_result.scalar_one_or_none()
+        if mapping:
+            assignee_id = mapping.chatwoot_user_id
+            logger.info(f"Mapped manager {selected_manager_key} to Chatwoot user {assignee_id}")
+        else:
+            # Пробуем найти через users
+            user_result = await db.execute(
+                select(User).where(
+                    User.cl_ref_key == selected_manager_key,
+                    User.deletion_mark == False,
+                    User.invalid == False
+                ).limit(1)
+            )
+            user = user_result.scalar_one_or_none()
+            if user and user.chatwoot_user_id:
+                assignee_id = user.chatwoot_user_id
+                logger.info(f"Found Chatwoot user {assignee_id} for manager {selected_manager_key}")
+            else:
+                # Менеджер не найден в Chatwoot - возможно, не синхронизирован
+                logger.warning(
+                    f"Manager {selected_manager_key} not found in Chatwoot. "
+                    f"User exists: {user is not None}, has chatwoot_user_id: {user.chatwoot_user_id if user else None}. "
+                    f"Conversation will be created without assignee. "
+                    f"Please run sync_users_to_chatwoot.py to sync this user."
+                )
+
+    # Внешняя фаза: менеджер найден в БД, соединение свободно на время вызовов Chatwoot
+    async with external_phase(db, "chatwoot_conversation"):
+        # ВАЖНО: Создание заявки/консультации/беседы происходит по Public API
+        # После создания нужно правильно обновить лейблами, агентом и командой
+        if not contact_source_id:
+            raise ValueError("contact_source_id is required for creating conversation via Public API")
+
+        logger.info(f"=== Creating conversation via Public API ===")
+        logger.info(f"  Contact source_id: {contact_source_id}")
+        logger.info(f"  Inbox identifier: {settings.CHATWOOT_INBOX_IDENTIFIER}")
+        logger.info(f"  Message preview: {(payload.consultation.comment or '')[:100]}")
+
+        chatwoot_response = await chatwoot_client.create_conversation_via_public_api(
+            source_id=contact_source_id,
+            message=payload.consultation.comment or "",
+            custom_attributes=custom_attrs,
+        )
+        chatwoot_cons_id = str(chatwoot_response.get("id"))
+        if not chatwoot_cons_id or chatwoot_cons_id == "None":
+            chatwoot_cons_id = str(chatwoot_response.get("payload", {}).get("id", "")) if isinstance(chatwoot_response.get("payload"), dict) else None
+            if not chatwoot_cons_id or chatwoot_cons_id == "None":
+                raise ValueError(f"Chatwoot returned invalid conversation ID: {chatwoot_response}")
+
+        conversation_source_id_from_response = chatwoot_client._extract_source_id(
+            chatwoot_response,
+            inbox_id=settings.CHATWOOT_INBOX_ID
+        )
+        chatwoot_source_id = conversation_source_id_from_response if conversation_source_id_from_response else contact_source_id
+
+        # ВАЖНО: После создания заявки назначаем команду и агента через assignments endpoint
+        # Сначала команду, потом агента (раздельно)
+        if team_id:
+            try:
+                await chatwoot_client.assign_conversation_team(
+                    conversation_id=chatwoot_cons_id,
+                    team_id=team_id
+                )
+                logger.info(f"✓ Assigned team {team_id} to conversation {chatwoot_cons_id}")
+            except Exception as team_error:
+                logger.warning(f"Failed to assign team to conversation: {team_error}")
+
+        if assignee_id:
+            try:
+                await chatwoot_client.assign_conversation_agent(
+                    conversation_id=chatwoot_cons_id,
+                    assignee_id=assignee_id
+                )
+                logger.info(f"✓ Assigned agent {assignee_id} to conversation {chatwoot_cons_id}")
+            except Exception as agent_error:
+                logger.warning(f"Failed to assign agent to conversation: {agent_error}")
+
+        # Добавляем labels отдельно (если нужно)
+        if labels and is_valid_chatwoot_conversation_id(chatwoot_cons_id):
+            try:
+                # Читаем существующие лейблы контакта и мержим с новыми
+                if contact_id:
+                    try:
+                        existing_contact_data = await chatwoot_client.get_contact(contact_id)
+                        contact_labels = (existing_contact_data or {}).get("custom_attributes", {}).get("labels", [])
+                        if contact_labels and isinstance(contact_labels, list):
+                            merged = list(dict.fromkeys(contact_labels + labels))
+                            labels = merged
+                    except Exception:
+                        pass
+
+                await chatwoot_client.add_conversation_labels(
+                    conversation_id=chatwoot_cons_id,
+                    labels=labels
+                )
+                logger.info(f"✓ Added labels to conversation {chatwoot_cons_id}: {labels}")
+            except Exception as labels_error:
+                logger.warning(f"Failed to add labels to conversation {chatwoot_cons_id}: {labels_error}")
+
+            # Сохраняем лейблы в custom_attributes контакта
+            if contact_id and labels:
+                try:
+                    await chatwoot_client.update_contact(
+                        contact_id=contact_id,
+                        custom_attributes={"labels": labels}
+                    )
+                    logger.info(f"✓ Saved labels to contact {contact_id}: {labels}")
+                except Exception as contact_labels_error:
+                    logger.warning(f"Failed to save labels to contact {contact_id}: {contact_labels_error}")
+        elif labels:
+            logger.debug(
+                f"Skipping labels for conversation {chatwoot_cons_id}: "
+                f"cons_id is not a valid Chatwoot conversation ID"
+            )
+
+    return chatwoot_cons_id, chatwoot_source_id
+
+
+async def _create_onec_consultation(
+    db: AsyncSession,
+    onec_client: OneCClient,
+    consultation: Consultation,
+    payload: ConsultationWithClient,
+    *,
+    client_key: Optional[str],
+    owner: OwnerSnapshot,
+    consultation_type: Optional[str],
+    selected_manager_key: Optional[str],
+    contact_hint: Optional[str],
+) -> None:
+    """
+    Создает документ консультации в 1C:ЦЛ и сохраняет ответ в consultation (flush).
+
+    ConsultationLimitExceeded и ошибки OData пробрасываются.
+    """
+    # ВАЖНО: Для технической поддержки менеджер не назначается - он сам назначит себя в Chatwoot
+    # Для консультаций по ведению учета используем выбранного менеджера (или дефолтного если не выбран)
+    if consultation_type == "Техническая поддержка":
+        manager_key = None  # Не назначаем менеджера для технической поддержки
+        logger.info("Техническая поддержка: менеджер не назначается, будет назначен через Chatwoot")
+    else:
+        manager_key = selected_manager_key or await _get_default_manager_key(db, consultation_type=consultation_type)
+        if not manager_key:
+            logger.warning("No manager found, consultation will be created without manager_key")
+
+    # СпособСвязи - пока используем маппинг из source (TODO: добавить preferred_contact_method в Client)
+    from ..services.onec_client import map_source_to_contact_method
+    contact_method = map_source_to_contact_method(payload.source) if payload.source else "ПоТелефону"
+
+    # Название клиента для АбонентПредставление
+    # Приоритет: company_name для названия компании, contact_name/name для ФИО
+    base_name = None
+
+    if owner.company_name:
+        # Если есть company_name - используем его
+        base_name = owner.company_name
+    elif owner.contact_name:
+        # contact_name обычно содержит ФИО
+        base_name = owner.contact_name
+    elif owner.name:
+        # name может быть как ФИО, так и названием компании
+        # Проверяем, не является ли это названием компании
+        if _is_company_name(owner.name):
+            # Это похоже на название компании - используем как company_name
+            base_name = owner.name
+            logger.warning(
+                f"Используется поле 'name' как название компании для клиента {owner.client_id}: "
+                f"'{owner.name}'. Рекомендуется заполнить поле 'company_name' отдельно."
+            )
+        else:
+            # Это похоже на ФИО
+            base_name = owner.name
+    else:
+        base_name = "Клиент"
+
+    client_display_name_parts = ["Clobus", base_name]
+    if owner.code_abonent:
+        client_display_name_parts.append(owner.code_abonent)
+    if owner.org_inn:
+        client_display_name_parts.append(f"({owner.org_inn})")
+    client_display_name = " ".join(client_display_name_parts)
+
+    # Валидация перед отправкой в 1C
+    if not client_key or len(client_key) != 36 or client_key.count("-") != 4:
+        raise ValueError(f"Invalid client_key format: '{client_key}'. Must be a valid GUID.")
+
+    if manager_key and (len(manager_key) != 36 or manager_key.count("-") != 4):
+        logger.warning(f"Invalid manager_key format: '{manager_key}', proceeding without manager")
+        manager_key = None
+
+    logger.info(f"Creating 1C consultation: client_key={client_key}, manager_key={manager_key}, client_display_name={client_display_name}")
+
+    onec_response = await onec_client.create_consultation_odata(
+        client_key=client_key,
+        manager_key=manager_key,  # Менеджер из БД
+        description=payload.consultation.comment or "",
+        topic=payload.consultation.topic,
+        scheduled_at=payload.consultation.scheduled_at,
+        question_category_key=normalize_uuid(payload.consultation.online_question_cat),  # Нормализуем пустые UUID
+        question_key=normalize_uuid(payload.consultation.online_question),  # Нормализуем пустые UUID
+        language_code=payload.consultation.lang,
+        contact_method=contact_method,
+        contact_hint=contact_hint,
+        client_display_name=client_display_name,
+        importance=payload.consultation.importance,
+        comment=payload.consultation.comment,
+        db_session=db,  # Передаем сессию БД для поиска автора по имени
+    )
+
+    # Проверяем, что ответ от 1C содержит обязательные поля
+    if not onec_response:
+        raise ValueError("1C returned empty response")
+
+    if "Ref_Key" not in onec_response:
+        logger.warning(f"1C response missing Ref_Key: {onec_response}")
+    else:
+        logger.debug(f"1C consultation created with Ref_Key: {onec_response.get('Ref_Key')}")
+
+    # Обрабатываем полный ответ от 1C и сохраняем все важные поля
+    await _process_onec_response(consultation, onec_response)
+    await db.flush()  # Сохраняем данные из 1C
+
+
+async def _send_chatwoot_info_message(
+    chatwoot_client: ChatwootClient,
+    consultation: Consultation,
+    chatwoot_cons_id: str,
+) -> None:
+    """Информационное сообщение от имени компании в беседе (ошибки только логируются)"""
+
+    try:
+        # Формируем информационное сообщение
+        info_message_parts = ["Ваша заявка на консультацию принята."]
+
+        if consultation.number:
+            info_message_parts.append(f"Номер заявки: {consultation.number}.")
+
+        if consultation.start_date:
+            date_str = consultation.start_date.strftime("%d.%m.%Y %H:%M")
+            info_message_parts.append(f"Запланированная дата консультации: {date_str}.")
+
+        # Добавляем сообщение о записи для консультаций на будущее
+        if consultation.start_date:
+            now = datetime.now(timezone.utc)
+            if consultation.start_date.date() > now.date():
+                info_message_parts.append("Вы записаны. Заявки обрабатываются в порядке очереди.")
+
+        info_message = " ".join(info_message_parts)
+
+        # Отправляем через Agent Bot API
+        # Bot сообщения видны клиенту и НЕ влияют на SLA
+        await chatwoot_client.send_bot_message(
+            conversation_id=chatwoot_cons_id,
+            content=info_message
+        )
+        logger.info(f"Sent info message to Chatwoot conversation {chatwoot_cons_id}")
+
+        # Обновляем custom_attributes с номером консультации если он есть
+        if consultation.number:
+            try:
+                await chatwoot_client.update_conversation_custom_attributes(
+                    conversation_id=chatwoot_cons_id,
+                    custom_attributes={"number_con": str(consultation.number)}
+                )
+                logger.info(f"Updated custom_attributes with number_con={consultation.number} for conversation {chatwoot_cons_id}")
+            except Exception as e:
+                logger.warning(f"Failed to update custom_attributes with number_con: {e}")
+    except Exception as e:
+        logger.warning(f"Failed to send info message to Chatwoot: {e}", exc_info=True)
+
+
+async def _get_telegram_bot_username() -> Optional[str]:
+    """Username бота для ответа на консультацию из Telegram"""
+    bot_username = None
+
+    try:
+        from ..services.telegram_bot import TelegramBotService
+        telegram_bot_service = TelegramBotService()
+        bot_info = await telegram_bot_service.bot.get_me()
+        if bot_info:
+            bot_username = bot_info.username
+            logger.info(f"Got bot username for Telegram consultation: {bot_username}")
+    except Exception as e:
+        logger.warning(f"Failed to get bot username: {e}")
+    return bot_username
+
+
+async def _notify_telegram_consultation_created(telegram_user_id: int, consultation: Consultation) -> None:
+    """Авто сообщение ботом пользователю Telegram о создании заявки"""
+
+    try:
+        from ..services.telegram_bot import TelegramBotService
+        telegram_bot_service = TelegramBotService()
+        # Отправляем сообщение пользователю о создании консультации
+        consultation_message = (
+            f"✅ Ваша заявка #{consultation.number or consultation.cons_id} создана!\n\n"
+            f"Мы получили ваш запрос и скоро с вами свяжемся.\n\n"
+            f"Вы можете продолжить общение здесь в чате."
+        )
+        await telegram_bot_service.bot.send_message(
+            chat_id=telegram_user_id,
+            text=consultation_message
+        )
+        logger.info(f"Sent auto message to Telegram user {telegram_user_id} for consultation {consultation.cons_id}")
+    except Exception as e:
+        logger.error(f"Failed to send auto message to Telegram user {telegram_user_id}: {e}", exc_info=True)
+        # Не блокируем ответ, если не удалось отправить сообщение
+
+
+async def _select_manager_key(payload: ConsultationWithClient, consultation_type: Optional[str]) -> Optional[str]:
+    """
+    Автоподбор менеджера (только для "Консультация по ведению учёта").
+
+    ВАЖНО: выполняется в своей сессии — одновременно с синхронизацией владельца
+    с 1C:ЦЛ, которая работает в сессии запроса. Ошибка подбора только логируется.
+    """
+    # ВАЖНО: Для "Техническая поддержка" не подбираем менеджера автоматически
+    if consultation_type == "Техническая поддержка":
+        logger.info("Skipping auto-assignment for Техническая поддержка (no manager selection needed)")
+        return None
+    if consultation_type != "Консультация по ведению учёта":
+        # Для других типов консультаций (если появятся) также не подбираем автоматически
+        logger.info(f"Skipping auto-assignment for consultation_type={consultation_type}")
+        return None
+
+    # Используются только менеджеры с лимитами (проверка в ManagerSelector)
+    # Пока используем online_question_cat как category_key для выбора менеджера
+    category_key = normalize_uuid(payload.consultation.online_question_cat)
+    try:
+        from ..database import AsyncSessionLocal
+        async with AsyncSessionLocal() as selector_db:
+            selected_manager_key = await ManagerSelector(selector_db).select_manager_for_consultation(
+                consultation=None,  # Консультация еще не создана
+                category_key=category_key,
+                current_time=datetime.now(timezone.utc),
+                consultation_type=consultation_type,  # Передаем тип консультации для фильтрации
+                language=payload.consultation.lang,  # Передаем язык для проверки соответствия
+            )
+    except Exception as e:
+        logger.error(f"Failed to auto-select manager: {e}", exc_info=True)
+        # Продолжаем без автоматического выбора менеджера
+        return None
+
+    if selected_manager_key:
+        logger.info(f"Auto-selected manager {selected_manager_key} for consultation (Консультация по ведению учёта)")
+    else:
+        logger.warning("No manager selected automatically for consultation (Консультация по ведению учёта), will use default or manual assignment")
+    return selected_manager_key
+
+
+def _accepted_response(accepted: ConsultationCreateAccepted) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        content=accepted.dict(),
+        headers={"Location": accepted.status_url, "Preference-Applied": "respond-async"},
+    )
+
+
+async def _accept_consultation_saga(
+    db: AsyncSession,
+    payload: ConsultationWithClient,
+    consultation: Consultation,
+    *,
+    client_id: str,
+    owner: OwnerSnapshot,
+    client_key: Optional[str],
+    selected_manager_key: Optional[str],
+    source: str,
+    telegram_user_id: Optional[int],
+    contact_hint: Optional[str],
+    idempotency_key: Optional[str],
+) -> JSONResponse:
+    """
+    Асинхронный режим: консультация и сага фиксируются одним commit, ответ 202.
+
+    Контекст саги — все, что синхронный режим вычисляет до обращения к Chatwoot
+    (payload с уже скорректированным scheduled_at, владелец, менеджер, источник).
+    """
+    saga = start_consultation_saga(db, consultation, context={
+        "payload": payload.model_dump(mode="json", exclude={"client"}),
+        "client_id": client_id,
+        "owner": owner._asdict(),
+        "client_key": client_key,
+        "selected_manager_key": selected_manager_key,
+        "source": source,
+        "telegram_user_id": telegram_user_id,
+        "contact_hint": contact_hint,
+        "accepted_cons_id": consultation.cons_id,
+    })
+    accepted = ConsultationCreateAccepted(
+        saga_id=str(saga.id),
+        cons_id=consultation.cons_id,
+        client_id=client_id,
+        status_url=f"/api/consultations/create/{saga.id}",
+    )
+    if idempotency_key:
+        await store_idempotency_key(
+            db=db,
+            key=idempotency_key,
+            operation_type="create_consultation",
+            resource_id=consultation.cons_id,
+            request_hash=generate_request_hash(payload.dict()),
+            response_data=accepted.dict(),
+        )
+    await db.commit()
+    logger.info(f"Accepted consultation {consultation.cons_id} for async creation (saga {saga.id})")
+    return _accepted_response(accepted)
+
+
+async def _discard_consultation(db: AsyncSession, cons_ids: List[str]) -> None:
+    """
+    Отмена создания консультации, уже зафиксированной DB-фазой (utils.db_phases):
+    rollback текущей транзакции и удаление строки по ID, под которыми она сохранялась.
+    """
+    try:
+        await db.rollback()
+        await db.execute(delete(Consultation).where(Consultation.cons_id.in_(cons_ids)))
+        await db.commit()
+    except Exception as e:
+        logger.error(f"Failed to discard consultation {cons_ids}: {e}", exc_info=True)
+
+
 @router.post("/create", response_model=ConsultationResponse)
 async def create_consultation(
     payload: ConsultationWithClient,
     request: Request,
     db: AsyncSession = Depends(get_db),
     authorization: Optional[str] = Header(None, description="Bearer токен (опционально)"),
-    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", description="Уникальный ключ для предотвращения дублирования")
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", description="Уникальный ключ для предотвращения дублирования"),
+    prefer: Optional[str] = Header(None, description="respond-async — ответ 202, Chatwoot и 1C:ЦЛ в фоне")
 ):
     """
     Создание консультации с данными клиента.
@@ -1257,20 +2259,44 @@ async def create_consultation(
     Headers:
     - Authorization: Bearer <token> (опционально, для будущей валидации)
     - Idempotency-Key: <key> (опционально, для предотвращения дублирования)
+    - Prefer: respond-async (опционально): шаги 4-6 выполняются в фоне сагой
+      (services.consultation_saga), ответ — 202 с saga_id и status_url
+      (GET /api/consultations/create/{saga_id}); без воркера саг заголовок игнорируется
+    
+    Вызовы 1C:ЦЛ и Chatwoot выполняются без соединения с БД (utils.db_phases):
+    перед каждым из них транзакция фиксируется. Консультация, сохраненная до
+    ошибки, удаляется (_discard_consultation) — как раньше при rollback.
     """
-    # Проверяем idempotency key если передан
+    use_short_transactions(db)
+    # Проверяем и резервируем idempotency key если передан (один атомарный запрос)
     if idempotency_key:
         request_hash = generate_request_hash(payload.dict())
-        cached_response = await check_idempotency_key(
-            db=db,
+        reservation = await reserve_idempotency_key(
             key=idempotency_key,
             operation_type="create_consultation",
             request_hash=request_hash
         )
-        if cached_response:
+        if reservation.status == "completed":
             logger.info(f"Returning cached response for idempotency key: {idempotency_key}")
-            return ConsultationResponse(**cached_response)
+            if "saga_id" in reservation.response_data:
+                # Повтор асинхронного запроса — та же сага
+                return _accepted_response(ConsultationCreateAccepted(**reservation.response_data))
+            return ConsultationResponse(**reservation.response_data)
+        if reservation.status == "in_progress":
+            raise HTTPException(
+                status_code=409,
+                detail="Request with this Idempotency-Key is already in progress"
+            )
+        if reservation.status == "mismatch":
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used with a different request body"
+            )
     
+    started = perf_counter()
+    total_step = TOTAL_STEP
+    # ID, под которыми консультация могла быть зафиксирована до завершения создания
+    pending_cons_ids: Optional[List[str]] = None
     try:
         # 1. Находим или создаем клиента
         client = None
@@ -1314,11 +2340,19 @@ async def create_consultation(
             owner_client = await _get_owner_client(db, client)
             onec_client = OneCClient()
 
-            # Для технической поддержки не создаем/не обновляем клиента в ЦЛ
-            if consultation_type == "Техническая поддержка":
-                logger.info("Skipping 1C client sync for technical support consultation")
-            else:
-                owner_client = await _ensure_owner_synced_with_cl(db, owner_client, onec_client)
+            async def sync_owner(results):
+                # Для технической поддержки не создаем/не обновляем клиента в ЦЛ
+                if consultation_type == "Техническая поддержка":
+                    logger.info("Skipping 1C client sync for technical support consultation")
+                    return owner_client
+                return await _ensure_owner_synced_with_cl(db, owner_client, onec_client)
+
+            # Поиск владельца в 1C:ЦЛ (сессия запроса) и подбор менеджера (своя сессия) независимы
+            prepared = await run_step_graph(CREATE_CONSULTATION_FLOW, [
+                Step("owner_sync", sync_owner),
+                Step("manager_selection", lambda results: _select_manager_key(payload, consultation_type)),
+            ], name="prepare")
+            owner_client = prepared["owner_sync"]
         except HTTPException:
             raise
         except Exception as e:
@@ -1339,6 +2373,7 @@ async def create_consultation(
         owner_client_company_name = owner_client.company_name
         owner_client_phone_number = owner_client.phone_number
         client_phone_number = client.phone_number
+        owner_snapshot = OwnerSnapshot.from_client(owner_client)
         
         # ВАЖНО: Проверка обязательных полей для создания консультации
         # Номер телефона обязателен для связи с клиентом
@@ -1378,44 +2413,8 @@ async def create_consultation(
         if consultation_type == "Техническая поддержка":
             # Проверка: максимум 1 открытая консультация одновременно для одного user_id (client_id)
             await _check_technical_support_limit(db, client.client_id)
-        # 2. Автоматически выбираем менеджера для консультации
-        # ВАЖНО: Для "Техническая поддержка" не подбираем менеджера автоматически
-        selected_manager_key = None
-        
-        if consultation_type == "Консультация по ведению учёта":
-            # Автоподбор менеджера только для консультаций по ведению учета
-            # Используются только менеджеры с лимитами (проверка в ManagerSelector)
-            manager_selector = ManagerSelector(db)
-            
-            # Получаем раздел программы из консультации (если есть)
-            # Пока используем online_question_cat как category_key для выбора менеджера
-            category_key = normalize_uuid(payload.consultation.online_question_cat)
-            
-            try:
-                # Получаем язык консультации для проверки соответствия языка менеджера
-                consultation_language = payload.consultation.lang
-                
-                selected_manager_key = await manager_selector.select_manager_for_consultation(
-                    consultation=None,  # Консультация еще не создана
-                    category_key=category_key,
-                    current_time=datetime.now(timezone.utc),
-                    consultation_type=consultation_type,  # Передаем тип консультации для фильтрации
-                    language=consultation_language,  # Передаем язык для проверки соответствия
-                )
-                
-                if selected_manager_key:
-                    logger.info(f"Auto-selected manager {selected_manager_key} for consultation (Консультация по ведению учёта)")
-                else:
-                    logger.warning("No manager selected automatically for consultation (Консультация по ведению учёта), will use default or manual assignment")
-            except Exception as e:
-                logger.error(f"Failed to auto-select manager: {e}", exc_info=True)
-                # Продолжаем без автоматического выбора менеджера
-        elif consultation_type == "Техническая поддержка":
-            # Для технической поддержки не подбираем менеджера автоматически
-            logger.info("Skipping auto-assignment for Техническая поддержка (no manager selection needed)")
-        else:
-            # Для других типов консультаций (если появятся) также не подбираем автоматически
-            logger.info(f"Skipping auto-assignment for consultation_type={consultation_type}")
+        # 2. Менеджер, автоматически подобранный для консультации (шаг manager_selection)
+        selected_manager_key = prepared["manager_selection"]
         
         # Если менеджер не выбран автоматически, используем менеджера "не определено"
         # ВАЖНО: Для "Техническая поддержка" менеджер не назначается автоматически
@@ -1542,580 +2541,126 @@ async def create_consultation(
             except Exception as e:
                 logger.warning(f"Failed to link Telegram user: {e}", exc_info=True)
                 # Продолжаем создание консультации даже если не удалось связать пользователя
-        
-        # 3. Создаем консультацию в БД
-        # ВАЖНО: Используем транзакцию для атомарности операций
-        # При ошибке в Chatwoot/1C - откатываем транзакцию
-        temp_cons_id = f"temp_{uuid.uuid4()}"
-        consultation = Consultation(
-            cons_id=temp_cons_id,
-            client_id=client.client_id,
-            client_key=client_key,
-            cl_ref_key=payload.consultation.cl_ref_key,
-            org_inn=owner_client_org_inn,
-            lang=payload.consultation.lang or "ru",
-            consultation_type=payload.consultation.consultation_type,
-            comment=payload.consultation.comment or "",
-            online_question_cat=normalize_uuid(payload.consultation.online_question_cat),
-            online_question=normalize_uuid(payload.consultation.online_question),
-            importance=payload.consultation.importance,
-            start_date=payload.consultation.scheduled_at,
-            status="open",
-            # ВАЖНО: Для технической поддержки менеджер не устанавливается - он будет назначен через Chatwoot webhook
-            manager=None if consultation_type == "Техническая поддержка" else selected_manager_key,
-            source=source,  # Указываем источник создания (TELEGRAM, SITE, BACKEND)
-        )
-        db.add(consultation)
-        await db.flush()
-        
-        # Формируем custom_attrs с учетом созданной consultation
-        custom_attrs = await _build_chatwoot_custom_attrs(db, owner_client, payload, consultation=consultation)
-        
-        # Валидация обязательного поля для Chatwoot
-        # Если code_abonent пустой, используем дефолтное значение
-        # ВАЖНО: это поле должно быть непустым, иначе Chatwoot может вернуть ошибку
-        code_abonent_value = custom_attrs.get("code_abonent")
-        if not code_abonent_value or code_abonent_value == "":
-            logger.warning(f"code_abonent is empty for client {owner_client_id}, using default 'N/A'")
-            custom_attrs["code_abonent"] = "N/A"  # Дефолтное значение вместо пустой строки
-        
-        # Логируем финальные custom_attrs перед отправкой
-        logger.info(f"Final custom_attrs for Chatwoot: {custom_attrs}")
-        
-        # 4. Отправляем в Chatwoot и 1C
-        # Отслеживаем успех создания хотя бы в одной системе
-        chatwoot_success = False
-        onec_success = False
-        
-        chatwoot_client = ChatwootClient()
-        chatwoot_cons_id = None
-        # ВАЖНО: source_id для conversation - это UUID, который МЫ генерируем на нашей стороне
-        # Это уникальный идентификатор беседы для идемпотентности (чтобы Chatwoot не создавал дубликаты)
-        # source_id НЕ берется из contact_inboxes - это разные идентификаторы
-        conversation_source_id = str(uuid.uuid4())  # Генерируем UUID для conversation
-        logger.info(f"Generated conversation source_id (UUID): {conversation_source_id} for consultation")
-        
-        chatwoot_source_id = None  # source_id для подключения виджета (будет установлен после создания conversation)
-        pubsub_token = None  # pubsub_token для WebSocket подключения (будет извлечен из Public API ответа)
-        
-        try:
-            from ..config import settings
-            
-            # 3. Создаем conversation в Chatwoot
-            # ВАЖНО: Application API Chatwoot не позволяет создавать contacts напрямую
-            # Поэтому создаем conversation только с source_id - Chatwoot автоматически создаст contact
-            logger.info(
-                f"Creating Chatwoot conversation: source_id={client.client_id}, "
-                f"inbox_id={settings.CHATWOOT_INBOX_ID}, custom_attrs={custom_attrs}"
-            )
-            
-            # Маппинг importance в priority (типовое поле Chatwoot)
-            priority = _map_importance_to_priority(payload.consultation.importance)
-            
-            # Формируем labels для language, source, consultation_type и selected_software (типовое поле Chatwoot)
-            consultation_type_for_labels = None
-            if consultation and consultation.consultation_type:
-                consultation_type_for_labels = consultation.consultation_type
-            elif payload.consultation.consultation_type:
-                consultation_type_for_labels = payload.consultation.consultation_type
-            
-            selected_software_for_labels = None
-            if hasattr(payload.consultation, "selected_software") and payload.consultation.selected_software:
-                selected_software_for_labels = payload.consultation.selected_software
-            
-            labels = _build_chatwoot_labels(
-                language=payload.consultation.lang,
-                source=source,  # Используем определенный выше source (TELEGRAM, SITE, BACKEND)
-                consultation_type=consultation_type_for_labels,
-                selected_software=selected_software_for_labels
-            )
-            
-            # Подготавливаем данные контакта (используются для поиска, создания контакта и conversation)
-            contact_name = client.name or client.contact_name or owner_client.name or owner_client.contact_name or "Клиент"
-            contact_email = client.email or owner_client.email
-            contact_phone = client.phone_number or owner_client.phone_number
-            
-            # Валидируем email перед использованием
-            if contact_email and not is_valid_email(contact_email):
-                logger.warning(f"Invalid email format '{contact_email}' for client {client.client_id}, skipping email field")
-                contact_email = None  # Не отправляем невалидный email
-            
-            # Разделяем custom_attributes на contact и conversation согласно ТЗ
-            from ..routers.clients import _build_chatwoot_contact_additional_attrs
-            contact_custom_attrs = _build_chatwoot_contact_custom_attrs(owner_client, client)
-            contact_additional_attrs = _build_chatwoot_contact_additional_attrs(owner_client, client)
-            conversation_custom_attrs = custom_attrs
-            
-            # ВАЖНО: Используем source_id из БД клиента, если он уже есть
-            # Контакт должен быть создан при создании клиента, и source_id сохранен в БД
-            contact_id = None
-            contact_source_id = None
-            
-            # Проверяем, есть ли source_id в БД клиента
-            if client.source_id:
-                logger.info(f"Using source_id from DB for client {client.client_id}: {client.source_id}")
-                contact_source_id = client.source_id
-                
-                # Проверяем, что contact существует в Chatwoot (получаем contact_id)
-                try:
-                    existing_contact = await chatwoot_client.find_contact_by_identifier(str(client.client_id))
-                    if existing_contact:
-                        contact_id = existing_contact.get("id")
-                        logger.info(f"Found existing Chatwoot contact by identifier: {contact_id} for client {client.client_id}")
-                        
-                        # ВАЖНО: Получаем pubsub_token для существующего contact через Public API
-                        if not client.chatwoot_pubsub_token:
-                            try:
-                                logger.info(f"Getting pubsub_token for existing contact (found by identifier) via Public API: source_id={client.source_id}")
-                                contact_public_data = await chatwoot_client.get_contact_via_public_api(client.source_id)
-                                
-                                existing_pubsub_token = chatwoot_client._extract_pubsub_token(contact_public_data)
-                                if existing_pubsub_token:
-                                    client.chatwoot_pubsub_token = existing_pubsub_token
-                                    await db.flush()
-                                    logger.info(f"✓ Retrieved pubsub_token for existing contact (found by identifier): {existing_pubsub_token[:20]}...")
-                                else:
-                                    logger.warning(f"⚠ pubsub_token not found in Public API response for existing contact (found by identifier)")
-                            except Exception as get_pubsub_error:
-                                logger.warning(f"Failed to get pubsub_token for existing contact (found by identifier) via Public API: {get_pubsub_error}")
-                    else:
-                        logger.warning(f"source_id exists in DB but contact not found in Chatwoot for client {client.client_id}")
-                        # source_id может быть устаревшим, нужно обновить
-                        contact_source_id = None
-                except Exception as contact_error:
-                    logger.error(f"Failed to verify contact in Chatwoot: {contact_error}", exc_info=True)
-                    contact_source_id = None
-            
-            # Если source_id нет в БД или contact не найден, ищем существующий contact
-            if not contact_source_id:
-                try:
-                    # Ищем контакт по identifier (client_id UUID)
-                    existing_contact = await chatwoot_client.find_contact_by_identifier(str(client.client_id))
-                    if existing_contact:
-                        contact_id = existing_contact.get("id")
-                        logger.info(f"Found existing Chatwoot contact by identifier: {contact_id} for client {client.client_id}")
-                        
-                        # Извлекаем source_id из существующего contact
-                        contact_inboxes = existing_contact.get("contact_inboxes", [])
-                        if isinstance(contact_inboxes, list) and len(contact_inboxes) > 0:
-                            for ci in contact_inboxes:
-                                if ci.get("inbox_id") == settings.CHATWOOT_INBOX_ID:
-                                    contact_source_id = ci.get("source_id")
-                                    break
-                            if not contact_source_id and len(contact_inboxes) > 0:
-                                contact_source_id = contact_inboxes[0].get("source_id")
-                        
-                        # Сохраняем source_id в БД клиента для будущего использования
-                        if contact_source_id:
-                            client.source_id = contact_source_id
-                            await db.flush()
-                            logger.info(f"✓ Saved source_id to DB: {contact_source_id} for client {client.client_id}")
-                    else:
-                        logger.warning(f"Contact not found in Chatwoot for client {client.client_id}. Contact should be created when client is created.")
-                        # Пробуем найти по email или phone как fallback
-                        
-                        if contact_email:
-                            existing_contact = await chatwoot_client.find_contact_by_email(contact_email)
-                            if existing_contact:
-                                contact_id = existing_contact.get("id")
-                                logger.info(f"Found existing Chatwoot contact by email: {contact_id}")
-                                
-                                # Извлекаем source_id
-                                contact_inboxes = existing_contact.get("contact_inboxes", [])
-                                if isinstance(contact_inboxes, list) and len(contact_inboxes) > 0:
-                                    for ci in contact_inboxes:
-                                        if ci.get("inbox_id") == settings.CHATWOOT_INBOX_ID:
-                                            contact_source_id = ci.get("source_id")
-                                            break
-                                    if not contact_source_id and len(contact_inboxes) > 0:
-                                        contact_source_id = contact_inboxes[0].get("source_id")
-                                
-                                if contact_source_id:
-                                    client.source_id = contact_source_id
-                                    
-                                    # ВАЖНО: Получаем pubsub_token для существующего contact через Public API
-                                    if not client.chatwoot_pubsub_token:
-                                        try:
-                                            logger.info(f"Getting pubsub_token for existing contact (found by email) via Public API: source_id={contact_source_id}")
-                                            contact_public_data = await chatwoot_client.get_contact_via_public_api(
-                                                source_id=contact_source_id
-                                            )
-                                            
-                                            existing_pubsub_token = chatwoot_client._extract_pubsub_token(contact_public_data)
-                                            if existing_pubsub_token:
-                                                client.chatwoot_pubsub_token = existing_pubsub_token
-                                                logger.info(f"✓ Retrieved pubsub_token for existing contact (found by email): {existing_pubsub_token[:20]}...")
-                                            else:
-                                                logger.warning(f"⚠ pubsub_token not found in Public API response for existing contact (found by email)")
-                                        except Exception as get_pubsub_error:
-                                            logger.warning(f"Failed to get pubsub_token for existing contact (found by email) via Public API: {get_pubsub_error}")
-                                    
-                                    await db.flush()
-                        
-                        if not contact_id and contact_phone:
-                            existing_contact = await chatwoot_client.find_contact_by_phone(contact_phone)
-                            if existing_contact:
-                                contact_id = existing_contact.get("id")
-                                logger.info(f"Found existing Chatwoot contact by phone: {contact_id}")
-                                
-                                # Извлекаем source_id
-                                contact_inboxes = existing_contact.get("contact_inboxes", [])
-                                if isinstance(contact_inboxes, list) and len(contact_inboxes) > 0:
-                                    for ci in contact_inboxes:
-                                        if ci.get("inbox_id") == settings.CHATWOOT_INBOX_ID:
-                                            contact_source_id = ci.get("source_id")
-                                            break
-                                    if not contact_source_id and len(contact_inboxes) > 0:
-                                        contact_source_id = contact_inboxes[0].get("source_id")
-                                
-                                if contact_source_id:
-                                    client.source_id = contact_source_id
-                                    
-                                    # ВАЖНО: Получаем pubsub_token для существующего contact через Public API
-                                    if not client.chatwoot_pubsub_token:
-                                        try:
-                                            logger.info(f"Getting pubsub_token for existing contact (found by phone) via Public API: source_id={contact_source_id}")
-                                            contact_public_data = await chatwoot_client.get_contact_via_public_api(
-                                                source_id=contact_source_id
-                                            )
-                                            
-                                            existing_pubsub_token = chatwoot_client._extract_pubsub_token(contact_public_data)
-                                            if existing_pubsub_token:
-                                                client.chatwoot_pubsub_token = existing_pubsub_token
-                                                logger.info(f"✓ Retrieved pubsub_token for existing contact (found by phone): {existing_pubsub_token[:20]}...")
-                                            else:
-                                                logger.warning(f"⚠ pubsub_token not found in Public API response for existing contact (found by phone)")
-                                        except Exception as get_pubsub_error:
-                                            logger.warning(f"Failed to get pubsub_token for existing contact (found by phone) via Public API: {get_pubsub_error}")
-                                    
-                                    await db.flush()
-                        
-                        if not contact_id:
-                            logger.warning(f"No contact found in Chatwoot for client {client.client_id}. Will create contact before conversation.")
-                except Exception as contact_error:
-                    logger.error(f"Failed to find contact in Chatwoot: {contact_error}", exc_info=True)
-                    # Продолжаем - попробуем создать контакт явно
-                    contact_id = None
-            
-            # ВАЖНО: Если контакт не найден, создаем его явно перед созданием conversation
-            # Это более надежный подход, чем полагаться на автоматическое создание через payload
-            if not contact_id:
-                try:
-                    logger.info(f"Contact not found, creating new contact in Chatwoot for client {client.client_id}")
-                    # Данные контакта уже подготовлены выше
-                    
-                    # Проверяем, что есть хотя бы email или phone для создания контакта
-                    if contact_email or contact_phone:
-                        # ВАЖНО: Используем Public API для создания contact, чтобы получить pubsub_token
-                        try:
-                            new_contact = await chatwoot_client.create_contact_via_public_api(
-                                name=contact_name,
-                                identifier=str(client.client_id),  # Глобальный внешний ID (UUID)
-                                email=contact_email,
-                                phone_number=contact_phone,
-                                custom_attributes=contact_custom_attrs,
-                                additional_attributes=contact_additional_attrs
-                            )
-                            
-                            # Извлекаем contact_id из ответа Public API
-                            contact_id = new_contact.get("id")
-                            if not contact_id:
-                                contact_id = new_contact.get("payload", {}).get("contact", {}).get("id") if isinstance(new_contact.get("payload"), dict) else None
-                            
-                            # Извлекаем source_id из ответа Public API
-                            # source_id создается автоматически Chatwoot при создании contact через Public API
-                            new_contact_source_id = chatwoot_client._extract_source_id(
-                                new_contact,
-                                inbox_id=settings.CHATWOOT_INBOX_ID
-                            )
-                            
-                            if new_contact_source_id:
-                                logger.info(f"✓ Extracted source_id from Public API response: {new_contact_source_id}")
-                            else:
-                                # Если source_id не найден в ответе создания, получаем contact через GET для извлечения source_id
-                                if contact_id:
-                                    try:
-                                        logger.info(f"source_id not found in create response, fetching contact {contact_id} to get source_id")
-                                        fetched_contact = await chatwoot_client.get_contact(contact_id)
-                                        
-                                        # Извлекаем source_id из ответа GET запроса Application API
-                                        new_contact_source_id = chatwoot_client._extract_source_id(
-                                            fetched_contact,
-                                            inbox_id=settings.CHATWOOT_INBOX_ID
-                                        )
-                                        
-                                        if new_contact_source_id:
-                                            logger.info(f"✓ Retrieved source_id from GET contact: {new_contact_source_id}")
-                                    except Exception as get_contact_error:
-                                        logger.warning(f"Failed to get contact {contact_id} to extract source_id: {get_contact_error}")
-                            
-                            # Извлекаем pubsub_token из ответа создания contact
-                            # ВАЖНО: pubsub_token принадлежит контакту (Contact), а не беседе (Conversation)
-                            logger.info(f"=== Extracting pubsub_token from contact creation response ===")
-                            logger.info(f"  Contact response keys: {list(new_contact.keys()) if isinstance(new_contact, dict) else 'not a dict'}")
-                            
-                            contact_pubsub_token = chatwoot_client._extract_pubsub_token(new_contact)
-                            if contact_pubsub_token:
-                                logger.info(f"✓ Extracted pubsub_token from contact creation response: {contact_pubsub_token[:20]}...")
-                                # Сохраняем pubsub_token в БД клиента (он принадлежит контакту)
-                                client.chatwoot_pubsub_token = contact_pubsub_token
-                                pubsub_token = contact_pubsub_token  # Используем для ответа
-                                logger.info(f"✓ Saved pubsub_token to client DB: {contact_pubsub_token[:20]}...")
-                            else:
-                                logger.warning(f"⚠ pubsub_token not found in contact creation response")
-                                # Логируем полную структуру ответа для отладки
-                                import json
-                                logger.warning(f"  Full contact response structure: {json.dumps(new_contact, ensure_ascii=False, indent=2)}")
-                            
-                            # Сохраняем source_id в БД клиента
-                            if new_contact_source_id:
-                                contact_source_id = new_contact_source_id
-                                client.source_id = new_contact_source_id
-                                await db.flush()
-                                logger.info(f"✓ Created Chatwoot contact via Public API: {contact_id}, source_id: {new_contact_source_id} for client {client.client_id}")
-                                logger.info(f"✓ Saved source_id to DB: {new_contact_source_id} for client {client.client_id}")
-                            else:
-                                logger.warning(f"Created Chatwoot contact {contact_id} but source_id not found in response or get_contact for client {client.client_id}")
-                                logger.warning(f"Response structure: {list(new_contact.keys()) if isinstance(new_contact, dict) else 'not a dict'}")
-                                logger.warning("source_id will remain null - frontend will handle this case")
-                            
-                            if not contact_id:
-                                logger.warning(f"Failed to extract contact_id from Chatwoot response: {new_contact}")
-                        except httpx.HTTPStatusError as http_error:
-                            # Обработка ошибки 422 - контакт уже существует
-                            if http_error.response.status_code == 422:
-                                logger.warning(f"Contact already exists in Chatwoot (422), trying to find existing contact for client {client.client_id}")
-                                
-                                # Пытаемся найти существующий contact
-                                existing_contact = None
-                                if str(client.client_id):
-                                    existing_contact = await chatwoot_client.find_contact_by_identifier(str(client.client_id))
-                                
-                                if not existing_contact and contact_email:
-                                    existing_contact = await chatwoot_client.find_contact_by_email(contact_email)
-                                
-                                if not existing_contact and contact_phone:
-                                    existing_contact = await chatwoot_client.find_contact_by_phone(contact_phone)
-                                
-                                if existing_contact:
-                                    # Извлекаем contact_id из найденного контакта
-                                    contact_id = existing_contact.get("id")
-                                    if not contact_id:
-                                        contact_id = existing_contact.get("payload", {}).get("contact", {}).get("id")
-                                    
-                                    # Извлекаем source_id из найденного contact
-                                    # Используем универсальный метод для извлечения source_id
-                                    contact_source_id = chatwoot_client._extract_source_id(
-                                        existing_contact,
-                                        inbox_id=settings.CHATWOOT_INBOX_ID
-                                    )
-                                    
-                                    # Если source_id не найден в ответе find, получаем contact через GET
-                                    if not contact_source_id and contact_id:
-                                        try:
-                                            logger.info(f"source_id not found in find response, fetching contact {contact_id} to get source_id")
-                                            fetched_contact = await chatwoot_client.get_contact(contact_id)
-                                            
-                                            # Извлекаем source_id из ответа GET запроса Application API
-                                            contact_source_id = chatwoot_client._extract_source_id(
-                                                fetched_contact,
-                                                inbox_id=settings.CHATWOOT_INBOX_ID
-                                            )
-                                            
-                                            if contact_source_id:
-                                                logger.info(f"✓ Retrieved source_id from GET contact: {contact_source_id}")
-                                        except Exception as get_contact_error:
-                                            logger.warning(f"Failed to get contact {contact_id} to extract source_id: {get_contact_error}")
-                                    
-                                    # Сохраняем source_id в БД клиента
-                                    if contact_source_id:
-                                        client.source_id = contact_source_id
-                                        
-                                        # ВАЖНО: Для существующего contact нужно получить pubsub_token через GET запрос к Public API
-                                        # pubsub_token не возвращается в Application API ответе, только в Public API
-                                        if not client.chatwoot_pubsub_token:
-                                            try:
-                                                logger.info(f"Getting pubsub_token for existing contact via Public API: source_id={contact_source_id}")
-                                                contact_public_data = await chatwoot_client.get_contact_via_public_api(
-                                                    source_id=contact_source_id
-                                                )
-                                                
-                                                existing_pubsub_token = chatwoot_client._extract_pubsub_token(contact_public_data)
-                                                if existing_pubsub_token:
-                                                    client.chatwoot_pubsub_token = existing_pubsub_token
-                                                    pubsub_token = existing_pubsub_token
-                                                    logger.info(f"✓ Retrieved pubsub_token for existing contact: {existing_pubsub_token[:20]}...")
-                                                else:
-                                                    logger.warning(f"⚠ pubsub_token not found in Public API response for existing contact")
-                                                    import json
-                                                    logger.warning(f"  Full Public API response: {json.dumps(contact_public_data, ensure_ascii=False, indent=2)}")
-                                            except Exception as get_pubsub_error:
-                                                logger.warning(f"Failed to get pubsub_token for existing contact via Public API: {get_pubsub_error}")
-                                                # Продолжаем без pubsub_token - frontend может получить его сам
-                                        else:
-                                            pubsub_token = client.chatwoot_pubsub_token
-                                            logger.info(f"✓ Using existing pubsub_token from client DB: {pubsub_token[:20]}...")
-                                        
-                                        await db.flush()
-                                        logger.info(f"✓ Found existing Chatwoot contact: {contact_id}, source_id: {contact_source_id} for client {client.client_id}")
-                                        logger.info(f"✓ Saved source_id to DB: {contact_source_id} for client {client.client_id}")
-                                    else:
-                                        logger.warning(f"Found existing contact {contact_id} but source_id not found for client {client.client_id}")
-                                else:
-                                    logger.error(f"Contact exists (422) but cannot be found by identifier/email/phone for client {client.client_id}")
-                                    raise ValueError("Contact exists but cannot be found")
-                            else:
-                                # Другие HTTP ошибки - пробрасываем дальше
-                                raise
-                    else:
-                        logger.warning(f"Cannot create contact: no valid email or phone for client {client.client_id}")
-                except Exception as create_contact_error:
-                    logger.error(f"Failed to create contact in Chatwoot: {create_contact_error}", exc_info=True)
-                    # Продолжаем без contact_id - попробуем создать conversation с объектом contact (fallback)
-                    contact_id = None
-            
-            
-            # Назначаем менеджера в Chatwoot (если выбран)
-            assignee_id = None
-            if selected_manager_key:
-                # Ищем chatwoot_user_id через user_mapping или напрямую в users
-                mapping_result = await db.execute(
-                    select(UserMapping).where(UserMapping.cl_manager_key == selected_manager_key).limit(1)
-                )
-                mapping = mapping_result.scalar_one_or_none()
-                if mapping:
-                    assignee_id = mapping.chatwoot_user_id
-                    logger.info(f"Mapped manager {selected_manager_key} to Chatwoot user {assignee_id}")
-                else:
-                    # Пробуем найти через users
-                    user_result = await db.execute(
-                        select(User).where(
-                            User.cl_ref_key == selected_manager_key,
-                            User.deletion_mark == False,
-                            User.invalid == False
-                        ).limit(1)
-                    )
-                    user = user_result.scalar_one_or_none()
-                    if user and user.chatwoot_user_id:
-                        assignee_id = user.chatwoot_user_id
-                        logger.info(f"Found Chatwoot user {assignee_id} for manager {selected_manager_key}")
-                    else:
-                        # Менеджер не найден в Chatwoot - возможно, не синхронизирован
-                        logger.warning(
-                            f"Manager {selected_manager_key} not found in Chatwoot. "
-                            f"User exists: {user is not None}, has chatwoot_user_id: {user.chatwoot_user_id if user else None}. "
-                            f"Conversation will be created without assignee. "
-                            f"Please run sync_users_to_chatwoot.py to sync this user."
-                        )
-            
-            # Определяем команду (team) в зависимости от consultation_type
-            # ВАЖНО: Сначала делаем GET команд, сравниваем что подходит, обновляем названия при необходимости
-            team_id = None
-            consultation_type = payload.consultation.consultation_type
-            if consultation_type == "Консультация по ведению учёта":
-                # Ищем команду с любым похожим названием и обновляем до правильного
-                team_id = await chatwoot_client.find_team_by_name(
-                    team_name="консультация по ведению учета",  # Для поиска
-                    expected_name="консультация по ведению учета"  # Ожидаемое название
-                )
-                if not team_id:
-                    logger.warning(f"Team 'консультация по ведению учета' not found in Chatwoot, conversation will be created without team")
-            elif consultation_type == "Техническая поддержка":
-                # Ищем команду с любым похожим названием и обновляем до правильного
-                team_id = await chatwoot_client.find_team_by_name(
-                    team_name="техническая поддержка",  # Для поиска
-                    expected_name="техническая поддержка"  # Ожидаемое название
-                )
-                if not team_id:
-                    logger.warning(f"Team 'техническая поддержка' not found in Chatwoot, conversation will be created without team")
-            
-            # ВАЖНО: Создание заявки/консультации/беседы происходит по Public API
-            # После создания нужно правильно обновить лейблами, агентом и командой
-            if not contact_source_id:
-                raise ValueError("contact_source_id is required for creating conversation via Public API")
-            
-            logger.info(f"=== Creating conversation via Public API ===")
-            logger.info(f"  Contact source_id: {contact_source_id}")
-            logger.info(f"  Inbox identifier: {settings.CHATWOOT_INBOX_IDENTIFIER}")
-            logger.info(f"  Message preview: {(payload.consultation.comment or '')[:100]}")
-            
-            chatwoot_response = await chatwoot_client.create_conversation_via_public_api(
-                source_id=contact_source_id,
-                message=payload.consultation.comment or "",
-                custom_attributes=conversation_custom_attrs,
+        
+        # 3. Создаем консультацию в БД
+        # ВАЖНО: Перед вызовами Chatwoot/1C транзакция фиксируется (utils.db_phases),
+        # поэтому при ошибке консультация удаляется по pending_cons_ids, а не только rollback
+        respond_async = prefers_respond_async(prefer)
+        if respond_async:
+            # Ответ 202 не включает внешние системы — отдельная запись, чтобы не смешивать с total
+            total_step = "accepted"
+        temp_cons_id = f"temp_{uuid.uuid4()}"
+        consultation = Consultation(
+            # В асинхронном режиме ответ уходит до Chatwoot — сразу постоянный UUID
+            cons_id=str(uuid.uuid4()) if respond_async else temp_cons_id,
+            client_id=client.client_id,
+            client_key=client_key,
+            cl_ref_key=payload.consultation.cl_ref_key,
+            org_inn=owner_client_org_inn,
+            lang=payload.consultation.lang or "ru",
+            consultation_type=payload.consultation.consultation_type,
+            comment=payload.consultation.comment or "",
+            online_question_cat=normalize_uuid(payload.consultation.online_question_cat),
+            online_question=normalize_uuid(payload.consultation.online_question),
+            importance=payload.consultation.importance,
+            start_date=payload.consultation.scheduled_at,
+            status="open",
+            # ВАЖНО: Для технической поддержки менеджер не устанавливается - он будет назначен через Chatwoot webhook
+            manager=None if consultation_type == "Техническая поддержка" else selected_manager_key,
+            source=source,  # Указываем источник создания (TELEGRAM, SITE, BACKEND)
+        )
+        db.add(consultation)
+        await db.flush()
+        
+        if respond_async:
+            return await _accept_consultation_saga(
+                db,
+                payload,
+                consultation,
+                client_id=str(client.client_id),
+                owner=owner_snapshot,
+                client_key=client_key,
+                selected_manager_key=selected_manager_key,
+                source=source,
+                telegram_user_id=telegram_user_id,
+                contact_hint=contact_hint,
+                idempotency_key=idempotency_key,
             )
-            chatwoot_cons_id = str(chatwoot_response.get("id"))
-            if not chatwoot_cons_id or chatwoot_cons_id == "None":
-                chatwoot_cons_id = str(chatwoot_response.get("payload", {}).get("id", "")) if isinstance(chatwoot_response.get("payload"), dict) else None
-                if not chatwoot_cons_id or chatwoot_cons_id == "None":
-                    raise ValueError(f"Chatwoot returned invalid conversation ID: {chatwoot_response}")
+        pending_cons_ids = [consultation.cons_id]
+        
+        # custom_attrs формируются шагом custom_attrs графа Chatwoot (с учетом созданной consultation)
+        custom_attrs: Dict[str, Any] = {}
+        
+        # 4. Отправляем в Chatwoot и 1C
+        # Отслеживаем успех создания хотя бы в одной системе
+        chatwoot_success = False
+        onec_success = False
+        
+        chatwoot_client = ChatwootClient()
+        chatwoot_cons_id = None
+        # ВАЖНО: source_id для conversation - это UUID, который МЫ генерируем на нашей стороне
+        # Это уникальный идентификатор беседы для идемпотентности (чтобы Chatwoot не создавал дубликаты)
+        # source_id НЕ берется из contact_inboxes - это разные идентификаторы
+        conversation_source_id = str(uuid.uuid4())  # Генерируем UUID для conversation
+        logger.info(f"Generated conversation source_id (UUID): {conversation_source_id} for consultation")
+        
+        chatwoot_source_id = None  # source_id для подключения виджета (будет установлен после создания conversation)
+        pubsub_token = None  # pubsub_token для WebSocket подключения (будет извлечен из Public API ответа)
+        contact_source_id = None  # source_id контакта (нужен и при ошибке создания conversation)
+        
+        try:
+            from ..config import settings
             
-            conversation_source_id_from_response = chatwoot_client._extract_source_id(
-                chatwoot_response,
-                inbox_id=settings.CHATWOOT_INBOX_ID
+            # 3. Создаем conversation в Chatwoot
+            # ВАЖНО: Application API Chatwoot не позволяет создавать contacts напрямую
+            # Поэтому создаем conversation только с source_id - Chatwoot автоматически создаст contact
+            logger.info(
+                f"Creating Chatwoot conversation: source_id={client.client_id}, "
+                f"inbox_id={settings.CHATWOOT_INBOX_ID}"
             )
-            chatwoot_source_id = conversation_source_id_from_response if conversation_source_id_from_response else contact_source_id
-            
-            # ВАЖНО: После создания заявки назначаем команду и агента через assignments endpoint
-            # Сначала команду, потом агента (раздельно)
-            if team_id:
-                try:
-                    await chatwoot_client.assign_conversation_team(
-                        conversation_id=chatwoot_cons_id,
-                        team_id=team_id
-                    )
-                    logger.info(f"✓ Assigned team {team_id} to conversation {chatwoot_cons_id}")
-                except Exception as team_error:
-                    logger.warning(f"Failed to assign team to conversation: {team_error}")
             
-            if assignee_id:
-                try:
-                    await chatwoot_client.assign_conversation_agent(
-                        conversation_id=chatwoot_cons_id,
-                        assignee_id=assignee_id
-                    )
-                    logger.info(f"✓ Assigned agent {assignee_id} to conversation {chatwoot_cons_id}")
-                except Exception as agent_error:
-                    logger.warning(f"Failed to assign agent to conversation: {agent_error}")
+            async def build_custom_attrs(results):
+                # Справочники читаются в своей сессии: сессию запроса в это время использует контакт.
+                # Из owner_client и consultation читаются только уже загруженные атрибуты
+                from ..database import AsyncSessionLocal
+                async with AsyncSessionLocal() as attrs_db:
+                    return await _build_conversation_custom_attrs(attrs_db, owner_client, payload, consultation)
             
-            # Добавляем labels отдельно (если нужно)
-            if labels and is_valid_chatwoot_conversation_id(chatwoot_cons_id):
-                try:
-                    # Читаем существующие лейблы контакта и мержим с новыми
-                    if contact_id:
-                        try:
-                            existing_contact_data = await chatwoot_client.get_contact(contact_id)
-                            contact_labels = (existing_contact_data or {}).get("custom_attributes", {}).get("labels", [])
-                            if contact_labels and isinstance(contact_labels, list):
-                                merged = list(dict.fromkeys(contact_labels + labels))
-                                labels = merged
-                        except Exception:
-                            pass
-
-                    await chatwoot_client.add_conversation_labels(
-                        conversation_id=chatwoot_cons_id,
-                        labels=labels
-                    )
-                    logger.info(f"✓ Added labels to conversation {chatwoot_cons_id}: {labels}")
-                except Exception as labels_error:
-                    logger.warning(f"Failed to add labels to conversation {chatwoot_cons_id}: {labels_error}")
-
-                # Сохраняем лейблы в custom_attributes контакта
-                if contact_id and labels:
-                    try:
-                        await chatwoot_client.update_contact(
-                            contact_id=contact_id,
-                            custom_attributes={"labels": labels}
-                        )
-                        logger.info(f"✓ Saved labels to contact {contact_id}: {labels}")
-                    except Exception as contact_labels_error:
-                        logger.warning(f"Failed to save labels to contact {contact_id}: {contact_labels_error}")
-            elif labels:
-                logger.debug(
-                    f"Skipping labels for conversation {chatwoot_cons_id}: "
-                    f"cons_id is not a valid Chatwoot conversation ID"
+            async def open_conversation(results):
+                # Создаем conversation через Public API, назначаем команду, агента и labels
+                resolved_contact_id, resolved_source_id, _ = results["chatwoot_contact"]
+                return await _open_chatwoot_conversation(
+                    db,
+                    chatwoot_client,
+                    payload,
+                    consultation_type=payload.consultation.consultation_type,
+                    source=source,
+                    selected_manager_key=selected_manager_key,
+                    contact_id=resolved_contact_id,
+                    contact_source_id=resolved_source_id,
+                    custom_attrs=results["custom_attrs"],
+                    team_id=results["chatwoot_team"],
                 )
             
+            # Контакт (сессия запроса), команда (только Chatwoot) и custom_attrs (своя сессия)
+            # независимы — беседа создается, когда готовы все три
+            chatwoot_steps: Dict[str, Any] = {}
+            try:
+                await run_step_graph(CREATE_CONSULTATION_FLOW, [
+                    # Находим или создаем контакт (source_id и pubsub_token сохраняются в клиенте)
+                    Step("chatwoot_contact", lambda results: _resolve_chatwoot_contact(db, chatwoot_client, client, owner_client)),
+                    Step("chatwoot_team", lambda results: _find_chatwoot_team(chatwoot_client, payload.consultation.consultation_type)),
+                    Step("custom_attrs", build_custom_attrs),
+                    Step("chatwoot_conversation", open_conversation, after=("chatwoot_contact", "chatwoot_team", "custom_attrs")),
+                ], results=chatwoot_steps, name="chatwoot")
+            finally:
+                # contact_source_id нужен и при ошибке создания conversation
+                contact_id, contact_source_id, contact_pubsub_token = chatwoot_steps.get("chatwoot_contact", (None, None, None))
+                custom_attrs = chatwoot_steps.get("custom_attrs", custom_attrs)
+            if contact_pubsub_token:
+                pubsub_token = contact_pubsub_token
+            chatwoot_cons_id, chatwoot_source_id = chatwoot_steps["chatwoot_conversation"]
+            
             # ВАЖНО: pubsub_token НЕ возвращается в ответе создания conversation
             # pubsub_token возвращается ТОЛЬКО в ответе POST создания contact через Public API
             # pubsub_token уже сохранен в БД клиента при создании contact выше
@@ -2157,8 +2702,9 @@ async def create_consultation(
                             f"Consultation with cons_id={chatwoot_cons_id} already exists and is active for client {owner_client_id}. "
                             f"This is a duplicate request (idempotency). Returning existing consultation."
                         )
-                        # Откатываем текущую транзакцию (мы не создавали новую консультацию)
-                        await db.rollback()
+                        # Удаляем временную консультацию (мы не создавали новую консультацию)
+                        await _discard_consultation(db, pending_cons_ids)
+                        pending_cons_ids = None
                         # Загружаем существующую консультацию в новой сессии для ответа
                         from ..database import AsyncSessionLocal
                         async with AsyncSessionLocal() as new_db:
@@ -2189,6 +2735,21 @@ async def create_consultation(
                                     chatwoot_inbox_id=settings.CHATWOOT_INBOX_ID,
                                     chatwoot_pubsub_token=final_pubsub_token,
                                 )
+                                if idempotency_key:
+                                    # Повтор с тем же ключом получит этот же ответ, а не пройдет создание заново
+                                    try:
+                                        await store_idempotency_key(
+                                            db=new_db,
+                                            key=idempotency_key,
+                                            operation_type="create_consultation",
+                                            resource_id=existing_loaded.cons_id,
+                                            request_hash=generate_request_hash(payload.dict()),
+                                            response_data=response.dict(),
+                                        )
+                                        await new_db.commit()
+                                    except Exception as e:
+                                        logger.warning(f"Failed to store idempotency key: {e}")
+                                        await release_idempotency_key(idempotency_key, "create_consultation")
                                 return response
                         # Если не удалось загрузить - продолжаем создание новой (fallback)
                         logger.warning(f"Failed to load existing consultation {chatwoot_cons_id}, continuing with new creation")
@@ -2233,6 +2794,7 @@ async def create_consultation(
                     detail=f"Consultation with cons_id={chatwoot_cons_id} already exists. "
                            f"This is a duplicate request. Please check frontend cache."
                 )
+            pending_cons_ids.append(chatwoot_cons_id)
             chatwoot_success = True
             logger.info(f"✓ Created Chatwoot conversation via Public API: {chatwoot_cons_id}, source_id: {chatwoot_source_id}, contact_id: {contact_id}")
         except HTTPException:
@@ -2329,94 +2891,18 @@ async def create_consultation(
                             f"Proceeding with 1C creation (1C will check limit anyway)."
                         )
                 
-                # ВАЖНО: Для технической поддержки менеджер не назначается - он сам назначит себя в Chatwoot
-                # Для консультаций по ведению учета используем выбранного менеджера (или дефолтного если не выбран)
-                if consultation_type == "Техническая поддержка":
-                    manager_key = None  # Не назначаем менеджера для технической поддержки
-                    logger.info("Техническая поддержка: менеджер не назначается, будет назначен через Chatwoot")
-                else:
-                    manager_key = selected_manager_key or await _get_default_manager_key(db, consultation_type=consultation_type)
-                    if not manager_key:
-                        logger.warning("No manager found, consultation will be created without manager_key")
-                
-                # СпособСвязи - пока используем маппинг из source (TODO: добавить preferred_contact_method в Client)
-                from ..services.onec_client import map_source_to_contact_method
-                contact_method = map_source_to_contact_method(payload.source) if payload.source else "ПоТелефону"
-                
-                # Название клиента для АбонентПредставление
-                # ВАЖНО: Используем сохраненные значения, а не обращаемся к owner_client напрямую
-                # (после возможного rollback owner_client может быть не доступен)
-                # Приоритет: company_name для названия компании, contact_name/name для ФИО
-                base_name = None
-                
-                if owner_client_company_name:
-                    # Если есть company_name - используем его
-                    base_name = owner_client_company_name
-                elif owner_client_contact_name:
-                    # contact_name обычно содержит ФИО
-                    base_name = owner_client_contact_name
-                elif owner_client_name:
-                    # name может быть как ФИО, так и названием компании
-                    # Проверяем, не является ли это названием компании
-                    if _is_company_name(owner_client_name):
-                        # Это похоже на название компании - используем как company_name
-                        base_name = owner_client_name
-                        logger.warning(
-                            f"Используется поле 'name' как название компании для клиента {owner_client_id}: "
-                            f"'{owner_client_name}'. Рекомендуется заполнить поле 'company_name' отдельно."
-                        )
-                    else:
-                        # Это похоже на ФИО
-                        base_name = owner_client_name
-                else:
-                    base_name = "Клиент"
-                
-                client_display_name_parts = ["Clobus", base_name]
-                if owner_client_code_abonent:
-                    client_display_name_parts.append(owner_client_code_abonent)
-                if owner_client_org_inn:
-                    client_display_name_parts.append(f"({owner_client_org_inn})")
-                client_display_name = " ".join(client_display_name_parts)
-                
-                # Валидация перед отправкой в 1C
-                if not client_key or len(client_key) != 36 or client_key.count("-") != 4:
-                    raise ValueError(f"Invalid client_key format: '{client_key}'. Must be a valid GUID.")
-                
-                if manager_key and (len(manager_key) != 36 or manager_key.count("-") != 4):
-                    logger.warning(f"Invalid manager_key format: '{manager_key}', proceeding without manager")
-                    manager_key = None
-                
-                logger.info(f"Creating 1C consultation: client_key={client_key}, manager_key={manager_key}, client_display_name={client_display_name}")
-                
-                onec_response = await onec_client.create_consultation_odata(
-                    client_key=client_key,
-                    manager_key=manager_key,  # Менеджер из БД
-                    description=payload.consultation.comment or "",
-                    topic=payload.consultation.topic,
-                    scheduled_at=payload.consultation.scheduled_at,
-                    question_category_key=normalize_uuid(payload.consultation.online_question_cat),  # Нормализуем пустые UUID
-                    question_key=normalize_uuid(payload.consultation.online_question),  # Нормализуем пустые UUID
-                    language_code=payload.consultation.lang,
-                    contact_method=contact_method,
-                    contact_hint=contact_hint,
-                    client_display_name=client_display_name,
-                    importance=payload.consultation.importance,
-                    comment=payload.consultation.comment,
-                    db_session=db,  # Передаем сессию БД для поиска автора по имени
-                )
-                
-                # Проверяем, что ответ от 1C содержит обязательные поля
-                if not onec_response:
-                    raise ValueError("1C returned empty response")
-                
-                if "Ref_Key" not in onec_response:
-                    logger.warning(f"1C response missing Ref_Key: {onec_response}")
-                else:
-                    logger.debug(f"1C consultation created with Ref_Key: {onec_response.get('Ref_Key')}")
-                
-                # Обрабатываем полный ответ от 1C и сохраняем все важные поля
-                await _process_onec_response(consultation, onec_response)
-                await db.flush()  # Сохраняем данные из 1C
+                async with timed_step(CREATE_CONSULTATION_FLOW, "onec_consultation"):
+                    await _create_onec_consultation(
+                        db,
+                        onec_client,
+                        consultation,
+                        payload,
+                        client_key=client_key,
+                        owner=owner_snapshot,
+                        consultation_type=consultation_type,
+                        selected_manager_key=selected_manager_key,
+                        contact_hint=contact_hint,
+                    )
                 
                 # Проверяем, что cl_ref_key сохранен
                 if not consultation.cl_ref_key:
@@ -2429,10 +2915,11 @@ async def create_consultation(
                     if chatwoot_success and chatwoot_cons_id:
                         try:
                             # Обновляем custom_attributes в Chatwoot с номером консультации
-                            await chatwoot_client.update_conversation(
-                                conversation_id=chatwoot_cons_id,
-                                custom_attributes={"number_con": str(consultation.number)}
-                            )
+                            async with external_phase(db, "chatwoot_conversation"):
+                                await chatwoot_client.update_conversation(
+                                    conversation_id=chatwoot_cons_id,
+                                    custom_attributes={"number_con": str(consultation.number)}
+                                )
                             logger.info(f"Updated Chatwoot conversation {chatwoot_cons_id} with 1C number: {consultation.number}")
                         except Exception as e:
                             logger.warning(f"Failed to update Chatwoot conversation with 1C number: {e}")
@@ -2511,6 +2998,7 @@ async def create_consultation(
         # Если обе системы упали, все равно сохраняем в БД для последующей синхронизации
         try:
             await db.commit()
+            pending_cons_ids = None
             # ВАЖНО: Проверяем, что consultation все еще в сессии перед refresh
             # После rollback consultation может быть не persistent
             try:
@@ -2578,45 +3066,9 @@ async def create_consultation(
         
         # Отправляем информационное сообщение от имени компании в Chatwoot
         if chatwoot_success and chatwoot_cons_id:
-            try:
-                # Формируем информационное сообщение
-                info_message_parts = ["Ваша заявка на консультацию принята."]
-                
-                if consultation.number:
-                    info_message_parts.append(f"Номер заявки: {consultation.number}.")
-                
-                if consultation.start_date:
-                    date_str = consultation.start_date.strftime("%d.%m.%Y %H:%M")
-                    info_message_parts.append(f"Запланированная дата консультации: {date_str}.")
-                
-                # Добавляем сообщение о записи для консультаций на будущее
-                if consultation.start_date:
-                    now = datetime.now(timezone.utc)
-                    if consultation.start_date.date() > now.date():
-                        info_message_parts.append("Вы записаны. Заявки обрабатываются в порядке очереди.")
-                
-                info_message = " ".join(info_message_parts)
-                
-                # Отправляем через Agent Bot API
-                # Bot сообщения видны клиенту и НЕ влияют на SLA
-                await chatwoot_client.send_bot_message(
-                    conversation_id=chatwoot_cons_id,
-                    content=info_message
-                )
-                logger.info(f"Sent info message to Chatwoot conversation {chatwoot_cons_id}")
-                
-                # Обновляем custom_attributes с номером консультации если он есть
-                if consultation.number:
-                    try:
-                        await chatwoot_client.update_conversation_custom_attributes(
-                            conversation_id=chatwoot_cons_id,
-                            custom_attributes={"number_con": str(consultation.number)}
-                        )
-                        logger.info(f"Updated custom_attributes with number_con={consultation.number} for conversation {chatwoot_cons_id}")
-                    except Exception as e:
-                        logger.warning(f"Failed to update custom_attributes with number_con: {e}")
-            except Exception as e:
-                logger.warning(f"Failed to send info message to Chatwoot: {e}", exc_info=True)
+            async with timed_step(CREATE_CONSULTATION_FLOW, "chatwoot_info_message"), \
+                    external_phase(db, "chatwoot_info_message"):
+                await _send_chatwoot_info_message(chatwoot_client, consultation, chatwoot_cons_id)
         
         # Формируем сообщение об успехе
         success_parts = []
@@ -2663,15 +3115,8 @@ async def create_consultation(
         # Получаем bot_username для Telegram (если консультация создана через Telegram)
         bot_username = None
         if source == "TELEGRAM" and telegram_user_id:
-            try:
-                from ..services.telegram_bot import TelegramBotService
-                telegram_bot_service = TelegramBotService()
-                bot_info = await telegram_bot_service.bot.get_me()
-                if bot_info:
-                    bot_username = bot_info.username
-                    logger.info(f"Got bot username for Telegram consultation: {bot_username}")
-            except Exception as e:
-                logger.warning(f"Failed to get bot username: {e}")
+            async with external_phase(db, "telegram_notify"):
+                bot_username = await _get_telegram_bot_username()
         
         # Формируем ответ
         response = ConsultationResponse(
@@ -2692,23 +3137,9 @@ async def create_consultation(
         
         # Если консультация создана через Telegram, отправляем авто сообщение ботом
         if source == "TELEGRAM" and telegram_user_id and chatwoot_cons_id:
-            try:
-                from ..services.telegram_bot import TelegramBotService
-                telegram_bot_service = TelegramBotService()
-                # Отправляем сообщение пользователю о создании консультации
-                consultation_message = (
-                    f"✅ Ваша заявка #{consultation.number or consultation.cons_id} создана!\n\n"
-                    f"Мы получили ваш запрос и скоро с вами свяжемся.\n\n"
-                    f"Вы можете продолжить общение здесь в чате."
-                )
-                await telegram_bot_service.bot.send_message(
-                    chat_id=telegram_user_id,
-                    text=consultation_message
-                )
-                logger.info(f"Sent auto message to Telegram user {telegram_user_id} for consultation {consultation.cons_id}")
-            except Exception as e:
-                logger.error(f"Failed to send auto message to Telegram user {telegram_user_id}: {e}", exc_info=True)
-                # Не блокируем ответ, если не удалось отправить сообщение
+            async with timed_step(CREATE_CONSULTATION_FLOW, "telegram_notify"), \
+                    external_phase(db, "telegram_notify"):
+                await _notify_telegram_consultation_created(telegram_user_id, consultation)
         
         # Сохраняем idempotency key если передан (после успешного создания)
         if idempotency_key:
@@ -2728,19 +3159,53 @@ async def create_consultation(
         
         return response
     except HTTPException:
+        # Консультация, зафиксированная до ошибки, удаляется (вместо rollback)
+        if pending_cons_ids:
+            await _discard_consultation(db, pending_cons_ids)
+        # Снимаем резерв ключа, чтобы повтор запроса не получил 409
+        if idempotency_key:
+            await release_idempotency_key(idempotency_key, "create_consultation")
         # Пробрасываем HTTPException как есть
         raise
     except Exception as e:
         # Логируем все остальные ошибки и возвращаем 500 с деталями
         logger.error(f"Unexpected error in create_consultation: {e}", exc_info=True)
-        try:
-            await db.rollback()
-        except Exception as rollback_error:
-            logger.error(f"Failed to rollback after unexpected error: {rollback_error}")
+        if idempotency_key:
+            await release_idempotency_key(idempotency_key, "create_consultation")
+        if pending_cons_ids:
+            await _discard_consultation(db, pending_cons_ids)
+        else:
+            try:
+                await db.rollback()
+            except Exception as rollback_error:
+                logger.error(f"Failed to rollback after unexpected error: {rollback_error}")
         raise HTTPException(
             status_code=500,
             detail=f"Internal server error: {str(e)}"
         )
+    finally:
+        record_step_timing(CREATE_CONSULTATION_FLOW, total_step, perf_counter() - started, sys.exc_info()[0] is None)
+
+
+@router.get("/create/{saga_id}", response_model=ConsultationCreateStatus)
+async def get_consultation_create_status(saga_id: uuid.UUID, db: AsyncSession = Depends(get_db)):
+    """
+    Состояние асинхронного создания консультации (status_url из ответа 202).
+
+    status=pending — шаги еще выполняются, done — result содержит тот же ответ, что и
+    синхронный режим, compensated — создание отменено (error — причина).
+    """
+    saga = await db.get(ConsultationCreateSaga, saga_id)
+    if not saga:
+        raise HTTPException(status_code=404, detail=f"Consultation creation {saga_id} not found")
+    return ConsultationCreateStatus(
+        saga_id=str(saga.id),
+        status=saga.status,
+        cons_id=saga.cons_id,
+        steps=saga.steps or {},
+        error=saga.last_error if saga.status != "done" else None,
+        result=ConsultationResponse(**saga.result) if saga.result else None,
+    )
 
 
 @router.post("/simple", response_model=ConsultationResponse)
@@ -2818,6 +3283,7 @@ async def create_redate(
     payload: ConsultationRedateCreate,
     db: AsyncSession = Depends(get_db),
 ):
+    use_short_transactions(db)
     consultation = await _get_consultation_or_404(db, cons_id)
     if not consultation.cl_ref_key:
         raise HTTPException(status_code=400, detail="Consultation not yet synced with 1C")
@@ -2864,54 +3330,56 @@ async def create_redate(
 
     await db.flush()
     
-    # Отправляем в 1C:ЦЛ
-    onec_client = OneCClient()
-    try:
-        await onec_client.create_redate_odata(
-            cons_key=consultation.cl_ref_key,
-            client_key=clients_key,
-            manager_key=manager_key,
-            old_date=old_date,
-            new_date=payload.new_date,
-            comment=payload.comment,
-            period=redate.period,
-        )
-        # Также обновляем дату в самом документе
-        onec_response = await onec_client.update_consultation_odata(
-            ref_key=consultation.cl_ref_key,
-            start_date=payload.new_date,
-        )
-        # Обрабатываем ответ от 1C и обновляем локальную БД
-        await _process_onec_response(consultation, onec_response)
-        await db.flush()
-        logger.info(f"Created redate in 1C for consultation {cons_id}")
-    except Exception as e:
-        logger.error(f"Failed to create redate in 1C: {e}", exc_info=True)
-    
-    # Отправляем note в Chatwoot
-    chatwoot_client = ChatwootClient()
-    try:
-        old_date_str = old_date.strftime("%d.%m.%Y %H:%M") if old_date else "не указана"
-        new_date_str = payload.new_date.strftime("%d.%m.%Y %H:%M") if payload.new_date else "не указана"
-        note_content = f"📅 Консультация перенесена\nСтарая дата: {old_date_str}\nНовая дата: {new_date_str}"
-        if payload.comment:
-            note_content += f"\nКомментарий: {payload.comment}"
-        note_content += "\nВы записаны на новую дату. Заявки обрабатываются в порядке очереди."
-        
-        if is_valid_chatwoot_conversation_id(cons_id):
-            # Используем Agent Bot чтобы клиент видел и не влияло на SLA
-            await chatwoot_client.send_bot_message(
-                conversation_id=cons_id,
-                content=note_content
+    # Внешняя фаза: перенос зафиксирован в БД, соединение свободно на время вызовов 1C и Chatwoot.
+    # Ответ 1C записывается в consultation и сохраняется итоговым commit
+    async with external_phase(db, "create_redate"):
+        # Отправляем в 1C:ЦЛ
+        onec_client = OneCClient()
+        try:
+            await onec_client.create_redate_odata(
+                cons_key=consultation.cl_ref_key,
+                client_key=clients_key,
+                manager_key=manager_key,
+                old_date=old_date,
+                new_date=payload.new_date,
+                comment=payload.comment,
+                period=redate.period,
             )
-            logger.info(f"Sent redate note to Chatwoot for consultation {cons_id}")
-        else:
-            logger.debug(
-                f"Skipping Chatwoot message for redate consultation {cons_id}: "
-                f"cons_id is not a valid Chatwoot conversation ID"
+            # Также обновляем дату в самом документе
+            onec_response = await onec_client.update_consultation_odata(
+                ref_key=consultation.cl_ref_key,
+                start_date=payload.new_date,
             )
-    except Exception as e:
-        logger.error(f"Failed to send redate note to Chatwoot: {e}", exc_info=True)
+            # Обрабатываем ответ от 1C и обновляем локальную БД
+            await _process_onec_response(consultation, onec_response)
+            logger.info(f"Created redate in 1C for consultation {cons_id}")
+        except Exception as e:
+            logger.error(f"Failed to create redate in 1C: {e}", exc_info=True)
+    
+        # Отправляем note в Chatwoot
+        chatwoot_client = ChatwootClient()
+        try:
+            old_date_str = old_date.strftime("%d.%m.%Y %H:%M") if old_date else "не указана"
+            new_date_str = payload.new_date.strftime("%d.%m.%Y %H:%M") if payload.new_date else "не указана"
+            note_content = f"📅 Консультация перенесена\nСтарая дата: {old_date_str}\nНовая дата: {new_date_str}"
+            if payload.comment:
+                note_content += f"\nКомментарий: {payload.comment}"
+            note_content += "\nВы записаны на новую дату. Заявки обрабатываются в порядке очереди."
+        
+            if is_valid_chatwoot_conversation_id(cons_id):
+                # Используем Agent Bot чтобы клиент видел и не влияло на SLA
+                await chatwoot_client.send_bot_message(
+                    conversation_id=cons_id,
+                    content=note_content
+                )
+                logger.info(f"Sent redate note to Chatwoot for consultation {cons_id}")
+            else:
+                logger.debug(
+                    f"Skipping Chatwoot message for redate consultation {cons_id}: "
+                    f"cons_id is not a valid Chatwoot conversation ID"
+                )
+        except Exception as e:
+            logger.error(f"Failed to send redate note to Chatwoot: {e}", exc_info=True)
     
     await db.commit()
     await db.refresh(redate)
@@ -2960,6 +3428,7 @@ async def submit_ratings(
     payload: ConsultationRatingRequest,
     db: AsyncSession = Depends(get_db),
 ):
+    use_short_transactions(db)
     consultation = await _get_consultation_or_404(db, cons_id)
     if not consultation.cl_ref_key:
         raise HTTPException(status_code=400, detail="Consultation not yet synced with 1C")
@@ -3004,56 +3473,68 @@ async def submit_ratings(
     await recalc_consultation_ratings(db, {consultation.cl_ref_key})
     await db.flush()
     
-    # Отправляем оценки в 1C:ЦЛ
-    onec_client = OneCClient()
+    # Валидация manager_key - должен быть валидным GUID. Менеджер по умолчанию читается
+    # из БД до внешней фазы (один раз на запрос)
+    answer_manager_keys = []
+    default_manager_key = None
     for answer in payload.answers:
-        try:
-            # Валидация manager_key - должен быть валидным GUID
-            answer_manager_key = answer.manager_key or consultation.manager
-            if not answer_manager_key or answer_manager_key == "FRONT" or len(answer_manager_key) != 36 or answer_manager_key.count("-") != 4:
-                # Получаем менеджера по умолчанию из БД с учетом типа консультации
-                consultation_type = consultation.consultation_type
-                answer_manager_key = await _get_default_manager_key(db, consultation_type=consultation_type)
-                if not answer_manager_key:
-                    logger.warning(f"Invalid manager_key for rating question {answer.question_number}, skipping 1C sync")
-                    continue
-            
-            await onec_client.create_rating_odata(
-                cons_key=consultation.cl_ref_key,
-                client_key=client_key or "",
-                manager_key=answer_manager_key,
-                question_number=answer.question_number,
-                rating=answer.rating,
-                question_text=answer.question,
-                comment=answer.comment,
-                period=datetime.now(timezone.utc),
-            )
-        except Exception as e:
-            logger.error(f"Failed to create rating in 1C for question {answer.question_number}: {e}", exc_info=True)
+        answer_manager_key = answer.manager_key or consultation.manager
+        if not answer_manager_key or answer_manager_key == "FRONT" or len(answer_manager_key) != 36 or answer_manager_key.count("-") != 4:
+            if default_manager_key is None:
+                try:
+                    # Получаем менеджера по умолчанию из БД с учетом типа консультации
+                    default_manager_key = await _get_default_manager_key(db, consultation_type=consultation.consultation_type) or ""
+                except Exception as e:
+                    logger.error(f"Failed to get default manager for ratings of consultation {cons_id}: {e}", exc_info=True)
+                    default_manager_key = ""
+            answer_manager_key = default_manager_key
+        answer_manager_keys.append(answer_manager_key)
+    
+    # Внешняя фаза: оценки зафиксированы в БД, соединение свободно на время вызовов 1C и Chatwoot
+    async with external_phase(db, "submit_ratings"):
+        # Отправляем оценки в 1C:ЦЛ
+        onec_client = OneCClient()
+        for answer, answer_manager_key in zip(payload.answers, answer_manager_keys):
+            if not answer_manager_key:
+                logger.warning(f"Invalid manager_key for rating question {answer.question_number}, skipping 1C sync")
+                continue
+            try:
+                await onec_client.create_rating_odata(
+                    cons_key=consultation.cl_ref_key,
+                    client_key=client_key or "",
+                    manager_key=answer_manager_key,
+                    question_number=answer.question_number,
+                    rating=answer.rating,
+                    question_text=answer.question,
+                    comment=answer.comment,
+                    period=datetime.now(timezone.utc),
+                )
+            except Exception as e:
+                logger.error(f"Failed to create rating in 1C for question {answer.question_number}: {e}", exc_info=True)
     
-    # Отправляем note в Chatwoot
-    chatwoot_client = ChatwootClient()
-    try:
-        avg_rating = sum(a.rating for a in payload.answers if a.rating) / len([a for a in payload.answers if a.rating]) if payload.answers else None
-        note_content = f"⭐ Оценка консультации получена\nСредняя оценка: {avg_rating:.1f}" if avg_rating else "⭐ Оценка консультации получена"
-        if len(payload.answers) > 1:
-            note_content += f"\nКоличество вопросов: {len(payload.answers)}"
+        # Отправляем note в Chatwoot
+        chatwoot_client = ChatwootClient()
+        try:
+            avg_rating = sum(a.rating for a in payload.answers if a.rating) / len([a for a in payload.answers if a.rating]) if payload.answers else None
+            note_content = f"⭐ Оценка консультации получена\nСредняя оценка: {avg_rating:.1f}" if avg_rating else "⭐ Оценка консультации получена"
+            if len(payload.answers) > 1:
+                note_content += f"\nКоличество вопросов: {len(payload.answers)}"
         
-        # Используем send_message вместо send_note, так как note сообщения не видны клиенту
-        if is_valid_chatwoot_conversation_id(cons_id):
-            # Используем activity чтобы не влиять на SLA
-            await chatwoot_client.send_activity_message(
-                conversation_id=cons_id,
-                content=note_content
-            )
-            logger.info(f"Sent rating message to Chatwoot for consultation {cons_id}")
-        else:
-            logger.debug(
-                f"Skipping Chatwoot message for rating consultation {cons_id}: "
-                f"cons_id is not a valid Chatwoot conversation ID"
-            )
-    except Exception as e:
-        logger.error(f"Failed to send rating note to Chatwoot: {e}", exc_info=True)
+            # Используем send_message вместо send_note, так как note сообщения не видны клиенту
+            if is_valid_chatwoot_conversation_id(cons_id):
+                # Используем activity чтобы не влиять на SLA
+                await chatwoot_client.send_activity_message(
+                    conversation_id=cons_id,
+                    content=note_content
+                )
+                logger.info(f"Sent rating message to Chatwoot for consultation {cons_id}")
+            else:
+                logger.debug(
+                    f"Skipping Chatwoot message for rating consultation {cons_id}: "
+                    f"cons_id is not a valid Chatwoot conversation ID"
+                )
+        except Exception as e:
+            logger.error(f"Failed to send rating note to Chatwoot: {e}", exc_info=True)
     
     await db.commit()
     return await _build_rating_response(db, consultation.cl_ref_key)
@@ -3165,7 +3646,11 @@ async def cancel_consultation(
     
     Настройка:
     - Время для аннулирования настраивается через переменную окружения CANCEL_CONSULTATION_TIMEOUT_MINUTES (по умолчанию 30 минут)
+    
+    Проверки читают БД, вызовы 1C:ЦЛ и Chatwoot выполняются без соединения с БД
+    (utils.db_phases), статус записывается после них.
     """
+    use_short_transactions(db)
     consultation = await _get_consultation_or_404(db, cons_id)
     now = datetime.now(timezone.utc)
     settings = get_settings()
@@ -3231,66 +3716,68 @@ async def cancel_consultation(
         f"cl_ref_key={consultation.cl_ref_key}"
     )
     
-    # Обновляем статус в 1C:ЦЛ: ВидОбращения="Другое" + ЗакрытоБезКонсультации=true, затем DeletionMark
-    if consultation.cl_ref_key:
-        onec_client = OneCClient()
-        try:
-            # Сначала устанавливаем ВидОбращения="Другое" и ЗакрытоБезКонсультации=true
-            await onec_client.update_consultation_odata(
-                ref_key=consultation.cl_ref_key,
-                status="cancelled",
-                denied=True,
-                check_changes=False,
-            )
-            logger.info(f"✓ Updated 1C consultation status to 'Другое' + denied=true: Ref_Key={consultation.cl_ref_key}")
-        except Exception as e:
-            logger.error(f"✗ Failed to update 1C consultation {consultation.cl_ref_key} status: {e}", exc_info=True)
-        try:
-            await onec_client.mark_consultation_deleted(consultation.cl_ref_key)
-            logger.info(f"✓ Marked 1C consultation as deleted (DeletionMark=true): Ref_Key={consultation.cl_ref_key} for annulled consultation {cons_id}")
-        except Exception as e:
-            logger.error(f"✗ Failed to mark 1C consultation {consultation.cl_ref_key} as deleted: {e}", exc_info=True)
-            # Продолжаем выполнение даже если пометка в 1C не удалась
+    # Внешняя фаза: проверки только читали БД, соединение свободно на время вызовов 1C и Chatwoot
+    async with external_phase(db, "cancel_consultation"):
+        # Обновляем статус в 1C:ЦЛ: ВидОбращения="Другое" + ЗакрытоБезКонсультации=true, затем DeletionMark
+        if consultation.cl_ref_key:
+            onec_client = OneCClient()
+            try:
+                # Сначала устанавливаем ВидОбращения="Другое" и ЗакрытоБезКонсультации=true
+                await onec_client.update_consultation_odata(
+                    ref_key=consultation.cl_ref_key,
+                    status="cancelled",
+                    denied=True,
+                    check_changes=False,
+                )
+                logger.info(f"✓ Updated 1C consultation status to 'Другое' + denied=true: Ref_Key={consultation.cl_ref_key}")
+            except Exception as e:
+                logger.error(f"✗ Failed to update 1C consultation {consultation.cl_ref_key} status: {e}", exc_info=True)
+            try:
+                await onec_client.mark_consultation_deleted(consultation.cl_ref_key)
+                logger.info(f"✓ Marked 1C consultation as deleted (DeletionMark=true): Ref_Key={consultation.cl_ref_key} for annulled consultation {cons_id}")
+            except Exception as e:
+                logger.error(f"✗ Failed to mark 1C consultation {consultation.cl_ref_key} as deleted: {e}", exc_info=True)
+                # Продолжаем выполнение даже если пометка в 1C не удалась
     
-    # Закрываем беседу в Chatwoot и отправляем сообщение
-    if is_valid_chatwoot_conversation_id(cons_id):
-        chatwoot_client = ChatwootClient()
-        try:
-            # Закрываем беседу со статусом "resolved" и пометкой "closed_without_con": true
-            await chatwoot_client.update_conversation(
-                conversation_id=cons_id,
-                status="resolved",
-                custom_attributes={"closed_without_con": True}
-            )
-            logger.info(f"✓ Closed Chatwoot conversation {cons_id} with 'closed_without_con' flag")
-            
-            # Отправляем сообщение в чат о том, что заявка аннулирована
+        # Закрываем беседу в Chatwoot и отправляем сообщение
+        if is_valid_chatwoot_conversation_id(cons_id):
+            chatwoot_client = ChatwootClient()
             try:
-                # Используем Agent Bot чтобы клиент видел и не влияло на SLA
-                # Основное сообщение на русском
-                await chatwoot_client.send_bot_message(
+                # Закрываем беседу со статусом "resolved" и пометкой "closed_without_con": true
+                await chatwoot_client.update_conversation(
                     conversation_id=cons_id,
-                    content="Заявка аннулирована клиентом."
+                    status="resolved",
+                    custom_attributes={"closed_without_con": True}
                 )
-                # Дополнительное сообщение на узбекском (если язык клиента - uz)
-                uz_message = format_cancellation_message(consultation.lang)
-                if uz_message:
+                logger.info(f"✓ Closed Chatwoot conversation {cons_id} with 'closed_without_con' flag")
+            
+                # Отправляем сообщение в чат о том, что заявка аннулирована
+                try:
+                    # Используем Agent Bot чтобы клиент видел и не влияло на SLA
+                    # Основное сообщение на русском
                     await chatwoot_client.send_bot_message(
                         conversation_id=cons_id,
-                        content=uz_message
+                        content="Заявка аннулирована клиентом."
                     )
-                logger.info(f"✓ Sent cancellation message to Chatwoot conversation {cons_id}")
-            except Exception as msg_error:
-                logger.warning(f"Failed to send cancellation message to Chatwoot conversation {cons_id}: {msg_error}")
-                # Не критично, продолжаем выполнение
-        except Exception as e:
-            logger.error(f"✗ Failed to update Chatwoot conversation {cons_id}: {e}", exc_info=True)
-            # Продолжаем выполнение даже если обновление в Chatwoot не удалось
-    else:
-        logger.warning(
-            f"Skipping Chatwoot update for cancelled consultation {cons_id}: "
-            f"cons_id is not a valid Chatwoot conversation ID (UUID or temporary)"
-        )
+                    # Дополнительное сообщение на узбекском (если язык клиента - uz)
+                    uz_message = format_cancellation_message(consultation.lang)
+                    if uz_message:
+                        await chatwoot_client.send_bot_message(
+                            conversation_id=cons_id,
+                            content=uz_message
+                        )
+                    logger.info(f"✓ Sent cancellation message to Chatwoot conversation {cons_id}")
+                except Exception as msg_error:
+                    logger.warning(f"Failed to send cancellation message to Chatwoot conversation {cons_id}: {msg_error}")
+                    # Не критично, продолжаем выполнение
+            except Exception as e:
+                logger.error(f"✗ Failed to update Chatwoot conversation {cons_id}: {e}", exc_info=True)
+                # Продолжаем выполнение даже если обновление в Chatwoot не удалось
+        else:
+            logger.warning(
+                f"Skipping Chatwoot update for cancelled consultation {cons_id}: "
+                f"cons_id is not a valid Chatwoot conversation ID (UUID or temporary)"
+            )
     
     # Обновляем статус в БД
     consultation.status = "cancelled"
@@ -3382,6 +3869,7 @@ async def sync_consultation(
     cons_id: str = ...,
     db: AsyncSession = Depends(get_db)
 ):
+    use_short_transactions(db)
     # Получаем консультацию из БД
     result = await db.execute(
         select(Consultation).where(Consultation.cons_id == cons_id)
@@ -3412,15 +3900,28 @@ async def sync_consultation(
     
     sync_changes = []
     
-    try:
-        # Синхронизация с Chatwoot
-        if consultation.cons_id and not consultation.cons_id.startswith(("temp_", "cl_")):
+    # Внешняя фаза: беседа Chatwoot запрашивается без соединения с БД,
+    # изменения применяются к консультации после нее (ошибка обрабатывается там же)
+    sync_chatwoot = bool(consultation.cons_id and not consultation.cons_id.startswith(("temp_", "cl_")))
+    conversation_response = None
+    conversation_error = None
+    if sync_chatwoot:
+        async with external_phase(db, "sync_consultation"):
             try:
                 # Получаем актуальные данные из Chatwoot
                 conversation_response = await chatwoot_client._request(
                     "GET",
                     f"/api/v1/accounts/{chatwoot_client.account_id}/conversations/{cons_id}"
                 )
+            except Exception as e:
+                conversation_error = e
+    
+    try:
+        # Синхронизация с Chatwoot
+        if sync_chatwoot:
+            try:
+                if conversation_error is not None:
+                    raise conversation_error
                 
                 if conversation_response:
                     conversation = conversation_response
@@ -3643,7 +4144,7 @@ async def get_consultation_updates(
     - `{"type": "initial", "data": {...}}` - Начальное состояние консультации
     - `{"type": "update", "data": {...}}` - Обновление консультации
     - `{"type": "error", "message": "..."}` - Ошибка
-    - `: heartbeat` - Keep-alive сообщения (каждые 3 секунды)
+    - `: heartbeat` - Keep-alive сообщения (SSE_HEARTBEAT_SECONDS, по умолчанию 15 секунд), если обновлений не было
     
     **Альтернативы:**
     - WebSocket: `WS /ws/consultations/{cons_id}` - двусторонняя связь
@@ -3652,73 +4153,76 @@ async def get_consultation_updates(
 )
 async def stream_consultation_updates(
     cons_id: str = ...,
-    db: AsyncSession = Depends(get_db)
 ):
+    """
+    Поток не держит сессию БД: начальное состояние читается короткой сессией, дальше
+    обновления приходят из consultation_event_hub (LISTEN consultation_updates).
+    Пока LISTEN недоступен, консультация перечитывается раз в heartbeat.
+    """
     import asyncio
     import json
-    
+    from ..database import AsyncSessionLocal
+    from ..services.consultation_events import consultation_event_hub, load_consultation_updates
+
+    heartbeat_seconds = get_settings().SSE_HEARTBEAT_SECONDS
+
+    def json_serializer(obj):
+        """Кастомный сериализатор для JSON (поддержка datetime, date, time, bytes)"""
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        elif isinstance(obj, date):
+            return obj.isoformat()
+        elif isinstance(obj, time):
+            return obj.isoformat()
+        elif isinstance(obj, bytes):
+            return obj.decode('utf-8')
+        raise TypeError(f"Type {type(obj)} not serializable")
+
+    async def load_current():
+        async with AsyncSessionLocal() as session:
+            return (await load_consultation_updates(session, [cons_id])).get(cons_id)
+
     async def event_generator():
         last_updated = None
-        
+        # Подписываемся до чтения начального состояния, чтобы не потерять изменение между ними
+        queue = consultation_event_hub.subscribe(cons_id)
+
         try:
+            message = await load_current()
+            if message is None:
+                yield f"data: {json.dumps({'error': 'Consultation not found'})}\n\n"
+                return
+
             while True:
-                # Получаем консультацию
-                result = await db.execute(
-                    select(Consultation).where(Consultation.cons_id == cons_id)
-                )
-                consultation = result.scalar_one_or_none()
-                
-                if not consultation:
-                    yield f"data: {json.dumps({'error': 'Consultation not found'})}\n\n"
-                    break
-                
-                # Проверяем изменения
-                current_updated_at = consultation.updated_at
+                current_updated_at = message.get("updated_at") if message else None
                 if current_updated_at:
-                    if current_updated_at.tzinfo is None:
-                        current_updated_at = current_updated_at.replace(tzinfo=timezone.utc)
-                    else:
-                        current_updated_at = current_updated_at.astimezone(timezone.utc)
-                    
-                    if last_updated is None or current_updated_at > last_updated:
-                        # Есть обновления
-                        def json_serializer(obj):
-                            """Кастомный сериализатор для JSON (поддержка datetime, date, time, bytes)"""
-                            if isinstance(obj, datetime):
-                                return obj.isoformat()
-                            elif isinstance(obj, date):
-                                return obj.isoformat()
-                            elif isinstance(obj, time):
-                                return obj.isoformat()
-                            elif isinstance(obj, bytes):
-                                return obj.decode('utf-8')
-                            raise TypeError(f"Type {type(obj)} not serializable")
-                        
-                        # Получаем ФИО менеджера
-                        manager_name = await _get_manager_name(db, consultation.manager)
-                        consultation_dict = ConsultationRead.from_model(consultation, manager_name=manager_name).dict()
-                        data = {
-                            "has_updates": True,
-                            "consultation": consultation_dict,
-                            "updated_at": current_updated_at.isoformat()
-                        }
-                        yield f"data: {json.dumps(data, ensure_ascii=False, default=json_serializer)}\n\n"
-                        last_updated = current_updated_at
-                    else:
-                        # Нет обновлений - отправляем heartbeat
-                        yield f": heartbeat\n\n"
+                    current_updated_at = datetime.fromisoformat(current_updated_at)
+                if current_updated_at and (last_updated is None or current_updated_at > last_updated):
+                    yield f"data: {json.dumps(message, ensure_ascii=False, default=json_serializer)}\n\n"
+                    last_updated = current_updated_at
                 else:
+                    # Нет обновлений - отправляем heartbeat
                     yield f": heartbeat\n\n"
-                
-                # Ждем перед следующей проверкой (2-5 секунд)
-                await asyncio.sleep(3)
-                
+
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    message = None
+                    if not consultation_event_hub.connected:
+                        # LISTEN недоступен - проверяем консультацию сами
+                        message = await load_current()
+                        if message is None:
+                            yield f"data: {json.dumps({'error': 'Consultation not found'})}\n\n"
+                            return
+
         except asyncio.CancelledError:
             logger.info(f"SSE stream cancelled for consultation {cons_id}")
         except Exception as e:
             logger.error(f"Error in SSE stream for consultation {cons_id}: {e}", exc_info=True)
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
-    
+        finally:
+            consultation_event_hub.unsubscribe(cons_id, queue)
+
     return StreamingResponse(
         event_generator(),
         media_type="text/event-stream",
@@ -1,10 +1,9 @@
 from __future__ import annotations
 
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Request, Response
+from pydantic import TypeAdapter
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -27,13 +26,10 @@
     KnowledgeBaseEntry,
     ConsultationInterferenceRead,
 )
+from ..services.dict_cache import CachedBody, dict_cache, etag_matches, make_etag
 
 router = APIRouter(dependencies=[Depends(verify_front_secret)])
 
-# Простой in-memory кэш с TTL 30 минут
-_cache: Dict[str, tuple] = {}  # key -> (data, expiry_time)
-CACHE_TTL = timedelta(minutes=30)
-
 
 def _get_cache_key(endpoint: str, **params) -> str:
     """Генерирует ключ кэша из endpoint и параметров"""
@@ -44,53 +40,65 @@ def _get_cache_key(endpoint: str, **params) -> str:
     return endpoint
 
 
-def _get_cached(key: str) -> Optional[Any]:
-    """Получает данные из кэша если они не устарели"""
-    if key in _cache:
-        data, expiry = _cache[key]
-        if datetime.now() < expiry:
-            return data
-        del _cache[key]
-    return None
+async def _cached_response(request: Request, cache_key: str, build: Callable[[], Awaitable[bytes]]) -> Response:
+    """
+    Отдает готовый JSON из dict_cache (или строит его), с ETag и 304 на If-None-Match.
+
+    ВАЖНО: ответ, построенный во время смены версии справочников, в кэш не кладется.
+    """
+    await dict_cache.ensure_version()
+    entry = dict_cache.get(cache_key)
+    if entry is None:
+        version = dict_cache.version
+        body = await build()
+        if dict_cache.version == version:
+            entry = dict_cache.put(cache_key, body)
+        else:
+            entry = CachedBody(body, make_etag(body))
+
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
 
-def _set_cache(key: str, data: Any):
-    """Сохраняет данные в кэш с TTL"""
-    expiry = datetime.now() + CACHE_TTL
-    _cache[key] = (data, expiry)
+def _dump(schema) -> Callable[[list], bytes]:
+    adapter = TypeAdapter(List[schema])
+    return lambda rows: adapter.dump_json([schema.model_validate(row) for row in rows])
+
+
+_dump_po_types = _dump(POTypeReadSimple)
+_dump_po_sections = _dump(POSectionRead)
+_dump_categories = _dump(OnlineQuestionCategoryRead)
+_dump_questions = _dump(OnlineQuestionRead)
+_dump_knowledge_base = _dump(KnowledgeBaseEntry)
+_dump_interference = _dump(ConsultationInterferenceRead)
 
 
 @router.get("/po-types", response_model=List[POTypeReadSimple])
-async def list_po_types(db: AsyncSession = Depends(get_db)):
+async def list_po_types(request: Request, db: AsyncSession = Depends(get_db)):
     """Получить список типов ПО (упрощенная версия для фронтенда)"""
-    cache_key = _get_cache_key("po-types")
-    cached = _get_cached(cache_key)
-    if cached is not None:
-        return cached
-    
-    result = await db.execute(select(POType).order_by(POType.description))
-    data = [POTypeReadSimple.model_validate(row) for row in result.scalars().all()]
-    _set_cache(cache_key, data)
-    return data
+    async def build():
+        result = await db.execute(select(POType).order_by(POType.description))
+        return _dump_po_types(result.scalars().all())
+
+    return await _cached_response(request, _get_cache_key("po-types"), build)
 
 
 @router.get("/po-sections", response_model=List[POSectionRead])
 async def list_po_sections(
+    request: Request,
     owner_key: Optional[str] = Query(default=None),
     db: AsyncSession = Depends(get_db),
 ):
-    cache_key = _get_cache_key("po-sections", owner_key=owner_key)
-    cached = _get_cached(cache_key)
-    if cached is not None:
-        return cached
-    
-    stmt = select(POSection).order_by(POSection.description)
-    if owner_key:
-        stmt = stmt.where(POSection.owner_key == owner_key)
-    result = await db.execute(stmt)
-    data = [POSectionRead.model_validate(row) for row in result.scalars().all()]
-    _set_cache(cache_key, data)
-    return data
+    async def build():
+        stmt = select(POSection).order_by(POSection.description)
+        if owner_key:
+            stmt = stmt.where(POSection.owner_key == owner_key)
+        result = await db.execute(stmt)
+        return _dump_po_sections(result.scalars().all())
+
+    return await _cached_response(request, _get_cache_key("po-sections", owner_key=owner_key), build)
 
 
 SOFTWARE_TO_PROGRAM = {
@@ -102,6 +110,7 @@ async def list_po_sections(
 
 @router.get("/online-question/categories", response_model=List[OnlineQuestionCategoryRead])
 async def list_online_question_categories(
+    request: Request,
     language: Optional[str] = Query(default=None, description="Filter by language code (ru/uz)"),
     program: Optional[str] = Query(default=None, description="Filter by program name"),
     selected_software: Optional[str] = Query(default=None, description="Short software code: бух, ук, рт"),
@@ -110,77 +119,65 @@ async def list_online_question_categories(
     if selected_software:
         program = SOFTWARE_TO_PROGRAM.get(selected_software.lower(), selected_software)
 
-    cache_key = _get_cache_key("online-question/categories", language=language, program=program)
-    cached = _get_cached(cache_key)
-    if cached is not None:
-        return cached
+    async def build():
+        stmt = select(OnlineQuestionCat).order_by(OnlineQuestionCat.description)
+        if language:
+            stmt = stmt.where(OnlineQuestionCat.language == language)
+        if program:
+            stmt = stmt.where(OnlineQuestionCat.program == program)
+        result = await db.execute(stmt)
+        return _dump_categories(result.scalars().all())
 
-    stmt = select(OnlineQuestionCat).order_by(OnlineQuestionCat.description)
-    if language:
-        stmt = stmt.where(OnlineQuestionCat.language == language)
-    if program:
-        stmt = stmt.where(OnlineQuestionCat.program == program)
-    result = await db.execute(stmt)
-    data = [OnlineQuestionCategoryRead.model_validate(row) for row in result.scalars().all()]
-    _set_cache(cache_key, data)
-    return data
+    cache_key = _get_cache_key("online-question/categories", language=language, program=program)
+    return await _cached_response(request, cache_key, build)
 
 
 @router.get("/online-questions", response_model=List[OnlineQuestionRead])
 async def list_online_questions(
+    request: Request,
     language: Optional[str] = Query(default=None),
     category_key: Optional[str] = Query(default=None),
     db: AsyncSession = Depends(get_db),
 ):
+    async def build():
+        stmt = select(OnlineQuestion).order_by(OnlineQuestion.description)
+        if language:
+            stmt = stmt.where(OnlineQuestion.language == language)
+        if category_key:
+            stmt = stmt.where(OnlineQuestion.category_key == category_key)
+        result = await db.execute(stmt)
+        return _dump_questions(result.scalars().all())
+
     cache_key = _get_cache_key("online-questions", language=language, category_key=category_key)
-    cached = _get_cached(cache_key)
-    if cached is not None:
-        return cached
-    
-    stmt = select(OnlineQuestion).order_by(OnlineQuestion.description)
-    if language:
-        stmt = stmt.where(OnlineQuestion.language == language)
-    if category_key:
-        stmt = stmt.where(OnlineQuestion.category_key == category_key)
-    result = await db.execute(stmt)
-    data = [OnlineQuestionRead.model_validate(row) for row in result.scalars().all()]
-    _set_cache(cache_key, data)
-    return data
+    return await _cached_response(request, cache_key, build)
 
 
 @router.get("/knowledge-base", response_model=List[KnowledgeBaseEntry])
 async def list_knowledge_base(
+    request: Request,
     po_type_key: Optional[str] = Query(default=None),
     po_section_key: Optional[str] = Query(default=None),
     db: AsyncSession = Depends(get_db),
 ):
+    async def build():
+        stmt = select(KnowledgeBase).order_by(KnowledgeBase.description)
+        if po_type_key:
+            stmt = stmt.where(KnowledgeBase.po_type_key == po_type_key)
+        if po_section_key:
+            stmt = stmt.where(KnowledgeBase.po_section_key == po_section_key)
+        result = await db.execute(stmt)
+        return _dump_knowledge_base(result.scalars().all())
+
     cache_key = _get_cache_key("knowledge-base", po_type_key=po_type_key, po_section_key=po_section_key)
-    cached = _get_cached(cache_key)
-    if cached is not None:
-        return cached
-    
-    stmt = select(KnowledgeBase).order_by(KnowledgeBase.description)
-    if po_type_key:
-        stmt = stmt.where(KnowledgeBase.po_type_key == po_type_key)
-    if po_section_key:
-        stmt = stmt.where(KnowledgeBase.po_section_key == po_section_key)
-    result = await db.execute(stmt)
-    data = [KnowledgeBaseEntry.model_validate(row) for row in result.scalars().all()]
-    _set_cache(cache_key, data)
-    return data
+    return await _cached_response(request, cache_key, build)
 
 
 @router.get("/interference", response_model=List[ConsultationInterferenceRead])
-async def list_consultation_interference(db: AsyncSession = Depends(get_db)):
-    cache_key = _get_cache_key("interference")
-    cached = _get_cached(cache_key)
-    if cached is not None:
-        return cached
-    
-    result = await db.execute(
-        select(ConsultationInterference).order_by(ConsultationInterference.description)
-    )
-    data = [ConsultationInterferenceRead.model_validate(row) for row in result.scalars().all()]
-    _set_cache(cache_key, data)
-    return data
-
+async def list_consultation_interference(request: Request, db: AsyncSession = Depends(get_db)):
+    async def build():
+        result = await db.execute(
+            select(ConsultationInterference).order_by(ConsultationInterference.description)
+        )
+        return _dump_interference(result.scalars().all())
+
+    return await _cached_response(request, _get_cache_key("interference"), build)
@@ -4,6 +4,9 @@
 from sqlalchemy import text
 from ..database import get_db
 from ..scheduler import scheduler
+from ..utils.db_phases import pool_metrics_snapshot
+from ..utils.http_pool import http_metrics_snapshot
+from ..utils.step_graph import step_timings_snapshot
 
 router = APIRouter()
 
@@ -25,6 +28,12 @@ async def health_db(db: AsyncSession = Depends(get_db)):
         return {"status": "error", "database": "disconnected", "error": str(e)}
 
 
+@router.get("/health/db-pool")
+async def health_db_pool():
+    """Загрузка пула соединений к БД и время удержания соединения (с момента старта процесса)"""
+    return {"status": "ok", "pool": pool_metrics_snapshot()}
+
+
 @router.get("/health/scheduler")
 async def health_scheduler():
     """Проверка статуса планировщика задач"""
@@ -46,3 +55,15 @@ async def health_scheduler():
             'scheduler_running': False,
             'error': str(e),
         }
+
+
+@router.get("/health/http")
+async def health_http():
+    """Задержки вызовов внешних HTTP API по местам вызова (с момента старта процесса)"""
+    return {"status": "ok", "services": http_metrics_snapshot()}
+
+
+@router.get("/health/steps")
+async def health_steps():
+    """Длительность шагов многошаговых операций (create_consultation) с момента старта процесса"""
+    return {"status": "ok", "flows": step_timings_snapshot()}
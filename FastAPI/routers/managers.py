@@ -10,7 +10,7 @@
 
 from ..database import get_db
 from ..dependencies.security import verify_front_secret, verify_api_token
-from ..services.manager_selector import ManagerSelector
+from ..services.manager_selector import ManagerSelector, manager_load_info
 from ..models import Consultation
 
 logger = logging.getLogger(__name__)
@@ -143,16 +143,21 @@ async def get_available_managers(
             filter_by_working_hours=False,  # Показываем всех менеджеров, независимо от времени работы
         )
         
+        # Загрузка и среднее время решения для всех менеджеров сразу (индекс загрузки или GROUP BY)
+        manager_keys = [manager.cl_ref_key for manager in managers if manager.cl_ref_key]
+        queue_counts = await manager_selector.get_managers_queue_counts(manager_keys)
+        avg_by_manager = await manager_selector.get_managers_avg_resolution(manager_keys, days=30)
+        
         # Добавляем информацию о загрузке для каждого менеджера
         result = []
         for manager in managers:
             if not manager.cl_ref_key:
                 continue
             
-            load_info = await manager_selector.get_manager_current_load(manager.cl_ref_key)
+            load_info = manager_load_info(queue_counts.get(manager.cl_ref_key, 0), manager.con_limit)
             
-            # Получаем среднее время решения за 2 дня
-            avg_info = await manager_selector.get_manager_avg_resolution(manager.cl_ref_key, days=30)
+            # Среднее время решения за 30 дней
+            avg_info = avg_by_manager[manager.cl_ref_key]
             avg_minutes = avg_info["avg_resolution_minutes"]
             
             # Рассчитываем примерное время ожидания
@@ -210,14 +215,18 @@ async def managers_dashboard(
             filter_by_working_hours=False,
         )
         
+        manager_keys = [manager.cl_ref_key for manager in managers if manager.cl_ref_key]
+        queue_counts = await manager_selector.get_managers_queue_counts(manager_keys)
+        avg_by_manager = await manager_selector.get_managers_avg_resolution(manager_keys, days=30)
+        
         # Собираем данные менеджеров
         managers_data = []
         for manager in managers:
             if not manager.cl_ref_key:
                 continue
             
-            load_info = await manager_selector.get_manager_current_load(manager.cl_ref_key)
-            avg_info = await manager_selector.get_manager_avg_resolution(manager.cl_ref_key, days=30)
+            load_info = manager_load_info(queue_counts.get(manager.cl_ref_key, 0), manager.con_limit)
+            avg_info = avg_by_manager[manager.cl_ref_key]
             avg_minutes = avg_info["avg_resolution_minutes"]
             
             queue_count = load_info["queue_count"]
@@ -1,6 +1,6 @@
 """Роутеры для работы с Telegram ботом"""
 import logging
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from typing import Optional, Dict, Any
@@ -19,6 +19,9 @@
 from ..services.chatwoot_client import ChatwootClient
 from ..services.telegram_bot import TelegramBotService
 from ..config import settings
+from ..services.webhook_inbox import delivery_id_from_headers, register_webhook_handler, SOURCE_CHATWOOT_TELEGRAM
+from ..middleware.rate_limit import rate_limit_exempt
+from .webhooks import accept_webhook
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -39,6 +42,7 @@ def get_telegram_bot_service() -> TelegramBotService:
 
 
 @router.post("/webhook")
+@rate_limit_exempt
 async def telegram_webhook(
     request: Request,
     bot_service: TelegramBotService = Depends(get_telegram_bot_service)
@@ -74,37 +78,46 @@ async def telegram_webhook(
 
 
 @router.post("/webhook/chatwoot")
+@rate_limit_exempt
 async def chatwoot_webhook_for_telegram(
     request: Request,
-    db: AsyncSession = Depends(get_db),
+    x_chatwoot_signature: Optional[str] = Header(None),
     bot_service: TelegramBotService = Depends(get_telegram_bot_service)
 ):
     """
-    Webhook от Chatwoot для новых сообщений в консультациях.
+    Прием вебхука от Chatwoot для Telegram (обработка — process_chatwoot_event_for_telegram в воркере).
     
-    Отправляет сообщения менеджеров в Telegram пользователям.
+    ВАЖНО: зависимость от bot_service оставлена — пока бот не инициализирован, отвечаем 503
+    и Chatwoot повторит доставку, а не копим события, которые некому отправить.
+    """
+    body_bytes = await request.body()
+    if len(body_bytes) == 0:
+        logger.warning("Empty request body")
+        return {"ok": True}
+    
+    await accept_webhook(
+        SOURCE_CHATWOOT_TELEGRAM, body_bytes, x_chatwoot_signature, delivery_id_from_headers(request.headers)
+    )
+    return {"ok": True}
+
+
+def telegram_ordering_key(payload: Dict[str, Any]) -> Optional[Any]:
+    """События одного разговора обрабатываются по порядку (данные Chatwoot в корне payload)"""
+    conversation = payload.get("conversation") or {}
+    return conversation.get("id") or (payload.get("id") if str(payload.get("event", "")).startswith("conversation") else None)
+
+
+async def process_chatwoot_event_for_telegram(db: AsyncSession, payload: Dict[str, Any]):
     """
-    # ЛОГИРУЕМ СРАЗУ, ДО ПАРСИНГА JSON
-    # Используем print для гарантированного вывода
-    print(f"[TELEGRAM WEBHOOK] === INCOMING WEBHOOK REQUEST ===")
-    print(f"[TELEGRAM WEBHOOK] Method: {request.method}, URL: {request.url}")
-    logger.info("=== INCOMING WEBHOOK REQUEST ===")
-    logger.info(f"Method: {request.method}")
-    logger.info(f"URL: {request.url}")
-    logger.info(f"Headers: {dict(request.headers)}")
+    Обработка вебхука Chatwoot для Telegram (воркер sys.webhook_inbox).
     
+    Отправляет сообщения менеджеров в Telegram пользователям.
+    
+    ВАЖНО: ошибки отправки не пробрасываются (как и раньше) — повтор события
+    продублировал бы пользователю уже доставленные сообщения.
+    """
+    bot_service = get_telegram_bot_service()
     try:
-        # Получаем тело запроса как байты для логирования
-        body_bytes = await request.body()
-        logger.info(f"Body length: {len(body_bytes)} bytes")
-        
-        if len(body_bytes) == 0:
-            logger.warning("Empty request body")
-            return {"ok": True}
-        
-        # Парсим JSON
-        import json
-        payload = json.loads(body_bytes)
         event_type = payload.get("event")
         
         # Логируем все входящие webhook'и для отладки
@@ -752,3 +765,5 @@ async def link_telegram_user(
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+
+register_webhook_handler(SOURCE_CHATWOOT_TELEGRAM, process_chatwoot_event_for_telegram, telegram_ordering_key)
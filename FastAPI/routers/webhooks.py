@@ -1,91 +1,33 @@
 """Роуты для обработки вебхуков от внешних систем"""
-from fastapi import APIRouter, Request, HTTPException, Header, Depends
+from fastapi import APIRouter, Request, HTTPException, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from typing import Optional
+from typing import Any, Dict, Optional
 import hmac
 import hashlib
 import json
 import logging
-import asyncio
 from datetime import datetime, timezone, time, date
 from dateutil import parser as date_parser
 
-from ..database import get_db, AsyncSessionLocal
-from ..models import WebhookLog, Consultation, UserMapping
-from ..services.onec_client import OneCClient
+from ..models import Consultation, UserMapping
 from ..schemas.webhooks import WebhookResponse
 from ..schemas.tickets import parse_datetime_flexible
 from ..config import settings
 from ..services.chatwoot_client import ChatwootClient
-from ..utils.change_log import log_consultation_change, mark_change_synced
+from ..services.chatwoot_contacts import CONTACT_EVENTS, apply_contact_event
+from ..services.chatwoot_directory import chatwoot_directory
+from ..utils.change_log import log_consultation_change
+from ..utils.etl_triggers import jobs_for_webhook_event, request_etl_run
+from ..services.onec_sync_queue import enqueue_onec_sync, JOB_STATUS, JOB_MANAGER
+from ..services.webhook_inbox import (
+    delivery_id_from_headers, ingest_webhook, register_webhook_handler, SOURCE_CHATWOOT, SOURCE_ONEC,
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-async def _sync_status_to_1c_background(cons_id: str, cl_ref_key: str, onec_status: str):
-    """
-    Фоновая задача для синхронизации статуса консультации с 1C:ЦЛ.
-    Выполняется асинхронно, чтобы не блокировать webhook обработчик.
-    
-    ВАЖНО: Использует отдельную сессию БД, которая автоматически закрывается через async with.
-    """
-    db = None
-    try:
-        async with AsyncSessionLocal() as db:
-            onec_client = OneCClient()
-            await onec_client.update_consultation_odata(
-                ref_key=cl_ref_key,
-                status=onec_status,
-            )
-            await mark_change_synced(
-                db=db,
-                cons_id=cons_id,
-                field_name="status",
-                synced_to_1c=True
-            )
-            await db.commit()
-            logger.info(f"Synced status change to 1C for consultation {cons_id}")
-    except Exception as e:
-        logger.warning(f"Failed to sync status change to 1C in background task: {e}", exc_info=True)
-    finally:
-        # Явно закрываем сессию для гарантии освобождения соединения
-        if db:
-            try:
-                await db.close()
-            except Exception:
-                pass
-
-
-async def _sync_manager_to_1c_background(cons_id: str, cl_ref_key: str, manager_key: str):
-    """
-    Фоновая задача для синхронизации менеджера консультации с 1C:ЦЛ.
-    Выполняется асинхронно, чтобы не блокировать webhook обработчик.
-    
-    ВАЖНО: Использует отдельную сессию БД, которая автоматически закрывается через async with.
-    """
-    db = None
-    try:
-        async with AsyncSessionLocal() as db:
-            onec_client = OneCClient()
-            await onec_client.update_consultation_odata(
-                ref_key=cl_ref_key,
-                manager_key=manager_key,
-            )
-            await db.commit()
-            logger.info(f"Synced manager reassignment to 1C for consultation {cons_id}")
-    except Exception as e:
-        logger.warning(f"Failed to sync manager reassignment to 1C in background task: {e}", exc_info=True)
-    finally:
-        # Явно закрываем сессию для гарантии освобождения соединения
-        if db:
-            try:
-                await db.close()
-            except Exception:
-                pass
-
-
 def verify_chatwoot_signature(payload: bytes, signature: str) -> bool:
     """Проверка подписи вебхука от Chatwoot"""
     if not settings.CHATWOOT_API_TOKEN:
@@ -100,42 +42,92 @@ def verify_chatwoot_signature(payload: bytes, signature: str) -> bool:
     return hmac.compare_digest(expected_signature, signature)
 
 
+def _parse_payload(body: bytes) -> Dict[str, Any]:
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+    return payload
+
+
+async def accept_webhook(
+    source: str,
+    body: bytes,
+    signature: Optional[str] = None,
+    delivery_id: Optional[str] = None,
+) -> WebhookResponse:
+    """
+    Этап приема вебхука: подпись → запись в sys.webhook_inbox → ответ.
+
+    ВАЖНО: обработка события выполняется воркером после ответа (services.webhook_inbox).
+    Повторная доставка отбрасывается только по id доставки (X-Chatwoot-Delivery /
+    X-Delivery-Id); без этих заголовков каждый запрос считается новым событием.
+    Если очередь недоступна, отвечаем 503 — отправитель повторит доставку.
+    """
+    if signature and not verify_chatwoot_signature(body, signature):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    payload = _parse_payload(body)
+    event_type = payload.get("event")
+    try:
+        queued = await ingest_webhook(source, body, payload, delivery_id)
+    except Exception as e:
+        logger.error(f"Failed to enqueue {source} webhook {event_type}: {e}", exc_info=True)
+        raise HTTPException(status_code=503, detail="Webhook queue unavailable")
+    return WebhookResponse(status="ok", message=f"{'Queued' if queued else 'Duplicate'} {event_type}")
+
+
+def chatwoot_ordering_key(payload: Dict[str, Any]) -> Optional[Any]:
+    """События одного разговора (и одного контакта) Chatwoot обрабатываются по порядку"""
+    event_data = payload.get("data") or {}
+    if payload.get("event") in CONTACT_EVENTS:
+        contact_id = (event_data.get("contact") or event_data or payload).get("id")
+        return f"contact:{contact_id}" if contact_id else None
+    conversation = event_data.get("conversation") or {}
+    message = event_data.get("message") or {}
+    return conversation.get("id") or message.get("conversation_id")
+
+
+def onec_ordering_key(payload: Dict[str, Any]) -> Optional[Any]:
+    """События одной консультации ЦЛ обрабатываются по порядку"""
+    event_data = payload.get("data") or {}
+    return event_data.get("cl_ref_key") or event_data.get("cons_id")
+
+
 @router.post("/chatwoot", response_model=WebhookResponse)
 async def chatwoot_webhook(
     request: Request,
-    db: AsyncSession = Depends(get_db),
     x_chatwoot_signature: Optional[str] = Header(None)
 ):
     """
-    Обработка вебхука от Chatwoot.
+    Прием вебхука от Chatwoot (обработка — process_chatwoot_event в воркере).
+    """
+    return await accept_webhook(
+        SOURCE_CHATWOOT, await request.body(), x_chatwoot_signature, delivery_id_from_headers(request.headers)
+    )
+
+
+async def process_chatwoot_event(db: AsyncSession, payload: Dict[str, Any]):
+    """
+    Обработка вебхука от Chatwoot (воркер sys.webhook_inbox).
     
     События:
     - conversation.created
     - conversation.updated
     - message.created
     - message.updated
-    """
-    # Получаем payload
-    body = await request.body()
-    payload = json.loads(body)
+    - contact.created / contact.updated / contact.deleted (известные контакты клиентов)
     
-    # Сохраняем в лог
-    webhook_log = WebhookLog(
-        source="CHATWOOT",
-        payload=payload
-    )
-    db.add(webhook_log)
-    await db.flush()
-    
-    # Проверяем подпись
-    if x_chatwoot_signature:
-        if not verify_chatwoot_signature(body, x_chatwoot_signature):
-            raise HTTPException(status_code=401, detail="Invalid signature")
-    
-    # Обрабатываем событие
+    Беседы и сообщения также служат подсказками справочнику Chatwoot: неизвестные
+    агент, команда, inbox или метка помечают его раздел устаревшим.
+    """
     event_type = payload.get("event")
     event_data = payload.get("data", {})
     
+    if event_type and event_type.startswith(("conversation.", "message.")):
+        chatwoot_directory.note_webhook(event_data if isinstance(event_data, dict) and event_data else payload)
+    
     try:
         if event_type == "conversation.created":
             # Новая консультация создана в Chatwoot
@@ -234,8 +226,8 @@ async def chatwoot_webhook(
                         )
                         logger.info(f"Status changed for consultation {cons_id}: {old_status} -> {new_status}")
                         
-                        # Синхронизируем статус обратно в 1C:ЦЛ в фоновой задаче
-                        # ВАЖНО: Выполняем в фоне, чтобы не блокировать webhook и не удерживать соединение с БД
+                        # Синхронизируем статус обратно в 1C:ЦЛ через очередь sys.onec_sync_jobs
+                        # ВАЖНО: PATCH в ЦЛ выполняется после commit, webhook не ждет 1C и не теряет задачу при рестарте
                         if consultation.cl_ref_key:
                             # Маппим статус Chatwoot в статус 1C
                             status_mapping = {
@@ -244,12 +236,8 @@ async def chatwoot_webhook(
                                 "pending": "in_progress",
                             }
                             onec_status = status_mapping.get(new_status, new_status)
-                            # Запускаем фоновую задачу (не ждем её завершения)
-                            asyncio.create_task(_sync_status_to_1c_background(
-                                cons_id=cons_id,
-                                cl_ref_key=consultation.cl_ref_key,
-                                onec_status=onec_status
-                            ))
+                            # Задача уходит в очередь в этой же транзакции; PATCH выполнит OneCSyncWorker
+                            enqueue_onec_sync(db, cons_id, consultation.cl_ref_key, JOB_STATUS, {"status": onec_status})
                 
                 if "assignee" in conversation:
                     old_manager = consultation.manager
@@ -310,15 +298,11 @@ async def chatwoot_webhook(
                                     manager_key=consultation.manager,
                                 )
                             
-                            # Синхронизируем с ЦЛ в фоновой задаче
-                            # ВАЖНО: Выполняем в фоне, чтобы не блокировать webhook и не удерживать соединение с БД
+                            # Синхронизируем с ЦЛ через очередь sys.onec_sync_jobs
+                            # ВАЖНО: PATCH в ЦЛ выполняется после commit, webhook не ждет 1C и не теряет задачу при рестарте
                             if consultation.cl_ref_key and consultation.manager:
-                                # Запускаем фоновую задачу (не ждем её завершения)
-                                asyncio.create_task(_sync_manager_to_1c_background(
-                                    cons_id=cons_id,
-                                    cl_ref_key=consultation.cl_ref_key,
-                                    manager_key=consultation.manager
-                                ))
+                                # Задача уходит в очередь в этой же транзакции; PATCH выполнит OneCSyncWorker
+                                enqueue_onec_sync(db, cons_id, consultation.cl_ref_key, JOB_MANAGER, {"manager_key": consultation.manager})
                         except Exception as e:
                             logger.warning(f"Failed to send manager reassignment notification: {e}")
                 
@@ -523,8 +507,8 @@ async def chatwoot_webhook(
                     )
                     
                     # Синхронизируем статус обратно в 1C:ЦЛ
-                    # Синхронизируем статус обратно в 1C:ЦЛ в фоновой задаче
-                    # ВАЖНО: Выполняем в фоне, чтобы не блокировать webhook и не удерживать соединение с БД
+                    # Синхронизируем статус обратно в 1C:ЦЛ через очередь sys.onec_sync_jobs
+                    # ВАЖНО: PATCH в ЦЛ выполняется после commit, webhook не ждет 1C и не теряет задачу при рестарте
                     if consultation.cl_ref_key:
                         status_mapping = {
                             "open": "new",
@@ -532,12 +516,8 @@ async def chatwoot_webhook(
                             "pending": "in_progress",
                         }
                         onec_status = status_mapping.get(new_status, new_status)
-                        # Запускаем фоновую задачу (не ждем её завершения)
-                        asyncio.create_task(_sync_status_to_1c_background(
-                            cons_id=cons_id,
-                            cl_ref_key=consultation.cl_ref_key,
-                            onec_status=onec_status
-                        ))
+                        # Задача уходит в очередь в этой же транзакции; PATCH выполнит OneCSyncWorker
+                        enqueue_onec_sync(db, cons_id, consultation.cl_ref_key, JOB_STATUS, {"status": onec_status})
                     
                     await db.flush()
                     logger.info(f"Updated consultation {cons_id} status to '{new_status}' in DB from Chatwoot webhook")
@@ -616,7 +596,7 @@ async def chatwoot_webhook(
                     if new_status in ("resolved", "closed") and not consultation.end_date:
                         consultation.end_date = datetime.now(timezone.utc)
                     
-                    # Синхронизируем с ЦЛ в фоновой задаче
+                    # Синхронизируем с ЦЛ через очередь sys.onec_sync_jobs
                     if consultation.cl_ref_key:
                         status_mapping = {
                             "open": "new",
@@ -624,15 +604,17 @@ async def chatwoot_webhook(
                             "pending": "in_progress",
                         }
                         onec_status = status_mapping.get(new_status, new_status)
-                        asyncio.create_task(_sync_status_to_1c_background(
-                            cons_id=cons_id,
-                            cl_ref_key=consultation.cl_ref_key,
-                            onec_status=onec_status
-                        ))
+                        enqueue_onec_sync(db, cons_id, consultation.cl_ref_key, JOB_STATUS, {"status": onec_status})
                     
                     await db.flush()
                     logger.info(f"Updated consultation {cons_id} status to '{new_status}' from Chatwoot toggle_status")
         
+        elif event_type in CONTACT_EVENTS:
+            # Контакт Chatwoot изменен или удален — обновляем sys.chatwoot_contacts
+            contact = event_data.get("contact") or event_data or payload
+            outcome = await apply_contact_event(db, event_type, contact)
+            logger.info(f"Chatwoot {event_type} for contact {contact.get('id')}: {outcome}")
+        
         elif event_type == "message.updated" or event_type == "message.rating" or event_type == "conversation.rating":
             # Обработка оценки консультации из Chatwoot
             conversation = event_data.get("conversation", {})
@@ -688,25 +670,25 @@ async def chatwoot_webhook(
                         logger.warning(f"Failed to send rating to ЦЛ for consultation {conversation_id}: {rating_error}", exc_info=True)
         
         await db.commit()
-        webhook_log.processed = True
-        await db.commit()
         
         return WebhookResponse(status="ok", message=f"Processed {event_type}")
     
-    except Exception as e:
+    except Exception:
         await db.rollback()
-        webhook_log.error_message = str(e)
-        await db.commit()
-        raise HTTPException(status_code=500, detail=f"Error processing webhook: {str(e)}")
+        raise
 
 
 @router.post("/1c_cl", response_model=WebhookResponse)
-async def onec_webhook(
-    request: Request,
-    db: AsyncSession = Depends(get_db)
-):
+async def onec_webhook(request: Request):
+    """
+    Прием вебхука от 1C:ЦЛ (обработка — process_onec_event в воркере).
     """
-    Обработка вебхука от 1C:ЦЛ.
+    return await accept_webhook(SOURCE_ONEC, await request.body(), delivery_id=delivery_id_from_headers(request.headers))
+
+
+async def process_onec_event(db: AsyncSession, payload: Dict[str, Any]):
+    """
+    Обработка вебхука от 1C:ЦЛ (воркер sys.webhook_inbox).
     
     События:
     - consultation.created
@@ -714,16 +696,6 @@ async def onec_webhook(
     - consultation.closed
     - consultation.rescheduled
     """
-    payload = await request.json()
-    
-    # Сохраняем в лог
-    webhook_log = WebhookLog(
-        source="1C_CL",
-        payload=payload
-    )
-    db.add(webhook_log)
-    await db.flush()
-    
     event_type = payload.get("event")
     event_data = payload.get("data", {})
     
@@ -897,14 +869,18 @@ async def onec_webhook(
                 except Exception as ws_error:
                     logger.debug(f"Failed to notify WebSocket clients: {ws_error}")
         
-        await db.commit()
-        webhook_log.processed = True
+        # Срочный прогон ETL: изменения из ЦЛ подтянутся сразу, а не через интервал планировщика
+        # (NOTIFY уходит вместе с commit)
+        await request_etl_run(db, jobs_for_webhook_event(event_type))
+        
         await db.commit()
         
         return WebhookResponse(status="ok", message=f"Processed {event_type}")
     
-    except Exception as e:
+    except Exception:
         await db.rollback()
-        webhook_log.error_message = str(e)
-        await db.commit()
-        raise HTTPException(status_code=500, detail=f"Error processing webhook: {str(e)}")
+        raise
+
+
+register_webhook_handler(SOURCE_CHATWOOT, process_chatwoot_event, chatwoot_ordering_key)
+register_webhook_handler(SOURCE_ONEC, process_onec_event, onec_ordering_key)
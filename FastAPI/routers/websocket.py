@@ -1,71 +1,177 @@
 """
 WebSocket endpoints для real-time обновлений.
 """
+import asyncio
 import json
 import logging
-from typing import Dict, Any
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from datetime import date, datetime, time
+from typing import Dict, Any, Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
-from ..database import get_db, AsyncSessionLocal
+from ..config import settings
+from ..database import AsyncSessionLocal
 from ..models import Consultation, User
 from ..schemas.tickets import ConsultationRead
+from ..services.consultation_events import consultation_event_hub, load_consultation_updates
 from sqlalchemy import select
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Код закрытия для отстающего клиента: "Try Again Later" (клиент переподключится и получит initial)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+def _json_default(obj):
+    """Кастомный сериализатор для JSON (поддержка datetime, date, time, bytes)"""
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+def serialize_message(message: Dict[str, Any]) -> str:
+    return json.dumps(message, ensure_ascii=False, default=_json_default)
+
+
+class _Connection:
+    """Соединение с собственной очередью исходящих кадров и задачей-писателем"""
+    __slots__ = ("websocket", "queue", "writer")
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+
 
 class ConnectionManager:
-    """Менеджер WebSocket соединений"""
+    """
+    Менеджер WebSocket соединений.
+
+    ВАЖНО: рассылка не ждет клиентов. У каждого соединения ограниченная очередь
+    исходящих кадров и своя задача-писатель; сообщение сериализуется один раз на
+    рассылку. Клиент, у которого очередь переполнена или отправка дольше
+    WS_SEND_TIMEOUT_SECONDS, отключается с кодом 1013.
+
+    Обновления приходят из consultation_event_hub (LISTEN consultation_updates),
+    поэтому рассылка работает при нескольких воркерах uvicorn и при изменениях из ETL:
+    на консультацию с подписчиками в процессе одна подписка hub и одна задача рассылки.
+    """
     
-    def __init__(self):
+    def __init__(self, queue_size: Optional[int] = None, send_timeout: Optional[float] = None):
+        self.queue_size = queue_size or settings.WS_SEND_QUEUE_SIZE
+        self.send_timeout = send_timeout or settings.WS_SEND_TIMEOUT_SECONDS
         # Храним активные соединения по cons_id
-        self.active_connections: Dict[str, list[WebSocket]] = {}
+        self.active_connections: Dict[str, Dict[WebSocket, _Connection]] = {}
+        self._relays: Dict[str, asyncio.Task] = {}
+        self.slow_disconnects = 0
     
     async def connect(self, websocket: WebSocket, cons_id: str):
         """Подключить клиента к WebSocket"""
         await websocket.accept()
-        if cons_id not in self.active_connections:
-            self.active_connections[cons_id] = []
-        self.active_connections[cons_id].append(websocket)
+        connection = _Connection(websocket, self.queue_size)
+        connection.writer = asyncio.create_task(self._write(cons_id, connection))
+        self.active_connections.setdefault(cons_id, {})[websocket] = connection
+        if cons_id not in self._relays:
+            self._relays[cons_id] = asyncio.create_task(
+                self._relay(cons_id, consultation_event_hub.subscribe(cons_id))
+            )
         logger.info(f"WebSocket connected for consultation {cons_id}. Total connections: {len(self.active_connections[cons_id])}")
     
     def disconnect(self, websocket: WebSocket, cons_id: str):
-        """Отключить клиента от WebSocket"""
-        if cons_id in self.active_connections:
-            if websocket in self.active_connections[cons_id]:
-                self.active_connections[cons_id].remove(websocket)
-            if not self.active_connections[cons_id]:
-                del self.active_connections[cons_id]
+        """Отключить клиента от WebSocket (идемпотентно)"""
+        connections = self.active_connections.get(cons_id)
+        if connections is None or websocket not in connections:
+            return
+        connection = connections.pop(websocket)
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        if not connections:
+            del self.active_connections[cons_id]
+            relay = self._relays.pop(cons_id, None)
+            if relay is not None and relay is not asyncio.current_task():
+                relay.cancel()
         logger.info(f"WebSocket disconnected for consultation {cons_id}")
     
+    def _enqueue(self, cons_id: str, connection: _Connection, text: str):
+        try:
+            connection.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            logger.warning(f"WebSocket client for consultation {cons_id} is too slow, disconnecting")
+            self._drop(cons_id, connection)
+    
+    def _drop(self, cons_id: str, connection: _Connection):
+        self.slow_disconnects += 1
+        self.disconnect(connection.websocket, cons_id)
+        asyncio.create_task(self._close(connection.websocket))
+    
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+    
+    async def _write(self, cons_id: str, connection: _Connection):
+        while True:
+            text = await connection.queue.get()
+            try:
+                await asyncio.wait_for(connection.websocket.send_text(text), timeout=self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to send to WebSocket client: {e!r}")
+                self._drop(cons_id, connection)
+                return
+    
+    async def _relay(self, cons_id: str, queue: asyncio.Queue):
+        """Пересылает обновления hub подписчикам консультации (без повторов по updated_at)"""
+        last_updated = None
+        try:
+            while True:
+                message = await queue.get()
+                if message.get("updated_at") is not None and message["updated_at"] == last_updated:
+                    continue
+                last_updated = message.get("updated_at")
+                self.broadcast_text(cons_id, serialize_message({"type": "update", "data": message["consultation"]}))
+                if self._relays.get(cons_id) is not asyncio.current_task():
+                    # Последний клиент отключен во время рассылки
+                    return
+        finally:
+            consultation_event_hub.unsubscribe(cons_id, queue)
+    
     async def send_personal_message(self, message: Dict[str, Any], websocket: WebSocket):
-        """Отправить сообщение конкретному клиенту"""
+        """Отправить сообщение конкретному клиенту (через его очередь)"""
+        for cons_id, connections in self.active_connections.items():
+            connection = connections.get(websocket)
+            if connection is not None:
+                self._enqueue(cons_id, connection, serialize_message(message))
+                return
         try:
-            await websocket.send_json(message)
+            await websocket.send_text(serialize_message(message))
         except Exception as e:
             logger.error(f"Failed to send WebSocket message: {e}")
     
+    def send_text(self, cons_id: str, websocket: WebSocket, text: str) -> bool:
+        """Кладет готовый кадр в очередь клиента; False — клиент уже отключен"""
+        connection = self.active_connections.get(cons_id, {}).get(websocket)
+        if connection is None:
+            return False
+        self._enqueue(cons_id, connection, text)
+        return True
+    
+    def broadcast_text(self, cons_id: str, text: str):
+        """Кладет готовый кадр в очереди всех клиентов консультации, не дожидаясь отправки"""
+        for connection in list(self.active_connections.get(cons_id, {}).values()):
+            self._enqueue(cons_id, connection, text)
+    
     async def broadcast_to_consultation(self, cons_id: str, message: Dict[str, Any]):
         """Отправить сообщение всем клиентам, подписанным на консультацию"""
         if cons_id not in self.active_connections:
             return
-        
-        disconnected = []
-        for websocket in self.active_connections[cons_id]:
-            try:
-                await websocket.send_json(message)
-            except Exception as e:
-                logger.warning(f"Failed to send to WebSocket client: {e}")
-                disconnected.append(websocket)
-        
-        # Удаляем отключенные соединения
-        for websocket in disconnected:
-            self.disconnect(websocket, cons_id)
-
-
+        self.broadcast_text(cons_id, serialize_message(message))
+    
 # Глобальный менеджер соединений
 manager = ConnectionManager()
 
@@ -108,43 +214,26 @@ async def websocket_endpoint(
     
     try:
         # Отправляем начальное состояние консультации
-        # ВАЖНО: get_db() - это dependency, нужно использовать AsyncSessionLocal напрямую
+        # ВАЖНО: get_db() - это dependency, нужно использовать AsyncSessionLocal напрямую;
+        # сессия закрывается сразу, дальше обновления приходят через consultation_event_hub
         async with AsyncSessionLocal() as db:
-            result = await db.execute(
-                select(Consultation).where(Consultation.cons_id == cons_id)
+            current = (await load_consultation_updates(db, [cons_id])).get(cons_id)
+        
+        if current:
+            await manager.send_personal_message({"type": "initial", "data": current["consultation"]}, websocket)
+        else:
+            await manager.send_personal_message(
+                {"type": "error", "message": f"Consultation {cons_id} not found"},
+                websocket
             )
-            consultation = result.scalar_one_or_none()
-            
-            if consultation:
-                # Получаем ФИО менеджера
-                manager_name = None
-                if consultation.manager:
-                    manager_result = await db.execute(
-                        select(User.description)
-                        .where(User.cl_ref_key == consultation.manager)
-                        .where(User.deletion_mark == False)
-                        .limit(1)
-                    )
-                    manager_name = manager_result.scalar_one_or_none()
-                
-                initial_data = {
-                    "type": "initial",
-                    "data": ConsultationRead.from_model(consultation, manager_name=manager_name).dict()
-                }
-                await manager.send_personal_message(initial_data, websocket)
-            else:
-                await manager.send_personal_message(
-                    {"type": "error", "message": f"Consultation {cons_id} not found"},
-                    websocket
-                )
         
         # Ожидаем сообщения от клиента (ping/pong для keep-alive)
         while True:
             try:
                 data = await websocket.receive_text()
-                # Обрабатываем ping/pong
-                if data == "ping":
-                    await websocket.send_text("pong")
+                # Обрабатываем ping/pong (через очередь соединения, чтобы не писать в сокет параллельно)
+                if data == "ping" and not manager.send_text(cons_id, websocket, "pong"):
+                    break
             except WebSocketDisconnect:
                 break
             except Exception as e:
@@ -152,9 +241,10 @@ async def websocket_endpoint(
                 break
     
     except WebSocketDisconnect:
-        manager.disconnect(websocket, cons_id)
+        pass
     except Exception as e:
         logger.error(f"WebSocket error for consultation {cons_id}: {e}", exc_info=True)
+    finally:
         manager.disconnect(websocket, cons_id)
 
 
@@ -163,10 +253,17 @@ async def notify_consultation_update(cons_id: str, consultation: Consultation):
     """
     Уведомить всех подключенных клиентов об обновлении консультации.
     
+    ВАЖНО: если работает LISTEN consultation_updates, ничего не делает — изменение
+    Consultation через ORM уже опубликовано в транзакции (after_flush) и после commit
+    дойдет до клиентов всех воркеров. Без LISTEN рассылает локально, как раньше.
+    
     Args:
         cons_id: ID консультации
         consultation: Обновленная консультация
     """
+    if consultation_event_hub.connected or cons_id not in manager.active_connections:
+        return
+    
     # Получаем ФИО менеджера
     manager_name = None
     if consultation.manager:
@@ -184,4 +281,3 @@ async def notify_consultation_update(cons_id: str, consultation: Consultation):
         "data": ConsultationRead.from_model(consultation, manager_name=manager_name).dict()
     }
     await manager.broadcast_to_consultation(cons_id, update_data)
-
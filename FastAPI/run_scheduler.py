@@ -11,9 +11,11 @@
 # Добавляем путь к проекту
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from FastAPI.scheduler import setup_scheduler, start_scheduler, shutdown_scheduler
+from FastAPI.scheduler import setup_scheduler, start_scheduler, shutdown_scheduler, shutdown_etl_runtime
 from FastAPI.config import settings
 from FastAPI.init_db import check_db_connection
+from FastAPI.utils.http_pool import start_http_clients, close_http_clients
+from FastAPI.services.consultation_events import install_consultation_publishing
 
 # Настраиваем детальное логирование
 LOG_LEVEL = os.getenv("ETL_LOG_LEVEL", "INFO")
@@ -67,6 +69,10 @@ async def main():
     # Настраиваем и запускаем scheduler
     # ВАЖНО: НЕ запускаем init_db() или load_dicts() - это только для API контейнера
     try:
+        # Общий пул соединений к Chatwoot для outbox диспетчера
+        await start_http_clients()
+        # Изменения консультаций из ETL уходят в SSE потоки API (NOTIFY consultation_updates)
+        install_consultation_publishing()
         logger.info("📅 Setting up scheduler...")
         setup_scheduler()
         start_scheduler()
@@ -82,6 +88,8 @@ async def main():
         except KeyboardInterrupt:
             logger.info("⚠ Received shutdown signal...")
             shutdown_scheduler()
+            await shutdown_etl_runtime()
+            await close_http_clients()
             logger.info("✓ Scheduler stopped")
     except Exception as e:
         logger.error("✗ Failed to start scheduler: %s", e, exc_info=True)
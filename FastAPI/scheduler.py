@@ -5,9 +5,17 @@
 import os
 import asyncio
 import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
+from .config import settings
+from .utils.adaptive_schedule import AdaptiveInterval
+from .utils.etl_runtime import run_etl_job_inprocess, stop_etl_runtime
+from .utils.etl_triggers import ETL_TRIGGER_CHANNEL
+
 logger = logging.getLogger(__name__)
 
 scheduler = AsyncIOScheduler()
@@ -48,15 +56,67 @@ def get_etl_interval(env_var: str, default: int) -> int:
 
 # ВАЖНО: Если интервал = 0, ETL процесс отключается
 
+# Адаптивное расписание: интервал задачи растет на пустых прогонах и сокращается, когда 1C отдает изменения
+ETL_ADAPTIVE_SCHEDULING = os.getenv("ETL_ADAPTIVE_SCHEDULING", "true").strip().lower() in ("1", "true", "yes")
+ETL_ADAPTIVE_MIN_SECONDS = get_etl_interval("ETL_ADAPTIVE_MIN_SECONDS", 30)
+ETL_ADAPTIVE_MAX_SECONDS = get_etl_interval("ETL_ADAPTIVE_MAX_SECONDS", 600)
+
+# job_id -> AdaptiveInterval (заполняется в setup_scheduler)
+adaptive_intervals: Dict[str, AdaptiveInterval] = {}
+# Время начала текущего/последнего прогона и последнего срочного запроса (time.monotonic)
+job_started_at: Dict[str, float] = {}
+job_triggered_at: Dict[str, float] = {}
+_trigger_listener_task: Optional[asyncio.Task] = None
+
+# Режим запуска ETL: inprocess (общий engine и пул HTTP, без старта интерпретатора) или subprocess
+ETL_RUNNER_MODE = os.getenv("ETL_RUNNER_MODE", "inprocess").strip().lower() or "inprocess"
+if ETL_RUNNER_MODE not in ("inprocess", "subprocess"):
+    logger.warning(f"Invalid value for ETL_RUNNER_MODE: '{ETL_RUNNER_MODE}', using 'inprocess'")
+    ETL_RUNNER_MODE = "inprocess"
+
+
+async def run_etl_script(script_name: str, job_name: Optional[str] = None) -> Optional[int]:
+    """
+    Запуск ETL скрипта с защитой от параллельных запусков.
+
+    ETL_RUNNER_MODE=inprocess — задача в текущем event loop (utils/etl_runtime),
+    subprocess — отдельный процесс `python -m FastAPI.catalog_scripts.<script_name>`.
+    job_name — вариант задачи для in-process режима (например, 'pull_cons_cl:open_update');
+    блокировка от параллельных запусков общая для всех вариантов скрипта.
 
-async def run_etl_script(script_name: str):
-    """Запуск ETL скрипта с защитой от параллельных запусков"""
+    Возвращает число изменений, о котором сообщил скрипт (None — неизвестно или ошибка).
+    """
     if script_name in running_tasks:
         logger.warning(f"Task {script_name} is already running, skipping...")
         print(f"⚠ Task {script_name} is already running, skipping...")
-        return
+        return None
     
     running_tasks.add(script_name)
+    job_started(script_name)
+    changes, ok = None, False
+    try:
+        if ETL_RUNNER_MODE == "inprocess":
+            name = job_name or script_name
+            logger.info(f"Starting ETL task: {name} (in-process)")
+            print(f"🔄 Starting ETL task: {name} (in-process)")
+            result = await run_etl_job_inprocess(name)
+            changes, ok = result.changes, result.ok
+            if ok:
+                print(f"✅ ETL task {name} completed successfully")
+            else:
+                print(f"❌ ETL task {name} failed")
+        else:
+            # Число изменений из subprocess не возвращается — интервал остается прежним
+            ok = await run_etl_subprocess(script_name)
+    finally:
+        running_tasks.discard(script_name)
+        if job_name is None:
+            job_finished(script_name, changes, ok)
+    return changes if ok else None
+
+
+async def run_etl_subprocess(script_name: str) -> bool:
+    """Запуск ETL скрипта отдельным процессом (fallback режим)"""
     try:
         logger.info(f"Starting ETL task: {script_name}")
         print(f"🔄 Starting ETL task: {script_name}")
@@ -87,6 +147,7 @@ async def run_etl_script(script_name: str):
         if process.returncode == 0:
             logger.info(f"ETL task {script_name} completed successfully")
             print(f"✅ ETL task {script_name} completed successfully")
+            return True
         else:
             logger.error(f"ETL task {script_name} failed with code {process.returncode}")
             print(f"❌ ETL task {script_name} failed with code {process.returncode}")
@@ -97,8 +158,7 @@ async def run_etl_script(script_name: str):
     except Exception as e:
         logger.error(f"Error running ETL task {script_name}: {e}", exc_info=True)
         print(f"❌ Error running ETL task {script_name}: {e}")
-    finally:
-        running_tasks.discard(script_name)
+    return False
 
 
 async def run_clients_then_consultations():
@@ -106,14 +166,18 @@ async def run_clients_then_consultations():
     # Сначала запускаем загрузку клиентов и ждем её завершения
     logger.info("Starting clients sync, then consultations sync")
     print("🔄 Starting clients sync, then consultations sync")
+    job_started('pull_clients_then_cons')
     
-    await run_etl_script('pull_clients_cl')
+    clients_changes = await run_etl_script('pull_clients_cl')
     
     # Только после завершения загрузки клиентов запускаем загрузку консультаций (инкремент)
     # await гарантирует, что pull_clients_cl уже завершился
     logger.info("Clients sync completed, starting consultations incremental sync")
     print("✅ Clients sync completed, starting consultations incremental sync")
-    await run_etl_script('pull_cons_cl')
+    cons_changes = await run_etl_script('pull_cons_cl')
+    
+    known = [c for c in (clients_changes, cons_changes) if c is not None]
+    job_finished('pull_clients_then_cons', sum(known) if known else None, ok=bool(known))
 
 
 async def run_consultations_open_update():
@@ -121,7 +185,9 @@ async def run_consultations_open_update():
     logger.info("Starting open consultations update")
     print("🔄 Starting open consultations update")
     # Передаем режим через переменную окружения
-    import os
+    if ETL_RUNNER_MODE == "inprocess":
+        await run_etl_script('pull_cons_cl', job_name='pull_cons_cl:open_update')
+        return
     old_mode = os.environ.get('ETL_CONS_MODE')
     os.environ['ETL_CONS_MODE'] = 'open_update'
     try:
@@ -133,6 +199,121 @@ async def run_consultations_open_update():
             del os.environ['ETL_CONS_MODE']
 
 
+def job_started(job_id: str):
+    job_started_at[job_id] = time.monotonic()
+
+
+def job_finished(job_id: str, changes: Optional[int], ok: bool = True):
+    """
+    Пересчитывает адаптивный интервал задачи по результату прогона.
+    Если во время прогона пришел срочный запрос (вебхук), запускает задачу еще раз.
+    """
+    policy = adaptive_intervals.get(job_id)
+    if policy is not None:
+        previous = policy.current
+        interval = policy.record(changes, success=ok)
+        if interval != previous and scheduler.get_job(job_id):
+            scheduler.reschedule_job(job_id, trigger=IntervalTrigger(seconds=interval))
+            logger.info(
+                f"Adaptive schedule: {job_id} interval {previous:.0f}s → {interval:.0f}s "
+                f"(changes={changes}, empty runs in a row={policy.empty_runs})"
+            )
+
+    if job_triggered_at.get(job_id, 0) > job_started_at.get(job_id, 0):
+        trigger_etl_job(job_id)
+
+
+def register_adaptive_job(job_id: str, interval_minutes: int, min_seconds: Optional[int] = None):
+    """Включает адаптивный интервал для задачи (стартовое значение — интервал из env)"""
+    if not ETL_ADAPTIVE_SCHEDULING:
+        return
+    adaptive_intervals[job_id] = AdaptiveInterval(
+        base_seconds=interval_minutes * 60,
+        min_seconds=min_seconds if min_seconds is not None else ETL_ADAPTIVE_MIN_SECONDS,
+        max_seconds=ETL_ADAPTIVE_MAX_SECONDS,
+    )
+
+
+def trigger_etl_job(job_id: str) -> bool:
+    """
+    Срочный запуск задачи: ближайший запуск переносится на "сейчас".
+    Если задача уже выполняется, она будет перезапущена сразу после завершения.
+    """
+    job = scheduler.get_job(job_id) if scheduler.running else None
+    if job is None:
+        return False
+    now = time.monotonic()
+    job_triggered_at[job_id] = now
+    if _is_job_running(job_id):
+        logger.info(f"ETL trigger: {job_id} is running, will rerun after completion")
+        return True
+    job.modify(next_run_time=datetime.now(timezone.utc))
+    logger.info(f"ETL trigger: {job_id} scheduled to run now")
+    return True
+
+
+def _is_job_running(job_id: str) -> bool:
+    if job_id == 'pull_clients_then_cons':
+        return bool({'pull_clients_cl', 'pull_cons_cl'} & running_tasks)
+    return job_id in running_tasks
+
+
+def _on_etl_trigger(payload: str):
+    for job_id in (payload or "").split(","):
+        if job_id.strip():
+            trigger_etl_job(job_id.strip())
+
+
+async def listen_etl_triggers():
+    """LISTEN etl_trigger: срочные запуски задач по вебхукам 1C (в т.ч. из API контейнера)"""
+    from .utils.pg_listen import listen_forever
+
+    await listen_forever(ETL_TRIGGER_CHANNEL, _on_etl_trigger)
+
+
+_outbox_dispatcher = None
+
+
+async def run_chatwoot_outbox_dispatcher():
+    """Доставка накопленных ETL событий из sys.chatwoot_outbox в Chatwoot"""
+    global _outbox_dispatcher
+    from .services.chatwoot_outbox import ChatwootOutboxDispatcher
+
+    if _outbox_dispatcher is None:
+        _outbox_dispatcher = ChatwootOutboxDispatcher()
+    try:
+        stats = await _outbox_dispatcher.drain()
+        if stats.get("events"):
+            logger.info(
+                f"Chatwoot outbox: {stats['events']} events in {stats['conversations']} conversations, "
+                f"delivered={stats['delivered']}, retried={stats['retried']}, failed={stats['failed']}"
+            )
+    except Exception as e:
+        logger.error(f"Chatwoot outbox dispatcher error: {e}", exc_info=True)
+
+
+async def run_idempotency_sweeper():
+    """Удаление истекших idempotency keys пачками (вместо DELETE в каждом запросе)"""
+    from .utils.idempotency import sweep_expired_idempotency_keys
+
+    try:
+        deleted = await sweep_expired_idempotency_keys()
+        if deleted:
+            logger.info(f"Idempotency sweeper: deleted {deleted} expired keys")
+    except Exception as e:
+        logger.error(f"Idempotency sweeper error: {e}", exc_info=True)
+
+
+async def run_log_partition_maintenance():
+    """Партиции журналов: создание на следующие месяцы, удаление старше LOG_RETENTION_DAYS"""
+    from .services.log_partitions import maintain_log_partitions
+
+    try:
+        await maintain_log_partitions()
+    except Exception as e:
+        logger.error(f"Log partition maintenance error: {e}", exc_info=True)
+
+
 def setup_scheduler():
     """Настройка планировщика задач"""
     
@@ -150,6 +331,10 @@ def setup_scheduler():
             max_instances=1,
             misfire_grace_time=ETL_CONS_INCREMENTAL_INTERVAL * 2,  # Пропустить если опоздал больше чем в 2 раза
         )
+        # Инкремент тяжелый (окно ETL_CONS_INCREMENTAL_BUFFER_DAYS), поэтому чаще интервала из env
+        # не запускается: только backoff на пустых прогонах, свежие изменения — через вебхук 1C
+        register_adaptive_job('pull_clients_then_cons', ETL_CONS_INCREMENTAL_INTERVAL,
+                              min_seconds=ETL_CONS_INCREMENTAL_INTERVAL * 60)
     else:
         logger.info("ETL incremental consultations disabled (ETL_CONS_INCREMENTAL_INTERVAL=0)")
         print("⚠ ETL incremental consultations disabled (ETL_CONS_INCREMENTAL_INTERVAL=0)")
@@ -180,6 +365,7 @@ def setup_scheduler():
             max_instances=1,
             misfire_grace_time=ETL_CONS_REDATE_INTERVAL * 2,
         )
+        register_adaptive_job('pull_cons_redate_cl', ETL_CONS_REDATE_INTERVAL)
     else:
         logger.info("ETL consultations redate disabled (ETL_CONS_REDATE_INTERVAL=0)")
         print("⚠ ETL consultations redate disabled (ETL_CONS_REDATE_INTERVAL=0)")
@@ -195,6 +381,7 @@ def setup_scheduler():
             max_instances=1,
             misfire_grace_time=ETL_CONS_RATES_INTERVAL * 2,
         )
+        register_adaptive_job('pull_cons_rates_cl', ETL_CONS_RATES_INTERVAL)
     else:
         logger.info("ETL consultations rates disabled (ETL_CONS_RATES_INTERVAL=0)")
         print("⚠ ETL consultations rates disabled (ETL_CONS_RATES_INTERVAL=0)")
@@ -210,6 +397,7 @@ def setup_scheduler():
             max_instances=1,
             misfire_grace_time=ETL_CALLS_INTERVAL * 2,
         )
+        register_adaptive_job('pull_calls_cl', ETL_CALLS_INTERVAL)
     else:
         logger.info("ETL calls disabled (ETL_CALLS_INTERVAL=0)")
         print("⚠ ETL calls disabled (ETL_CALLS_INTERVAL=0)")
@@ -225,6 +413,7 @@ def setup_scheduler():
             max_instances=1,
             misfire_grace_time=ETL_QUEUE_CLOSING_INTERVAL * 2,
         )
+        register_adaptive_job('pull_queue_closing_cl', ETL_QUEUE_CLOSING_INTERVAL)
     else:
         logger.info("ETL queue closing disabled (ETL_QUEUE_CLOSING_INTERVAL=0)")
         print("⚠ ETL queue closing disabled (ETL_QUEUE_CLOSING_INTERVAL=0)")
@@ -245,7 +434,49 @@ def setup_scheduler():
         logger.info("ETL users disabled (ETL_USERS_INTERVAL=0)")
         print("⚠ ETL users disabled (ETL_USERS_INTERVAL=0)")
     
-    logger.info("Scheduler configured with ETL tasks")
+    # Диспетчер outbox Chatwoot - в секундах, чтобы изменения из ЦЛ доходили почти сразу
+    if settings.CHATWOOT_OUTBOX_POLL_SECONDS > 0:
+        scheduler.add_job(
+            run_chatwoot_outbox_dispatcher,
+            IntervalTrigger(seconds=settings.CHATWOOT_OUTBOX_POLL_SECONDS),
+            id='chatwoot_outbox_dispatcher',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=settings.CHATWOOT_OUTBOX_POLL_SECONDS * 2,
+        )
+    else:
+        logger.info("Chatwoot outbox dispatcher disabled (CHATWOOT_OUTBOX_POLL_SECONDS=0)")
+        print("⚠ Chatwoot outbox dispatcher disabled (CHATWOOT_OUTBOX_POLL_SECONDS=0)")
+    
+    # Очистка истекших idempotency keys
+    if settings.IDEMPOTENCY_SWEEP_INTERVAL_SECONDS > 0:
+        scheduler.add_job(
+            run_idempotency_sweeper,
+            IntervalTrigger(seconds=settings.IDEMPOTENCY_SWEEP_INTERVAL_SECONDS),
+            id='idempotency_sweeper',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=settings.IDEMPOTENCY_SWEEP_INTERVAL_SECONDS * 2,
+        )
+    
+    # Партиции журналов log.consultation_change_log / log.webhook_log
+    if settings.LOG_PARTITION_MAINTENANCE_HOURS > 0:
+        scheduler.add_job(
+            run_log_partition_maintenance,
+            IntervalTrigger(hours=settings.LOG_PARTITION_MAINTENANCE_HOURS),
+            id='log_partition_maintenance',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=3600,
+        )
+    
+    logger.info(
+        f"Scheduler configured with ETL tasks (runner mode: {ETL_RUNNER_MODE}, "
+        f"adaptive: {ETL_ADAPTIVE_SCHEDULING}, bounds {ETL_ADAPTIVE_MIN_SECONDS}-{ETL_ADAPTIVE_MAX_SECONDS}s)"
+    )
     logger.info(f"ETL intervals: clients={ETL_CLIENTS_INTERVAL}min, "
                 f"cons_incremental={ETL_CONS_INCREMENTAL_INTERVAL}min, "
                 f"cons_open_update={ETL_CONS_OPEN_UPDATE_INTERVAL}min, "
@@ -267,10 +498,13 @@ def setup_scheduler():
 
 def start_scheduler():
     """Запуск планировщика"""
+    global _trigger_listener_task
     if not scheduler.running:
         scheduler.start()
         logger.info("Scheduler started")
         print("✓ Scheduler started")
+        if settings.ETL_WEBHOOK_TRIGGER and _trigger_listener_task is None:
+            _trigger_listener_task = asyncio.get_event_loop().create_task(listen_etl_triggers())
         # Выводим информацию о запланированных задачах
         jobs = scheduler.get_jobs()
         print(f"  Scheduled {len(jobs)} tasks:")
@@ -281,7 +515,16 @@ def start_scheduler():
 
 def shutdown_scheduler():
     """Остановка планировщика"""
+    global _trigger_listener_task
+    if _trigger_listener_task is not None:
+        _trigger_listener_task.cancel()
+        _trigger_listener_task = None
     if scheduler.running:
         scheduler.shutdown(wait=True)
         logger.info("Scheduler stopped")
 
+
+async def shutdown_etl_runtime():
+    """Закрытие общего engine и пула HTTP соединений in-process режима ETL"""
+    await stop_etl_runtime()
+
@@ -216,6 +216,26 @@ class ConsultationResponse(BaseModel):
     chatwoot_pubsub_token: Optional[str] = None  # pubsub_token для WebSocket подключения (из Public API)
 
 
+
+class ConsultationCreateAccepted(BaseModel):
+    """Ответ 202 асинхронного создания консультации (Prefer: respond-async)"""
+    saga_id: str
+    status: str = "pending"
+    cons_id: str  # ID консультации в БД; после создания беседы станет ID из Chatwoot
+    client_id: str
+    status_url: str  # GET — состояние саги и итоговый ConsultationResponse
+    message: str = "Consultation accepted, Chatwoot and 1C:ЦЛ steps are running in background"
+
+
+class ConsultationCreateStatus(BaseModel):
+    """Состояние асинхронного создания консультации"""
+    saga_id: str
+    status: str  # pending, done, compensated
+    cons_id: str  # текущий ID консультации
+    steps: Dict[str, Any] = {}  # шаг -> {"status": done|skipped|failed|pending, "attempts", "error", "at"}
+    error: Optional[str] = None
+    result: Optional[ConsultationResponse] = None  # заполнен при status=done
+
 # Алиасы для обратной совместимости (deprecated, использовать ConsultationRead и т.д.)
 TicketCreate = ConsultationCreateSimple
 TicketRead = ConsultationRead
@@ -4,6 +4,9 @@
 import re
 from typing import Optional, Dict, Any, List
 from ..config import settings
+from ..utils.http_pool import CHATWOOT, get_chatwoot_http, send_request
+from ..utils.structured_logging import LazyJson
+from .chatwoot_directory import AGENTS, LABELS, TEAMS, chatwoot_directory, normalize_name
 
 logger = logging.getLogger(__name__)
 
@@ -37,8 +40,7 @@ class ChatwootClient:
     # Кэш для bot_id (в памяти, для одного процесса)
     _bot_id_cache: Optional[int] = None
     
-    # Кэш для созданных labels (в памяти, для одного процесса)
-    _labels_cache: set[str] = set()
+    # Агенты, команды, inbox'ы и метки — в chatwoot_directory (общий для процесса)
     
     def __init__(self):
         self.base_url = settings.CHATWOOT_API_URL.rstrip("/")
@@ -142,6 +144,15 @@ def _clean_custom_attributes(
         
         return final_custom_attrs
     
+    async def _send(self, method: str, url: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        """
+        HTTP запрос через общий пул соединений к Chatwoot (utils.http_pool).
+
+        Вне lifespan приложения пула нет — открывается одноразовое соединение.
+        Задержка каждого вызова пишется в метрики по месту вызова.
+        """
+        return await send_request(CHATWOOT, get_chatwoot_http(), method, url, timeout=timeout, **kwargs)
+
     async def _request(
         self,
         method: str,
@@ -172,63 +183,55 @@ async def _request(
             "User-Agent": "Clobus-Chatwoot-Client/1.0 (Custom Python Client)" # Добавьте это для Chatwoot
         }
         
-        # Логируем запрос детально (без токена для безопасности)
-        import json
-        request_log = f"Chatwoot API Request: {method} {url}"
-        request_log += f" | Using CHATWOOT_API_TOKEN (token length: {len(self.api_token) if self.api_token else 0})"
-        if params:
-            request_log += f"\n  Query params: {json.dumps(params, ensure_ascii=False, indent=2)}"
-        if data:
-            request_log += f"\n  Request body: {json.dumps(data, ensure_ascii=False, indent=2)}"
-        logger.info(request_log)
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=data,
-                params=params
+        # ВАЖНО: параметры и тело запроса (без токена) сериализуются только если DEBUG включен (LazyJson)
+        logger.debug(
+            "Chatwoot API request: %s %s | params=%s | body=%s",
+            method, url, LazyJson(params), LazyJson(data, limit=4000),
+        )
+        
+        response = await self._send(
+            method,
+            url,
+            headers=headers,
+            json=data,
+            params=params
+        )
+        
+        # На INFO — только сводка; тело ответа — на DEBUG
+        logger.info(f"Chatwoot API {method} {endpoint}: {response.status_code} {response.reason_phrase}")
+        logger.debug("Chatwoot API response body: %s", response.text[:500])
+        
+        # Handle 429 Too Many Requests with retry
+        if response.status_code == 429:
+            import asyncio
+            retry_after = int(response.headers.get("Retry-After", 2))
+            wait_time = min(retry_after, 30)
+            logger.warning(
+                f"Rate limited (429) on {method} {endpoint}. Waiting {wait_time}s before retry."
             )
-            
-            # Логируем ответ
-            response_body_preview = response.text[:500] if response.text else ""
-            logger.info(
-                f"Chatwoot API Response: {response.status_code} {response.reason_phrase}"
-                + (f" | body: {response_body_preview}" if response_body_preview else "")
+            await asyncio.sleep(wait_time)
+            # Recursive retry with decremented counter
+            return await self._request(method, endpoint, data, params, max_retries - 1) if max_retries > 1 else {}
+        
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as exc:
+            body = exc.response.text if exc.response else ""
+            # Логируем полный ответ при ошибке для отладки
+            logger.error(
+                f"Chatwoot API Error: {exc} | "
+                f"URL: {exc.request.url if exc.request else 'N/A'} | "
+                f"Method: {exc.request.method if exc.request else 'N/A'} | "
+                f"Response body (full): {body}"
             )
-            
-            # Handle 429 Too Many Requests with retry
-            if response.status_code == 429:
-                import asyncio
-                retry_after = int(response.headers.get("Retry-After", 2))
-                wait_time = min(retry_after, 30)
-                logger.warning(
-                    f"Rate limited (429) on {method} {endpoint}. Waiting {wait_time}s before retry."
-                )
-                await asyncio.sleep(wait_time)
-                # Recursive retry with decremented counter
-                return await self._request(method, endpoint, data, params, max_retries - 1) if max_retries > 1 else {}
-            
-            try:
-                response.raise_for_status()
-            except httpx.HTTPStatusError as exc:
-                body = exc.response.text if exc.response else ""
-                # Логируем полный ответ при ошибке для отладки
-                logger.error(
-                    f"Chatwoot API Error: {exc} | "
-                    f"URL: {exc.request.url if exc.request else 'N/A'} | "
-                    f"Method: {exc.request.method if exc.request else 'N/A'} | "
-                    f"Response body (full): {body}"
-                )
-                raise httpx.HTTPStatusError(
-                    f"{exc} | response body: {body}",
-                    request=exc.request,
-                    response=exc.response,
-                ) from exc
-            if not response.content:
-                return {}
-            return response.json()
+            raise httpx.HTTPStatusError(
+                f"{exc} | response body: {body}",
+                request=exc.request,
+                response=exc.response,
+            ) from exc
+        if not response.content:
+            return {}
+        return response.json()
     
     def _extract_source_id(self, data: Dict[str, Any], inbox_id: Optional[int] = None) -> Optional[str]:
         """
@@ -446,66 +449,51 @@ async def _request_public_api(
             "User-Agent": "Clobus-Chatwoot-Client/1.0 (Public API)"
         }
         
-        # Логируем запрос с полным телом
-        import json
-        request_log = f"Chatwoot Public API Request: {method} {url}"
-        if params:
-            request_log += f"\n  Query params: {json.dumps(params, ensure_ascii=False, indent=2)}"
-        if data:
-            request_log += f"\n  Request body (full): {json.dumps(data, ensure_ascii=False, indent=2)}"
-        logger.info(request_log)
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=data,
-                params=params
+        logger.debug(
+            "Chatwoot Public API request: %s %s | params=%s | body=%s",
+            method, url, LazyJson(params), LazyJson(data, limit=4000),
+        )
+        
+        response = await self._send(
+            method,
+            url,
+            headers=headers,
+            json=data,
+            params=params
+        )
+        
+        logger.info(f"Chatwoot Public API {method} {endpoint}: {response.status_code} {response.reason_phrase}")
+        logger.debug("Chatwoot Public API response body: %s", response.text[:2000])
+        
+        # Handle 429 Too Many Requests with retry
+        if response.status_code == 429:
+            import asyncio
+            retry_after = int(response.headers.get("Retry-After", 2))
+            wait_time = min(retry_after, 30)
+            logger.warning(
+                f"Rate limited (429) on Public API {method} {endpoint}. Waiting {wait_time}s before retry."
             )
-            
-            # Логируем ответ с полным телом
-            response_body = response.text if response.text else ""
-            try:
-                response_json = response.json() if response_body else {}
-                response_body_formatted = json.dumps(response_json, ensure_ascii=False, indent=2)
-            except Exception:
-                response_body_formatted = response_body[:2000]  # Первые 2000 символов если не JSON
-            
-            logger.info(
-                f"Chatwoot Public API Response: {response.status_code} {response.reason_phrase}"
-                + f"\n  Response body (full): {response_body_formatted}"
+            await asyncio.sleep(wait_time)
+            return await self._request_public_api(method, endpoint, data, params, max_retries - 1) if max_retries > 1 else {}
+        
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as exc:
+            body = exc.response.text if exc.response else ""
+            logger.error(
+                f"Chatwoot Public API Error: {exc} | "
+                f"URL: {exc.request.url if exc.request else 'N/A'} | "
+                f"Method: {exc.request.method if exc.request else 'N/A'} | "
+                f"Response body (full): {body}"
             )
-            
-            # Handle 429 Too Many Requests with retry
-            if response.status_code == 429:
-                import asyncio
-                retry_after = int(response.headers.get("Retry-After", 2))
-                wait_time = min(retry_after, 30)
-                logger.warning(
-                    f"Rate limited (429) on Public API {method} {endpoint}. Waiting {wait_time}s before retry."
-                )
-                await asyncio.sleep(wait_time)
-                return await self._request_public_api(method, endpoint, data, params, max_retries - 1) if max_retries > 1 else {}
-            
-            try:
-                response.raise_for_status()
-            except httpx.HTTPStatusError as exc:
-                body = exc.response.text if exc.response else ""
-                logger.error(
-                    f"Chatwoot Public API Error: {exc} | "
-                    f"URL: {exc.request.url if exc.request else 'N/A'} | "
-                    f"Method: {exc.request.method if exc.request else 'N/A'} | "
-                    f"Response body (full): {body}"
-                )
-                raise httpx.HTTPStatusError(
-                    f"{exc} | response body: {body}",
-                    request=exc.request,
-                    response=exc.response,
-                ) from exc
-            if not response.content:
-                return {}
-            return response.json()
+            raise httpx.HTTPStatusError(
+                f"{exc} | response body: {body}",
+                request=exc.request,
+                response=exc.response,
+            ) from exc
+        if not response.content:
+            return {}
+        return response.json()
     
     async def create_contact_via_public_api(
         self,
@@ -882,6 +870,14 @@ async def get_teams(self) -> List[Dict[str, Any]]:
         endpoint = f"/api/v1/accounts/{self.account_id}/teams"
         return await self._request("GET", endpoint)
     
+    async def get_inboxes(self) -> List[Dict[str, Any]]:
+        """Получить список всех inbox'ов аккаунта (ответ Chatwoot как есть)"""
+        return await self._request("GET", f"/api/v1/accounts/{self.account_id}/inboxes")
+    
+    async def get_labels(self) -> List[Dict[str, Any]]:
+        """Получить список всех меток аккаунта (ответ Chatwoot как есть)"""
+        return await self._request("GET", f"/api/v1/accounts/{self.account_id}/labels")
+    
     async def find_team_by_name(self, team_name: str, expected_name: Optional[str] = None) -> Optional[int]:
         """
         Найти команду по имени (регистронезависимый поиск).
@@ -901,44 +897,30 @@ async def find_team_by_name(self, team_name: str, expected_name: Optional[str] =
             expected_name = team_name
         
         try:
-            teams = await self.get_teams()
-            # teams может быть списком или словарем с ключом "payload"
-            if isinstance(teams, dict) and "payload" in teams:
-                teams_list = teams["payload"]
-            elif isinstance(teams, list):
-                teams_list = teams
-            else:
-                logger.warning(f"Unexpected teams response format: {type(teams)}")
+            # Команды ищутся в справочнике (GET /teams не чаще TTL, а не на каждую консультацию)
+            expected_name_normalized = normalize_name(expected_name)
+            team = await chatwoot_directory.find(self, TEAMS, "name", expected_name_normalized)
+            if team is None and normalize_name(team_name) != expected_name_normalized:
+                team = await chatwoot_directory.find(self, TEAMS, "name", normalize_name(team_name))
+            
+            if team is None:
+                teams_list = await chatwoot_directory.list_items(self, TEAMS)
+                logger.warning(f"Team '{team_name}' not found in Chatwoot. Available teams: {[t.get('name') for t in teams_list]}")
                 return None
             
-            # Нормализуем имя команды для поиска (регистронезависимо)
-            team_name_normalized = team_name.lower().strip()
-            expected_name_normalized = expected_name.lower().strip()
+            team_id = team.get("id")
+            team_name_in_chatwoot = team.get("name", "")
             
-            # Ищем команду по похожему названию
-            for team in teams_list:
-                if isinstance(team, dict):
-                    team_name_in_chatwoot = team.get("name", "")
-                    team_name_in_chatwoot_normalized = team_name_in_chatwoot.lower().strip()
-                    
-                    # Проверяем точное совпадение или похожее название
-                    if (team_name_in_chatwoot_normalized == team_name_normalized or
-                        team_name_in_chatwoot_normalized == expected_name_normalized):
-                        team_id = team.get("id")
-                        
-                        # Если название отличается от ожидаемого, обновляем его
-                        if team_name_in_chatwoot_normalized != expected_name_normalized:
-                            try:
-                                await self.update_team(team_id=team_id, name=expected_name)
-                                logger.info(f"Updated team {team_id} name from '{team_name_in_chatwoot}' to '{expected_name}'")
-                            except Exception as update_error:
-                                logger.warning(f"Failed to update team {team_id} name: {update_error}")
-                        
-                        logger.info(f"Found team '{expected_name}' in Chatwoot: id={team_id}")
-                        return team_id
+            # Если название отличается от ожидаемого, обновляем его
+            if normalize_name(team_name_in_chatwoot) != expected_name_normalized:
+                try:
+                    await self.update_team(team_id=team_id, name=expected_name)
+                    logger.info(f"Updated team {team_id} name from '{team_name_in_chatwoot}' to '{expected_name}'")
+                except Exception as update_error:
+                    logger.warning(f"Failed to update team {team_id} name: {update_error}")
             
-            logger.warning(f"Team '{team_name}' not found in Chatwoot. Available teams: {[t.get('name') for t in teams_list if isinstance(t, dict)]}")
-            return None
+            logger.info(f"Found team '{expected_name}' in Chatwoot: id={team_id}")
+            return team_id
         except Exception as e:
             logger.warning(f"Failed to find team '{team_name}' in Chatwoot: {e}")
             return None
@@ -1003,11 +985,16 @@ async def update_team(
             return {}
         
         logger.info(f"Updating team {team_id} with: {payload}")
-        return await self._request(
+        response = await self._request(
             "PATCH",
             f"/api/v1/accounts/{self.account_id}/teams/{team_id}",
             data=payload
         )
+        if isinstance(response, dict) and response.get("id") is not None:
+            chatwoot_directory.upsert(TEAMS, response)
+        else:
+            chatwoot_directory.invalidate(TEAMS)
+        return response
     
     async def add_team_members(
         self,
@@ -1400,31 +1387,9 @@ async def ensure_label_exists(self, label_title: str) -> bool:
         Returns:
             True если label существует или был создан, False если не удалось создать
         """
-        # Проверяем кэш
-        if label_title in ChatwootClient._labels_cache:
-            return True
-        
         try:
-            # Пытаемся найти существующий label
-            labels_response = await self._request(
-                "GET",
-                f"/api/v1/accounts/{self.account_id}/labels"
-            )
-            
-            # Обрабатываем разные форматы ответа
-            labels_list = []
-            if isinstance(labels_response, list):
-                labels_list = labels_response
-            elif isinstance(labels_response, dict):
-                if "payload" in labels_response:
-                    labels_list = labels_response["payload"] if isinstance(labels_response["payload"], list) else []
-                elif "value" in labels_response:
-                    labels_list = labels_response["value"] if isinstance(labels_response["value"], list) else []
-            
-            # Проверяем существование label
-            existing_labels = [label.get("title") for label in labels_list if isinstance(label, dict)]
-            if label_title in existing_labels:
-                ChatwootClient._labels_cache.add(label_title)
+            # Метки ищутся в справочнике: один GET /labels на процесс (и TTL), а не на каждую метку
+            if await chatwoot_directory.find(self, LABELS, "title", label_title) is not None:
                 logger.debug(f"Label '{label_title}' already exists in Chatwoot")
                 return True
             
@@ -1437,16 +1402,16 @@ async def ensure_label_exists(self, label_title: str) -> bool:
             }
             
             try:
-                await self._request(
+                created = await self._request(
                     "POST",
                     f"/api/v1/accounts/{self.account_id}/labels",
                     data=create_payload
                 )
-                ChatwootClient._labels_cache.add(label_title)
+                chatwoot_directory.upsert(LABELS, created if isinstance(created, dict) and created.get("title") else create_payload)
                 logger.info(f"Created label in Chatwoot: {label_title}")
                 return True
             except httpx.HTTPStatusError as create_error:
-                # Если label уже существует (409 или 422), добавляем в кэш
+                # Если label уже существует (409 или 422), запоминаем его в справочнике
                 status_code = create_error.response.status_code if create_error.response else None
                 error_body = create_error.response.text if create_error.response else ""
                 error_str = error_body.lower()
@@ -1457,7 +1422,7 @@ async def ensure_label_exists(self, label_title: str) -> bool:
                     "already been taken" in error_str or
                     "title has already been taken" in error_str
                 ):
-                    ChatwootClient._labels_cache.add(label_title)
+                    chatwoot_directory.upsert(LABELS, create_payload)
                     logger.debug(f"Label already exists (status {status_code}): {label_title}")
                     return True
                 logger.warning(f"Failed to create label {label_title}: {create_error}")
@@ -1472,7 +1437,7 @@ async def ensure_label_exists(self, label_title: str) -> bool:
                     "already been taken" in error_str or
                     "title has already been taken" in error_str
                 ):
-                    ChatwootClient._labels_cache.add(label_title)
+                    chatwoot_directory.upsert(LABELS, create_payload)
                     logger.debug(f"Label already exists: {label_title}")
                     return True
                 logger.warning(f"Failed to create label {label_title}: {create_error}")
@@ -1637,17 +1602,17 @@ async def send_bot_message(
         }
         
         # Используем токен Agent Bot вместо обычного API токена
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{self.base_url}/api/v1/accounts/{self.account_id}/conversations/{conversation_id}/messages",
-                headers={
-                    "api_access_token": bot_token,
-                    "Content-Type": "application/json"
-                },
-                json=payload
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self._send(
+            "POST",
+            f"{self.base_url}/api/v1/accounts/{self.account_id}/conversations/{conversation_id}/messages",
+            headers={
+                "api_access_token": bot_token,
+                "Content-Type": "application/json"
+            },
+            json=payload
+        )
+        response.raise_for_status()
+        return response.json()
 
     async def send_message_with_attachment(
         self,
@@ -1667,15 +1632,13 @@ async def send_message_with_attachment(
             attachment_type: Тип файла (image, file, audio, video)
             message_type: Тип сообщения (incoming/outgoing)
         """
-        import httpx
         from io import BytesIO
         
         # Сначала загружаем файл по URL
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            file_response = await client.get(attachment_url)
-            file_response.raise_for_status()
-            file_content = file_response.content
-            file_name = attachment_url.split("/")[-1] or f"file.{attachment_type}"
+        file_response = await self._send("GET", attachment_url, timeout=60.0, site="GET <attachment_url>")
+        file_response.raise_for_status()
+        file_content = file_response.content
+        file_name = attachment_url.split("/")[-1] or f"file.{attachment_type}"
         
         # Определяем content_type по типу файла
         content_type_map = {
@@ -1705,26 +1668,27 @@ async def send_message_with_attachment(
         
         logger.info(f"Sending message with attachment to conversation {conversation_id}: type={attachment_type}, size={len(file_content)} bytes, filename={file_name}")
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            try:
-                response = await client.post(
-                    url,
-                    headers=headers,
-                    data=data,
-                    files=files
-                )
-                response.raise_for_status()
-                result = response.json()
-                logger.info(f"Successfully sent message with attachment to conversation {conversation_id}")
-                return result
-            except httpx.HTTPStatusError as e:
-                error_body = e.response.text if e.response else ""
-                logger.error(
-                    f"Failed to send message with attachment: {e} | "
-                    f"Status: {e.response.status_code if e.response else 'N/A'} | "
-                    f"Response: {error_body}"
-                )
-                raise
+        try:
+            response = await self._send(
+                "POST",
+                url,
+                timeout=60.0,
+                headers=headers,
+                data=data,
+                files=files
+            )
+            response.raise_for_status()
+            result = response.json()
+            logger.info(f"Successfully sent message with attachment to conversation {conversation_id}")
+            return result
+        except httpx.HTTPStatusError as e:
+            error_body = e.response.text if e.response else ""
+            logger.error(
+                f"Failed to send message with attachment: {e} | "
+                f"Status: {e.response.status_code if e.response else 'N/A'} | "
+                f"Response: {error_body}"
+            )
+            raise
     
     async def send_note(
         self,
@@ -1818,7 +1782,14 @@ async def create_user(
         if custom_attributes:
             payload["custom_attributes"] = custom_attributes
         
-        user_response = await self._request("POST", f"/api/v1/accounts/{self.account_id}/agents", data=payload)
+        try:
+            user_response = await self._request("POST", f"/api/v1/accounts/{self.account_id}/agents", data=payload)
+        except httpx.HTTPStatusError:
+            # 422 — агент уже есть, но справочник его не знает: следующий поиск перезагрузит агентов
+            chatwoot_directory.invalidate(AGENTS)
+            raise
+        if isinstance(user_response, dict) and user_response.get("id") is not None:
+            chatwoot_directory.upsert(AGENTS, user_response)
         
         # Добавляем пользователя в inbox после создания
         user_id = user_response.get("id") if isinstance(user_response, dict) else None
@@ -1891,25 +1862,9 @@ async def find_user_by_custom_attribute(
         # Поэтому поиск по custom_attributes может не работать
         # Рекомендуется использовать chatwoot_user_id из БД для маппинга
         try:
-            response = await self._request("GET", f"/api/v1/accounts/{self.account_id}/agents")
-            # Chatwoot может возвращать список напрямую или в поле payload
-            if isinstance(response, list):
-                agents = response
-            elif isinstance(response, dict):
-                agents = response.get("payload", [])
-                if not agents and isinstance(response.get("value"), list):
-                    agents = response.get("value", [])
-            else:
-                agents = []
-            
-            for agent in agents:
-                # Application API может не возвращать custom_attributes
-                custom_attrs = agent.get("custom_attributes", {})
-                if custom_attrs and custom_attrs.get(attribute_key) == attribute_value:
-                    return agent
+            return await chatwoot_directory.find(self, AGENTS, "attribute", (attribute_key, str(attribute_value)))
         except Exception:
-            pass
-        return None
+            return None
     
     async def find_user_by_email(
         self,
@@ -1925,25 +1880,9 @@ async def find_user_by_email(
             Dict с данными пользователя или None
         """
         try:
-            response = await self._request("GET", f"/api/v1/accounts/{self.account_id}/agents")
-            # Chatwoot может возвращать список напрямую или в поле payload
-            if isinstance(response, list):
-                agents = response
-            elif isinstance(response, dict):
-                agents = response.get("payload", [])
-                if not agents and isinstance(response.get("value"), list):
-                    agents = response.get("value", [])
-            else:
-                agents = []
-            
-            email_lower = email.lower()
-            for agent in agents:
-                agent_email = agent.get("email")
-                if agent_email and agent_email.lower() == email_lower:
-                    return agent
+            return await chatwoot_directory.find(self, AGENTS, "email", email.strip().lower())
         except Exception:
-            pass
-        return None
+            return None
     
     async def find_user_by_name(
         self,
@@ -1959,26 +1898,9 @@ async def find_user_by_name(
             Dict с данными пользователя или None
         """
         try:
-            response = await self._request("GET", f"/api/v1/accounts/{self.account_id}/agents")
-            # Chatwoot может возвращать список напрямую или в поле payload
-            if isinstance(response, list):
-                agents = response
-            elif isinstance(response, dict):
-                agents = response.get("payload", [])
-                if not agents and isinstance(response.get("value"), list):
-                    agents = response.get("value", [])
-            else:
-                agents = []
-            
-            name_lower = name.lower().strip()
-            for agent in agents:
-                agent_name = agent.get("name", "").lower().strip()
-                agent_available_name = agent.get("available_name", "").lower().strip()
-                if (agent_name and agent_name == name_lower) or (agent_available_name and agent_available_name == name_lower):
-                    return agent
+            return await chatwoot_directory.find(self, AGENTS, "name", normalize_name(name))
         except Exception:
-            pass
-        return None
+            return None
     
     async def list_all_agents(self) -> List[Dict[str, Any]]:
         """
@@ -1988,20 +1910,14 @@ async def list_all_agents(self) -> List[Dict[str, Any]]:
             Список всех агентов
         """
         try:
-            response = await self._request("GET", f"/api/v1/accounts/{self.account_id}/agents")
-            # Chatwoot может возвращать список напрямую или в поле payload
-            if isinstance(response, list):
-                return response
-            elif isinstance(response, dict):
-                agents = response.get("payload", [])
-                if not agents and isinstance(response.get("value"), list):
-                    agents = response.get("value", [])
-                return agents if isinstance(agents, list) else []
-            else:
-                return []
+            return await chatwoot_directory.list_items(self, AGENTS)
         except Exception:
             return []
     
+    async def get_agents(self) -> List[Dict[str, Any]]:
+        """Получить список всех агентов аккаунта (ответ Chatwoot как есть, без справочника)"""
+        return await self._request("GET", f"/api/v1/accounts/{self.account_id}/agents")
+    
     async def create_contact(
         self,
         name: str,
@@ -0,0 +1,240 @@
+"""
+Известные контакты Chatwoot клиентов: client_id -> contact_id, source_id, pubsub_token.
+
+Раньше create_consultation для каждой консультации искал контакт заново
+(find_contact_by_identifier, get_contact_via_public_api, find_contact_by_email,
+find_contact_by_phone, а после 422 — еще раз), хотя контакт клиента почти не меняется.
+Теперь найденный или созданный контакт запоминается:
+
+- sys.chatwoot_contacts — таблица, общая для процессов (поиск по client_id, затем по
+  email и телефону — контакт того же человека под другим client_id);
+- LRU процесса (CHATWOOT_CONTACT_CACHE_SIZE) — повторная консультация не ходит в БД.
+
+Заполняют путь создания консультации и вебхуки contact.* (identifier контакта —
+client_id). Запись, проверенная менее CHATWOOT_CONTACT_VERIFY_SECONDS назад,
+используется без запросов к Chatwoot; более старая проверяется одним GET контакта:
+404 или пропавший source_id — запись удаляется, и контакт ищется как раньше.
+
+ВАЖНО: contact.deleted сбрасывает LRU только того процесса, где обработан вебхук —
+в остальных запись доживет до очередной проверки (не дольше окна проверки).
+"""
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, NamedTuple, Optional
+
+import httpx
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models import ChatwootContact
+
+logger = logging.getLogger(__name__)
+
+CONTACT_CREATED = "contact.created"
+CONTACT_UPDATED = "contact.updated"
+CONTACT_DELETED = "contact.deleted"
+CONTACT_EVENTS = (CONTACT_CREATED, CONTACT_UPDATED, CONTACT_DELETED)
+
+
+class ContactRef(NamedTuple):
+    client_id: str  # клиент, для которого контакт записан
+    contact_id: int
+    source_id: str
+    pubsub_token: Optional[str]
+    verified_at: datetime
+
+
+class ChatwootContactCache:
+    """LRU известных контактов процесса: client_id -> ContactRef"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, ContactRef]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, client_id: str) -> Optional[ContactRef]:
+        ref = self._items.get(client_id)
+        if ref is not None:
+            self._items.move_to_end(client_id)
+        return ref
+
+    def put(self, ref: ContactRef):
+        if self.max_size <= 0:
+            return
+        self._items[ref.client_id] = ref
+        self._items.move_to_end(ref.client_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def discard(self, client_id: Optional[str] = None, contact_id: Optional[int] = None):
+        if client_id is not None:
+            self._items.pop(client_id, None)
+        if contact_id is not None:
+            for key in [key for key, ref in self._items.items() if ref.contact_id == contact_id]:
+                del self._items[key]
+
+    def clear(self):
+        self._items.clear()
+
+
+chatwoot_contact_cache = ChatwootContactCache(settings.CHATWOOT_CONTACT_CACHE_SIZE)
+
+
+def _ref_from_row(row: ChatwootContact) -> ContactRef:
+    return ContactRef(str(row.client_id), int(row.contact_id), row.source_id, row.pubsub_token, row.verified_at)
+
+
+def contact_is_fresh(ref: ContactRef, now: Optional[datetime] = None) -> bool:
+    now = now or datetime.now(timezone.utc)
+    return now - ref.verified_at < timedelta(seconds=settings.CHATWOOT_CONTACT_VERIFY_SECONDS)
+
+
+def inbox_source_id(contact: Dict[str, Any]) -> Optional[str]:
+    """source_id контакта в CHATWOOT_INBOX_ID (или первый, если inbox не найден)"""
+    contact_inboxes = [ci for ci in contact.get("contact_inboxes") or [] if isinstance(ci, dict)]
+    for ci in contact_inboxes:
+        inbox_id = ci.get("inbox_id") or (ci.get("inbox") or {}).get("id")
+        if inbox_id == settings.CHATWOOT_INBOX_ID and ci.get("source_id"):
+            return ci["source_id"]
+    return next((ci["source_id"] for ci in contact_inboxes if ci.get("source_id")), None)
+
+
+async def find_known_contact(
+    db: AsyncSession,
+    client_id,
+    email: Optional[str] = None,
+    phone: Optional[str] = None,
+) -> Optional[ContactRef]:
+    """Известный контакт клиента: LRU, затем таблица по client_id, email, телефону"""
+    ref = chatwoot_contact_cache.get(str(client_id))
+    if ref is not None:
+        return ref
+
+    row = (await db.execute(
+        select(ChatwootContact).where(ChatwootContact.client_id == client_id)
+    )).scalar_one_or_none()
+    if row is None and (email or phone):
+        conditions = []
+        if email:
+            conditions.append(ChatwootContact.email == email)
+        if phone:
+            conditions.append(ChatwootContact.phone_number == phone)
+        row = (await db.execute(
+            select(ChatwootContact).where(or_(*conditions)).order_by(ChatwootContact.verified_at.desc()).limit(1)
+        )).scalar_one_or_none()
+    if row is None:
+        return None
+    ref = _ref_from_row(row)
+    if ref.client_id == str(client_id):
+        chatwoot_contact_cache.put(ref)
+    return ref
+
+
+async def verify_contact(chatwoot_client, ref: ContactRef) -> Optional[ContactRef]:
+    """
+    Проверка одним GET контакта.
+
+    None — контакт удален (404) или source_id больше не принадлежит контакту.
+    Другие ошибки Chatwoot пробрасываются.
+    """
+    try:
+        response = await chatwoot_client.get_contact(ref.contact_id)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            return None
+        raise
+    contact = response.get("payload") if isinstance((response or {}).get("payload"), dict) else (response or {})
+    if "contact_inboxes" in contact:
+        source_ids = {ci.get("source_id") for ci in contact["contact_inboxes"] or [] if isinstance(ci, dict)}
+        if ref.source_id not in source_ids:
+            return None
+    return ref._replace(verified_at=datetime.now(timezone.utc))
+
+
+async def remember_contact(
+    db: AsyncSession,
+    ref: ContactRef,
+    email: Optional[str] = None,
+    phone: Optional[str] = None,
+):
+    """Записывает контакт клиента (upsert по client_id, pubsub_token не затирается пустым)"""
+    stmt = insert(ChatwootContact).values(
+        client_id=uuid.UUID(ref.client_id),
+        contact_id=ref.contact_id,
+        source_id=ref.source_id,
+        pubsub_token=ref.pubsub_token,
+        email=email,
+        phone_number=phone,
+        verified_at=ref.verified_at,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ChatwootContact.client_id],
+        set_={
+            "contact_id": stmt.excluded.contact_id,
+            "source_id": stmt.excluded.source_id,
+            "pubsub_token": func.coalesce(stmt.excluded.pubsub_token, ChatwootContact.pubsub_token),
+            "email": func.coalesce(stmt.excluded.email, ChatwootContact.email),
+            "phone_number": func.coalesce(stmt.excluded.phone_number, ChatwootContact.phone_number),
+            "verified_at": stmt.excluded.verified_at,
+            "updated_at": func.now(),
+        },
+    )
+    await db.execute(stmt)
+    if ref.pubsub_token:
+        chatwoot_contact_cache.put(ref)
+    else:
+        # В таблице мог остаться pubsub_token — запись перечитается из БД
+        chatwoot_contact_cache.discard(client_id=ref.client_id)
+
+
+async def forget_contact(db: AsyncSession, contact_id: int):
+    """Удаляет все записи контакта (контакт удален или устарел)"""
+    await db.execute(delete(ChatwootContact).where(ChatwootContact.contact_id == contact_id))
+    chatwoot_contact_cache.discard(contact_id=contact_id)
+
+
+async def apply_contact_event(db: AsyncSession, event_type: str, contact: Dict[str, Any]) -> Optional[str]:
+    """
+    Вебхук contact.*: обновляет известные контакты.
+
+    Returns:
+        "forgotten", "remembered", "updated" или None (событие без ID контакта)
+    """
+    contact_id = contact.get("id")
+    if not contact_id:
+        return None
+    contact_id = int(contact_id)
+    if event_type == CONTACT_DELETED:
+        await forget_contact(db, contact_id)
+        return "forgotten"
+
+    source_id = inbox_source_id(contact)
+    email = contact.get("email") or None
+    phone = contact.get("phone_number") or None
+    now = datetime.now(timezone.utc)
+
+    # Записи этого контакта у других клиентов (найдены по email/телефону)
+    values: Dict[str, Any] = {"verified_at": now, "updated_at": func.now()}
+    if source_id:
+        values["source_id"] = source_id
+    if email:
+        values["email"] = email
+    if phone:
+        values["phone_number"] = phone
+    await db.execute(update(ChatwootContact).where(ChatwootContact.contact_id == contact_id).values(**values))
+    chatwoot_contact_cache.discard(contact_id=contact_id)
+
+    try:
+        client_id = uuid.UUID(str(contact.get("identifier")))
+    except ValueError:
+        client_id = None
+    if client_id is None or not source_id:
+        return "updated"
+    await remember_contact(db, ContactRef(str(client_id), contact_id, source_id, None, now), email=email, phone=phone)
+    return "remembered"
@@ -0,0 +1,227 @@
+"""
+Справочник Chatwoot: агенты, команды, inbox'ы и метки аккаунта.
+
+Раньше find_user_by_email / find_user_by_name / find_user_by_custom_attribute /
+list_all_agents делали GET /agents на каждый вызов и искали линейно,
+find_team_by_name — GET /teams на каждую консультацию, а ensure_label_exists
+проверял метки по множеству, которое в каждом ETL подпроцессе начиналось пустым
+(и на первый вызов для каждой метки — GET /labels).
+
+Теперь каждый раздел загружается одним запросом и индексируется по id, email,
+нормализованному имени и custom_attributes. Раздел перезагружается:
+- по TTL (CHATWOOT_DIRECTORY_TTL_SECONDS);
+- при промахе поиска, если раздел загружен раньше CHATWOOT_DIRECTORY_MISS_REFRESH_SECONDS
+  (агент/команда могли появиться после загрузки);
+- по подсказкам вебхуков: беседа с неизвестным агентом, командой, inbox'ом или меткой
+  (или с переименованными) помечает раздел устаревшим;
+- после собственных изменений (create_user, update_team, создание метки) запись
+  обновляется сразу, без перезагрузки.
+
+Справочник общий для процесса (chatwoot_directory) и используется через
+ChatwootClient — API, sync_users_to_chatwoot.py и ETL скрипты получают его без
+изменений в вызывающем коде.
+
+ВАЖНО: вебхуки обрабатывает воркер одного процесса — в остальных процессах
+изменения видны не позже TTL или ближайшего промаха.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+AGENTS = "agents"
+TEAMS = "teams"
+INBOXES = "inboxes"
+LABELS = "labels"
+SECTIONS = (AGENTS, TEAMS, INBOXES, LABELS)
+
+# Методы ChatwootClient, загружающие раздел целиком
+_LOADERS = {
+    AGENTS: "get_agents",
+    TEAMS: "get_teams",
+    INBOXES: "get_inboxes",
+    LABELS: "get_labels",
+}
+
+
+def normalize_name(value: Any) -> str:
+    """Имя для сравнения: без регистра и лишних пробелов"""
+    return " ".join(str(value or "").split()).lower()
+
+
+def unwrap_list(response: Any) -> List[Dict[str, Any]]:
+    """Список из ответа Chatwoot (список, {"payload": [...]} или {"value": [...]})"""
+    if isinstance(response, dict):
+        for key in ("payload", "value", "data"):
+            if isinstance(response.get(key), list):
+                response = response[key]
+                break
+    if not isinstance(response, list):
+        return []
+    return [item for item in response if isinstance(item, dict)]
+
+
+def _index_keys(section: str, item: Dict[str, Any]) -> Iterable[Tuple[str, Any]]:
+    if section == AGENTS:
+        if item.get("email"):
+            yield "email", str(item["email"]).strip().lower()
+        for field in ("name", "available_name"):
+            if item.get(field):
+                yield "name", normalize_name(item[field])
+        for key, value in (item.get("custom_attributes") or {}).items():
+            if value is not None:
+                yield "attribute", (key, str(value))
+    elif section == LABELS:
+        if item.get("title"):
+            yield "title", item["title"]
+    elif item.get("name"):
+        yield "name", normalize_name(item["name"])
+
+
+class _Section:
+    def __init__(self):
+        self.items: Dict[Any, Dict[str, Any]] = {}
+        self.indexes: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        self.loaded_at: Optional[float] = None
+        self.stale = False
+        self.lock = asyncio.Lock()
+
+    def replace(self, items: List[Dict[str, Any]], section: str):
+        self.items = {}
+        self.indexes = {}
+        for item in items:
+            self.add(item, section)
+        self.loaded_at = time.monotonic()
+        self.stale = False
+
+    def add(self, item: Dict[str, Any], section: str):
+        key = item.get("id") if item.get("id") is not None else item.get("title")
+        if key is None:
+            return
+        previous = self.items.get(key)
+        if previous is not None:
+            for index, value in _index_keys(section, previous):
+                if self.indexes.get(index, {}).get(value) is previous:
+                    del self.indexes[index][value]
+        self.items[key] = item
+        for index, value in _index_keys(section, item):
+            # При совпадении имен выигрывает первая запись (как при линейном поиске)
+            self.indexes.setdefault(index, {}).setdefault(value, item)
+
+
+class ChatwootDirectory:
+    """Индексированный кэш агентов, команд, inbox'ов и меток Chatwoot"""
+
+    def __init__(self, ttl_seconds: float, miss_refresh_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.miss_refresh_seconds = miss_refresh_seconds
+        self._sections: Dict[str, _Section] = {section: _Section() for section in SECTIONS}
+
+    def clear(self):
+        self._sections = {section: _Section() for section in SECTIONS}
+
+    def invalidate(self, section: Optional[str] = None):
+        """Помечает раздел (или все) устаревшим: следующий запрос перезагрузит его"""
+        for name in (section,) if section else SECTIONS:
+            self._sections[name].stale = True
+
+    def _expired(self, section: _Section, max_age: float) -> bool:
+        return (
+            section.loaded_at is None
+            or section.stale
+            or time.monotonic() - section.loaded_at >= max_age
+        )
+
+    async def _ensure(self, chatwoot_client, name: str, max_age: Optional[float] = None):
+        section = self._sections[name]
+        max_age = self.ttl_seconds if max_age is None else max_age
+        if not self._expired(section, max_age):
+            return section
+        async with section.lock:
+            # Раздел мог загрузить конкурентный запрос, пока ждали блокировку
+            if not self._expired(section, max_age):
+                return section
+            try:
+                response = await getattr(chatwoot_client, _LOADERS[name])()
+            except Exception as e:
+                if section.loaded_at is None:
+                    raise
+                # Отдаем прежние данные, повторная загрузка — по обычным правилам от текущего момента
+                logger.warning(f"Failed to refresh Chatwoot {name}, using cached directory: {e}")
+                section.loaded_at = time.monotonic()
+                section.stale = False
+                return section
+            section.replace(unwrap_list(response), name)
+            logger.debug(f"Loaded Chatwoot {name}: {len(section.items)} items")
+        return section
+
+    async def list_items(self, chatwoot_client, name: str) -> List[Dict[str, Any]]:
+        section = await self._ensure(chatwoot_client, name)
+        return list(section.items.values())
+
+    async def find(self, chatwoot_client, name: str, index: str, value: Any) -> Optional[Dict[str, Any]]:
+        """
+        Поиск по индексу раздела ("id", "email", "name", "attribute", "title").
+
+        При промахе раздел перезагружается, если загружен раньше miss_refresh_seconds.
+        """
+        section = await self._ensure(chatwoot_client, name)
+        item = self._lookup(section, index, value)
+        if item is None:
+            section = await self._ensure(chatwoot_client, name, max_age=self.miss_refresh_seconds)
+            item = self._lookup(section, index, value)
+        return item
+
+    @staticmethod
+    def _lookup(section: _Section, index: str, value: Any) -> Optional[Dict[str, Any]]:
+        if index == "id":
+            return section.items.get(value)
+        return section.indexes.get(index, {}).get(value)
+
+    def upsert(self, name: str, item: Dict[str, Any]):
+        """Запись, созданная или измененная этим процессом (раздел не перезагружается)"""
+        section = self._sections[name]
+        if section.loaded_at is not None:
+            section.add(item, name)
+
+    def note_webhook(self, payload: Dict[str, Any]):
+        """
+        Подсказка из вебхука беседы/сообщения: неизвестные или переименованные
+        агент, команда, inbox и метки помечают раздел устаревшим.
+        """
+        conversation = payload.get("conversation") if isinstance(payload.get("conversation"), dict) else payload
+        meta = conversation.get("meta") if isinstance(conversation.get("meta"), dict) else {}
+
+        hints = [
+            (AGENTS, meta.get("assignee")),
+            (TEAMS, meta.get("team")),
+            (INBOXES, {"id": conversation.get("inbox_id")} if conversation.get("inbox_id") else None),
+        ]
+        for name, item in hints:
+            if not isinstance(item, dict) or item.get("id") is None:
+                continue
+            section = self._sections[name]
+            if section.loaded_at is None or section.stale:
+                continue
+            known = section.items.get(item["id"])
+            renamed = known is not None and item.get("name") and known.get("name") != item["name"]
+            if known is None or renamed:
+                logger.debug(f"Webhook mentions unknown or renamed Chatwoot {name[:-1]} {item['id']}, refreshing")
+                section.stale = True
+
+        labels = self._sections[LABELS]
+        titles = conversation.get("labels") or []
+        if labels.loaded_at is not None and any(
+            isinstance(title, str) and title not in labels.indexes.get("title", {}) for title in titles
+        ):
+            labels.stale = True
+
+
+chatwoot_directory = ChatwootDirectory(
+    ttl_seconds=settings.CHATWOOT_DIRECTORY_TTL_SECONDS,
+    miss_refresh_seconds=settings.CHATWOOT_DIRECTORY_MISS_REFRESH_SECONDS,
+)
@@ -0,0 +1,339 @@
+"""
+Transactional outbox для побочных эффектов ETL в Chatwoot.
+
+ETL (pull_cons_cl) не ходит в Chatwoot внутри открытой транзакции: вместо HTTP вызова
+в sys.chatwoot_outbox пишется событие — в той же сессии и том же commit, что и
+изменение консультации. Откатилась транзакция — события нет; прошел commit — событие
+будет доставлено, даже если Chatwoot в этот момент недоступен.
+
+ChatwootOutboxDispatcher (запускается планировщиком):
+- забирает conversations целиком, с арендой (FOR UPDATE SKIP LOCKED): два диспетчера
+  не получат одну запись, а записи упавшего диспетчера вернутся после истечения аренды.
+  Conversation берется, только когда наступил срок всех ее pending записей
+  (HAVING max(next_attempt_at) <= now() + advisory lock по conversation, как в
+  onec_sync_queue): новая запись не обгонит более старую, которая ждет повтора в backoff;
+- группирует события по conversation и схлопывает их: из смен статуса выполняется
+  только последняя, custom_attributes объединяются в один вызов;
+- разные conversations обрабатываются параллельно (CHATWOOT_OUTBOX_CONCURRENCY),
+  события одной conversation — последовательно;
+- при ошибке запись откладывается с экспоненциальным backoff, после
+  CHATWOOT_OUTBOX_MAX_ATTEMPTS (или при 4xx, который не исправится повтором) — failed.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models import ChatwootOutbox, Consultation
+from .odata_client import compute_backoff
+
+logger = logging.getLogger(__name__)
+
+# Типы событий outbox
+EVENT_STATUS = "status"                        # {"status": "resolved"|"open"|"pending", "message": str|None, "custom_attributes": {...}|None}
+EVENT_RECONCILE = "reconcile"                  # {"message": str} — закрыть, только если в Chatwoot еще open/pending
+EVENT_CUSTOM_ATTRIBUTES = "custom_attributes"  # {"custom_attributes": {...}}
+EVENT_MANAGER_CHANGE = "manager_change"        # {"old_manager_key": str|None, "new_manager_key": str, "reason": str}
+
+# На сколько запись "арендуется" диспетчером; если он упал, запись снова станет доступна
+LEASE_SECONDS = 120
+
+# HTTP статусы, при которых повтор имеет смысл
+RETRYABLE_STATUS_CODES = {408, 425, 429}
+
+
+def enqueue_chatwoot_event(
+    db: AsyncSession,
+    conversation_id: str,
+    event_type: str,
+    payload: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    Добавляет событие в outbox в текущей транзакции.
+
+    ВАЖНО: commit делает вызывающий код — событие появится в outbox только вместе
+    с изменением консультации.
+    """
+    db.add(ChatwootOutbox(
+        conversation_id=str(conversation_id),
+        event_type=event_type,
+        payload=payload or {},
+    ))
+
+
+@dataclass
+class ConversationPlan:
+    """Схлопнутые события одной conversation — то, что реально уйдет в Chatwoot"""
+    conversation_id: str
+    row_ids: List[int] = field(default_factory=list)
+    attempts: int = 0
+    status_event: Optional[Tuple[str, Dict[str, Any]]] = None
+    custom_attributes: Dict[str, Any] = field(default_factory=dict)
+    manager_changes: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def coalesce_events(rows: List[Dict[str, Any]]) -> List[ConversationPlan]:
+    """
+    Группирует записи outbox по conversation и схлопывает их (в порядке id):
+        - status/reconcile — остается только последнее событие;
+        - custom_attributes — словари сливаются, более позднее значение побеждает;
+        - manager_change — все уникальные в исходном порядке.
+    """
+    plans: Dict[str, ConversationPlan] = {}
+    for row in sorted(rows, key=lambda r: r["id"]):
+        plan = plans.setdefault(row["conversation_id"], ConversationPlan(conversation_id=row["conversation_id"]))
+        plan.row_ids.append(row["id"])
+        plan.attempts = max(plan.attempts, row.get("attempts") or 0)
+        event_type = row["event_type"]
+        payload = row.get("payload") or {}
+
+        if event_type in (EVENT_STATUS, EVENT_RECONCILE):
+            plan.status_event = (event_type, payload)
+            plan.custom_attributes.update(payload.get("custom_attributes") or {})
+        elif event_type == EVENT_CUSTOM_ATTRIBUTES:
+            plan.custom_attributes.update(payload.get("custom_attributes") or {})
+        elif event_type == EVENT_MANAGER_CHANGE:
+            if payload not in plan.manager_changes:
+                plan.manager_changes.append(payload)
+        else:
+            logger.warning(f"Unknown chatwoot outbox event type '{event_type}' (id={row['id']}), skipping")
+    return list(plans.values())
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """4xx от Chatwoot (кроме 408/425/429) повтором не исправить — например, conversation удалена"""
+    if isinstance(error, httpx.HTTPStatusError):
+        code = error.response.status_code
+        return code >= 500 or code in RETRYABLE_STATUS_CODES
+    return True
+
+
+class ChatwootOutboxDispatcher:
+    """Доставка событий sys.chatwoot_outbox в Chatwoot"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        chatwoot_client=None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+    ):
+        if session_factory is None:
+            from ..database import AsyncSessionLocal
+            session_factory = AsyncSessionLocal
+        self.session_factory = session_factory
+        self._chatwoot = chatwoot_client
+        self.batch_size = batch_size or settings.CHATWOOT_OUTBOX_BATCH_SIZE
+        self.concurrency = max(1, concurrency or settings.CHATWOOT_OUTBOX_CONCURRENCY)
+        self.max_attempts = max_attempts or settings.CHATWOOT_OUTBOX_MAX_ATTEMPTS
+
+    @property
+    def chatwoot(self):
+        if self._chatwoot is None:
+            from .chatwoot_client import ChatwootClient
+            self._chatwoot = ChatwootClient()
+        return self._chatwoot
+
+    async def claim(self) -> List[Dict[str, Any]]:
+        """
+        Забирает pending записи до batch_size conversations, продлевая их next_attempt_at
+        на время аренды.
+
+        ВАЖНО: conversation, у которой хоть одна запись ждет повтора, пропускается целиком —
+        события одной conversation уходят в Chatwoot в порядке id.
+        """
+        due = (
+            select(ChatwootOutbox.conversation_id)
+            .where(ChatwootOutbox.status == "pending")
+            .group_by(ChatwootOutbox.conversation_id)
+            .having(func.max(ChatwootOutbox.next_attempt_at) <= func.now())
+            .order_by(func.min(ChatwootOutbox.id))
+            .limit(self.batch_size)
+            .subquery()
+        )
+        # Один диспетчер на conversation: второй не заберет ее новые записи, пока первый их арендует
+        locked = select(due.c.conversation_id).where(
+            func.pg_try_advisory_xact_lock(func.hashtext("chatwoot_outbox:" + due.c.conversation_id))
+        )
+        candidates = (
+            select(ChatwootOutbox.id)
+            .where(
+                ChatwootOutbox.status == "pending",
+                ChatwootOutbox.conversation_id.in_(locked),
+                ChatwootOutbox.next_attempt_at <= func.now(),
+            )
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(ChatwootOutbox)
+            .where(ChatwootOutbox.id.in_(candidates))
+            .values(
+                attempts=ChatwootOutbox.attempts + 1,
+                next_attempt_at=func.now() + timedelta(seconds=LEASE_SECONDS),
+            )
+            .returning(
+                ChatwootOutbox.id,
+                ChatwootOutbox.conversation_id,
+                ChatwootOutbox.event_type,
+                ChatwootOutbox.payload,
+                ChatwootOutbox.attempts,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        async with self.session_factory() as db:
+            result = await db.execute(stmt)
+            rows = [dict(row) for row in result.mappings().all()]
+            await db.commit()
+        return rows
+
+    async def deliver(self, plan: ConversationPlan):
+        """Выполняет схлопнутые события одной conversation (последовательно)"""
+        conversation_id = plan.conversation_id
+        message = None
+
+        if plan.status_event:
+            event_type, payload = plan.status_event
+            if event_type == EVENT_RECONCILE:
+                # Закрываем, только если conversation в Chatwoot еще открыта
+                conv_data = await self.chatwoot.get_conversation(conversation_id=conversation_id)
+                if (conv_data or {}).get("status") in ("open", "pending"):
+                    await self.chatwoot.toggle_conversation_status(conversation_id=conversation_id, status="resolved")
+                    message = payload.get("message")
+                    logger.info(f"Reconciliation: closed Chatwoot conversation {conversation_id}")
+            else:
+                target_status = payload["status"]
+                if target_status == "resolved":
+                    await self.chatwoot.toggle_conversation_status(conversation_id=conversation_id, status="resolved")
+                else:
+                    await self.chatwoot.update_conversation(conversation_id=conversation_id, status=target_status)
+                message = payload.get("message")
+                logger.info(f"Synced status '{target_status}' to Chatwoot conversation {conversation_id}")
+
+        if plan.custom_attributes:
+            await self.chatwoot.update_conversation_custom_attributes(
+                conversation_id=conversation_id,
+                custom_attributes=plan.custom_attributes,
+            )
+            logger.info(f"Synced custom_attributes to Chatwoot for {conversation_id}: {list(plan.custom_attributes.keys())}")
+
+        # Уведомления о смене менеджера при повторе не дублируются (log.notification_log)
+        for change in plan.manager_changes:
+            await self._notify_manager_change(conversation_id, change)
+
+        # Сообщение — последним: если упадет предыдущий шаг, повтор не задублирует его в чате
+        if message:
+            await self.chatwoot.send_message(conversation_id=conversation_id, content=message, message_type="outgoing")
+
+    async def _notify_manager_change(self, conversation_id: str, change: Dict[str, Any]):
+        """Уведомления о переназначении менеджера и об изменении очереди"""
+        from .manager_notifications import (
+            send_manager_reassignment_notification,
+            send_queue_update_notification,
+        )
+        async with self.session_factory() as db:
+            result = await db.execute(select(Consultation).where(Consultation.cons_id == conversation_id))
+            consultation = result.scalar_one_or_none()
+            if consultation is None:
+                return
+            # Дубли при повторе отсекает log.notification_log внутри send_*
+            await send_manager_reassignment_notification(
+                db=db,
+                consultation=consultation,
+                old_manager_key=change.get("old_manager_key"),
+                new_manager_key=change.get("new_manager_key"),
+                reason=change.get("reason") or "Переназначено в ЦЛ",
+            )
+            await send_queue_update_notification(
+                db=db,
+                consultation=consultation,
+                manager_key=change.get("new_manager_key"),
+            )
+            await db.commit()
+
+    async def _finish(self, results: List[Tuple[ConversationPlan, Optional[BaseException]]]) -> Dict[str, int]:
+        """Фиксирует результат доставки: done / отложить с backoff / failed"""
+        stats = {"delivered": 0, "retried": 0, "failed": 0}
+        now = datetime.now(timezone.utc)
+        delivered_ids: List[int] = []
+
+        async with self.session_factory() as db:
+            for plan, error in results:
+                if error is None:
+                    delivered_ids.extend(plan.row_ids)
+                    stats["delivered"] += len(plan.row_ids)
+                    continue
+
+                error_text = f"{type(error).__name__}: {error}"[:2000]
+                if not is_retryable_error(error) or plan.attempts >= self.max_attempts:
+                    values = {"status": "failed", "last_error": error_text, "processed_at": now}
+                    stats["failed"] += len(plan.row_ids)
+                    logger.error(
+                        f"Chatwoot outbox: giving up on conversation {plan.conversation_id} "
+                        f"after {plan.attempts} attempts: {error_text}"
+                    )
+                else:
+                    delay = compute_backoff(plan.attempts, cap=600.0)
+                    values = {"last_error": error_text, "next_attempt_at": now + timedelta(seconds=delay)}
+                    stats["retried"] += len(plan.row_ids)
+                    logger.warning(
+                        f"Chatwoot outbox: conversation {plan.conversation_id} failed "
+                        f"(attempt {plan.attempts}), retry in {delay:.1f}s: {error_text}"
+                    )
+                await db.execute(
+                    update(ChatwootOutbox)
+                    .where(ChatwootOutbox.id.in_(plan.row_ids))
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+
+            if delivered_ids:
+                await db.execute(
+                    update(ChatwootOutbox)
+                    .where(ChatwootOutbox.id.in_(delivered_ids))
+                    .values(status="done", processed_at=now, last_error=None)
+                    .execution_options(synchronize_session=False)
+                )
+            await db.commit()
+        return stats
+
+    async def run_once(self) -> Dict[str, int]:
+        """Один проход: claim → схлопывание → доставка с ограниченной параллельностью → фиксация"""
+        rows = await self.claim()
+        stats = {"events": len(rows), "conversations": 0, "delivered": 0, "retried": 0, "failed": 0}
+        if not rows:
+            return stats
+
+        plans = coalesce_events(rows)
+        stats["conversations"] = len(plans)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(plan: ConversationPlan):
+            async with semaphore:
+                try:
+                    await self.deliver(plan)
+                    return plan, None
+                except Exception as error:
+                    return plan, error
+
+        results = await asyncio.gather(*(run(plan) for plan in plans))
+        stats.update(await self._finish(results))
+        return stats
+
+    async def drain(self, max_batches: int = 10) -> Dict[str, int]:
+        """Несколько проходов подряд, пока outbox отдает полные пачки conversations"""
+        total: Dict[str, int] = {}
+        for _ in range(max_batches):
+            stats = await self.run_once()
+            for key, value in stats.items():
+                total[key] = total.get(key, 0) + value
+            if stats["conversations"] < self.batch_size:
+                break
+        return total
@@ -0,0 +1,236 @@
+"""
+Pub/sub обновлений консультаций для SSE (/api/consultations/{cons_id}/stream).
+
+Раньше каждый SSE клиент держал сессию БД все время соединения и каждые 3 секунды
+перечитывал консультацию. Теперь:
+- любое изменение Consultation через ORM (API, вебхуки, ETL) публикует cons_id в канал
+  CONSULTATION_UPDATES_CHANNEL через pg_notify в той же транзакции (after_flush) —
+  PostgreSQL доставляет уведомление только после commit; batch upsert ETL публикует
+  явно (publish_consultation_updates);
+- в каждом воркере одно asyncpg соединение слушает канал (utils.pg_listen);
+- ConsultationEventHub загружает консультации, на которые есть подписчики, одним
+  коротким запросом и раскладывает обновление по очередям подписчиков.
+
+Подписчик без событий соединение с БД не держит. Если LISTEN недоступен (hub.connected
+= False), SSE поток сам проверяет консультацию раз в heartbeat.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+
+from ..models import Consultation, User
+
+logger = logging.getLogger(__name__)
+
+CONSULTATION_UPDATES_CHANNEL = "consultation_updates"
+# Лимит payload NOTIFY — 8000 байт; ID консультаций режем на части с запасом
+NOTIFY_PAYLOAD_LIMIT = 7900
+# Пауза для склейки пачки уведомлений (ETL публикует страницу консультаций за раз)
+DISPATCH_COALESCE_SECONDS = 0.05
+
+
+def _notify_payloads(cons_ids: Iterable[str]) -> List[str]:
+    payloads: List[str] = []
+    current: List[str] = []
+    size = 0
+    for cons_id in dict.fromkeys(c for c in cons_ids if c):
+        if current and size + len(cons_id.encode()) + 1 > NOTIFY_PAYLOAD_LIMIT:
+            payloads.append(",".join(current))
+            current, size = [], 0
+        current.append(cons_id)
+        size += len(cons_id.encode()) + 1
+    if current:
+        payloads.append(",".join(current))
+    return payloads
+
+
+def updated_at_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+_NOTIFY_SQL = text("SELECT pg_notify(:channel, :payload)")
+_publishing_installed = False
+
+
+def publishing_enabled() -> bool:
+    return _publishing_installed
+
+
+async def publish_consultation_updates(db, cons_ids: Iterable[str]):
+    """
+    Публикует обновления консультаций, измененных в обход ORM (Core INSERT/UPDATE).
+
+    ВАЖНО: уведомление уходит при commit сессии db.
+    """
+    if not _publishing_installed:
+        return
+    for payload in _notify_payloads(cons_ids):
+        await db.execute(_NOTIFY_SQL, {"channel": CONSULTATION_UPDATES_CHANNEL, "payload": payload})
+
+
+def _after_flush(session: Session, flush_context):
+    cons_ids = [
+        obj.cons_id for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        if isinstance(obj, Consultation) and (obj not in session.dirty or session.is_modified(obj))
+    ]
+    if not cons_ids:
+        return
+    connection = session.connection()
+    for payload in _notify_payloads(cons_ids):
+        connection.execute(_NOTIFY_SQL, {"channel": CONSULTATION_UPDATES_CHANNEL, "payload": payload})
+
+
+def install_consultation_publishing():
+    """Включает публикацию изменений Consultation из всех ORM сессий процесса"""
+    global _publishing_installed
+    if _publishing_installed:
+        return
+    event.listen(Session, "after_flush", _after_flush)
+    _publishing_installed = True
+
+
+async def load_consultation_updates(db, cons_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Сообщения об обновлении консультаций (формат SSE потока) двумя запросами:
+    консультации и имена их менеджеров (display_name > description).
+    """
+    from ..schemas.tickets import ConsultationRead
+
+    cons_ids = list(cons_ids)
+    if not cons_ids:
+        return {}
+    consultations = (await db.execute(
+        select(Consultation).where(Consultation.cons_id.in_(cons_ids))
+    )).scalars().all()
+    manager_keys = {c.manager for c in consultations if c.manager}
+    names: Dict[str, Optional[str]] = {}
+    if manager_keys:
+        rows = (await db.execute(
+            select(User.cl_ref_key, User.display_name, User.description)
+            .where(User.cl_ref_key.in_(manager_keys))
+            .where(User.deletion_mark == False)
+        )).all()
+        for key, display_name, description in rows:
+            names.setdefault(key, display_name or description)
+
+    messages = {}
+    for consultation in consultations:
+        updated_at = updated_at_utc(consultation.updated_at)
+        messages[consultation.cons_id] = {
+            "has_updates": True,
+            "consultation": ConsultationRead.from_model(consultation, manager_name=names.get(consultation.manager)).dict(),
+            "updated_at": updated_at.isoformat() if updated_at else None,
+        }
+    return messages
+
+
+class ConsultationEventHub:
+    """Подписки процесса на обновления консультаций (одна очередь на подписчика)"""
+
+    def __init__(self, queue_size: int = 8):
+        self.queue_size = queue_size
+        self.connected = False
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._pending: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._listener_task: Optional[asyncio.Task] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self, cons_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(cons_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, cons_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(cons_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[cons_id]
+
+    def deliver(self, cons_id: str, message: Dict[str, Any]):
+        """Кладет сообщение во все очереди подписчиков; у отстающих вытесняется самое старое"""
+        for queue in list(self._subscribers.get(cons_id, ())):
+            if queue.full():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(message)
+
+    def handle_notification(self, payload: str):
+        """Обработчик NOTIFY: ID без локальных подписчиков отбрасываются сразу"""
+        cons_ids = {c for c in (payload or "").split(",") if c and c in self._subscribers}
+        if not cons_ids:
+            return
+        self._pending |= cons_ids
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        # ID, пришедшие во время загрузки, ждут в _pending — задача еще не завершена,
+        # поэтому handle_notification новую не создает: догружаем их здесь же
+        while self._pending:
+            await asyncio.sleep(DISPATCH_COALESCE_SECONDS)
+            cons_ids, self._pending = self._pending, set()
+            cons_ids = [c for c in cons_ids if c in self._subscribers]
+            if cons_ids:
+                await self._load_and_deliver(cons_ids)
+
+    async def _load_and_deliver(self, cons_ids: List[str]):
+        from ..database import AsyncSessionLocal
+
+        try:
+            async with AsyncSessionLocal() as db:
+                messages = await load_consultation_updates(db, cons_ids)
+        except Exception as e:
+            logger.warning(f"Failed to load consultation updates for {len(cons_ids)} subscriptions: {e}")
+            return
+        for cons_id, message in messages.items():
+            self.deliver(cons_id, message)
+
+    def _set_connected(self, connected: bool):
+        self.connected = connected
+
+    def start(self):
+        from ..utils.pg_listen import listen_forever
+
+        if self._listener_task is None:
+            self._listener_task = asyncio.create_task(
+                listen_forever(CONSULTATION_UPDATES_CHANNEL, self.handle_notification, self._set_connected)
+            )
+
+    async def stop(self):
+        for task in (self._listener_task, self._flush_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._listener_task = None
+        self._flush_task = None
+        self.connected = False
+
+
+consultation_event_hub = ConsultationEventHub()
+
+
+async def start_consultation_events():
+    """Публикация изменений и LISTEN обновлений в процессе API (main.lifespan)"""
+    install_consultation_publishing()
+    consultation_event_hub.start()
+
+
+async def stop_consultation_events():
+    await consultation_event_hub.stop()
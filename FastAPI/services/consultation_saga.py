@@ -0,0 +1,577 @@
+"""
+Асинхронное создание консультации: сага шагов Chatwoot / 1C:ЦЛ (sys.consultation_create_sagas).
+
+POST /api/consultations/create с заголовком Prefer: respond-async (и включенным
+воркером, CONSULTATION_SAGA_POLL_SECONDS > 0) сохраняет клиента, консультацию и
+выбранного менеджера, записывает сагу в той же транзакции и отвечает 202 со ссылкой
+на статус (GET /api/consultations/create/{saga_id}). Остальное выполняет
+ConsultationSagaWorker:
+
+1. chatwoot_contact      — найти или создать контакт (source_id, pubsub_token → клиент);
+2. chatwoot_conversation — создать беседу, назначить команду/агента, labels;
+3. bind_conversation     — перевести консультацию на ID беседы (cons_id = ID Chatwoot);
+4. onec_consultation     — создать документ в 1C:ЦЛ (только "Консультация по ведению учёта");
+5. chatwoot_info_message — информационное сообщение бота с номером заявки;
+6. telegram_notify       — сообщение пользователю Telegram.
+
+Каждый шаг выполняется в своей транзакции: изменения шага и контрольная точка
+(steps / context) фиксируются одним commit, повтор саги продолжает с первого
+незавершенного шага. Ошибка шага откладывает сагу с backoff; после
+CONSULTATION_SAGA_MAX_ATTEMPTS (или 4xx, который не исправится повтором) шаг
+помечается failed, а сага идет дальше — как и синхронный режим, консультация
+остается в БД без внешней системы. Шаг, который не может завершиться по
+бизнес-причине (SagaAbort — например, лимит консультаций в ЦЛ), запускает
+компенсацию: выполненные шаги откатываются в обратном порядке (беседа Chatwoot
+закрывается через outbox), консультация отменяется, сага — compensated.
+
+ВАЖНО: беседа в Chatwoot и документ в ЦЛ создаются не идемпотентно (шаги с
+idempotent=False). Перед внешним вызовом такой шаг фиксирует контрольную точку
+in_flight отдельным commit; результат (ID беседы, Ref_Key документа) фиксируется
+вместе с завершением шага. Повторяется такой шаг только после ошибки, при которой
+запрос заведомо не выполнен (нет соединения, 408/425/429/503). Неоднозначная ошибка
+(таймаут ответа, разрыв соединения, ошибка разбора ответа) или найденная при повторе
+точка in_flight (воркер упал между запросом и commit) — шаг failed без повтора:
+объект мог быть создан, и повтор создал бы дубль. Перенос консультации на ID беседы
+выполняет следующий (чисто БД) шаг.
+"""
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models import Client, Consultation, ConsultationCreateSaga
+from .chatwoot_outbox import EVENT_STATUS, enqueue_chatwoot_event, is_retryable_error
+from .odata_client import compute_backoff
+
+logger = logging.getLogger(__name__)
+
+SAGA_PENDING = "pending"
+SAGA_DONE = "done"
+SAGA_COMPENSATED = "compensated"
+
+STEP_DONE = "done"
+STEP_SKIPPED = "skipped"
+STEP_FAILED = "failed"
+STEP_IN_FLIGHT = "in_flight"  # внешний вызов неидемпотентного шага начат, результат не зафиксирован
+
+# Ответы, при которых сервер запрос не выполнил — неидемпотентный шаг можно повторить
+NOT_PROCESSED_STATUS_CODES = {408, 425, 429, 503}
+
+# Заголовок запроса (RFC 7240), включающий асинхронный режим
+PREFER_RESPOND_ASYNC = "respond-async"
+
+# На сколько сага "арендуется" воркером; если он упал, сага снова станет доступна
+LEASE_SECONDS = 300
+
+_CLAIM_SQL = text("""
+    WITH due AS (
+        SELECT id FROM sys.consultation_create_sagas
+        WHERE status = 'pending' AND next_attempt_at <= now()
+        ORDER BY next_attempt_at
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE sys.consultation_create_sagas AS s
+    SET attempts = s.attempts + 1,
+        next_attempt_at = now() + make_interval(secs => :lease_seconds)
+    FROM due
+    WHERE s.id = due.id
+    RETURNING s.id
+""")
+
+
+class SagaAbort(Exception):
+    """Шаг не может завершиться по бизнес-причине — выполнить компенсацию"""
+
+
+class SagaStepSkipped(Exception):
+    """Шаг не нужен для этой консультации (или нет результата предыдущего шага)"""
+
+
+def request_not_processed(error: BaseException) -> bool:
+    """Запрос заведомо не выполнен сервером: соединение не установлено или отказ до обработки"""
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in NOT_PROCESSED_STATUS_CODES
+    return False
+
+
+def prefers_respond_async(prefer: Optional[str]) -> bool:
+    """Prefer: respond-async и работающий воркер саг"""
+    if not prefer or settings.CONSULTATION_SAGA_POLL_SECONDS <= 0:
+        return False
+    tokens = (part.split(";", 1)[0].strip().lower() for part in prefer.split(","))
+    return PREFER_RESPOND_ASYNC in tokens
+
+
+def start_consultation_saga(db: AsyncSession, consultation: Consultation, context: Dict[str, Any]) -> ConsultationCreateSaga:
+    """
+    Добавляет сагу создания консультации в текущей транзакции.
+
+    ВАЖНО: commit делает вызывающий код; после commit воркер этого процесса
+    будится сразу, не дожидаясь очередного опроса.
+    """
+    saga = ConsultationCreateSaga(
+        id=uuid.uuid4(),
+        cons_id=consultation.cons_id,
+        client_id=consultation.client_id,
+        status=SAGA_PENDING,
+        steps={},
+        context=context,
+    )
+    db.add(saga)
+    event.listen(db.sync_session, "after_commit", lambda session: consultation_saga_worker.wake(), once=True)
+    return saga
+
+
+class SagaRun:
+    """Состояние саги на время одного шага: сессия, строка саги, контекст и клиенты API"""
+
+    def __init__(self, db: AsyncSession, saga: ConsultationCreateSaga, chatwoot, onec):
+        self.db = db
+        self.saga = saga
+        self.context: Dict[str, Any] = dict(saga.context or {})
+        self.chatwoot = chatwoot
+        self.onec = onec
+        self._consultation: Optional[Consultation] = None
+
+    async def consultation(self) -> Consultation:
+        if self._consultation is None:
+            self._consultation = await self.db.get(Consultation, self.saga.cons_id)
+            if self._consultation is None:
+                raise SagaAbort(f"Consultation {self.saga.cons_id} not found")
+        return self._consultation
+
+    async def client(self) -> Client:
+        return await self.db.get(Client, uuid.UUID(self.context["client_id"]))
+
+    async def owner_client(self) -> Client:
+        return await self.db.get(Client, uuid.UUID(self.context["owner"]["client_id"]))
+
+    def payload(self):
+        from ..schemas.tickets import ConsultationWithClient
+        return ConsultationWithClient(**self.context["payload"])
+
+    @property
+    def conversation_id(self) -> Optional[str]:
+        """ID беседы, на который уже переведена консультация"""
+        conversation_id = self.context.get("conversation_id")
+        return conversation_id if conversation_id and conversation_id == self.saga.cons_id else None
+
+
+@dataclass
+class SagaStep:
+    name: str
+    action: Callable[[SagaRun], Awaitable[Optional[Dict[str, Any]]]]
+    compensate: Optional[Callable[[SagaRun, str], Awaitable[None]]] = None
+    # False — шаг создает объект во внешней системе, повтор после неясной ошибки создаст дубль
+    idempotent: bool = True
+
+
+async def _chatwoot_contact(run: SagaRun) -> Dict[str, Any]:
+    from ..routers.consultations import _resolve_chatwoot_contact
+
+    contact_id, contact_source_id, _ = await _resolve_chatwoot_contact(
+        run.db, run.chatwoot, await run.client(), await run.owner_client()
+    )
+    if not contact_source_id:
+        # Ошибки Chatwoot _resolve_chatwoot_contact только логирует — повторяем шаг
+        raise RuntimeError("Chatwoot contact source_id is not resolved")
+    return {"contact_id": contact_id, "contact_source_id": contact_source_id}
+
+
+async def _chatwoot_conversation(run: SagaRun) -> Dict[str, Any]:
+    from ..routers.consultations import (
+        _build_conversation_custom_attrs,
+        _find_chatwoot_team,
+        _open_chatwoot_conversation,
+    )
+
+    if not run.context.get("contact_source_id"):
+        raise SagaStepSkipped("no Chatwoot contact")
+    payload = run.payload()
+    custom_attrs = await _build_conversation_custom_attrs(
+        run.db, await run.owner_client(), payload, await run.consultation()
+    )
+    conversation_id, chatwoot_source_id = await _open_chatwoot_conversation(
+        run.db,
+        run.chatwoot,
+        payload,
+        consultation_type=payload.consultation.consultation_type,
+        source=run.context["source"],
+        selected_manager_key=run.context.get("selected_manager_key"),
+        contact_id=run.context.get("contact_id"),
+        contact_source_id=run.context["contact_source_id"],
+        custom_attrs=custom_attrs,
+        team_id=await _find_chatwoot_team(run.chatwoot, payload.consultation.consultation_type),
+    )
+    return {"conversation_id": conversation_id, "chatwoot_source_id": chatwoot_source_id}
+
+
+async def _close_conversation(run: SagaRun, reason: str) -> None:
+    conversation_id = run.context.get("conversation_id")
+    if conversation_id:
+        enqueue_chatwoot_event(run.db, conversation_id, EVENT_STATUS, {"status": "resolved", "message": reason})
+
+
+async def _bind_conversation(run: SagaRun) -> Dict[str, Any]:
+    conversation_id = run.context.get("conversation_id")
+    if not conversation_id:
+        raise SagaStepSkipped("no Chatwoot conversation")
+    consultation = await run.consultation()
+    existing = await run.db.get(Consultation, conversation_id)
+    if existing is not None and existing is not consultation:
+        raise SagaAbort(f"Consultation with cons_id={conversation_id} already exists")
+
+    # cons_id = ID беседы Chatwoot, как и при синхронном создании
+    consultation.cons_id = conversation_id
+    consultation.chatwoot_source_id = run.context.get("chatwoot_source_id") or run.context.get("contact_source_id")
+    run.saga.cons_id = conversation_id
+    await run.db.flush()
+    return {"previous_cons_id": run.context.get("accepted_cons_id")}
+
+
+async def _onec_consultation(run: SagaRun) -> Dict[str, Any]:
+    from ..routers.consultations import OwnerSnapshot, _create_onec_consultation
+    from .onec_client import ConsultationLimitExceeded
+
+    payload = run.payload()
+    consultation_type = payload.consultation.consultation_type
+    if consultation_type != "Консультация по ведению учёта":
+        raise SagaStepSkipped("consultation_type does not require CL sync")
+    if not run.context.get("client_key"):
+        raise SagaStepSkipped("owner client is not synced with 1C")
+
+    consultation = await run.consultation()
+    try:
+        await _create_onec_consultation(
+            run.db,
+            run.onec,
+            consultation,
+            payload,
+            client_key=run.context["client_key"],
+            owner=OwnerSnapshot(**run.context["owner"]),
+            consultation_type=consultation_type,
+            selected_manager_key=run.context.get("selected_manager_key"),
+            contact_hint=run.context.get("contact_hint"),
+        )
+    except ConsultationLimitExceeded as e:
+        raise SagaAbort(str(e)) from e
+    return {"cl_ref_key": consultation.cl_ref_key, "number": consultation.number}
+
+
+async def _chatwoot_info_message(run: SagaRun) -> None:
+    from ..routers.consultations import _send_chatwoot_info_message
+
+    if not run.conversation_id:
+        raise SagaStepSkipped("no Chatwoot conversation")
+    await _send_chatwoot_info_message(run.chatwoot, await run.consultation(), run.conversation_id)
+
+
+async def _telegram_notify(run: SagaRun) -> None:
+    from ..routers.consultations import _notify_telegram_consultation_created
+
+    telegram_user_id = run.context.get("telegram_user_id")
+    if run.context.get("source") != "TELEGRAM" or not telegram_user_id or not run.conversation_id:
+        raise SagaStepSkipped("not a Telegram consultation")
+    await _notify_telegram_consultation_created(telegram_user_id, await run.consultation())
+
+
+CONSULTATION_SAGA_STEPS: List[SagaStep] = [
+    SagaStep("chatwoot_contact", _chatwoot_contact),
+    SagaStep("chatwoot_conversation", _chatwoot_conversation, compensate=_close_conversation, idempotent=False),
+    SagaStep("bind_conversation", _bind_conversation),
+    SagaStep("onec_consultation", _onec_consultation, idempotent=False),
+    SagaStep("chatwoot_info_message", _chatwoot_info_message),
+    SagaStep("telegram_notify", _telegram_notify),
+]
+
+
+async def build_saga_result(run: SagaRun) -> Dict[str, Any]:
+    """Итоговый ConsultationResponse — тот же ответ, что и у синхронного режима"""
+    from ..routers.consultations import _get_manager_name, _get_telegram_bot_username
+    from ..schemas.tickets import ConsultationRead, ConsultationResponse
+
+    consultation = await run.consultation()
+    client = await run.client()
+    steps = run.saga.steps or {}
+    created_in = [
+        system for system, step in (("Chatwoot", "bind_conversation"), ("1C:ЦЛ", "onec_consultation"))
+        if (steps.get(step) or {}).get("status") == STEP_DONE
+    ]
+    pubsub_token = client.chatwoot_pubsub_token if client else None
+    if isinstance(pubsub_token, bytes):
+        pubsub_token = pubsub_token.decode("utf-8")
+
+    bot_username = None
+    telegram_user_id = run.context.get("telegram_user_id")
+    if run.context.get("source") == "TELEGRAM" and telegram_user_id:
+        bot_username = await _get_telegram_bot_username()
+
+    response = ConsultationResponse(
+        consultation=ConsultationRead.from_model(
+            consultation, manager_name=await _get_manager_name(run.db, consultation.manager)
+        ),
+        client_id=run.context["client_id"],
+        message=f"Consultation created successfully in: {', '.join(created_in) if created_in else 'database only'}",
+        source=run.context.get("source"),
+        telegram_user_id=telegram_user_id,
+        bot_username=bot_username,
+        chatwoot_conversation_id=run.conversation_id,
+        chatwoot_source_id=consultation.chatwoot_source_id,
+        chatwoot_account_id=str(settings.CHATWOOT_ACCOUNT_ID) if settings.CHATWOOT_ACCOUNT_ID else None,
+        chatwoot_inbox_id=settings.CHATWOOT_INBOX_ID or None,
+        chatwoot_pubsub_token=str(pubsub_token) if pubsub_token else None,
+    )
+    return response.model_dump(mode="json")
+
+
+class ConsultationSagaDispatcher:
+    """Выполнение саг sys.consultation_create_sagas"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        chatwoot_client=None,
+        onec_client=None,
+        steps: Optional[List[SagaStep]] = None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        result_builder=build_saga_result,
+    ):
+        if session_factory is None:
+            from ..database import AsyncSessionLocal
+            session_factory = AsyncSessionLocal
+        self.session_factory = session_factory
+        self._chatwoot = chatwoot_client
+        self._onec = onec_client
+        self.steps = steps if steps is not None else CONSULTATION_SAGA_STEPS
+        self.batch_size = batch_size or settings.CONSULTATION_SAGA_BATCH_SIZE
+        self.concurrency = max(1, concurrency or settings.CONSULTATION_SAGA_CONCURRENCY)
+        self.max_attempts = max_attempts or settings.CONSULTATION_SAGA_MAX_ATTEMPTS
+        self.result_builder = result_builder
+
+    @property
+    def chatwoot(self):
+        if self._chatwoot is None:
+            from .chatwoot_client import ChatwootClient
+            self._chatwoot = ChatwootClient()
+        return self._chatwoot
+
+    @property
+    def onec(self):
+        if self._onec is None:
+            from .onec_client import OneCClient
+            self._onec = OneCClient()
+        return self._onec
+
+    async def claim(self) -> List[uuid.UUID]:
+        async with self.session_factory() as db:
+            result = await db.execute(_CLAIM_SQL, {"limit": self.batch_size, "lease_seconds": LEASE_SECONDS})
+            saga_ids = list(result.scalars().all())
+            await db.commit()
+        return saga_ids
+
+    @staticmethod
+    def _checkpoint(saga: ConsultationCreateSaga, run: SagaRun, name: str, **values):
+        steps = dict(saga.steps or {})
+        steps[name] = {**(steps.get(name) or {}), **values, "at": datetime.now(timezone.utc).isoformat()}
+        saga.steps = steps
+        saga.context = run.context
+
+    async def _run_step(self, saga_id: uuid.UUID, step: SagaStep) -> Optional[str]:
+        """Один шаг в своей транзакции; None — идти дальше, иначе статус, с которым сага остановлена"""
+        async with self.session_factory() as db:
+            saga = await db.get(ConsultationCreateSaga, saga_id)
+            if saga is None or saga.status != SAGA_PENDING:
+                return saga.status if saga is not None else SAGA_DONE
+            state = (saga.steps or {}).get(step.name) or {}
+            if state.get("status") in (STEP_DONE, STEP_SKIPPED, STEP_FAILED):
+                return None
+
+            run = SagaRun(db, saga, self.chatwoot, self.onec)
+            if not step.idempotent:
+                if state.get("status") == STEP_IN_FLIGHT:
+                    # Прошлая попытка отправила запрос, но не зафиксировала результат
+                    error_text = "outcome of the previous attempt is unknown, not repeated"
+                    self._checkpoint(saga, run, step.name, status=STEP_FAILED, error=error_text)
+                    saga.last_error = f"{step.name}: {error_text}"
+                    await db.commit()
+                    logger.error(f"Consultation saga {saga_id}: step {step.name} {error_text}")
+                    return None
+                self._checkpoint(saga, run, step.name, status=STEP_IN_FLIGHT)
+                await db.commit()
+            try:
+                outputs = await step.action(run)
+                run.context.update(outputs or {})
+                self._checkpoint(saga, run, step.name, status=STEP_DONE, error=None)
+                await db.commit()
+                return None
+            except SagaStepSkipped as skipped:
+                self._checkpoint(saga, run, step.name, status=STEP_SKIPPED, error=str(skipped))
+                await db.commit()
+                return None
+            except SagaAbort as abort:
+                await db.rollback()
+                await self.compensate(saga_id, step.name, str(abort))
+                return SAGA_COMPENSATED
+            except Exception as error:
+                await db.rollback()
+                return await self._step_failed(saga_id, step, error)
+
+    async def _step_failed(self, saga_id: uuid.UUID, step: SagaStep, error: BaseException) -> Optional[str]:
+        """Отложить сагу с backoff или пометить шаг failed и идти дальше"""
+        step_name = step.name
+        error_text = f"{type(error).__name__}: {error}"[:2000]
+        # Неидемпотентный шаг повторяется, только если запрос заведомо не выполнен
+        retryable = is_retryable_error(error) if step.idempotent else request_not_processed(error)
+        async with self.session_factory() as db:
+            saga = await db.get(ConsultationCreateSaga, saga_id)
+            run = SagaRun(db, saga, self.chatwoot, self.onec)
+            attempts = ((saga.steps or {}).get(step_name) or {}).get("attempts", 0) + 1
+            saga.last_error = f"{step_name}: {error_text}"
+            if not retryable or attempts >= self.max_attempts:
+                self._checkpoint(saga, run, step_name, status=STEP_FAILED, attempts=attempts, error=error_text)
+                logger.error(f"Consultation saga {saga_id}: step {step_name} failed after {attempts} attempts: {error_text}")
+                outcome = None
+            else:
+                delay = compute_backoff(attempts, cap=300.0)
+                self._checkpoint(saga, run, step_name, status=SAGA_PENDING, attempts=attempts, error=error_text)
+                saga.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+                logger.warning(
+                    f"Consultation saga {saga_id}: step {step_name} failed "
+                    f"(attempt {attempts}), retry in {delay:.1f}s: {error_text}"
+                )
+                outcome = SAGA_PENDING
+            await db.commit()
+        return outcome
+
+    async def compensate(self, saga_id: uuid.UUID, failed_step: str, reason: str):
+        """Откат выполненных шагов в обратном порядке и отмена консультации — одной транзакцией"""
+        async with self.session_factory() as db:
+            saga = await db.get(ConsultationCreateSaga, saga_id)
+            run = SagaRun(db, saga, self.chatwoot, self.onec)
+            done = {name for name, state in (saga.steps or {}).items() if (state or {}).get("status") == STEP_DONE}
+            for step in reversed(self.steps):
+                if step.name in done and step.compensate is not None:
+                    await step.compensate(run, reason)
+
+            consultation = await db.get(Consultation, saga.cons_id)
+            if consultation is not None:
+                consultation.status = "cancelled"
+            self._checkpoint(saga, run, failed_step, status=STEP_FAILED, error=reason)
+            saga.status = SAGA_COMPENSATED
+            saga.last_error = f"{failed_step}: {reason}"
+            saga.completed_at = datetime.now(timezone.utc)
+            await db.commit()
+        logger.warning(f"Consultation saga {saga_id} compensated at step {failed_step}: {reason}")
+
+    async def _complete(self, saga_id: uuid.UUID):
+        async with self.session_factory() as db:
+            saga = await db.get(ConsultationCreateSaga, saga_id)
+            run = SagaRun(db, saga, self.chatwoot, self.onec)
+            saga.result = await self.result_builder(run)
+            saga.status = SAGA_DONE
+            saga.completed_at = datetime.now(timezone.utc)
+            await db.commit()
+
+    async def run_saga(self, saga_id: uuid.UUID) -> str:
+        """Шаги саги по порядку, начиная с первого незавершенного"""
+        for step in self.steps:
+            stopped = await self._run_step(saga_id, step)
+            if stopped is not None:
+                return stopped
+        await self._complete(saga_id)
+        return SAGA_DONE
+
+    async def run_once(self) -> Dict[str, int]:
+        """Один проход: claim → саги с ограниченной параллельностью"""
+        saga_ids = await self.claim()
+        stats = {"sagas": len(saga_ids), SAGA_DONE: 0, SAGA_PENDING: 0, SAGA_COMPENSATED: 0, "errors": 0}
+        if not saga_ids:
+            return stats
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(saga_id: uuid.UUID):
+            async with semaphore:
+                try:
+                    return await self.run_saga(saga_id)
+                except Exception as e:
+                    # Сага вернется к воркеру после истечения аренды
+                    logger.error(f"Consultation saga {saga_id} error: {e}", exc_info=True)
+                    return "errors"
+
+        for outcome in await asyncio.gather(*(run(saga_id) for saga_id in saga_ids)):
+            stats[outcome] += 1
+        return stats
+
+
+class ConsultationSagaWorker:
+    """Фоновый цикл процесса API: проход по сагам при wake() или раз в poll_seconds"""
+
+    def __init__(self, dispatcher_factory=ConsultationSagaDispatcher, poll_seconds: Optional[float] = None):
+        self.dispatcher_factory = dispatcher_factory
+        self.poll_seconds = poll_seconds if poll_seconds is not None else settings.CONSULTATION_SAGA_POLL_SECONDS
+        self._dispatcher: Optional[ConsultationSagaDispatcher] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                stats = await self._dispatcher.run_once()
+                if stats["sagas"]:
+                    logger.info(
+                        f"Consultation sagas: {stats['sagas']} claimed, done={stats[SAGA_DONE]}, "
+                        f"pending={stats[SAGA_PENDING]}, compensated={stats[SAGA_COMPENSATED]}, errors={stats['errors']}"
+                    )
+                    if stats["sagas"] >= self._dispatcher.batch_size:
+                        continue
+            except Exception as e:
+                logger.error(f"Consultation saga worker error: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None and self.poll_seconds > 0:
+            self._dispatcher = self.dispatcher_factory()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._wakeup = None
+
+
+consultation_saga_worker = ConsultationSagaWorker()
+
+
+async def start_consultation_saga_worker():
+    consultation_saga_worker.start()
+
+
+async def stop_consultation_saga_worker():
+    await consultation_saga_worker.stop()
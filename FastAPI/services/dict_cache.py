@@ -0,0 +1,125 @@
+"""
+Кэш ответов /api/dicts с версионированием и ETag.
+
+Справочники меняет только load_dicts: upsert_rows увеличивает версию в
+sys.cache_versions (name='dicts') в той же транзакции, что и данные. Каждый воркер
+сверяет свою версию с БД не чаще раза в DICT_VERSION_CHECK_SECONDS и при изменении
+сбрасывает кэш целиком — новые данные видны всем воркерам через секунды, а не через
+30 минут TTL.
+
+Записи кэша — готовые байты JSON и сильный ETag (хэш содержимого), поэтому повторный
+запрос отдается без сериализации, а запрос с If-None-Match — ответом 304 без тела.
+Размер кэша ограничен (LRU, DICT_CACHE_MAX_ENTRIES).
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+DICT_VERSION_NAME = "dicts"
+
+_BUMP_SQL = text("""
+    INSERT INTO sys.cache_versions (name, version, updated_at)
+    VALUES (:name, 1, now())
+    ON CONFLICT (name) DO UPDATE SET version = cache_versions.version + 1, updated_at = now()
+""")
+_VERSION_SQL = text("SELECT version FROM sys.cache_versions WHERE name = :name")
+
+
+class CachedBody(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверка If-None-Match (список ETag через запятую или *)"""
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+async def bump_dict_version(session) -> None:
+    """Увеличивает версию справочников (вызывается из load_dicts в транзакции загрузки)"""
+    await session.execute(_BUMP_SQL, {"name": DICT_VERSION_NAME})
+
+
+async def load_dict_version() -> int:
+    from ..database import engine
+
+    async with engine.connect() as conn:
+        version = (await conn.execute(_VERSION_SQL, {"name": DICT_VERSION_NAME})).scalar_one_or_none()
+    return version or 0
+
+
+class DictCache:
+    """LRU готовых ответов справочников, действительный для одной версии данных"""
+
+    def __init__(
+        self,
+        max_entries: int,
+        check_seconds: float,
+        version_loader: Callable[[], Awaitable[int]] = load_dict_version,
+    ):
+        self.max_entries = max_entries
+        self.check_seconds = check_seconds
+        self.version_loader = version_loader
+        self.version: Optional[int] = None
+        self._checked_at = 0.0
+        self._entries: "OrderedDict[str, CachedBody]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def ensure_version(self):
+        """Сверяет версию с БД не чаще check_seconds; при изменении сбрасывает кэш"""
+        if time.monotonic() - self._checked_at < self.check_seconds:
+            return
+        async with self._lock:
+            if time.monotonic() - self._checked_at < self.check_seconds:
+                return
+            try:
+                version = await self.version_loader()
+            except Exception as e:
+                # Нет связи с БД или таблицы версий - не кэшируем дольше интервала проверки
+                logger.warning(f"Failed to load dictionaries version: {e}")
+                version = None
+            if version is None or version != self.version:
+                self._entries.clear()
+            self.version = version
+            self._checked_at = time.monotonic()
+
+    def get(self, key: str) -> Optional[CachedBody]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, body: bytes) -> CachedBody:
+        entry = CachedBody(body, make_etag(body))
+        if self.max_entries > 0:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+        self._checked_at = 0.0
+
+
+dict_cache = DictCache(settings.DICT_CACHE_MAX_ENTRIES, settings.DICT_VERSION_CHECK_SECONDS)
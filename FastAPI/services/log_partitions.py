@@ -0,0 +1,166 @@
+"""
+Помесячные партиции журналов log.consultation_change_log и log.webhook_log.
+
+Обе таблицы партиционированы по RANGE (created_at): запись идет в небольшую партицию
+текущего месяца, а срок хранения (LOG_RETENTION_DAYS) выполняется удалением целых
+партиций — DROP TABLE вместо DELETE миллионов строк, без раздувания таблиц и VACUUM.
+
+maintain_log_partitions (при init_db и периодически из планировщика):
+- создает партиции текущего и LOG_PARTITION_PREMAKE_MONTHS следующих месяцев;
+- удаляет партиции, верхняя граница которых старше срока хранения (в том числе
+  партицию *_legacy с данными до перевода таблицы на партиции);
+- для новых партиций log.webhook_log задает метод сжатия payload
+  (LOG_PAYLOAD_COMPRESSION, например lz4 — быстрее и компактнее pglz для JSONB).
+
+Запись в журналы идет пачками и вне пути запроса:
+- log.webhook_log — воркер sys.webhook_inbox копирует завершенные события одним
+  INSERT ... SELECT на проход (created_at — время приема, попадает в его партицию);
+- log.consultation_change_log — строки копятся в сессии и уходят одним многострочным
+  INSERT при flush/commit вызывающего кода (utils.change_log).
+
+ВАЖНО: партиции по умолчанию (DEFAULT) нет — партиции создаются заранее, а
+обслуживание запускается при каждом старте и раз в LOG_PARTITION_MAINTENANCE_HOURS.
+"""
+import logging
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+from dateutil import parser as date_parser
+from sqlalchemy import text
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Партиционированная таблица -> колонка с payload (для сжатия) или None
+PARTITIONED_LOG_TABLES: Dict[str, Optional[str]] = {
+    "log.consultation_change_log": None,
+    "log.webhook_log": "payload",
+}
+COMPRESSION_METHODS = ("pglz", "lz4")
+
+_PARTITIONS_SQL = text("""
+    SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = CAST(:parent AS regclass)
+""")
+_UPPER_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+
+class Partition(NamedTuple):
+    name: str
+    upper: Optional[datetime]  # None — MAXVALUE (не удаляется)
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table.split('.', 1)[1]}_p{month.year:04d}_{month.month:02d}"
+
+
+def parse_upper_bound(bound: str) -> Optional[datetime]:
+    """Верхняя граница из pg_get_expr(relpartbound): FOR VALUES FROM (...) TO ('...')"""
+    match = _UPPER_BOUND_RE.search(bound or "")
+    if not match:
+        return None
+    upper = date_parser.parse(match.group(1))
+    return upper if upper.tzinfo else upper.replace(tzinfo=timezone.utc)
+
+
+async def list_partitions(conn, table: str) -> List[Partition]:
+    rows = (await conn.execute(_PARTITIONS_SQL, {"parent": table})).all()
+    return [Partition(row.name, parse_upper_bound(row.bound)) for row in rows]
+
+
+async def ensure_partitions(
+    conn,
+    table: str,
+    months_ahead: int,
+    today: Optional[date] = None,
+    compression: Optional[str] = None,
+    payload_column: Optional[str] = None,
+) -> List[str]:
+    """Создает недостающие партиции с текущего месяца на months_ahead вперед"""
+    today = today or datetime.now(timezone.utc).date()
+    existing = await list_partitions(conn, table)
+    names = {partition.name for partition in existing}
+    # Не пересекаемся с уже покрытым диапазоном (например, с партицией *_legacy)
+    covered_until = max((p.upper for p in existing if p.upper is not None), default=None)
+    schema = table.split(".", 1)[0]
+
+    created = []
+    for offset in range(months_ahead + 1):
+        start = add_months(month_start(today), offset)
+        end = add_months(start, 1)
+        name = partition_name(table, start)
+        if name in names:
+            continue
+        if covered_until is not None and datetime(end.year, end.month, end.day, tzinfo=timezone.utc) <= covered_until:
+            continue
+        lower = start
+        if covered_until is not None and covered_until.date() > start:
+            lower = covered_until.date()
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {schema}.{name} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{lower.isoformat()} 00:00:00+00') TO ('{end.isoformat()} 00:00:00+00')"
+        ))
+        if compression and payload_column:
+            await conn.execute(text(
+                f"ALTER TABLE {schema}.{name} ALTER COLUMN {payload_column} SET COMPRESSION {compression}"
+            ))
+        created.append(name)
+    return created
+
+
+async def drop_expired_partitions(conn, table: str, retention_days: int, now: Optional[datetime] = None) -> List[str]:
+    """Удаляет партиции, все строки которых старше срока хранения"""
+    if retention_days <= 0:
+        return []
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=retention_days)
+    schema = table.split(".", 1)[0]
+    dropped = []
+    for partition in await list_partitions(conn, table):
+        if partition.upper is not None and partition.upper <= cutoff:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {schema}.{partition.name}"))
+            dropped.append(partition.name)
+    return dropped
+
+
+async def maintain_log_partitions(engine=None) -> Dict[str, Dict[str, List[str]]]:
+    """Создание будущих и удаление устаревших партиций всех журналов"""
+    if engine is None:
+        from ..database import engine
+    compression = (settings.LOG_PAYLOAD_COMPRESSION or "").strip().lower() or None
+    if compression and compression not in COMPRESSION_METHODS:
+        logger.warning(f"Unknown LOG_PAYLOAD_COMPRESSION '{compression}', using server default")
+        compression = None
+
+    report = {}
+    for table, payload_column in PARTITIONED_LOG_TABLES.items():
+        # Каждая таблица в своей транзакции: ошибка одной не мешает другой
+        try:
+            async with engine.begin() as conn:
+                created = await ensure_partitions(
+                    conn,
+                    table,
+                    settings.LOG_PARTITION_PREMAKE_MONTHS,
+                    compression=compression,
+                    payload_column=payload_column,
+                )
+                dropped = await drop_expired_partitions(conn, table, settings.LOG_RETENTION_DAYS)
+        except Exception as e:
+            logger.error(f"Log partition maintenance failed for {table}: {e}", exc_info=True)
+            continue
+        report[table] = {"created": created, "dropped": dropped}
+        if created or dropped:
+            logger.info(f"Log partitions of {table}: created={created}, dropped={dropped}")
+    return report
@@ -0,0 +1,359 @@
+"""
+In-memory индекс загрузки менеджеров.
+
+get_manager_queue_count, get_manager_current_load, /api/managers/load и дашборд
+Chatwoot считали COUNT(*) по cons.cons для каждого менеджера отдельно. Индекс хранит
+в памяти процесса:
+- очередь менеджера (консультации pending/open, denied = false);
+- назначения за последний час (create_date) — для равномерного распределения;
+- среднее время решения за RESOLUTION_DAYS дней (resolved/closed со start/end_date).
+
+Жизненный цикл:
+- строится при старте API (start_manager_load_index) тремя запросами;
+- обновляется инкрементально: ORM изменения Consultation (API, вебхуки, ETL через ORM)
+  собираются в after_flush и применяются после commit; batch upsert ETL передает
+  строки явно (stash_consultation_snapshots);
+- раз в MANAGER_LOAD_RECONCILE_SECONDS пересобирается из БД — это покрывает изменения
+  из других процессов (cons_scheduler, другие воркеры uvicorn) и Core UPDATE.
+
+Пока индекс не построен или давно не сверялся с БД (is_fresh), ManagerSelector
+считает по БД как раньше.
+"""
+import asyncio
+import logging
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..models import Consultation
+
+logger = logging.getLogger(__name__)
+
+QUEUE_STATUSES = ("pending", "open")
+RESOLVED_STATUSES = ("resolved", "closed")
+RECENT_WINDOW = timedelta(hours=1)
+RESOLUTION_DAYS = 30
+
+ConsultationLoadSnapshot = namedtuple(
+    "ConsultationLoadSnapshot",
+    "cons_id manager status denied create_date start_date end_date removed",
+    defaults=(None, None, None, False),
+)
+
+_PENDING_KEY = "manager_load_snapshots"
+_TRACKED_FIELDS = ("cons_id", "manager", "status", "denied", "create_date", "start_date", "end_date")
+
+
+def _aware(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class ManagerLoadIndex:
+    """Загрузка менеджеров в памяти процесса (см. описание модуля)"""
+
+    def __init__(self):
+        self.ready = False
+        self.refreshed_at: Optional[float] = None  # time.monotonic() последней сверки с БД
+        self._queue: Dict[str, str] = {}  # cons_id -> manager (консультации в очереди)
+        self._queue_counts: Dict[str, int] = {}
+        self._recent: Dict[str, Tuple[str, datetime]] = {}  # cons_id -> (manager, create_date)
+        self._resolved: Dict[str, Tuple[str, float, datetime]] = {}  # cons_id -> (manager, минуты, end_date)
+
+    # --- Чтение ---
+
+    def is_fresh(self, max_age: Optional[float] = None) -> bool:
+        """Индекс построен и сверялся с БД не дольше max_age секунд назад"""
+        if not self.ready or self.refreshed_at is None:
+            return False
+        if max_age is None:
+            max_age = max(1, settings.MANAGER_LOAD_RECONCILE_SECONDS) * 3
+        return time.monotonic() - self.refreshed_at <= max_age
+
+    def queue_count(self, manager_key: str) -> int:
+        return self._queue_counts.get(manager_key, 0)
+
+    def queue_counts(self, manager_keys: Iterable[str]) -> Dict[str, int]:
+        return {key: self._queue_counts.get(key, 0) for key in manager_keys}
+
+    def covers_recent_since(self, since: datetime, now: Optional[datetime] = None) -> bool:
+        now = now or datetime.now(timezone.utc)
+        return _aware(since) >= now - RECENT_WINDOW
+
+    def recent_assignment_counts(self, manager_keys: Iterable[str], since: datetime) -> Dict[str, int]:
+        since = _aware(since)
+        counts = {key: 0 for key in manager_keys}
+        for manager, create_date in self._recent.values():
+            if manager in counts and create_date >= since:
+                counts[manager] += 1
+        return counts
+
+    def avg_resolution(self, manager_keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Среднее время решения за RESOLUTION_DAYS (формат get_manager_avg_resolution)"""
+        border = datetime.now(timezone.utc) - timedelta(days=RESOLUTION_DAYS)
+        totals = {key: [0.0, 0] for key in manager_keys}
+        for manager, minutes, end_date in self._resolved.values():
+            if manager in totals and end_date >= border:
+                totals[manager][0] += minutes
+                totals[manager][1] += 1
+        return {
+            key: {
+                "avg_resolution_minutes": round(total / count, 1) if count and total else None,
+                "consultations_count": count,
+            }
+            for key, (total, count) in totals.items()
+        }
+
+    # --- Обновление ---
+
+    def observe(self, snapshot: ConsultationLoadSnapshot):
+        """
+        Применяет текущее состояние консультации (идемпотентно: повторное применение
+        того же состояния ничего не меняет).
+        """
+        cons_id = snapshot.cons_id
+        if not cons_id:
+            return
+        self._remove_from_queue(cons_id)
+        self._recent.pop(cons_id, None)
+        self._resolved.pop(cons_id, None)
+        if snapshot.removed or not snapshot.manager:
+            return
+
+        manager = snapshot.manager
+        if snapshot.status in QUEUE_STATUSES and not snapshot.denied:
+            self._queue[cons_id] = manager
+            self._queue_counts[manager] = self._queue_counts.get(manager, 0) + 1
+
+        now = datetime.now(timezone.utc)
+        create_date = _aware(snapshot.create_date)
+        if not snapshot.denied and create_date is not None and create_date >= now - RECENT_WINDOW:
+            self._recent[cons_id] = (manager, create_date)
+
+        start_date, end_date = _aware(snapshot.start_date), _aware(snapshot.end_date)
+        if (
+            snapshot.status in RESOLVED_STATUSES
+            and not snapshot.denied
+            and start_date is not None
+            and end_date is not None
+            and end_date >= now - timedelta(days=RESOLUTION_DAYS)
+        ):
+            self._resolved[cons_id] = (manager, (end_date - start_date).total_seconds() / 60, end_date)
+
+    def _remove_from_queue(self, cons_id: str):
+        manager = self._queue.pop(cons_id, None)
+        if manager is not None:
+            left = self._queue_counts.get(manager, 0) - 1
+            if left > 0:
+                self._queue_counts[manager] = left
+            else:
+                self._queue_counts.pop(manager, None)
+
+    def _prune(self):
+        now = datetime.now(timezone.utc)
+        recent_border = now - RECENT_WINDOW
+        self._recent = {k: v for k, v in self._recent.items() if v[1] >= recent_border}
+        resolved_border = now - timedelta(days=RESOLUTION_DAYS)
+        self._resolved = {k: v for k, v in self._resolved.items() if v[2] >= resolved_border}
+
+    async def rebuild(self, db) -> None:
+        """Полная пересборка из БД (три запроса), состояние заменяется целиком"""
+        now = datetime.now(timezone.utc)
+        queue_rows = (await db.execute(
+            select(Consultation.cons_id, Consultation.manager).where(
+                Consultation.manager.isnot(None),
+                Consultation.status.in_(QUEUE_STATUSES),
+                Consultation.denied == False,
+            )
+        )).all()
+        recent_rows = (await db.execute(
+            select(Consultation.cons_id, Consultation.manager, Consultation.create_date).where(
+                Consultation.manager.isnot(None),
+                Consultation.create_date >= now - RECENT_WINDOW,
+                Consultation.denied == False,
+            )
+        )).all()
+        resolved_rows = (await db.execute(
+            select(
+                Consultation.cons_id,
+                Consultation.manager,
+                (func.extract('epoch', Consultation.end_date - Consultation.start_date) / 60).label("minutes"),
+                Consultation.end_date,
+            ).where(
+                Consultation.manager.isnot(None),
+                Consultation.status.in_(RESOLVED_STATUSES),
+                Consultation.start_date.isnot(None),
+                Consultation.end_date.isnot(None),
+                Consultation.denied == False,
+                Consultation.end_date >= now - timedelta(days=RESOLUTION_DAYS),
+            )
+        )).all()
+
+        queue = {cons_id: manager for cons_id, manager in queue_rows}
+        queue_counts: Dict[str, int] = {}
+        for manager in queue.values():
+            queue_counts[manager] = queue_counts.get(manager, 0) + 1
+        self._queue = queue
+        self._queue_counts = queue_counts
+        self._recent = {cons_id: (manager, _aware(created)) for cons_id, manager, created in recent_rows}
+        self._resolved = {
+            cons_id: (manager, float(minutes or 0), _aware(end_date))
+            for cons_id, manager, minutes, end_date in resolved_rows
+        }
+        self.ready = True
+        self.refreshed_at = time.monotonic()
+        logger.debug(
+            f"Manager load index rebuilt: {len(queue)} queued consultations, "
+            f"{len(queue_counts)} managers, {len(self._resolved)} resolved in {RESOLUTION_DAYS} days"
+        )
+
+
+manager_load_index = ManagerLoadIndex()
+
+
+def get_manager_load_index() -> Optional[ManagerLoadIndex]:
+    """Индекс, если он построен и свежий (иначе None — считать по БД)"""
+    if settings.MANAGER_LOAD_INDEX_ENABLED and manager_load_index.is_fresh():
+        return manager_load_index
+    return None
+
+
+# --- Отслеживание изменений Consultation ---
+
+def snapshot_from_row(row: Dict[str, Any]) -> ConsultationLoadSnapshot:
+    return ConsultationLoadSnapshot(**{field: row.get(field) for field in _TRACKED_FIELDS})
+
+
+def stash_consultation_snapshots(db, rows: Iterable[Dict[str, Any]]):
+    """
+    Откладывает строки консультаций (batch upsert ETL) до commit сессии db.
+
+    ВАЖНО: применяются в after_commit — откат транзакции индекс не меняет.
+    """
+    if not manager_load_index.ready:
+        return
+    snapshots = [snapshot_from_row(row) for row in rows]
+    if snapshots:
+        db.sync_session.info.setdefault(_PENDING_KEY, []).extend(snapshots)
+
+
+def _loaded_value(state, field: str):
+    # Только загруженные значения: lazy load в after_flush недопустим (async сессия).
+    # У сохраненного объекта с незагруженными полями снимок не строится (см. _after_flush)
+    return state.dict.get(field)
+
+
+def _after_flush(session: Session, flush_context):
+    if not manager_load_index.ready:
+        return
+    snapshots: List[ConsultationLoadSnapshot] = []
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Consultation):
+            continue
+        state = inspect(obj)
+        if obj in session.dirty and not any(
+            state.attrs[field].history.has_changes() for field in _TRACKED_FIELDS
+        ):
+            continue
+        if obj not in session.new and state.unloaded.intersection(_TRACKED_FIELDS):
+            # Поле не загружено (load_only, expire): прочитать его здесь нельзя, а None
+            # убрал бы консультацию из очереди — состояние поправит сверка с БД
+            logger.debug(f"Manager load index: skip snapshot of {state.identity} (unloaded fields)")
+            continue
+        # Смена PK (временный cl_... -> ID Chatwoot): старую запись убираем
+        for old_id in state.attrs["cons_id"].history.deleted or ():
+            if old_id:
+                snapshots.append(ConsultationLoadSnapshot(cons_id=old_id, removed=True))
+        snapshots.append(ConsultationLoadSnapshot(**{
+            field: _loaded_value(state, field) for field in _TRACKED_FIELDS
+        }))
+    for obj in session.deleted:
+        if isinstance(obj, Consultation):
+            snapshots.append(ConsultationLoadSnapshot(cons_id=_loaded_value(inspect(obj), "cons_id"), removed=True))
+    if snapshots:
+        session.info.setdefault(_PENDING_KEY, []).extend(snapshots)
+
+
+def _after_commit(session: Session):
+    snapshots = session.info.pop(_PENDING_KEY, None)
+    if not snapshots:
+        return
+    for snapshot in snapshots:
+        if snapshot.create_date is None and not snapshot.removed:
+            # create_date заполняется server_default и еще не загружен — консультация новая
+            snapshot = snapshot._replace(create_date=datetime.now(timezone.utc))
+        manager_load_index.observe(snapshot)
+
+
+def _after_rollback(session: Session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+_tracking_installed = False
+
+
+def install_consultation_tracking():
+    """Подписывает индекс на изменения Consultation во всех ORM сессиях процесса"""
+    global _tracking_installed
+    if _tracking_installed:
+        return
+    event.listen(Session, "after_flush", _after_flush)
+    event.listen(Session, "after_commit", _after_commit)
+    event.listen(Session, "after_rollback", _after_rollback)
+    _tracking_installed = True
+
+
+# --- Фоновая сверка ---
+
+_reconcile_task: Optional[asyncio.Task] = None
+
+
+async def refresh_manager_load_index():
+    from ..database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as db:
+        await manager_load_index.rebuild(db)
+
+
+async def _reconcile_loop(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_manager_load_index()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Manager load index reconcile failed: {e}")
+
+
+async def start_manager_load_index():
+    """Строит индекс и запускает периодическую сверку с БД (вызывается из main.lifespan)"""
+    global _reconcile_task
+    if not settings.MANAGER_LOAD_INDEX_ENABLED or _reconcile_task is not None:
+        return
+    install_consultation_tracking()
+    try:
+        await refresh_manager_load_index()
+        logger.info("Manager load index built")
+    except Exception as e:
+        logger.warning(f"Failed to build manager load index, falling back to DB counts: {e}")
+    interval = max(5, settings.MANAGER_LOAD_RECONCILE_SECONDS)
+    _reconcile_task = asyncio.create_task(_reconcile_loop(interval))
+
+
+async def stop_manager_load_index():
+    global _reconcile_task
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+        try:
+            await _reconcile_task
+        except asyncio.CancelledError:
+            pass
+        _reconcile_task = None
+    manager_load_index.ready = False
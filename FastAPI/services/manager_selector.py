@@ -7,10 +7,16 @@
 3. По лимитам (con_limit) - только менеджеры с установленными лимитами
 4. По времени работы (start_hour, end_hour) - только работающие в текущее время
 5. Универсальные менеджеры (знают все разделы) - распределяются по очереди
+
+ВАЖНО: данные для правил (менеджеры, закрытия очереди, навыки, очереди, последние
+назначения) загружаются за постоянное число запросов (IN / GROUP BY manager),
+а сами правила вычисляются в памяти — число запросов не растет с числом менеджеров.
+Очереди, последние назначения и среднее время решения берутся из in-memory индекса
+загрузки (services.manager_load), если он построен, иначе — из БД.
 """
 import logging
 from datetime import datetime, time, timezone, timedelta
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Optional, List, Dict, Any, Tuple, Iterable, Set
 from sqlalchemy import select, func, and_, or_, case
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
@@ -18,10 +24,107 @@
 from ..models import (
     User, UserSkill, Consultation, QAndA, UserMapping, QueueClosing, OnlineQuestionCat
 )
+from .manager_load import RESOLUTION_DAYS, get_manager_load_index
 
 logger = logging.getLogger(__name__)
 
 
+def manager_load_info(queue_count: int, con_limit: Optional[int]) -> Dict[str, Any]:
+    """Загрузка менеджера по размеру очереди и лимиту (формат get_manager_current_load)"""
+    limit = con_limit or 0
+    if limit == 0:
+        load_percent = 0
+        available_slots = 0
+    else:
+        load_percent = min(100, (queue_count / limit) * 100)
+        available_slots = max(0, limit - queue_count)
+    return {
+        "queue_count": queue_count,
+        "limit": limit,
+        "load_percent": round(load_percent, 2),
+        "available_slots": available_slots,
+    }
+
+
+def filter_managers_by_skills(
+    managers: List[User],
+    skills_by_manager: Dict[str, Set[str]],
+    po_section_key: Optional[str] = None,
+    category_key: Optional[str] = None,
+    consultation_type: Optional[str] = None,
+    language: Optional[str] = None,
+    category_language: Optional[str] = None,
+) -> List[User]:
+    """
+    Правила маршрутизации по навыкам, вычисляемые в памяти.
+    
+    Возвращает сначала менеджеров с подходящими навыками, потом универсальных
+    (без навыков — знают все разделы; для "Консультация по ведению учёта" не допускаются).
+    """
+    skilled_managers = []
+    universal_managers = []
+    
+    for manager in managers:
+        # Получаем список category_key, которые знает менеджер
+        manager_category_keys = skills_by_manager.get(manager.cl_ref_key) or set()
+        
+        # Если у менеджера нет навыков, считаем его универсальным
+        # (знает все разделы) - но только если это не "Консультация по ведению учёта"
+        if not manager_category_keys:
+            if consultation_type == "Консультация по ведению учёта":
+                # Для консультаций по ведению учета требуются точные навыки
+                continue
+            universal_managers.append(manager)
+            continue
+        
+        # Для "Консультация по ведению учёта" применяем строгую проверку:
+        # 1. Точное совпадение category_key
+        # 2. Соответствие языка менеджера языку категории вопроса
+        if consultation_type == "Консультация по ведению учёта" and category_key:
+            # Проверяем точное совпадение категории
+            if category_key not in manager_category_keys:
+                continue
+            
+            # Проверяем, что менеджер знает язык консультации
+            if language:
+                if language.lower() == "ru" and not manager.ru:
+                    logger.debug(f"Manager {manager.cl_ref_key} doesn't know Russian, skipping")
+                    continue
+                if language.lower() == "uz" and not manager.uz:
+                    logger.debug(f"Manager {manager.cl_ref_key} doesn't know Uzbek, skipping")
+                    continue
+            
+            # Если есть информация о языке категории, проверяем соответствие
+            if category_language:
+                if category_language.lower() == "ru" and not manager.ru:
+                    logger.debug(
+                        f"Manager {manager.cl_ref_key} doesn't know Russian "
+                        f"(required by category language), skipping"
+                    )
+                    continue
+                if category_language.lower() == "uz" and not manager.uz:
+                    logger.debug(
+                        f"Manager {manager.cl_ref_key} doesn't know Uzbek "
+                        f"(required by category language), skipping"
+                    )
+                    continue
+            
+            # Все проверки пройдены - менеджер подходит
+            skilled_managers.append(manager)
+        else:
+            # Для других типов консультаций используем старую логику
+            # category_key из users_skill соответствует КатегорияВопроса_Key
+            if category_key and category_key in manager_category_keys:
+                skilled_managers.append(manager)
+            # Если category_key не указан, но указан po_section_key,
+            # то пока считаем всех менеджеров с навыками подходящими
+            # TODO: добавить маппинг po_section_key -> category_key если нужно
+            elif not category_key and po_section_key:
+                skilled_managers.append(manager)
+    
+    return skilled_managers + universal_managers
+
+
 class ManagerSelector:
     """Сервис для выбора менеджеров"""
     
@@ -157,31 +260,15 @@ async def get_available_managers(
         )
         
         # Фильтруем менеджеров с закрытой очередью на текущую дату
-        # Проверяем закрытие очереди по дате (period) - если есть запись с period = текущая дата
-        current_date = current_time.date()
-        available_managers = []
-        
-        for manager in all_managers:
-            if not manager.cl_ref_key:
-                continue
-            
-            # Проверяем, закрыта ли очередь для этого менеджера на текущую дату
-            # Period в QueueClosing - это дата закрытия очереди
-            # Используем date_trunc для сравнения только по дате (без времени)
-            # Сравниваем дату закрытия очереди с текущей датой
-            queue_closing_query = select(QueueClosing).where(
-                QueueClosing.manager_key == manager.cl_ref_key,
-                func.date_trunc('day', QueueClosing.period) == func.date_trunc('day', current_time)
-            ).limit(1)
-            
-            queue_closing_result = await self.db.execute(queue_closing_query)
-            queue_closed = queue_closing_result.scalar_one_or_none() is not None
-            
-            if queue_closed:
-                logger.debug(f"Manager {manager.cl_ref_key} has closed queue on {current_date}, excluding from available")
-                continue
-            
-            available_managers.append(manager)
+        # ВАЖНО: один запрос на всех менеджеров вместо запроса на каждого
+        manager_keys = [manager.cl_ref_key for manager in all_managers if manager.cl_ref_key]
+        closed_keys = await self.get_closed_queue_manager_keys(manager_keys, current_time)
+        if closed_keys:
+            logger.debug(f"Managers with closed queue on {current_time.date()}: {sorted(closed_keys)}")
+        available_managers = [
+            manager for manager in all_managers
+            if manager.cl_ref_key and manager.cl_ref_key not in closed_keys
+        ]
         
         if not available_managers:
             logger.warning("No available managers found after filtering closed queues")
@@ -189,9 +276,6 @@ async def get_available_managers(
         
         # Фильтруем по навыкам, если указан раздел программы или категория
         if po_section_key or category_key:
-            skilled_managers = []
-            universal_managers = []
-            
             # Для "Консультация по ведению учёта" получаем информацию о категории вопроса
             category_language = None
             if consultation_type == "Консультация по ведению учёта" and category_key:
@@ -205,92 +289,102 @@ async def get_available_managers(
                     f"consultation language: {language}"
                 )
             
-            for manager in available_managers:
-                # Проверяем навыки менеджера
-                skills_query = select(UserSkill).where(
-                    UserSkill.user_key == manager.cl_ref_key
-                )
-                skills_result = await self.db.execute(skills_query)
-                manager_skills = skills_result.scalars().all()
-                
-                # Получаем список category_key, которые знает менеджер
-                manager_category_keys = {skill.category_key for skill in manager_skills}
-                
-                # Если у менеджера нет навыков, считаем его универсальным
-                # (знает все разделы) - но только если это не "Консультация по ведению учёта"
-                if not manager_category_keys:
-                    if consultation_type == "Консультация по ведению учёта":
-                        # Для консультаций по ведению учета требуются точные навыки
-                        continue
-                    universal_managers.append(manager)
-                    continue
-                
-                # Для "Консультация по ведению учёта" применяем строгую проверку:
-                # 1. Точное совпадение category_key
-                # 2. Соответствие языка менеджера языку категории вопроса
-                if consultation_type == "Консультация по ведению учёта" and category_key:
-                    # Проверяем точное совпадение категории
-                    if category_key not in manager_category_keys:
-                        continue
-                    
-                    # Проверяем соответствие языка
-                    # Если указан язык консультации, проверяем его
-                    if language:
-                        # Проверяем, что менеджер знает нужный язык
-                        if language.lower() == "ru" and not manager.ru:
-                            logger.debug(
-                                f"Manager {manager.cl_ref_key} doesn't know Russian, skipping"
-                            )
-                            continue
-                        if language.lower() == "uz" and not manager.uz:
-                            logger.debug(
-                                f"Manager {manager.cl_ref_key} doesn't know Uzbek, skipping"
-                            )
-                            continue
-                    
-                    # Если есть информация о языке категории, проверяем соответствие
-                    if category_language:
-                        # Проверяем, что менеджер знает язык категории
-                        if category_language.lower() == "ru" and not manager.ru:
-                            logger.debug(
-                                f"Manager {manager.cl_ref_key} doesn't know Russian "
-                                f"(required by category language), skipping"
-                            )
-                            continue
-                        if category_language.lower() == "uz" and not manager.uz:
-                            logger.debug(
-                                f"Manager {manager.cl_ref_key} doesn't know Uzbek "
-                                f"(required by category language), skipping"
-                            )
-                            continue
-                    
-                    # Все проверки пройдены - менеджер подходит
-                    skilled_managers.append(manager)
-                else:
-                    # Для других типов консультаций используем старую логику
-                    # Проверяем, знает ли менеджер нужную категорию
-                    # category_key из users_skill соответствует КатегорияВопроса_Key
-                    # Если указан category_key, проверяем его
-                    if category_key and category_key in manager_category_keys:
-                        skilled_managers.append(manager)
-                    # Если category_key не указан, но указан po_section_key,
-                    # то пока считаем менеджера подходящим (в будущем можно добавить
-                    # прямую связь между po_section_key и category_key)
-                    elif not category_key and po_section_key:
-                        # Пока считаем всех менеджеров с навыками подходящими
-                        # TODO: добавить маппинг po_section_key -> category_key если нужно
-                        skilled_managers.append(manager)
-                    # Если указан только po_section_key без category_key,
-                    # и у менеджера есть навыки, считаем его подходящим
-                    elif po_section_key and not category_key:
-                        skilled_managers.append(manager)
-            
-            # Возвращаем сначала менеджеров с навыками, потом универсальных
-            return skilled_managers + universal_managers
+            skills_by_manager = await self.get_managers_skills(
+                [manager.cl_ref_key for manager in available_managers]
+            )
+            return filter_managers_by_skills(
+                available_managers,
+                skills_by_manager,
+                po_section_key=po_section_key,
+                category_key=category_key,
+                consultation_type=consultation_type,
+                language=language,
+                category_language=category_language,
+            )
         
         # Если раздел не указан, возвращаем всех доступных менеджеров (без закрытой очереди)
         return available_managers
     
+    async def get_closed_queue_manager_keys(
+        self,
+        manager_keys: Iterable[str],
+        current_time: datetime,
+    ) -> Set[str]:
+        """
+        Менеджеры, у которых закрыта очередь на дату current_time (один запрос).
+        
+        Period в QueueClosing - это дата закрытия очереди, сравниваем только по дате (date_trunc).
+        """
+        manager_keys = list(manager_keys)
+        if not manager_keys:
+            return set()
+        query = select(QueueClosing.manager_key).where(
+            QueueClosing.manager_key.in_(manager_keys),
+            func.date_trunc('day', QueueClosing.period) == func.date_trunc('day', current_time)
+        ).distinct()
+        result = await self.db.execute(query)
+        return {row[0] for row in result.all()}
+    
+    async def get_managers_skills(self, manager_keys: Iterable[str]) -> Dict[str, Set[str]]:
+        """Навыки (category_key из users_skill) всех переданных менеджеров одним запросом"""
+        manager_keys = list(manager_keys)
+        skills: Dict[str, Set[str]] = {key: set() for key in manager_keys}
+        if not manager_keys:
+            return skills
+        query = select(UserSkill.user_key, UserSkill.category_key).where(
+            UserSkill.user_key.in_(manager_keys)
+        )
+        result = await self.db.execute(query)
+        for user_key, skill_category_key in result.all():
+            skills.setdefault(user_key, set()).add(skill_category_key)
+        return skills
+    
+    async def get_managers_queue_counts(self, manager_keys: Iterable[str]) -> Dict[str, int]:
+        """
+        Очередь всех переданных менеджеров одним запросом (GROUP BY manager).
+        
+        Условия подсчета совпадают с get_manager_queue_count.
+        """
+        manager_keys = list(manager_keys)
+        load_index = get_manager_load_index()
+        if load_index is not None:
+            return load_index.queue_counts(manager_keys)
+        counts: Dict[str, int] = {key: 0 for key in manager_keys}
+        if not manager_keys:
+            return counts
+        query = select(Consultation.manager, func.count(Consultation.cons_id)).where(
+            Consultation.manager.in_(manager_keys),
+            Consultation.status.in_(["pending", "open"]),
+            Consultation.denied == False,
+        ).group_by(Consultation.manager)
+        result = await self.db.execute(query)
+        for manager_key, count in result.all():
+            counts[manager_key] = count or 0
+        return counts
+    
+    async def get_recent_assignment_counts(
+        self,
+        manager_keys: Iterable[str],
+        since: datetime,
+    ) -> Dict[str, int]:
+        """Сколько консультаций назначено каждому менеджеру начиная с since (один запрос)"""
+        manager_keys = list(manager_keys)
+        load_index = get_manager_load_index()
+        if load_index is not None and load_index.covers_recent_since(since):
+            return load_index.recent_assignment_counts(manager_keys, since)
+        counts: Dict[str, int] = {key: 0 for key in manager_keys}
+        if not manager_keys:
+            return counts
+        query = select(Consultation.manager, func.count(Consultation.cons_id)).where(
+            Consultation.manager.in_(manager_keys),
+            Consultation.create_date >= since,
+            Consultation.denied == False,
+        ).group_by(Consultation.manager)
+        result = await self.db.execute(query)
+        for manager_key, count in result.all():
+            counts[manager_key] = count or 0
+        return counts
+    
     async def get_manager_queue_count(
         self,
         manager_key: str,
@@ -312,6 +406,10 @@ async def get_manager_queue_count(
         Returns:
             Количество консультаций в очереди
         """
+        load_index = get_manager_load_index()
+        if load_index is not None:
+            return load_index.queue_count(manager_key)
+        
         # ВАЖНО: Убрали фильтрацию по source - считаем все заявки менеджера
         # Это включает заявки созданные через бэкенд, вручную в ЦЛ, и через другие источники
         query = select(func.count(Consultation.cons_id)).where(
@@ -353,21 +451,7 @@ async def get_manager_current_load(
             }
         
         queue_count = await self.get_manager_queue_count(manager_key)
-        limit = manager.con_limit or 0
-        
-        if limit == 0:
-            load_percent = 0
-            available_slots = 0
-        else:
-            load_percent = min(100, (queue_count / limit) * 100)
-            available_slots = max(0, limit - queue_count)
-        
-        return {
-            "queue_count": queue_count,
-            "limit": limit,
-            "load_percent": round(load_percent, 2),
-            "available_slots": available_slots,
-        }
+        return manager_load_info(queue_count, manager.con_limit)
     
     async def get_manager_avg_resolution(
         self,
@@ -386,6 +470,11 @@ async def get_manager_avg_resolution(
             - avg_resolution_minutes: среднее время решения в минутах
             - consultations_count: количество завершённых консультаций за период
         """
+        if days == RESOLUTION_DAYS:
+            load_index = get_manager_load_index()
+            if load_index is not None:
+                return load_index.avg_resolution([manager_key])[manager_key]
+        
         # Считаем среднее время решения за последние N дней
         stats_query = select(
             func.avg(
@@ -412,6 +501,44 @@ async def get_manager_avg_resolution(
             "consultations_count": count,
         }
     
+    async def get_managers_avg_resolution(
+        self,
+        manager_keys: Iterable[str],
+        days: int = 2,
+    ) -> Dict[str, Dict[str, Any]]:
+        """Среднее время решения для всех переданных менеджеров (индекс или один GROUP BY)"""
+        manager_keys = list(manager_keys)
+        if days == RESOLUTION_DAYS:
+            load_index = get_manager_load_index()
+            if load_index is not None:
+                return load_index.avg_resolution(manager_keys)
+        stats: Dict[str, Dict[str, Any]] = {
+            key: {"avg_resolution_minutes": None, "consultations_count": 0} for key in manager_keys
+        }
+        if not manager_keys:
+            return stats
+        stats_query = select(
+            Consultation.manager,
+            func.avg(
+                func.extract('epoch', Consultation.end_date - Consultation.start_date) / 60
+            ).label('avg_duration'),
+            func.count(Consultation.cons_id).label('count')
+        ).where(
+            Consultation.manager.in_(manager_keys),
+            Consultation.status.in_(["resolved", "closed"]),
+            Consultation.start_date.isnot(None),
+            Consultation.end_date.isnot(None),
+            Consultation.denied == False,
+            Consultation.end_date >= datetime.now(timezone.utc) - timedelta(days=days)
+        ).group_by(Consultation.manager)
+        result = await self.db.execute(stats_query)
+        for manager_key, avg_minutes, count in result.all():
+            stats[manager_key] = {
+                "avg_resolution_minutes": round(avg_minutes, 1) if avg_minutes else None,
+                "consultations_count": count or 0,
+            }
+        return stats
+    
     async def select_manager_for_consultation(
         self,
         consultation: Optional[Consultation] = None,
@@ -474,13 +601,16 @@ async def select_manager_for_consultation(
             f"category_key={category_key}, language={language}"
         )
         
-        # Считаем очередь для каждого менеджера
+        # Считаем очередь для всех менеджеров одним запросом
+        queue_counts = await self.get_managers_queue_counts(
+            [manager.cl_ref_key for manager in available_managers if manager.cl_ref_key]
+        )
         manager_loads = []
         for manager in available_managers:
             if not manager.cl_ref_key:
                 continue
             
-            queue_count = await self.get_manager_queue_count(manager.cl_ref_key)
+            queue_count = queue_counts.get(manager.cl_ref_key, 0)
             limit = manager.con_limit or 0
             
             # Вычисляем приоритет: меньше очередь = выше приоритет
@@ -519,25 +649,20 @@ async def select_manager_for_consultation(
         # УЛУЧШЕНИЕ: Если есть несколько кандидатов, выбираем того, у кого меньше всего последних назначений
         # Это обеспечивает более равномерное распределение во времени
         if len(candidates) > 1:
-            # Получаем статистику последних назначений для каждого кандидата
-            candidate_stats = []
-            for candidate in candidates:
-                manager_key = candidate["manager"].cl_ref_key
-                
-                # Считаем количество консультаций, назначенных этому менеджеру за последний час
-                recent_assignments_query = select(func.count(Consultation.cons_id)).where(
-                    Consultation.manager == manager_key,
-                    Consultation.create_date >= current_time - timedelta(hours=1),
-                    Consultation.denied == False,
-                )
-                recent_result = await self.db.execute(recent_assignments_query)
-                recent_count = recent_result.scalar() or 0
-                
-                candidate_stats.append({
+            # Получаем статистику последних назначений для всех кандидатов одним запросом
+            # (количество консультаций, назначенных менеджеру за последний час)
+            recent_counts = await self.get_recent_assignment_counts(
+                [candidate["manager"].cl_ref_key for candidate in candidates],
+                since=current_time - timedelta(hours=1),
+            )
+            candidate_stats = [
+                {
                     "candidate": candidate,
-                    "recent_assignments": recent_count,
+                    "recent_assignments": recent_counts.get(candidate["manager"].cl_ref_key, 0),
                     "priority": candidate["priority"],
-                })
+                }
+                for candidate in candidates
+            ]
             
             # Сортируем по количеству последних назначений (меньше = лучше), затем по приоритету
             candidate_stats.sort(key=lambda x: (x["recent_assignments"], x["priority"]))
@@ -589,12 +714,16 @@ async def get_all_managers_load(
             filter_by_working_hours=False  # Показываем всех менеджеров, независимо от времени работы
         )
         
+        queue_counts = await self.get_managers_queue_counts(
+            [manager.cl_ref_key for manager in available_managers if manager.cl_ref_key]
+        )
+        
         result = []
         for manager in available_managers:
             if not manager.cl_ref_key:
                 continue
             
-            load_info = await self.get_manager_current_load(manager.cl_ref_key)
+            load_info = manager_load_info(queue_counts.get(manager.cl_ref_key, 0), manager.con_limit)
             
             result.append({
                 "manager_key": manager.cl_ref_key,
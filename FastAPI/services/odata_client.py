@@ -0,0 +1,320 @@
+"""
+Асинхронный OData-клиент для ETL скриптов (catalog_scripts).
+
+Заменяет синхронные копии http_get_with_backoff на requests + time.sleep:
+- один пул соединений httpx.AsyncClient с keep-alive на весь прогон скрипта;
+- неблокирующий backoff (asyncio.sleep) с jitter;
+- учитывает заголовок Retry-After от 1C/IIS при 429/503.
+
+Использование:
+    async with ODataClient(user_agent="cons-middleware/calls-loader") as odata:
+        resp = await odata.get(url)
+        batch = resp.json().get("value", [])
+"""
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+import httpx
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Статусы, при которых имеет смысл повторить запрос
+RETRY_STATUSES = {429, 502, 503, 504}
+
+DEFAULT_USER_AGENT = "cons-middleware/etl"
+
+# Ошибки получения страницы: сеть/HTTP или битое тело (не JSON, нет списка value) — ValueError
+PAGE_FETCH_ERRORS = (httpx.HTTPError, ValueError)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Разбирает заголовок Retry-After.
+
+    Поддерживает оба формата из RFC 9110: число секунд и HTTP-дату.
+    Возвращает задержку в секундах или None, если заголовок пустой/невалидный.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def compute_backoff(
+    attempt: int,
+    retry_after: Optional[float] = None,
+    base: float = 1.0,
+    cap: float = 60.0,
+) -> float:
+    """
+    Задержка перед повторной попыткой.
+
+    Если сервер прислал Retry-After — ждем столько, сколько он просит (но не больше cap).
+    Иначе экспоненциальный backoff с "equal jitter": половина окна фиксирована,
+    вторая половина случайна. Это разносит повторы параллельных ETL во времени.
+    """
+    if retry_after is not None:
+        return min(retry_after, cap)
+    window = min(cap, base * (2 ** attempt))
+    return window / 2 + random.uniform(0, window / 2)
+
+
+class ODataClient:
+    """Асинхронный клиент для чтения OData 1C:ЦЛ с пулом соединений и retry"""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        auth: Optional[Tuple[str, str]] = None,
+        user_agent: str = DEFAULT_USER_AGENT,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        client: Optional[httpx.AsyncClient] = None,
+    ):
+        """
+        client: Внешний httpx.AsyncClient (общий пул соединений). Если не передан,
+                в in-process режиме планировщика берется общий пул ETL
+                (utils/etl_runtime), иначе создается собственный. Внешний клиент
+                ODataClient не закрывает; User-Agent и auth передаются в каждый запрос.
+        """
+        self.base_url = base_url or settings.ODATA_BASEURL_CL or os.getenv("ODATA_BASEURL_CL")
+        self.auth = auth or (settings.ODATA_USER, settings.ODATA_PASSWORD)
+        self.user_agent = user_agent
+        self.timeout = timeout if timeout is not None else settings.ODATA_TIMEOUT
+        self.max_retries = max_retries if max_retries is not None else settings.ODATA_MAX_RETRIES
+        self._client: Optional[httpx.AsyncClient] = None
+        self._external_client = client
+        self._owns_client = True
+
+    async def __aenter__(self) -> "ODataClient":
+        external = self._external_client
+        if external is None:
+            from ..utils.etl_runtime import get_shared_odata_http
+            external = get_shared_odata_http()
+        if external is not None:
+            self._client = external
+            self._owns_client = False
+            return self
+        self._owns_client = True
+        self._client = httpx.AsyncClient(
+            auth=httpx.BasicAuth(*self.auth),
+            headers={
+                "User-Agent": self.user_agent,
+                "Accept": "application/json",
+            },
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=settings.ODATA_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.ODATA_MAX_CONNECTIONS,
+                keepalive_expiry=settings.ODATA_KEEPALIVE_EXPIRY,
+            ),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._client and self._owns_client:
+            await self._client.aclose()
+        self._client = None
+
+    def _request_options(self) -> Dict[str, Any]:
+        """Для общего пула заголовки и auth не зашиты в клиент — передаем их в запрос"""
+        if self._owns_client:
+            return {}
+        return {"headers": {"User-Agent": self.user_agent}, "auth": httpx.BasicAuth(*self.auth)}
+
+    async def get(self, url: str, timeout: Optional[float] = None) -> httpx.Response:
+        """
+        HTTP GET с retry и неблокирующим backoff.
+
+        - 4xx (кроме 429) не ретраим: логируем детали и поднимаем httpx.HTTPStatusError;
+        - 429/502/503/504 и сетевые ошибки ретраим до max_retries раз;
+        - пока идет ожидание, event loop свободен для других задач.
+        """
+        if not self._client:
+            raise RuntimeError("ODataClient is not initialized (use 'async with ODataClient()')")
+
+        attempt = 0
+        while True:
+            try:
+                resp = await self._client.get(url, timeout=timeout or self.timeout, **self._request_options())
+            except httpx.TransportError as exc:
+                if attempt >= self.max_retries:
+                    logger.error("✗ HTTP error after %s attempts: %s", attempt + 1, exc)
+                    logger.error("  URL: %s", url[:500])
+                    raise
+                wait = compute_backoff(attempt)
+                logger.warning(
+                    "Request failed (attempt %s/%s): %s — retry in %.1f sec",
+                    attempt + 1, self.max_retries + 1, exc, wait,
+                )
+                await asyncio.sleep(wait)
+                attempt += 1
+                continue
+
+            if resp.status_code in RETRY_STATUSES:
+                if attempt >= self.max_retries:
+                    logger.error("✗ HTTP %s after %s attempts", resp.status_code, attempt + 1)
+                    logger.error("  URL: %s", url[:500])
+                    resp.raise_for_status()
+                wait = compute_backoff(attempt, parse_retry_after(resp.headers.get("Retry-After")))
+                logger.warning(
+                    "⚠ HTTP %s — retry in %.1f sec (attempt %s/%s)",
+                    resp.status_code, wait, attempt + 1, self.max_retries + 1,
+                )
+                await asyncio.sleep(wait)
+                attempt += 1
+                continue
+
+            if 400 <= resp.status_code < 500:
+                logger.error("✗ HTTP %s Client Error (no retry): %s", resp.status_code, resp.reason_phrase)
+                logger.error("  URL: %s", url[:500])
+                logger.error("  Error response: %s", resp.text[:1000])
+
+            resp.raise_for_status()
+            return resp
+
+    async def iter_pages(self, paginator: "ODataKeysetPaginator") -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Последовательно отдает страницы keyset пагинации.
+
+        URL следующей страницы зависит только от последней строки текущей, поэтому
+        генератор можно запускать впереди обработки (см. utils/etl_pipeline.PagePrefetcher).
+
+        ВАЖНО: битая страница (тело не JSON или value не список объектов) — ValueError,
+        см. PAGE_FETCH_ERRORS.
+        """
+        while not paginator.exhausted:
+            resp = await self.get(paginator.next_url())
+            data = resp.json()
+            batch = data.get("value", []) if isinstance(data, dict) else None
+            if not isinstance(batch, list) or not all(isinstance(item, dict) for item in batch):
+                raise ValueError(f"Malformed OData page: {resp.text[:200]!r}")
+            paginator.advance(batch)
+            if batch:
+                yield batch
+
+
+def odata_datetime(value: str) -> str:
+    """Литерал Edm.DateTime для $filter: datetime'2025-01-01T00:00:00'"""
+    return f"datetime'{value}'"
+
+
+def odata_string(value: str) -> str:
+    """Строковый литерал для $filter (одинарные кавычки экранируются удвоением)"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class ODataKeysetPaginator:
+    """
+    Keyset (seek) пагинация OData вместо растущего $skip.
+
+    При $top=N&$skip=K 1C заново сканирует K строк на каждой странице, поэтому
+    первый прогон или большой бэклог становятся квадратичными. Здесь нижняя граница
+    фильтра сдвигается на последнее увиденное значение поля сортировки:
+
+        $filter=<seek_field> ge <last_value>&$orderby=<seek_field> asc, <tie_breakers>
+
+    1C OData не поддерживает gt/lt для GUID (Ref_Key), поэтому строки с тем же
+    значением seek_field, что уже были обработаны, пропускаются небольшим $skip,
+    равным размеру "хвоста" одинаковых значений, а не номеру страницы.
+    """
+
+    def __init__(
+        self,
+        entity_url: str,
+        seek_field: str,
+        start_value: str,
+        literal: Callable[[str], str] = odata_datetime,
+        tie_breakers: Sequence[str] = ("Ref_Key",),
+        page_size: int = 1000,
+        extra_filter: Optional[str] = None,
+    ):
+        self.entity_url = entity_url
+        self.seek_field = seek_field
+        self.literal = literal
+        self.tie_breakers = tuple(tie_breakers)
+        self.page_size = page_size
+        self.extra_filter = extra_filter
+
+        self.last_value: str = start_value
+        # Сколько строк с seek_field == last_value уже получено (смещение внутри "хвоста")
+        self.skip = 0
+        self.pages_fetched = 0
+        self.rows_fetched = 0
+        self.exhausted = False
+
+    @property
+    def page_num(self) -> int:
+        """Номер следующей страницы (с 1) — для логов"""
+        return self.pages_fetched + 1
+
+    def build_filter(self) -> str:
+        seek = f"{self.seek_field} ge {self.literal(self.last_value)}"
+        if self.extra_filter:
+            return f"({self.extra_filter}) and {seek}"
+        return seek
+
+    def build_orderby(self) -> str:
+        return ", ".join(f"{field} asc" for field in (self.seek_field, *self.tie_breakers))
+
+    def next_url(self) -> str:
+        encoded_filter = quote(self.build_filter(), safe="'()=<>", encoding="utf-8")
+        encoded_orderby = quote(self.build_orderby(), safe=",", encoding="utf-8")
+        url = (
+            f"{self.entity_url}?$format=json"
+            f"&$filter={encoded_filter}"
+            f"&$orderby={encoded_orderby}"
+            f"&$top={self.page_size}"
+        )
+        if self.skip:
+            url += f"&$skip={self.skip}"
+        return url
+
+    def advance(self, batch: List[Dict[str, Any]]) -> None:
+        """Сдвигает нижнюю границу на последнюю строку полученной страницы"""
+        self.pages_fetched += 1
+        self.rows_fetched += len(batch)
+        if len(batch) < self.page_size:
+            self.exhausted = True
+        if not batch:
+            return
+
+        page_last = batch[-1].get(self.seek_field)
+        if page_last is None:
+            # Без значения поля сортировки сдвигать границу нечем — дочитываем обычным $skip
+            self.skip += len(batch)
+            return
+
+        tail = 0
+        for item in reversed(batch):
+            if item.get(self.seek_field) != page_last:
+                break
+            tail += 1
+
+        if page_last == self.last_value:
+            # Вся страница — продолжение того же "хвоста"
+            self.skip += tail
+        else:
+            self.last_value = page_last
+            self.skip = tail
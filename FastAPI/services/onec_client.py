@@ -2,6 +2,8 @@
 import httpx
 import asyncio
 import logging
+import re
+import time
 from typing import Optional
 
 def normalize_comment(comment: Optional[str]) -> str:
@@ -22,9 +24,19 @@ def normalize_comment(comment: Optional[str]) -> str:
 from datetime import datetime
 from urllib.parse import quote
 from ..config import settings
+from ..utils.db_phases import external_phase
+from ..utils.http_pool import ONEC, call_site, get_onec_http, send_request
+from ..utils.structured_logging import LazyJson, log_with_context, sampled
 
 logger = logging.getLogger(__name__)
 
+_GUID_KEY = re.compile(r"\((guid)?'[^']*'\)")
+
+
+def _odata_call_site(method: str, endpoint: str) -> str:
+    """Метка места вызова для метрик: ключи сущностей (guid'...') заменяются на {key}"""
+    return call_site(method, "/" + _GUID_KEY.sub("({key})", endpoint or ""))
+
 
 class ConsultationLimitExceeded(Exception):
     """
@@ -178,92 +190,75 @@ async def _odata_request(
             "Accept": "application/json"
         }
         
+        site = _odata_call_site(method, endpoint)
+        
         attempt = 0
         while attempt < max_retries:
             try:
-                # Логируем запрос детально
-                import json
-                # Логируем исходный endpoint для отладки
-                original_endpoint = endpoint if endpoint else "(root)"
-                request_log = f"1C OData Request [{attempt + 1}/{max_retries}]: {method}\n"
-                request_log += f"  Original endpoint: {original_endpoint}\n"
-                request_log += f"  Final URL: {url}"
-                if params:
-                    request_log += f"\n  Query params: {json.dumps(params, ensure_ascii=False, indent=2)}"
-                if data:
-                    request_log += f"\n  Request body: {json.dumps(data, ensure_ascii=False, indent=2)}"
-                logger.info(request_log)
+                # ВАЖНО: тела запроса/ответа сериализуются только если DEBUG включен (LazyJson)
+                logger.debug(
+                    "1C OData request [%s/%s]: %s %s | params=%s | body=%s",
+                    attempt + 1, max_retries, method, url, LazyJson(params), LazyJson(data, limit=4000),
+                )
+                
+                started = time.perf_counter()
+                response = await send_request(
+                    ONEC,
+                    get_onec_http(),
+                    method,
+                    url,
+                    site=site,
+                    auth=auth,
+                    headers=headers,
+                    json=data if data else None,
+                    params=params
+                )
+                elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+                context = {
+                    "method": method,
+                    "site": site,
+                    "status": response.status_code,
+                    "duration_ms": elapsed_ms,
+                    "attempt": attempt + 1,
+                }
                 
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.request(
-                        method=method,
-                        url=url,
-                        auth=auth,
-                        headers=headers,
-                        json=data if data else None,
-                        params=params
+                if response.status_code >= 400:
+                    logger.error(
+                        "1C OData error [%s/%s]: %s %s for %s %s | request body: %s | response body: %s",
+                        attempt + 1, max_retries, response.status_code, response.reason_phrase, method, url,
+                        LazyJson(data, limit=4000), response.text[:2000],
+                        extra={"context": context},
                     )
-                    
-                    # Улучшенное логирование ошибок
-                    if response.status_code >= 400:
-                        error_body = ""
-                        try:
-                            error_body = response.text
-                        except:
-                            try:
-                                error_body = str(response.content)
-                            except:
-                                error_body = "Unable to read response body"
-                        
-                        logger.error(
-                            f"1C OData Error [{attempt + 1}/{max_retries}]: "
-                            f"Client error '{response.status_code} {response.reason_phrase}' for url '{url}'\n"
-                            f"  Request body: {json.dumps(data, ensure_ascii=False, indent=2) if data else 'None'}\n"
-                            f"  Response body: {error_body}"
-                        )
-                    
-                    # Логируем ответ
-                    logger.info(
-                        f"1C OData Response: {response.status_code} {response.reason_phrase}"
-                        + (f" | body: {response.text[:500]}" if response.text else "")
+                elif sampled(settings.ONEC_LOG_SAMPLE_RATE):
+                    log_with_context(
+                        logger, logging.INFO,
+                        f"1C OData {method} {site}: {response.status_code} in {elapsed_ms} ms",
+                        context=context,
                     )
-                    
-                    # Если 429 (Too Many Requests) или 5xx ошибка, делаем retry
-                    # ВАЖНО: 500 может быть временной ошибкой на стороне 1C, поэтому делаем retry
-                    if response.status_code in (429, 500, 502, 503, 504):
-                        if attempt < max_retries - 1:
-                            wait_time = min(2 ** attempt, 60)  # Экспоненциальный backoff, макс 60 сек
-                            logger.warning(f"1C OData retry {attempt + 1}/{max_retries} after {wait_time}s for status {response.status_code}")
-                            await asyncio.sleep(wait_time)
-                            attempt += 1
-                            continue
-                    
-                    response.raise_for_status()
-                    # Для DELETE запросов может быть пустой ответ (204 No Content)
-                    if method == "DELETE":
-                        return {}
-                    if response.content:
-                        return response.json()
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("1C OData response body: %.4000s", response.text)
+                
+                # Если 429 (Too Many Requests) или 5xx ошибка, делаем retry
+                # ВАЖНО: 500 может быть временной ошибкой на стороне 1C, поэтому делаем retry
+                if response.status_code in (429, 500, 502, 503, 504):
+                    if attempt < max_retries - 1:
+                        wait_time = min(2 ** attempt, 60)  # Экспоненциальный backoff, макс 60 сек
+                        logger.warning(f"1C OData retry {attempt + 1}/{max_retries} after {wait_time}s for status {response.status_code}")
+                        await asyncio.sleep(wait_time)
+                        attempt += 1
+                        continue
+                
+                response.raise_for_status()
+                # Для DELETE запросов может быть пустой ответ (204 No Content)
+                if method == "DELETE":
                     return {}
+                if response.content:
+                    return response.json()
+                return {}
             except (httpx.RequestError, httpx.HTTPStatusError) as e:
-                error_log = f"1C OData Error [{attempt + 1}/{max_retries}]: {e}"
-                if hasattr(e, 'response') and e.response:
-                    # Показываем полный ответ для отладки (первые 2000 символов)
-                    response_text = e.response.text
-                    error_log += f"\n  Response body: {response_text[:2000]}"
-                    # Если это 400 ошибка, логируем также request body для отладки
-                    if e.response.status_code == 400 and data:
-                        import json
-                        error_log += f"\n  Request body that caused error: {json.dumps(data, ensure_ascii=False, indent=2)}"
-                    # Пытаемся распарсить JSON если возможно
-                    try:
-                        if response_text:
-                            import json
-                            response_json = e.response.json()
-                            error_log += f"\n  Response JSON: {json.dumps(response_json, ensure_ascii=False, indent=2)[:1000]}"
-                    except:
-                        pass
-                logger.error(error_log)
+                # Ответ с ошибкой уже залогирован выше вместе с телами запроса и ответа
+                if isinstance(e, httpx.RequestError):
+                    logger.error(f"1C OData error [{attempt + 1}/{max_retries}]: {method} {url}: {e!r}")
                 if attempt < max_retries - 1:
                     wait_time = min(2 ** attempt, 60)
                     logger.warning(f"1C OData retry {attempt + 1}/{max_retries} after {wait_time}s")
@@ -491,13 +486,15 @@ async def create_consultation_odata(
         if not client_key:
             raise ValueError("client_key (Абонент_Key) is required for creating consultation in 1C")
         
-        # Логируем финальный payload перед отправкой
-        import json
-        logger.info(f"1C create_consultation_odata payload: {json.dumps(payload, ensure_ascii=False, indent=2)}")
+        # Логируем финальный payload перед отправкой (сериализуется только при DEBUG)
+        logger.debug("1C create_consultation_odata payload: %s", LazyJson(payload))
         
         endpoint = f"/{self.entity}"
         try:
-            return await self._odata_request("POST", endpoint, data=payload)
+            # Справочники прочитаны — на время POST соединение db_session не удерживается
+            # (если сессия использует короткие транзакции, см. utils.db_phases)
+            async with external_phase(db_session, "onec_consultation"):
+                return await self._odata_request("POST", endpoint, data=payload)
         except httpx.HTTPStatusError as e:
             # Проверяем, не является ли ошибка 500 результатом превышения лимита консультаций
             # В 1C:ЦЛ есть лимит: максимум 3 документа ТелефонныйЗвонок на один день
@@ -784,11 +781,7 @@ async def find_client_by_code_and_inn(
                     logger.warning(f"  Still {len(rows)} duplicates after filtering, using first one")
             
             for i, row in enumerate(rows[:3]):  # Логируем первые 3 для дебага
-                logger.info(f"  Client {i+1}: Ref_Key={row.get('Ref_Key')}")
-                logger.info(f"    КодАбонентаClobus (ЦЛ): '{row.get('КодАбонентаClobus')}' (type: {type(row.get('КодАбонентаClobus')).__name__})")
-                logger.info(f"    ИНН (ЦЛ): '{row.get('ИНН')}' (type: {type(row.get('ИНН')).__name__})")
-                logger.info(f"    Parent_Key: {row.get('Parent_Key')}")
-                logger.info(f"    DeletionMark: {row.get('DeletionMark')}")
+                logger.debug("  Client %s: %s", i + 1, LazyJson(row))
         else:
             logger.warning(f"=== NO client found in 1C ===")
             logger.warning(f"  Searched with: code_abonent='{code_abonent}', org_inn='{org_inn}'")
@@ -1066,10 +1059,11 @@ async def create_consultation(
             if scheduled_at:
                 payload["scheduled_at"] = scheduled_at.isoformat()
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(url, headers=headers, json=payload)
-                response.raise_for_status()
-                return response.json()
+            response = await send_request(
+                ONEC, get_onec_http(), "POST", url, site="POST /api/consultations", headers=headers, json=payload
+            )
+            response.raise_for_status()
+            return response.json()
         else:
             # Fallback на OData
             return await self.create_consultation_odata(
@@ -0,0 +1,308 @@
+"""
+Очередь синхронизации изменений консультаций в 1C:ЦЛ (sys.onec_sync_jobs).
+
+Раньше вебхук Chatwoot запускал asyncio.create_task на каждый PATCH в ЦЛ: задачи
+терялись при рестарте, не ограничивались по числу и каждая открывала свою сессию и
+OneCClient. Теперь вебхук добавляет задачу в той же транзакции, что и изменение
+консультации (enqueue_onec_sync), а OneCSyncWorker в фоне:
+- забирает консультации целиком, с арендой (FOR UPDATE SKIP LOCKED + advisory lock
+  по cons_id): задачи одной консультации выполняются по порядку и одним воркером,
+  консультация с задачей в backoff ждет ее повтора;
+- схлопывает задачи консультации: из статусов и менеджеров уходит только последнее
+  значение, одним PATCH;
+- выполняет PATCH с ограниченной параллельностью (ONEC_SYNC_CONCURRENCY) через общий
+  OneCClient;
+- при ошибке откладывает задачи с backoff, после ONEC_SYNC_MAX_ATTEMPTS (или 4xx,
+  который не исправится повтором) — failed;
+- после успешного PATCH проставляет synced_to_1c в log.consultation_change_log.
+
+ВАЖНО: created_at записи change_log ставит приложение (datetime.now), а created_at
+задачи — БД (now() = начало транзакции, т.е. раньше записи лога той же транзакции).
+Поэтому граница synced_to_1c — момент захвата задач по часам приложения: записи лога,
+сделанные до него, уже закоммичены вместе со своими задачами и вошли в PATCH.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, event, exists, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models import ConsultationChangeLog, OneCSyncJob
+from .chatwoot_outbox import is_retryable_error
+from .odata_client import compute_backoff
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUS = "status"    # {"status": "<статус ЦЛ>"}
+JOB_MANAGER = "manager"  # {"manager_key": "<Ref_Key менеджера>"}
+
+# Поле log.consultation_change_log, которое закрывает задача каждого типа
+CHANGE_LOG_FIELDS = {JOB_STATUS: "status", JOB_MANAGER: "manager"}
+FIELD_JOB_TYPES = {field_name: job_type for job_type, field_name in CHANGE_LOG_FIELDS.items()}
+
+# На сколько консультация "арендуется" воркером; если он упал, задачи снова станут доступны
+LEASE_SECONDS = 120
+
+_CLAIM_SQL = text("""
+    WITH due AS (
+        SELECT cons_id, min(id) AS first_id
+        FROM sys.onec_sync_jobs
+        WHERE status = 'pending'
+        GROUP BY cons_id
+        HAVING max(next_attempt_at) <= now()
+        ORDER BY first_id
+        LIMIT :limit
+    ), locked AS (
+        SELECT cons_id FROM due
+        WHERE pg_try_advisory_xact_lock(hashtext('onec_sync:' || cons_id))
+    )
+    UPDATE sys.onec_sync_jobs AS j
+    SET attempts = j.attempts + 1,
+        next_attempt_at = now() + make_interval(secs => :lease_seconds)
+    FROM locked
+    WHERE j.cons_id = locked.cons_id AND j.status = 'pending' AND j.next_attempt_at <= now()
+    RETURNING j.id, j.cons_id, j.cl_ref_key, j.job_type, j.payload, j.attempts, j.created_at
+""")
+
+
+def enqueue_onec_sync(
+    db: AsyncSession,
+    cons_id: str,
+    cl_ref_key: str,
+    job_type: str,
+    payload: Dict[str, Any],
+) -> None:
+    """
+    Добавляет задачу синхронизации в текущей транзакции.
+
+    ВАЖНО: commit делает вызывающий код; после commit воркер этого процесса
+    будится сразу, не дожидаясь очередного опроса.
+    """
+    db.add(OneCSyncJob(cons_id=str(cons_id), cl_ref_key=cl_ref_key, job_type=job_type, payload=payload))
+    event.listen(db.sync_session, "after_commit", lambda session: onec_sync_worker.wake(), once=True)
+
+
+@dataclass
+class ConsultationSyncPlan:
+    """Схлопнутые задачи одной консультации — один PATCH в ЦЛ"""
+    cons_id: str
+    cl_ref_key: str
+    job_ids: List[int] = field(default_factory=list)
+    attempts: int = 0
+    status: Optional[str] = None
+    manager_key: Optional[str] = None
+    fields: Dict[str, datetime] = field(default_factory=dict)  # поле change_log -> время захвата задач (часы приложения)
+
+
+def coalesce_jobs(rows: List[Dict[str, Any]]) -> List[ConsultationSyncPlan]:
+    """Группирует задачи по консультации (в порядке id); побеждает последнее значение"""
+    plans: Dict[str, ConsultationSyncPlan] = {}
+    for row in sorted(rows, key=lambda r: r["id"]):
+        plan = plans.setdefault(row["cons_id"], ConsultationSyncPlan(row["cons_id"], row["cl_ref_key"]))
+        plan.job_ids.append(row["id"])
+        plan.cl_ref_key = row["cl_ref_key"] or plan.cl_ref_key
+        plan.attempts = max(plan.attempts, row.get("attempts") or 0)
+        payload = row.get("payload") or {}
+        if row["job_type"] == JOB_STATUS:
+            plan.status = payload.get("status")
+        elif row["job_type"] == JOB_MANAGER:
+            plan.manager_key = payload.get("manager_key")
+        else:
+            logger.warning(f"Unknown 1C sync job type '{row['job_type']}' (id={row['id']}), skipping")
+            continue
+        plan.fields[CHANGE_LOG_FIELDS[row["job_type"]]] = row.get("claimed_at")
+    return list(plans.values())
+
+
+class OneCSyncDispatcher:
+    """Выполнение задач sys.onec_sync_jobs"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        onec_client=None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+    ):
+        if session_factory is None:
+            from ..database import AsyncSessionLocal
+            session_factory = AsyncSessionLocal
+        self.session_factory = session_factory
+        self._onec = onec_client
+        self.batch_size = batch_size or settings.ONEC_SYNC_BATCH_SIZE
+        self.concurrency = max(1, concurrency or settings.ONEC_SYNC_CONCURRENCY)
+        self.max_attempts = max_attempts or settings.ONEC_SYNC_MAX_ATTEMPTS
+
+    @property
+    def onec(self):
+        if self._onec is None:
+            from .onec_client import OneCClient
+            self._onec = OneCClient()
+        return self._onec
+
+    async def claim(self) -> List[Dict[str, Any]]:
+        # Те же часы, что у log_consultation_change — граница для synced_to_1c
+        claimed_at = datetime.now(timezone.utc)
+        async with self.session_factory() as db:
+            result = await db.execute(_CLAIM_SQL, {"limit": self.batch_size, "lease_seconds": LEASE_SECONDS})
+            rows = [dict(row, claimed_at=claimed_at) for row in result.mappings().all()]
+            await db.commit()
+        return rows
+
+    async def deliver(self, plan: ConsultationSyncPlan):
+        kwargs: Dict[str, Any] = {}
+        if plan.status is not None:
+            kwargs["status"] = plan.status
+        if plan.manager_key is not None:
+            kwargs["manager_key"] = plan.manager_key
+        if not kwargs:
+            return
+        await self.onec.update_consultation_odata(ref_key=plan.cl_ref_key, **kwargs)
+        logger.info(f"Synced {', '.join(kwargs)} to 1C for consultation {plan.cons_id}")
+
+    async def _finish(self, results: List[Tuple[ConsultationSyncPlan, Optional[BaseException]]]) -> Dict[str, int]:
+        """Фиксирует результат: done + synced_to_1c / отложить с backoff / failed"""
+        stats = {"synced": 0, "retried": 0, "failed": 0}
+        now = datetime.now(timezone.utc)
+
+        async with self.session_factory() as db:
+            for plan, error in results:
+                if error is None:
+                    values = {"status": "done", "processed_at": now, "last_error": None}
+                    stats["synced"] += 1
+                    for field_name, claimed_at in plan.fields.items():
+                        # Изменение, чья задача еще ждет в очереди, в этот PATCH не вошло
+                        newer_job = exists(
+                            select(OneCSyncJob.id).where(and_(
+                                OneCSyncJob.cons_id == plan.cons_id,
+                                OneCSyncJob.job_type == FIELD_JOB_TYPES[field_name],
+                                OneCSyncJob.status == "pending",
+                                OneCSyncJob.id.notin_(plan.job_ids),
+                            ))
+                        )
+                        await db.execute(
+                            update(ConsultationChangeLog)
+                            .where(
+                                ConsultationChangeLog.cons_id == plan.cons_id,
+                                ConsultationChangeLog.field_name == field_name,
+                                ConsultationChangeLog.synced_to_1c == False,
+                                ConsultationChangeLog.created_at <= (claimed_at or now),
+                                ~newer_job,
+                            )
+                            .values(synced_to_1c=True)
+                            .execution_options(synchronize_session=False)
+                        )
+                else:
+                    error_text = f"{type(error).__name__}: {error}"[:2000]
+                    if not is_retryable_error(error) or plan.attempts >= self.max_attempts:
+                        values = {"status": "failed", "last_error": error_text, "processed_at": now}
+                        stats["failed"] += 1
+                        logger.error(
+                            f"1C sync: giving up on consultation {plan.cons_id} "
+                            f"after {plan.attempts} attempts: {error_text}"
+                        )
+                    else:
+                        delay = compute_backoff(plan.attempts, cap=600.0)
+                        values = {"last_error": error_text, "next_attempt_at": now + timedelta(seconds=delay)}
+                        stats["retried"] += 1
+                        logger.warning(
+                            f"1C sync: consultation {plan.cons_id} failed "
+                            f"(attempt {plan.attempts}), retry in {delay:.1f}s: {error_text}"
+                        )
+                await db.execute(
+                    update(OneCSyncJob)
+                    .where(OneCSyncJob.id.in_(plan.job_ids))
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+            await db.commit()
+        return stats
+
+    async def run_once(self) -> Dict[str, int]:
+        """Один проход: claim → схлопывание → PATCH с ограниченной параллельностью → фиксация"""
+        rows = await self.claim()
+        stats = {"jobs": len(rows), "consultations": 0, "synced": 0, "retried": 0, "failed": 0}
+        if not rows:
+            return stats
+
+        plans = coalesce_jobs(rows)
+        stats["consultations"] = len(plans)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(plan: ConsultationSyncPlan):
+            async with semaphore:
+                try:
+                    await self.deliver(plan)
+                    return plan, None
+                except Exception as error:
+                    return plan, error
+
+        results = await asyncio.gather(*(run(plan) for plan in plans))
+        stats.update(await self._finish(results))
+        return stats
+
+
+class OneCSyncWorker:
+    """Фоновый цикл процесса API: проход по очереди при wake() или раз в poll_seconds"""
+
+    def __init__(self, dispatcher_factory=OneCSyncDispatcher, poll_seconds: Optional[float] = None):
+        self.dispatcher_factory = dispatcher_factory
+        self.poll_seconds = poll_seconds if poll_seconds is not None else settings.ONEC_SYNC_POLL_SECONDS
+        self._dispatcher: Optional[OneCSyncDispatcher] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                stats = await self._dispatcher.run_once()
+                if stats["jobs"]:
+                    logger.info(
+                        f"1C sync: {stats['jobs']} jobs in {stats['consultations']} consultations, "
+                        f"synced={stats['synced']}, retried={stats['retried']}, failed={stats['failed']}"
+                    )
+                    if stats["consultations"] >= self._dispatcher.batch_size:
+                        continue
+            except Exception as e:
+                logger.error(f"1C sync worker error: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None and self.poll_seconds > 0:
+            self._dispatcher = self.dispatcher_factory()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._wakeup = None
+
+
+onec_sync_worker = OneCSyncWorker()
+
+
+async def start_onec_sync_worker():
+    onec_sync_worker.start()
+
+
+async def stop_onec_sync_worker():
+    await onec_sync_worker.stop()
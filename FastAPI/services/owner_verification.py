@@ -0,0 +1,169 @@
+"""
+Проверенные владельцы в 1C:ЦЛ: (code_abonent, org_inn) -> Ref_Key в папке CLOBUS.
+
+Раньше _ensure_owner_synced_with_cl на каждую консультацию по ведению учета ходил
+в OData (find_client_by_code_and_inn, иногда create), чтобы заново убедиться, что
+владелец есть в папке CLOBUS с правильным Parent_Key. Теперь результат проверки
+хранится:
+
+- в cons.clients.cl_verified_at (вместе с cl_ref_key и parent_key) — маркер общий
+  для процессов; другой клиент с тем же кодом абонента и ИНН (дубль владельца)
+  находится по индексу idx_clients_code_inn_parent;
+- в LRU процесса (ONEC_OWNER_CACHE_SIZE) — повторная консультация не ходит в БД.
+
+Проверка, сделанная менее ONEC_OWNER_VERIFY_SECONDS назад, используется без
+запросов к 1C. Маркер обновляет и ETL pull_clients_cl: клиент из папки CLOBUS без
+пометки удаления считается проверенным на момент загрузки, клиент из другой папки
+или помеченный на удаление — маркер сбрасывается.
+
+ВАЖНО: удаление или перенос клиента в ЦЛ между загрузками ETL станет виден не
+позже окна проверки.
+"""
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models import Client
+
+logger = logging.getLogger(__name__)
+
+# Папка CLOBUS в Catalog_Контрагенты — владельцы консультаций должны быть в ней
+CLOBUS_PARENT_KEY = "7ccd31ca-887b-11eb-938b-00e04cd03b68"
+
+
+class OwnerVerification(NamedTuple):
+    ref_key: str
+    code_abonent: Optional[str]
+    verified_at: datetime
+
+
+OwnerKey = Tuple[str, str]
+
+
+class OwnerVerificationCache:
+    """LRU проверенных владельцев процесса: (code_abonent, org_inn) -> OwnerVerification"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[OwnerKey, OwnerVerification]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: OwnerKey) -> Optional[OwnerVerification]:
+        verification = self._items.get(key)
+        if verification is not None:
+            self._items.move_to_end(key)
+        return verification
+
+    def put(self, key: OwnerKey, verification: OwnerVerification):
+        if self.max_size <= 0:
+            return
+        self._items[key] = verification
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def discard(self, key: OwnerKey):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+
+owner_verification_cache = OwnerVerificationCache(settings.ONEC_OWNER_CACHE_SIZE)
+
+
+def owner_key(owner: Client) -> Optional[OwnerKey]:
+    if not owner.code_abonent or not owner.org_inn:
+        return None
+    return str(owner.code_abonent), str(owner.org_inn)
+
+
+def verification_is_fresh(verified_at: Optional[datetime], now: Optional[datetime] = None) -> bool:
+    if verified_at is None:
+        return False
+    now = now or datetime.now(timezone.utc)
+    return now - verified_at < timedelta(seconds=settings.ONEC_OWNER_VERIFY_SECONDS)
+
+
+def owner_is_verified(owner: Client, now: Optional[datetime] = None) -> bool:
+    """Собственный маркер владельца: Ref_Key в папке CLOBUS, проверен недавно"""
+    return bool(
+        owner.cl_ref_key
+        and owner.parent_key == CLOBUS_PARENT_KEY
+        and verification_is_fresh(owner.cl_verified_at, now)
+    )
+
+
+def mark_owner_verified(
+    owner: Client,
+    ref_key: str,
+    code_abonent: Optional[str] = None,
+    verified_at: Optional[datetime] = None,
+):
+    """Записывает результат проверки владельцу и в LRU (flush — на вызывающем)"""
+    verified_at = verified_at or datetime.now(timezone.utc)
+    owner.cl_ref_key = ref_key
+    owner.parent_key = CLOBUS_PARENT_KEY
+    owner.code_abonent = owner.code_abonent or code_abonent
+    owner.cl_verified_at = verified_at
+    key = owner_key(owner)
+    if key is not None:
+        owner_verification_cache.put(key, OwnerVerification(ref_key, owner.code_abonent, verified_at))
+
+
+def forget_owner_verification(owner: Client):
+    """Сбрасывает маркер: следующая консультация проверит владельца в 1C"""
+    owner.cl_verified_at = None
+    key = owner_key(owner)
+    if key is not None:
+        owner_verification_cache.discard(key)
+
+
+async def find_owner_verification(db: AsyncSession, owner: Client) -> Optional[OwnerVerification]:
+    """
+    Недавняя проверка владельца: собственный маркер, LRU, затем клиент
+    с тем же кодом абонента и ИНН в cons.clients. None — нужен запрос в 1C.
+    """
+    now = datetime.now(timezone.utc)
+    if owner_is_verified(owner, now):
+        return OwnerVerification(owner.cl_ref_key, owner.code_abonent, owner.cl_verified_at)
+
+    key = owner_key(owner)
+    if key is None:
+        return None
+
+    verification = owner_verification_cache.get(key)
+    if verification is not None:
+        if verification_is_fresh(verification.verified_at, now):
+            return verification
+        owner_verification_cache.discard(key)
+
+    row = (await db.execute(
+        select(Client.cl_ref_key, Client.code_abonent, Client.cl_verified_at)
+        .where(
+            Client.code_abonent == key[0],
+            Client.org_inn == key[1],
+            Client.parent_key == CLOBUS_PARENT_KEY,
+            Client.cl_ref_key.isnot(None),
+            Client.cl_verified_at > now - timedelta(seconds=settings.ONEC_OWNER_VERIFY_SECONDS),
+        )
+        .order_by(Client.cl_verified_at.desc())
+        .limit(1)
+    )).first()
+    if row is None:
+        return None
+    verification = OwnerVerification(row.cl_ref_key, row.code_abonent, row.cl_verified_at)
+    owner_verification_cache.put(key, verification)
+    return verification
+
+
+def onec_item_verifies_owner(item: Dict[str, Any]) -> bool:
+    """Элемент Catalog_Контрагенты подтверждает владельца: папка CLOBUS, без пометки удаления"""
+    return item.get("Parent_Key") == CLOBUS_PARENT_KEY and not item.get("DeletionMark")
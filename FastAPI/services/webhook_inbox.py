@@ -0,0 +1,391 @@
+"""
+Двухэтапный прием входящих вебхуков (sys.webhook_inbox).
+
+Раньше обработчик вебхука делал все внутри запроса: запись в log.webhook_log, поиск
+консультации, вызовы Chatwoot/1C, commit — и только потом отвечал. При медленной
+обработке Chatwoot не дожидался ответа и присылал событие повторно.
+
+Теперь:
+1. Прием (в запросе): проверка подписи → одна вставка INSERT ... ON CONFLICT DO NOTHING
+   в sys.webhook_inbox → 200. Повторная доставка с тем же id доставки отправителя
+   (DELIVERY_ID_HEADERS) отбрасывается уникальным индексом (source, event_id) и не
+   обрабатывается второй раз.
+
+   ВАЖНО: дедупликация работает только при заголовке X-Chatwoot-Delivery или X-Delivery-Id.
+   Без id отправителя событие принимается без дедупликации. Хэш тела ключом не годится:
+   то же тело приходит и законно (статус A→B→A), и такое событие терялось бы.
+2. Обработка (WebhookInboxWorker в процессе API): события забираются с арендой
+   (advisory lock по ordering_key), события одного разговора/консультации
+   обрабатываются строго по порядку поступления, разные — параллельно
+   (WEBHOOK_INBOX_CONCURRENCY). Каждое событие — отдельная сессия и транзакция.
+   При ошибке событие откладывается с backoff, а следующие события того же разговора
+   ждут его повтора; после WEBHOOK_INBOX_MAX_ATTEMPTS — failed (с текстом ошибки).
+3. Журнал log.webhook_log: событие, дошедшее до done/failed, копируется туда из строки
+   очереди одним INSERT ... SELECT на проход воркера (created_at — время приема), так что
+   аудит переживает удаление обработанных событий из очереди.
+
+Обработчики регистрируют роутеры (register_webhook_handler) — воркер не зависит от них.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+from sqlalchemy import insert, select, text, update
+
+from ..config import settings
+from ..models import WebhookInbox, WebhookLog
+from .odata_client import compute_backoff
+
+logger = logging.getLogger(__name__)
+
+SOURCE_CHATWOOT = "CHATWOOT"
+SOURCE_ONEC = "1C_CL"
+SOURCE_CHATWOOT_TELEGRAM = "CHATWOOT_TELEGRAM"
+
+# Заголовки с id доставки: отправитель повторяет доставку с тем же id
+DELIVERY_ID_HEADERS = ("X-Chatwoot-Delivery", "X-Delivery-Id")
+
+# На сколько события "арендуются" воркером; если он упал, события снова станут доступны
+LEASE_SECONDS = 300
+# Период удаления обработанных событий старше WEBHOOK_INBOX_RETENTION_DAYS
+PURGE_INTERVAL_SECONDS = 3600.0
+
+WebhookHandler = Callable[[Any, Dict[str, Any]], Awaitable[Any]]
+OrderingKey = Callable[[Dict[str, Any]], Optional[Any]]
+
+
+@dataclass
+class _Registration:
+    handler: WebhookHandler
+    ordering_key: OrderingKey
+
+
+_handlers: Dict[str, _Registration] = {}
+
+_INSERT_SQL = text("""
+    INSERT INTO sys.webhook_inbox (source, event_id, event_type, ordering_key, payload)
+    VALUES (:source, :event_id, :event_type, :ordering_key, CAST(:payload AS jsonb))
+    ON CONFLICT (source, event_id) DO NOTHING
+    RETURNING id
+""")
+
+_CLAIM_SQL = text("""
+    WITH due AS (
+        SELECT ordering_key, min(id) AS first_id
+        FROM sys.webhook_inbox
+        WHERE status = 'pending'
+        GROUP BY ordering_key
+        HAVING max(next_attempt_at) <= now()
+        ORDER BY first_id
+        LIMIT :limit
+    ), locked AS (
+        SELECT ordering_key FROM due
+        WHERE pg_try_advisory_xact_lock(hashtext('webhook_inbox:' || ordering_key))
+    )
+    UPDATE sys.webhook_inbox AS w
+    SET attempts = w.attempts + 1,
+        next_attempt_at = now() + make_interval(secs => :lease_seconds)
+    FROM locked
+    WHERE w.ordering_key = locked.ordering_key AND w.status = 'pending' AND w.next_attempt_at <= now()
+    RETURNING w.id, w.source, w.event_type, w.ordering_key, w.payload, w.attempts
+""")
+
+_PURGE_SQL = text("""
+    DELETE FROM sys.webhook_inbox
+    WHERE status <> 'pending' AND processed_at < now() - make_interval(days => :days)
+""")
+
+
+def register_webhook_handler(source: str, handler: WebhookHandler, ordering_key: OrderingKey) -> None:
+    """
+    Регистрирует обработчик событий источника.
+
+    handler(db, payload) выполняется воркером в отдельной сессии, commit делает воркер.
+    ordering_key(payload) — ключ, внутри которого события обрабатываются по порядку
+    (id разговора/консультации); None — событие ни с чем не упорядочивается.
+    """
+    _handlers[source] = _Registration(handler, ordering_key)
+
+
+def delivery_id_from_headers(headers: Mapping[str, str]) -> Optional[str]:
+    """id доставки из заголовков отправителя (None — отправитель его не передал)"""
+    for name in DELIVERY_ID_HEADERS:
+        value = (headers.get(name) or "").strip()
+        if value:
+            return value[:200]
+    return None
+
+
+async def ingest_webhook(
+    source: str,
+    body: bytes,
+    payload: Dict[str, Any],
+    delivery_id: Optional[str] = None,
+    engine=None,
+) -> bool:
+    """
+    Записывает событие в очередь (этап приема) и будит воркер.
+
+    delivery_id — id доставки от отправителя; без него событие не дедуплицируется.
+
+    Returns:
+        False, если это повторная доставка уже принятого события.
+    """
+    if engine is None:
+        from ..database import engine
+    event_id = f"delivery:{delivery_id}" if delivery_id else f"local:{uuid.uuid4().hex}"
+    registration = _handlers.get(source)
+    key = registration.ordering_key(payload) if registration else None
+    ordering_key = f"{source}:{key}" if key not in (None, "") else f"{source}:event:{event_id}"
+
+    async with engine.begin() as conn:
+        inserted = (await conn.execute(_INSERT_SQL, {
+            "source": source,
+            "event_id": event_id,
+            "event_type": payload.get("event") if isinstance(payload, dict) else None,
+            "ordering_key": ordering_key,
+            "payload": body.decode("utf-8"),
+        })).scalar_one_or_none()
+
+    if inserted is None:
+        logger.info(f"Duplicate {source} webhook ignored (event_id={event_id})")
+        return False
+    webhook_inbox_worker.wake()
+    return True
+
+
+class WebhookInboxDispatcher:
+    """Обработка событий sys.webhook_inbox"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        handlers: Optional[Dict[str, _Registration]] = None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+    ):
+        if session_factory is None:
+            from ..database import AsyncSessionLocal
+            session_factory = AsyncSessionLocal
+        self.session_factory = session_factory
+        self.handlers = handlers if handlers is not None else _handlers
+        self.batch_size = batch_size or settings.WEBHOOK_INBOX_BATCH_SIZE
+        self.concurrency = max(1, concurrency or settings.WEBHOOK_INBOX_CONCURRENCY)
+        self.max_attempts = max_attempts or settings.WEBHOOK_INBOX_MAX_ATTEMPTS
+        self._next_purge = time.monotonic()
+
+    async def claim(self) -> List[Dict[str, Any]]:
+        async with self.session_factory() as db:
+            result = await db.execute(_CLAIM_SQL, {"limit": self.batch_size, "lease_seconds": LEASE_SECONDS})
+            rows = [dict(row) for row in result.mappings().all()]
+            await db.commit()
+        return rows
+
+    async def process(self, row: Dict[str, Any]):
+        """Выполняет обработчик одного события в собственной транзакции"""
+        registration = self.handlers.get(row["source"])
+        if registration is None:
+            raise LookupError(f"No webhook handler registered for source '{row['source']}'")
+        async with self.session_factory() as db:
+            await registration.handler(db, row["payload"])
+            await db.commit()
+
+    async def process_ordered(self, rows: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Optional[BaseException]]]:
+        """
+        События одного ordering_key по порядку.
+
+        После ошибки, которая будет повторена, остальные события ключа не выполняются
+        и не попадают в результат — они вернутся в очередь вслед за ней.
+        """
+        results = []
+        for row in sorted(rows, key=lambda r: r["id"]):
+            try:
+                await self.process(row)
+                results.append((row, None))
+            except Exception as error:
+                results.append((row, error))
+                if row["attempts"] < self.max_attempts:
+                    break
+        return results
+
+    async def _finish(self, claimed: List[Dict[str, Any]], results: List[Tuple[Dict[str, Any], Optional[BaseException]]]) -> Dict[str, int]:
+        """Фиксирует результат: done / отложить с backoff / failed; невыполненные — обратно в очередь"""
+        stats = {"processed": 0, "retried": 0, "failed": 0, "deferred": 0}
+        now = datetime.now(timezone.utc)
+        done_ids = [row["id"] for row, error in results if error is None]
+        audit_ids = done_ids + [
+            row["id"] for row, error in results if error is not None and row["attempts"] >= self.max_attempts
+        ]
+        finished = {row["id"] for row, _ in results}
+        deferred_ids = [row["id"] for row in claimed if row["id"] not in finished]
+
+        async with self.session_factory() as db:
+            if done_ids:
+                await db.execute(
+                    update(WebhookInbox)
+                    .where(WebhookInbox.id.in_(done_ids))
+                    .values(status="done", processed_at=now, last_error=None)
+                    .execution_options(synchronize_session=False)
+                )
+                stats["processed"] = len(done_ids)
+            if deferred_ids:
+                # Ждали событие, которое упало раньше них: попытка не засчитывается
+                await db.execute(
+                    update(WebhookInbox)
+                    .where(WebhookInbox.id.in_(deferred_ids))
+                    .values(attempts=WebhookInbox.attempts - 1, next_attempt_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                stats["deferred"] = len(deferred_ids)
+            for row, error in results:
+                if error is None:
+                    continue
+                error_text = f"{type(error).__name__}: {error}"[:2000]
+                if row["attempts"] >= self.max_attempts:
+                    values = {"status": "failed", "last_error": error_text, "processed_at": now}
+                    stats["failed"] += 1
+                    logger.error(
+                        f"Webhook inbox: giving up on {row['source']} event {row['event_type']} "
+                        f"(id={row['id']}) after {row['attempts']} attempts: {error_text}"
+                    )
+                else:
+                    delay = compute_backoff(row["attempts"], cap=300.0)
+                    values = {"last_error": error_text, "next_attempt_at": now + timedelta(seconds=delay)}
+                    stats["retried"] += 1
+                    logger.warning(
+                        f"Webhook inbox: {row['source']} event {row['event_type']} (id={row['id']}) failed "
+                        f"(attempt {row['attempts']}), retry in {delay:.1f}s: {error_text}"
+                    )
+                await db.execute(
+                    update(WebhookInbox)
+                    .where(WebhookInbox.id == row["id"])
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+            if audit_ids:
+                await self._write_audit(db, audit_ids)
+            await db.commit()
+        return stats
+
+    async def _write_audit(self, db, ids: List[int]):
+        """
+        Копирует завершенные события в log.webhook_log одним INSERT ... SELECT.
+
+        ВАЖНО: ошибка журнала (например, нет партиции) не должна возвращать события
+        в очередь — запись идет в SAVEPOINT, при ошибке она откатывается и логируется.
+        """
+        try:
+            async with db.begin_nested():
+                await db.execute(
+                    insert(WebhookLog).from_select(
+                        ["source", "payload", "created_at"],
+                        select(WebhookInbox.source, WebhookInbox.payload, WebhookInbox.created_at)
+                        .where(WebhookInbox.id.in_(ids))
+                        .order_by(WebhookInbox.id),
+                    )
+                )
+        except Exception as e:
+            logger.error(f"Webhook inbox: failed to write {len(ids)} events to log.webhook_log: {e}", exc_info=True)
+
+    async def purge(self):
+        """Удаляет обработанные события старше WEBHOOK_INBOX_RETENTION_DAYS (не чаще раза в час)"""
+        now = time.monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + PURGE_INTERVAL_SECONDS
+        async with self.session_factory() as db:
+            result = await db.execute(_PURGE_SQL, {"days": settings.WEBHOOK_INBOX_RETENTION_DAYS})
+            await db.commit()
+        if result.rowcount:
+            logger.info(f"Webhook inbox: purged {result.rowcount} processed events")
+
+    async def run_once(self) -> Dict[str, int]:
+        """Один проход: claim → обработка по ключам с ограниченной параллельностью → фиксация"""
+        rows = await self.claim()
+        stats = {"events": len(rows), "keys": 0, "processed": 0, "retried": 0, "failed": 0, "deferred": 0}
+        if not rows:
+            return stats
+
+        by_key: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for row in rows:
+            by_key[row["ordering_key"]].append(row)
+        stats["keys"] = len(by_key)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(key_rows: List[Dict[str, Any]]):
+            async with semaphore:
+                return await self.process_ordered(key_rows)
+
+        batches = await asyncio.gather(*(run(key_rows) for key_rows in by_key.values()))
+        results = [result for batch in batches for result in batch]
+        stats.update(await self._finish(rows, results))
+        return stats
+
+
+class WebhookInboxWorker:
+    """Фоновый цикл процесса API: проход по очереди при wake() или раз в poll_seconds"""
+
+    def __init__(self, dispatcher_factory=WebhookInboxDispatcher, poll_seconds: Optional[float] = None):
+        self.dispatcher_factory = dispatcher_factory
+        self.poll_seconds = poll_seconds if poll_seconds is not None else settings.WEBHOOK_INBOX_POLL_SECONDS
+        self._dispatcher: Optional[WebhookInboxDispatcher] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                stats = await self._dispatcher.run_once()
+                if stats["events"]:
+                    logger.info(
+                        f"Webhook inbox: {stats['events']} events in {stats['keys']} conversations, "
+                        f"processed={stats['processed']}, retried={stats['retried']}, "
+                        f"failed={stats['failed']}, deferred={stats['deferred']}"
+                    )
+                    if stats["keys"] >= self._dispatcher.batch_size:
+                        continue
+                await self._dispatcher.purge()
+            except Exception as e:
+                logger.error(f"Webhook inbox worker error: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None and self.poll_seconds > 0:
+            self._dispatcher = self.dispatcher_factory()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._wakeup = None
+
+
+webhook_inbox_worker = WebhookInboxWorker()
+
+
+async def start_webhook_inbox_worker():
+    webhook_inbox_worker.start()
+
+
+async def stop_webhook_inbox_worker():
+    await webhook_inbox_worker.stop()
@@ -0,0 +1,53 @@
+"""
+Адаптивный интервал опроса 1C для ETL задач планировщика.
+
+Большинство минутных прогонов pull_calls_cl, pull_queue_closing_cl, pull_cons_rates_cl
+ничего не находят, но каждый раз делают полный круг запросов к 1C и БД.
+AdaptiveInterval подстраивает интервал под поток изменений:
+- прогон принес изменения — интервал уменьшается (shrink_factor), но не ниже min;
+- пустой прогон — интервал растет экспоненциально (backoff_factor), но не выше max;
+- ошибка или неизвестный результат (скрипт не сообщил число изменений) — интервал
+  не меняется.
+
+Срочный прогон по вебхуку 1C делается отдельно (scheduler.trigger_etl_job) и
+интервал не сбрасывает: если данные пришли, его сократит результат прогона.
+"""
+from typing import Optional
+
+
+class AdaptiveInterval:
+    """Интервал задачи в секундах с экспоненциальным backoff на пустых прогонах"""
+
+    def __init__(
+        self,
+        base_seconds: float,
+        min_seconds: float,
+        max_seconds: float,
+        backoff_factor: float = 2.0,
+        shrink_factor: float = 0.5,
+    ):
+        """
+        Args:
+            base_seconds: Стартовый интервал (интервал из env, например ETL_CALLS_INTERVAL)
+            min_seconds: Нижняя граница при активном потоке изменений
+            max_seconds: Верхняя граница при долгом отсутствии изменений
+        """
+        self.min_seconds = max(1.0, min(min_seconds, base_seconds))
+        self.max_seconds = max(max_seconds, base_seconds)
+        self.base_seconds = base_seconds
+        self.backoff_factor = max(1.0, backoff_factor)
+        self.shrink_factor = min(1.0, max(0.0, shrink_factor))
+        self.current = float(base_seconds)
+        self.empty_runs = 0
+
+    def record(self, changes: Optional[int], success: bool = True) -> float:
+        """Учитывает результат прогона и возвращает интервал до следующего"""
+        if not success or changes is None:
+            return self.current
+        if changes > 0:
+            self.empty_runs = 0
+            self.current = max(self.min_seconds, self.current * self.shrink_factor)
+        else:
+            self.empty_runs += 1
+            self.current = min(self.max_seconds, self.current * self.backoff_factor)
+        return self.current
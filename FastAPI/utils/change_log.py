@@ -20,6 +20,10 @@ async def log_consultation_change(
     """
     Логирует изменение поля консультации.
     
+    ВАЖНО: запись только добавляется в сессию (без flush на каждое изменение) —
+    все изменения транзакции уходят одним многострочным INSERT при ближайшем
+    flush/commit вызывающего кода и фиксируются атомарно с самим изменением.
+    
     Args:
         db: Сессия БД
         cons_id: ID консультации
@@ -43,7 +47,6 @@ async def log_consultation_change(
         created_at=datetime.now(timezone.utc)
     )
     db.add(change_log)
-    await db.flush()
 
 
 async def mark_change_synced(
@@ -0,0 +1,156 @@
+"""
+Короткие транзакции вокруг внешних вызовов и метрики пула соединений БД.
+
+Сессия get_db держит соединение из пула с первого запроса до commit в конце
+запроса. Обработчики консультаций (create_consultation, create_redate,
+submit_ratings, cancel_consultation, sync_consultation) между чтением и записью
+ждут Chatwoot и 1C:ЦЛ — секунды, и все это время соединение занято. При
+медленном 1C пул (DB_POOL_SIZE + DB_MAX_OVERFLOW) заканчивается, и запросы,
+которым внешние системы не нужны, ждут DB_POOL_TIMEOUT.
+
+Теперь такие обработчики разбиты на фазы:
+- DB-фаза — чтение и запись в сессии запроса (соединение занято);
+- внешняя фаза (external_phase) — перед ней транзакция завершается commit'ом,
+  соединение возвращается в пул, внутри — только HTTP вызовы.
+
+Сессия включает короткие транзакции через use_short_transactions(db) — в
+остальных сессиях (саги, ETL) external_phase ничего не делает, поэтому общие
+функции consultations.py можно вызывать и оттуда без изменения их транзакций.
+
+ВАЖНО: commit между фазами делает промежуточные данные видимыми другим
+запросам. Обработчик, которому при ошибке нужен откат, удаляет уже
+зафиксированные строки сам (см. _discard_consultation в routers.consultations).
+ORM объекты после commit остаются доступны (expire_on_commit=False).
+
+Запрос к БД внутри внешней фазы (новая транзакция) логируется и считается —
+снимок вместе с загрузкой пула и временем удержания соединений: GET /health/db-pool.
+"""
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+
+from .http_pool import CallLatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Ключи Session.info (AsyncSession.info — тот же словарь)
+SHORT_TRANSACTIONS = "short_transactions"
+EXTERNAL_PHASE = "external_phase"
+
+# Ключ ConnectionRecord.info — момент выдачи соединения из пула
+_CHECKOUT_AT = "checkout_at"
+
+
+class PoolStats:
+    """Загрузка пула соединений и время удержания соединения"""
+
+    def __init__(self):
+        self.capacity = 0
+        self.checked_out = 0
+        self.peak = 0
+        self.hold = CallLatencyStats()
+        self.external_phase_queries: Dict[str, int] = {}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "checked_out": self.checked_out,
+            "peak": self.peak,
+            "utilization": round(self.checked_out / self.capacity, 3) if self.capacity else None,
+            "hold": self.hold.snapshot(),
+            "external_phase_queries": dict(sorted(self.external_phase_queries.items())),
+        }
+
+
+pool_stats = PoolStats()
+
+
+def use_short_transactions(db: AsyncSession):
+    """Включает короткие транзакции для сессии запроса: external_phase отдает соединение"""
+    db.info[SHORT_TRANSACTIONS] = True
+
+
+def short_transactions_enabled(db: AsyncSession) -> bool:
+    return db.info.get(SHORT_TRANSACTIONS) is True
+
+
+async def release_connection(db: AsyncSession):
+    """Фиксирует текущую транзакцию сессии — соединение возвращается в пул"""
+    if db.in_transaction():
+        await db.commit()
+
+
+def in_external_phase(db: AsyncSession) -> bool:
+    return short_transactions_enabled(db) and bool(db.info.get(EXTERNAL_PHASE))
+
+
+async def flush_changes(db: AsyncSession):
+    """
+    flush сессии; во внешней фазе откладывается — измененные ORM объекты
+    сохранит следующая DB-фаза (autoflush=False, commit делает flush).
+    """
+    if not in_external_phase(db):
+        await db.flush()
+
+
+@asynccontextmanager
+async def external_phase(db: Optional[AsyncSession], name: str):
+    """
+    Внешние вызовы без соединения с БД.
+
+    Для сессии с короткими транзакциями текущая транзакция фиксируется перед
+    фазой; внутри фазы сессию использовать не нужно — следующий запрос к БД
+    откроет новую транзакцию. Для остальных сессий (и None) — ничего не делает.
+    """
+    if db is None or not short_transactions_enabled(db) or in_external_phase(db):
+        yield
+        return
+    await release_connection(db)
+    db.info[EXTERNAL_PHASE] = name
+    try:
+        yield
+    finally:
+        db.info.pop(EXTERNAL_PHASE, None)
+
+
+@event.listens_for(Session, "after_begin")
+def _after_begin(session, transaction, connection):
+    phase = session.info.get(EXTERNAL_PHASE)
+    if phase:
+        pool_stats.external_phase_queries[phase] = pool_stats.external_phase_queries.get(phase, 0) + 1
+        logger.warning(f"DB transaction started inside external phase '{phase}': connection is held during external calls")
+
+
+def instrument_pool(engine: AsyncEngine, capacity: int):
+    """Подписывает pool_stats на выдачу и возврат соединений пула engine (capacity — pool_size + max_overflow)"""
+    pool_stats.capacity = capacity
+
+    @event.listens_for(engine.sync_engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info[_CHECKOUT_AT] = time.perf_counter()
+        pool_stats.checked_out += 1
+        pool_stats.peak = max(pool_stats.peak, pool_stats.checked_out)
+
+    @event.listens_for(engine.sync_engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop(_CHECKOUT_AT, None)
+        if started is None:
+            return
+        pool_stats.checked_out = max(pool_stats.checked_out - 1, 0)
+        pool_stats.hold.record(time.perf_counter() - started, True)
+
+
+def pool_metrics_snapshot() -> Dict[str, Any]:
+    return pool_stats.snapshot()
+
+
+def reset_pool_metrics():
+    # Выданные сейчас соединения вернутся в пул позже — checked_out не сбрасываем
+    pool_stats.peak = pool_stats.checked_out
+    pool_stats.hold = CallLatencyStats()
+    pool_stats.external_phase_queries.clear()
@@ -11,6 +11,8 @@
 from typing import Optional, Dict, Any
 from datetime import datetime
 
+from .etl_runtime import report_etl_changes
+
 logger = logging.getLogger(__name__)
 
 
@@ -134,6 +136,8 @@ def finish(self, success: bool = True, error: Optional[Exception] = None):
         
         self.logger.info("=" * 80)
         if success:
+            # Для адаптивного расписания планировщика: были ли изменения в этом прогоне
+            report_etl_changes(self.total_created + self.total_updated)
             self.logger.info(
                 f"[{self.script_name}] ✅ Completed successfully "
                 f"(processed={self.total_processed}, created={self.total_created}, "
@@ -0,0 +1,111 @@
+"""
+Конвейер предзагрузки страниц для ETL скриптов (catalog_scripts).
+
+Обычный цикл ETL строго последовательный: скачать страницу из 1C → распарсить →
+обработать записи → commit → только потом скачать следующую. PagePrefetcher
+запускает источник страниц (async-генератор) в отдельной задаче и складывает
+страницы в ограниченную asyncio.Queue:
+
+- страница N+1 скачивается, пока страница N обрабатывается и пишется в БД;
+- глубина очереди (depth) ограничивает число страниц в памяти — при медленной БД
+  producer ждет на queue.put (backpressure) и не выкачивает весь 1C вперед;
+- исключение producer'а пробрасывается потребителю в том месте, где оно возникло.
+
+Время прохода стремится к max(сеть, БД) вместо их суммы.
+
+Использование:
+    async with PagePrefetcher(odata.iter_pages(paginator)) as pages:
+        async for batch in pages:
+            ...  # обработка и commit
+"""
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Generic, Optional, TypeVar
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class _ProducerError:
+    """Обертка исключения producer'а для передачи через очередь"""
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class PagePrefetcher(Generic[T]):
+    """Ограниченный producer/consumer конвейер поверх async-итератора страниц"""
+
+    def __init__(self, source: AsyncIterator[T], depth: Optional[int] = None):
+        """
+        Args:
+            source: Async-итератор страниц (например, ODataClient.iter_pages)
+            depth: Сколько страниц может лежать в очереди впереди потребителя
+                   (по умолчанию settings.ETL_PREFETCH_DEPTH)
+        """
+        self.source = source
+        self.depth = max(1, depth if depth is not None else settings.ETL_PREFETCH_DEPTH)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=self.depth)
+        self._task: Optional[asyncio.Task] = None
+
+        # Статистика: сколько потребитель простаивал в ожидании сети
+        self.pages = 0
+        self.consumer_wait_seconds = 0.0
+
+    async def _produce(self):
+        try:
+            async for page in self.source:
+                await self._queue.put(page)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as exc:
+            await self._queue.put(_ProducerError(exc))
+            return
+        await self._queue.put(_DONE)
+
+    async def __aenter__(self) -> "PagePrefetcher[T]":
+        self._task = asyncio.create_task(self._produce())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        aclose = getattr(self.source, "aclose", None)
+        if aclose:
+            await aclose()
+        if self.pages:
+            logger.debug(
+                "Prefetch pipeline: %s pages, consumer waited %.2f sec for network",
+                self.pages, self.consumer_wait_seconds,
+            )
+
+    def __aiter__(self) -> "PagePrefetcher[T]":
+        return self
+
+    async def __anext__(self) -> T:
+        if self._task is None:
+            raise RuntimeError("PagePrefetcher is not started (use 'async with PagePrefetcher(...)')")
+        started = time.monotonic()
+        item = await self._queue.get()
+        self.consumer_wait_seconds += time.monotonic() - started
+        if item is _DONE:
+            self._queue.put_nowait(_DONE)  # повторный __anext__ тоже завершает итерацию
+            raise StopAsyncIteration
+        if isinstance(item, _ProducerError):
+            raise item.exc
+        self.pages += 1
+        return item
@@ -0,0 +1,209 @@
+"""
+Общие ресурсы и in-process запуск ETL скриптов (catalog_scripts).
+
+В режиме subprocess (ETL_RUNNER_MODE=subprocess) планировщик запускает
+`python -m FastAPI.catalog_scripts.<name>` на каждый прогон: старт интерпретатора,
+все импорты, новый engine SQLAlchemy и новые TLS рукопожатия с 1C — несколько раз в минуту.
+
+В режиме inprocess (по умолчанию) модули скриптов импортируются один раз, а прогон —
+это asyncio задача в процессе планировщика:
+- все скрипты работают через один engine (create_etl_engine возвращает общий engine,
+  dispose_etl_engine его не закрывает);
+- ODataClient берет общий пул HTTP соединений к 1C (get_shared_odata_http);
+- каждый прогон изолирован: исключение и sys.exit() скрипта не роняют планировщик,
+  зависший прогон снимается по таймауту ETL_JOB_TIMEOUT_SECONDS.
+
+Скрипты по-прежнему запускаются и как `python -m ...` — тогда общих ресурсов нет
+и create_etl_engine создает собственный engine, как раньше.
+"""
+import asyncio
+import importlib
+import logging
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ETLJob:
+    """Точка входа ETL скрипта для in-process запуска"""
+    module: str
+    entry: str
+    setup: Optional[str] = None  # создание служебных таблиц, выполняется один раз за процесс
+    kwargs: Tuple[Tuple[str, Any], ...] = ()
+
+
+# Имена совпадают с именами скриптов в scheduler.run_etl_script
+ETL_JOBS: Dict[str, ETLJob] = {
+    "pull_clients_cl": ETLJob("FastAPI.catalog_scripts.pull_clients_cl", "pull_clients", "ensure_support_tables"),
+    "pull_cons_cl": ETLJob("FastAPI.catalog_scripts.pull_cons_cl", "pull_consultations", "ensure_sync_state_table"),
+    "pull_cons_cl:open_update": ETLJob(
+        "FastAPI.catalog_scripts.pull_cons_cl", "pull_consultations", "ensure_sync_state_table",
+        kwargs=(("mode", "open_update"),),
+    ),
+    "pull_cons_redate_cl": ETLJob("FastAPI.catalog_scripts.pull_cons_redate_cl", "pull_cons_redate", "ensure_support_objects"),
+    "pull_cons_rates_cl": ETLJob("FastAPI.catalog_scripts.pull_cons_rates_cl", "pull_cons_rates", "ensure_support_objects"),
+    "pull_calls_cl": ETLJob("FastAPI.catalog_scripts.pull_calls_cl", "pull_calls", "ensure_support_tables"),
+    "pull_queue_closing_cl": ETLJob("FastAPI.catalog_scripts.pull_queue_closing_cl", "pull_queue_closing"),
+    "pull_users_cl": ETLJob("FastAPI.catalog_scripts.pull_users_cl", "pull_users"),
+}
+
+
+@dataclass
+class ETLRunResult:
+    """Итог in-process прогона"""
+    ok: bool
+    changes: Optional[int] = None  # сколько строк изменил прогон (None — скрипт не сообщил)
+    duration: float = 0.0
+
+
+# Счетчик изменений текущего прогона; у каждой asyncio задачи своя копия контекста
+_run_changes: ContextVar[Optional[list]] = ContextVar("etl_run_changes", default=None)
+
+
+def report_etl_changes(count: int):
+    """
+    Скрипт сообщает, сколько строк из 1C он создал/обновил за прогон.
+
+    Используется адаптивным расписанием планировщика: пустые прогоны увеличивают
+    интервал, прогоны с данными — уменьшают. Вне in-process прогона ничего не делает.
+    """
+    box = _run_changes.get()
+    if box is not None:
+        box[0] = (box[0] or 0) + max(0, int(count))
+
+
+class ETLRuntime:
+    """Общие для всех in-process прогонов engine и пул HTTP соединений к OData"""
+
+    def __init__(self, database_url: str):
+        self.engine: AsyncEngine = create_async_engine(
+            database_url,
+            echo=False,
+            pool_size=settings.ETL_DB_POOL_SIZE,
+            max_overflow=settings.ETL_DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+        self.odata_http = httpx.AsyncClient(
+            auth=httpx.BasicAuth(settings.ODATA_USER, settings.ODATA_PASSWORD),
+            headers={"Accept": "application/json"},
+            timeout=settings.ODATA_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=settings.ODATA_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.ODATA_MAX_CONNECTIONS,
+                keepalive_expiry=settings.ODATA_KEEPALIVE_EXPIRY,
+            ),
+        )
+        self._setup_done: set = set()
+
+    async def aclose(self):
+        await self.odata_http.aclose()
+        await self.engine.dispose()
+
+
+_runtime: Optional[ETLRuntime] = None
+
+
+def get_etl_runtime() -> Optional[ETLRuntime]:
+    """Активный runtime in-process режима (None — скрипт запущен отдельным процессом)"""
+    return _runtime
+
+
+async def start_etl_runtime(database_url: Optional[str] = None) -> ETLRuntime:
+    global _runtime
+    if _runtime is None:
+        if database_url is None:
+            from ..database import DATABASE_URL
+            database_url = DATABASE_URL
+        _runtime = ETLRuntime(database_url)
+        logger.info("ETL runtime started (in-process mode, shared engine and OData pool)")
+    return _runtime
+
+
+async def stop_etl_runtime():
+    global _runtime
+    if _runtime is not None:
+        runtime, _runtime = _runtime, None
+        await runtime.aclose()
+        logger.info("ETL runtime stopped")
+
+
+def create_etl_engine(database_url: str, **engine_kwargs) -> AsyncEngine:
+    """Engine для ETL скрипта: общий в in-process режиме, собственный при запуске через python -m"""
+    if _runtime is not None:
+        return _runtime.engine
+    return create_async_engine(database_url, **engine_kwargs)
+
+
+async def dispose_etl_engine(engine: AsyncEngine):
+    """Закрывает engine скрипта; общий engine in-process режима не трогаем"""
+    if _runtime is not None and engine is _runtime.engine:
+        return
+    await engine.dispose()
+
+
+def get_shared_odata_http() -> Optional[httpx.AsyncClient]:
+    """Общий пул HTTP соединений к OData (None вне in-process режима)"""
+    return _runtime.odata_http if _runtime is not None else None
+
+
+def resolve_etl_job(name: str) -> Tuple[Callable[..., Awaitable[Any]], Optional[Callable[[], Awaitable[Any]]], Dict[str, Any]]:
+    """Импортирует модуль скрипта (один раз за процесс) и возвращает entry, setup и аргументы"""
+    job = ETL_JOBS[name]
+    module = importlib.import_module(job.module)
+    entry = getattr(module, job.entry)
+    setup = getattr(module, job.setup) if job.setup else None
+    return entry, setup, dict(job.kwargs)
+
+
+async def run_etl_job_inprocess(name: str, timeout: Optional[float] = None) -> ETLRunResult:
+    """
+    Запускает ETL задачу в текущем event loop.
+
+    Исключения, sys.exit() и таймаут скрипта логируются и не выходят за пределы
+    вызова — результат в ETLRunResult.ok.
+    """
+    runtime = await start_etl_runtime()
+    timeout = timeout if timeout is not None else settings.ETL_JOB_TIMEOUT_SECONDS
+    started = time.monotonic()
+    changes = [None]
+
+    async def guarded() -> Optional[int]:
+        # ВАЖНО: SystemExit ловим внутри корутины — вырвавшись из asyncio задачи,
+        # он остановил бы event loop планировщика
+        _run_changes.set(changes)
+        try:
+            entry, setup, kwargs = resolve_etl_job(name)
+            if setup is not None and name not in runtime._setup_done:
+                await setup()
+                runtime._setup_done.add(name)
+            await entry(**kwargs)
+            return 0
+        except SystemExit as exit_error:
+            return exit_error.code if isinstance(exit_error.code, int) else 1
+
+    try:
+        code = await asyncio.wait_for(guarded(), timeout=timeout if timeout and timeout > 0 else None)
+    except asyncio.TimeoutError:
+        logger.error(f"ETL task {name} timed out after {timeout} sec and was cancelled")
+        return ETLRunResult(ok=False, duration=time.monotonic() - started)
+    except Exception as e:
+        logger.error(f"ETL task {name} failed: {e}", exc_info=True)
+        return ETLRunResult(ok=False, duration=time.monotonic() - started)
+
+    elapsed = time.monotonic() - started
+    if code:
+        logger.error(f"ETL task {name} exited with code {code} ({elapsed:.1f} sec)")
+        return ETLRunResult(ok=False, changes=changes[0], duration=elapsed)
+    logger.info(f"ETL task {name} completed in {elapsed:.1f} sec (changes={changes[0]})")
+    return ETLRunResult(ok=True, changes=changes[0], duration=elapsed)
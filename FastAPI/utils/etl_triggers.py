@@ -0,0 +1,60 @@
+"""
+Срочный запуск ETL задач по событиям из 1C:ЦЛ.
+
+Вебхук /webhook/1c_cl вызывает request_etl_run: в текущей транзакции выполняется
+pg_notify(ETL_TRIGGER_CHANNEL, '<job_id>,...'). PostgreSQL доставляет уведомление
+только после commit, поэтому откаченный вебхук ничего не запускает. Планировщик
+(в API контейнере или отдельном cons_scheduler) слушает канал и переносит ближайший
+запуск задачи на "сейчас" (scheduler.trigger_etl_job).
+"""
+import logging
+from typing import Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+ETL_TRIGGER_CHANNEL = "etl_trigger"
+
+# ID задач планировщика (scheduler.setup_scheduler)
+JOB_CONSULTATIONS = "pull_clients_then_cons"
+JOB_REDATE = "pull_cons_redate_cl"
+
+# Какие задачи запускать по событию вебхука 1C
+WEBHOOK_EVENT_JOBS = {
+    "consultation.created": (JOB_CONSULTATIONS,),
+    "consultation.updated": (JOB_CONSULTATIONS,),
+    "consultation.closed": (JOB_CONSULTATIONS,),
+    "consultation.rescheduled": (JOB_CONSULTATIONS, JOB_REDATE),
+}
+
+
+def jobs_for_webhook_event(event_type: Optional[str]) -> List[str]:
+    """ID задач для события вебхука (неизвестные события — инкремент консультаций)"""
+    return list(WEBHOOK_EVENT_JOBS.get(event_type or "", (JOB_CONSULTATIONS,)))
+
+
+async def request_etl_run(db: AsyncSession, job_ids: Iterable[str]) -> None:
+    """
+    Просит планировщик запустить задачи немедленно.
+
+    ВАЖНО: уведомление уходит при commit сессии db; ошибка NOTIFY не должна ломать
+    обработку вебхука — задача все равно выполнится по расписанию.
+    """
+    if not settings.ETL_WEBHOOK_TRIGGER:
+        return
+    payload = ",".join(dict.fromkeys(job_ids))
+    if not payload:
+        return
+    try:
+        # SAVEPOINT: сбой NOTIFY не должен переводить транзакцию вебхука в aborted
+        async with db.begin_nested():
+            await db.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": ETL_TRIGGER_CHANNEL, "payload": payload},
+            )
+    except Exception as e:
+        logger.warning(f"Failed to request immediate ETL run ({payload}): {e}")
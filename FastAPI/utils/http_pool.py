@@ -0,0 +1,220 @@
+"""
+Общие пулы HTTP соединений к внешним сервисам и метрики задержек вызовов.
+
+Раньше каждый вызов Chatwoot и 1C (OneCClient) открывал свой `httpx.AsyncClient`:
+DNS, TCP и TLS рукопожатие на каждый запрос, а create_consultation делает несколько
+таких запросов подряд.
+Теперь пул создается один раз на процесс (main.lifespan / run_scheduler) и закрывается
+при остановке; соединения переиспользуются через keep-alive, а при установленном h2 —
+мультиплексируются через HTTP/2.
+
+Вне lifespan (ETL скрипты через python -m, тесты) пула нет: get_chatwoot_http() и
+get_onec_http() возвращают None и клиенты открывают одноразовое соединение, как раньше.
+
+Каждый вызов записывается в метрики по месту вызова ("METHOD /path/{id}"):
+число вызовов, ошибок, среднее/p50/p95/max задержки. Снимок — GET /health/http.
+"""
+import logging
+import re
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import httpx
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+CHATWOOT = "chatwoot"
+ONEC = "onec"
+
+# Сколько последних замеров хранится для перцентилей на одно место вызова
+LATENCY_SAMPLES = 256
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def http2_available() -> bool:
+    """HTTP/2 в httpx требует пакет h2 (httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _build_client(
+    max_connections: int,
+    keepalive_expiry: float,
+    timeout: float,
+    http2: bool,
+) -> httpx.AsyncClient:
+    if http2 and not http2_available():
+        logger.warning("HTTP/2 requested but h2 is not installed, falling back to HTTP/1.1 keep-alive")
+        http2 = False
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+    )
+
+
+async def start_http_clients():
+    """Создает общие пулы (идемпотентно). Вызывается при старте приложения"""
+    if CHATWOOT not in _clients:
+        _clients[CHATWOOT] = _build_client(
+            max_connections=settings.CHATWOOT_HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=settings.CHATWOOT_HTTP_KEEPALIVE_EXPIRY,
+            timeout=settings.CHATWOOT_HTTP_TIMEOUT,
+            http2=settings.CHATWOOT_HTTP2,
+        )
+        logger.info(
+            f"Chatwoot HTTP pool started (max_connections={settings.CHATWOOT_HTTP_MAX_CONNECTIONS}, "
+            f"http2={settings.CHATWOOT_HTTP2 and http2_available()})"
+        )
+    if ONEC not in _clients:
+        # 1C (Apache/IIS публикация) отвечает по HTTP/1.1 — только keep-alive
+        _clients[ONEC] = _build_client(
+            max_connections=settings.ONEC_HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=settings.ONEC_HTTP_KEEPALIVE_EXPIRY,
+            timeout=settings.ONEC_HTTP_TIMEOUT,
+            http2=False,
+        )
+        logger.info(f"1C HTTP pool started (max_connections={settings.ONEC_HTTP_MAX_CONNECTIONS})")
+
+
+async def close_http_clients():
+    """Закрывает общие пулы. Вызывается при остановке приложения"""
+    while _clients:
+        name, client = _clients.popitem()
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"Failed to close HTTP pool {name}: {e}")
+
+
+def get_shared_http(name: str) -> Optional[httpx.AsyncClient]:
+    """Общий пул сервиса (None — пул не запущен, нужен одноразовый клиент)"""
+    client = _clients.get(name)
+    if client is not None and client.is_closed:
+        return None
+    return client
+
+
+def get_chatwoot_http() -> Optional[httpx.AsyncClient]:
+    return get_shared_http(CHATWOOT)
+
+
+def get_onec_http() -> Optional[httpx.AsyncClient]:
+    return get_shared_http(ONEC)
+
+
+# --- Метрики задержек ---
+
+_ID_SEGMENT = re.compile(r"/(\d+|[0-9a-fA-F-]{32,36}|cl_[^/]+)(?=/|$)")
+
+
+def call_site(method: str, path: str) -> str:
+    """Метка места вызова: ID в пути заменяются на {id}, query отбрасывается"""
+    path = path.split("?", 1)[0]
+    return f"{method.upper()} {_ID_SEGMENT.sub('/{id}', path)}"
+
+
+class CallLatencyStats:
+    """Счетчики и последние замеры задержки одного места вызова"""
+
+    __slots__ = ("count", "errors", "total", "max", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: deque = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, duration: float, ok: bool):
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.samples.append(duration)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+
+        def percentile(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else 0.0,
+            "p50_ms": round(percentile(0.50) * 1000, 1),
+            "p95_ms": round(percentile(0.95) * 1000, 1),
+            "max_ms": round(self.max * 1000, 1),
+        }
+
+
+_metrics: Dict[str, Dict[str, CallLatencyStats]] = {}
+
+
+def record_http_call(service: str, site: str, duration: float, ok: bool = True):
+    stats = _metrics.setdefault(service, {}).get(site)
+    if stats is None:
+        stats = _metrics[service][site] = CallLatencyStats()
+    stats.record(duration, ok)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"{service} {site}: {duration * 1000:.1f} ms (ok={ok})")
+
+
+def http_metrics_snapshot() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    return {
+        service: {site: stats.snapshot() for site, stats in sorted(sites.items())}
+        for service, sites in _metrics.items()
+    }
+
+
+def reset_http_metrics():
+    _metrics.clear()
+
+
+async def send_request(
+    service: str,
+    client: Optional[httpx.AsyncClient],
+    method: str,
+    url: str,
+    site: Optional[str] = None,
+    timeout: Optional[float] = None,
+    **kwargs,
+) -> httpx.Response:
+    """
+    Выполняет запрос через общий пул (или одноразовый клиент, если пула нет)
+    и записывает задержку в метрики места вызова.
+
+    ВАЖНО: ответ полностью читается внутри вызова, поэтому одноразовый клиент
+    можно закрыть сразу.
+    """
+    if site is None:
+        site = call_site(method, httpx.URL(url).path)
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    started = time.perf_counter()
+    ok = False
+    try:
+        if client is not None:
+            response = await client.request(method, url, **kwargs)
+        else:
+            async with httpx.AsyncClient(timeout=timeout or 30.0) as one_shot:
+                response = await one_shot.request(method, url, **kwargs)
+        ok = response.status_code < 400
+        return response
+    finally:
+        record_http_call(service, site, time.perf_counter() - started, ok)
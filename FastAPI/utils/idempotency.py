@@ -1,15 +1,68 @@
 """
 Утилиты для работы с idempotency keys.
+
+- reserve_idempotency_key: проверка и резервирование ключа одним атомарным
+  INSERT ... ON CONFLICT (в отдельной короткой транзакции, чтобы резерв сразу видели
+  параллельные запросы). Резерв живет IDEMPOTENCY_LEASE_SECONDS, после сохранения
+  ответа — 24 часа;
+- завершенные ответы кэшируются в небольшом LRU процесса: повтор с тем же ключом
+  не доходит до БД;
+- истекшие ключи удаляет фоновая задача планировщика пачками
+  (sweep_expired_idempotency_keys), а не DELETE перед каждой проверкой.
 """
 import hashlib
 import json
-from typing import Optional, Dict, Any
+import logging
+import time as monotonic_time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Dict, Any, Tuple
 from datetime import datetime, timezone, timedelta, date, time
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
+from sqlalchemy import select, text
 
+from ..config import settings
 from ..models import IdempotencyKey
 
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyCache:
+    """LRU завершенных ответов: (key, operation_type) -> (request_hash, response_data, истекает monotonic)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[Tuple[str, str], Tuple[Optional[str], Dict[str, Any], float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str, operation_type: str) -> Optional[Tuple[Optional[str], Dict[str, Any]]]:
+        item = self._items.get((key, operation_type))
+        if item is None:
+            return None
+        if item[2] <= monotonic_time.monotonic():
+            del self._items[(key, operation_type)]
+            return None
+        self._items.move_to_end((key, operation_type))
+        return item[0], item[1]
+
+    def put(self, key: str, operation_type: str, request_hash: Optional[str], response_data: Dict[str, Any], expires_at: datetime):
+        if self.max_size <= 0:
+            return
+        ttl = (expires_at - datetime.now(timezone.utc)).total_seconds()
+        if ttl <= 0:
+            return
+        self._items[(key, operation_type)] = (request_hash, response_data, monotonic_time.monotonic() + ttl)
+        self._items.move_to_end((key, operation_type))
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+
+idempotency_cache = IdempotencyCache(settings.IDEMPOTENCY_CACHE_SIZE)
+
 
 def generate_request_hash(request_data: Dict[str, Any]) -> str:
     """
@@ -56,10 +109,14 @@ async def check_idempotency_key(
     Returns:
         Кэшированный response_data если ключ найден и валиден, None иначе
     """
-    # Удаляем истекшие ключи
-    await cleanup_expired_keys(db)
+    cached = idempotency_cache.get(key, operation_type)
+    if cached is not None:
+        cached_hash, response_data = cached
+        if request_hash and cached_hash and cached_hash != request_hash:
+            return None
+        return response_data
     
-    # Ищем ключ
+    # Ищем ключ (истекшие удаляет sweep_expired_idempotency_keys)
     result = await db.execute(
         select(IdempotencyKey).where(
             IdempotencyKey.key == key,
@@ -78,10 +135,112 @@ async def check_idempotency_key(
             # Запрос отличается от оригинального - это ошибка
             return None
     
+    if idempotency_record.response_data:
+        idempotency_cache.put(
+            key, operation_type, idempotency_record.request_hash,
+            idempotency_record.response_data, idempotency_record.expires_at,
+        )
+    
     # Возвращаем кэшированный ответ
     return idempotency_record.response_data
 
 
+class IdempotencyReservation(NamedTuple):
+    """
+    Результат reserve_idempotency_key.
+
+    status:
+        reserved    — ключ свободен и зарезервирован этим запросом
+        completed   — запрос уже выполнен, response_data — сохраненный ответ
+        in_progress — ключ занят выполняющимся запросом
+        mismatch    — ключ использован с другим телом запроса
+    """
+    status: str
+    response_data: Optional[Dict[str, Any]] = None
+
+
+_RESERVE_SQL = text("""
+    WITH reserved AS (
+        INSERT INTO sys.idempotency_keys (key, operation_type, request_hash, expires_at)
+        VALUES (:key, :operation_type, :request_hash, :lease_until)
+        ON CONFLICT ON CONSTRAINT uq_idempotency_key DO UPDATE SET
+            request_hash = EXCLUDED.request_hash,
+            resource_id = NULL,
+            response_data = NULL,
+            expires_at = EXCLUDED.expires_at,
+            created_at = now()
+        WHERE idempotency_keys.expires_at <= now()
+        RETURNING 1
+    )
+    SELECT true AS reserved, NULL::text AS request_hash, NULL::jsonb AS response_data FROM reserved
+    UNION ALL
+    SELECT false, request_hash, response_data FROM sys.idempotency_keys
+    WHERE key = :key AND operation_type = :operation_type AND NOT EXISTS (SELECT 1 FROM reserved)
+""")
+
+
+def _classify(request_hash: Optional[str], stored_hash: Optional[str], response_data) -> IdempotencyReservation:
+    if request_hash and stored_hash and stored_hash != request_hash:
+        return IdempotencyReservation("mismatch")
+    if response_data:
+        return IdempotencyReservation("completed", response_data)
+    return IdempotencyReservation("in_progress")
+
+
+async def reserve_idempotency_key(
+    key: str,
+    operation_type: str,
+    request_hash: Optional[str] = None,
+    lease_seconds: Optional[int] = None,
+) -> IdempotencyReservation:
+    """
+    Проверяет и резервирует idempotency key за один запрос к БД.
+
+    Завершенные ответы берутся из LRU процесса без обращения к БД. Истекший ключ,
+    который еще не удалил sweeper, резервируется заново.
+    ВАЖНО: резерв коммитится сразу (отдельное соединение); при ошибке запроса его нужно
+    снять release_idempotency_key, иначе повтор получит in_progress до конца lease.
+    """
+    from ..database import engine
+
+    cached = idempotency_cache.get(key, operation_type)
+    if cached is not None:
+        return _classify(request_hash, cached[0], cached[1])
+
+    lease_until = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds or settings.IDEMPOTENCY_LEASE_SECONDS)
+    async with engine.begin() as conn:
+        row = (await conn.execute(_RESERVE_SQL, {
+            "key": key,
+            "operation_type": operation_type,
+            "request_hash": request_hash,
+            "lease_until": lease_until,
+        })).first()
+
+    if row is None:
+        # Ключ зарезервирован параллельной транзакцией после начала нашего запроса
+        return IdempotencyReservation("in_progress")
+    if row.reserved:
+        return IdempotencyReservation("reserved")
+    return _classify(request_hash, row.request_hash, row.response_data)
+
+
+async def release_idempotency_key(key: str, operation_type: str) -> None:
+    """Снимает резерв ключа, если ответ не был сохранен (запрос завершился ошибкой)"""
+    from ..database import engine
+
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("""
+                    DELETE FROM sys.idempotency_keys
+                    WHERE key = :key AND operation_type = :operation_type AND response_data IS NULL
+                """),
+                {"key": key, "operation_type": operation_type},
+            )
+    except Exception as e:
+        logger.warning(f"Failed to release idempotency key {key}: {e}")
+
+
 async def store_idempotency_key(
     db: AsyncSession,
     key: str,
@@ -127,8 +286,6 @@ def json_serializer(obj):
             serialized_response_data = json.loads(json_str)
         except Exception as e:
             # Если не удалось сериализовать, логируем и не сохраняем response_data
-            import logging
-            logger = logging.getLogger(__name__)
             logger.warning(f"Failed to serialize response_data for idempotency key {key}: {e}")
             serialized_response_data = None
     
@@ -155,24 +312,51 @@ def json_serializer(obj):
     
     await db.execute(stmt)
     await db.flush()
+    if serialized_response_data:
+        idempotency_cache.put(key, operation_type, request_hash, serialized_response_data, expires_at)
 
 
-async def cleanup_expired_keys(db: AsyncSession) -> int:
+async def cleanup_expired_keys(db: AsyncSession, batch_size: int = 1000) -> int:
     """
-    Удаляет истекшие idempotency keys.
+    Удаляет одну пачку истекших idempotency keys (по индексу expires_at).
     
     Args:
         db: Сессия БД
+        batch_size: Максимум ключей за вызов
     
     Returns:
         Количество удаленных ключей
     """
     result = await db.execute(
-        delete(IdempotencyKey).where(
-            IdempotencyKey.expires_at < datetime.now(timezone.utc)
-        )
+        text("""
+            DELETE FROM sys.idempotency_keys
+            WHERE id IN (
+                SELECT id FROM sys.idempotency_keys
+                WHERE expires_at < now()
+                ORDER BY expires_at
+                LIMIT :batch_size
+                FOR UPDATE SKIP LOCKED
+            )
+        """),
+        {"batch_size": batch_size},
     )
-    deleted_count = result.rowcount
-    await db.flush()
-    return deleted_count
+    return result.rowcount
+
+
+async def sweep_expired_idempotency_keys(batch_size: Optional[int] = None, max_batches: int = 100) -> int:
+    """
+    Фоновая очистка истекших ключей (задача планировщика): пачки в отдельных
+    коротких транзакциях, чтобы не держать блокировки на большом объеме.
+    """
+    from ..database import AsyncSessionLocal
 
+    batch_size = batch_size or settings.IDEMPOTENCY_SWEEP_BATCH_SIZE
+    total = 0
+    for _ in range(max_batches):
+        async with AsyncSessionLocal() as db:
+            deleted = await cleanup_expired_keys(db, batch_size)
+            await db.commit()
+        total += deleted
+        if deleted < batch_size:
+            break
+    return total
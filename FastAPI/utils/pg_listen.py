@@ -0,0 +1,66 @@
+"""
+LISTEN на канал PostgreSQL через отдельное asyncpg соединение с переподключением.
+
+Используется для межпроцессных уведомлений: срочные запуски ETL (etl_trigger)
+и обновления консультаций для SSE/WebSocket (consultation_updates). Соединение
+одно на процесс и канал и не занимает пул SQLAlchemy.
+"""
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+async def listen_forever(
+    channel: str,
+    on_payload: Callable[[str], None],
+    on_state: Optional[Callable[[bool], None]] = None,
+):
+    """
+    Слушает канал до отмены задачи; при обрыве переподключается с backoff до 60 сек.
+
+    Args:
+        channel: Имя канала NOTIFY
+        on_payload: Синхронный обработчик payload (вызывается в event loop)
+        on_state: Вызывается с True после LISTEN и с False при потере соединения
+    """
+    import asyncpg
+
+    def _listener(connection, pid, notified_channel, payload):
+        try:
+            on_payload(payload)
+        except Exception as e:
+            logger.warning(f"Handler for channel '{notified_channel}' failed: {e}")
+
+    delay = 1
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(
+                user=settings.DB_USER,
+                password=settings.DB_PASS,
+                host=settings.DB_HOST,
+                port=settings.DB_PORT,
+                database=settings.DB_NAME,
+            )
+            await conn.add_listener(channel, _listener)
+            logger.info(f"Listening on channel '{channel}'")
+            if on_state:
+                on_state(True)
+            delay = 1
+            while not conn.is_closed():
+                await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Listener on channel '{channel}' error: {e}, reconnecting in {delay}s")
+        finally:
+            if on_state:
+                on_state(False)
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60)
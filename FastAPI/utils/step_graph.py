@@ -0,0 +1,120 @@
+"""
+Граф асинхронных шагов и метрики их длительности.
+
+create_consultation выполняет несколько независимых шагов (поиск клиента в 1C и
+подбор менеджера, контакт Chatwoot, поиск команды, custom_attributes беседы).
+run_step_graph запускает каждый шаг, как только завершены шаги из его `after`,
+поэтому длительность запроса определяется самой длинной цепочкой, а не суммой.
+
+ВАЖНО: AsyncSession нельзя использовать из нескольких задач одновременно —
+шаги, которые выполняются параллельно, либо не трогают сессию запроса, либо
+открывают свою (AsyncSessionLocal). Шаг, которому нужна сессия запроса, должен
+зависеть от остальных таких шагов через `after`.
+
+Длительность каждого шага, графа (если задан name) и всего запроса (TOTAL_STEP)
+записывается по потоку ("create_consultation") и имени шага. Снимок — GET /health/steps.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from .http_pool import CallLatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Имя записи с длительностью всего потока (критического пути)
+TOTAL_STEP = "total"
+
+
+class Step(NamedTuple):
+    name: str
+    # Получает словарь результатов уже завершенных шагов (имя шага -> результат)
+    action: Callable[[Dict[str, Any]], Awaitable[Any]]
+    after: Tuple[str, ...] = ()
+
+
+_timings: Dict[str, Dict[str, CallLatencyStats]] = {}
+
+
+def record_step_timing(flow: str, step: str, duration: float, ok: bool = True):
+    stats = _timings.setdefault(flow, {}).get(step)
+    if stats is None:
+        stats = _timings[flow][step] = CallLatencyStats()
+    stats.record(duration, ok)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"{flow}.{step}: {duration * 1000:.1f} ms (ok={ok})")
+
+
+def step_timings_snapshot() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    return {
+        flow: {step: stats.snapshot() for step, stats in sorted(steps.items())}
+        for flow, steps in _timings.items()
+    }
+
+
+def reset_step_timings():
+    _timings.clear()
+
+
+@asynccontextmanager
+async def timed_step(flow: str, step: str):
+    """Замер последовательного шага (вне графа) в тех же метриках"""
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        record_step_timing(flow, step, time.perf_counter() - started, ok)
+
+
+async def run_step_graph(
+    flow: str,
+    steps: Iterable[Step],
+    results: Optional[Dict[str, Any]] = None,
+    name: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Выполняет шаги с учетом зависимостей, независимые — одновременно.
+
+    Результаты пишутся в `results` по мере завершения шагов: при ошибке вызывающий
+    код видит, какие шаги успели выполниться. Ошибка шага отменяет незавершенные
+    шаги и пробрасывается как есть (первая по времени). name — имя записи
+    с длительностью всего графа.
+    """
+    results = {} if results is None else results
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(step: Step):
+        if step.after:
+            await asyncio.gather(*(tasks[dependency] for dependency in step.after))
+        async with timed_step(flow, step.name):
+            results[step.name] = await step.action(results)
+
+    steps = list(steps)
+    seen = set()
+    for step in steps:
+        missing = [dependency for dependency in step.after if dependency not in seen]
+        if missing:
+            raise ValueError(f"Step {step.name} depends on unknown or later steps: {missing}")
+        seen.add(step.name)
+
+    for step in steps:
+        tasks[step.name] = asyncio.ensure_future(run(step))
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    finally:
+        if name:
+            record_step_timing(flow, name, time.perf_counter() - started, all(
+                task.done() and not task.cancelled() and task.exception() is None for task in tasks.values()
+            ))
+    return results
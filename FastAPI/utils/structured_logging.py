@@ -3,6 +3,7 @@
 """
 import logging
 import json
+import random
 from typing import Dict, Any, Optional
 from datetime import datetime, timezone
 
@@ -91,3 +92,36 @@ def log_with_context(
     
     logger.log(level, message, extra=extra)
 
+
+
+class LazyJson:
+    """
+    JSON представление объекта, которое строится только при форматировании записи лога.
+
+    Используется как аргумент %-форматирования: logger.debug("body: %s", LazyJson(data)) —
+    если уровень DEBUG выключен, json.dumps не вызывается.
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: Optional[int] = None):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        try:
+            text = json.dumps(self.value, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            text = repr(self.value)
+        if self.limit is not None and len(text) > self.limit:
+            return text[:self.limit] + f"...(+{len(text) - self.limit} chars)"
+        return text
+
+
+def sampled(rate: float) -> bool:
+    """True для доли rate вызовов (rate <= 0 — никогда, rate >= 1 — всегда)"""
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    return random.random() < rate
@@ -0,0 +1,131 @@
+"""
+Бенчмарк пагинации OData: $skip vs keyset (ODataKeysetPaginator).
+
+1C отдает страницу $top=N&$skip=K, прочитав K+N строк по индексу сортировки,
+поэтому суммарная работа при полном проходе по бэклогу растет квадратично.
+Скрипт поднимает фейковый OData endpoint (httpx.MockTransport), прогоняет через
+ODataClient оба способа и считает:
+    - returned — сколько строк 1C вернула клиенту;
+    - scanned  — сколько строк 1C пришлось прочитать, чтобы собрать страницы.
+
+Запуск:
+    python -m benchmarks.bench_odata_pagination
+    python -m benchmarks.bench_odata_pagination --sizes 1000 10000 50000 --page-size 500
+"""
+import argparse
+import asyncio
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+from FastAPI.services.odata_client import ODataClient, ODataKeysetPaginator
+
+ENTITY_URL = "https://odata.bench/Document_ТелефонныйЗвонок"
+SEEK_FIELD = "ДатаИзменения"
+FILTER_RE = re.compile(r"^(\w+) ge datetime'([^']+)'$")
+
+
+def make_rows(count: int) -> List[Dict[str, Any]]:
+    """Строки с повторяющимися ДатаИзменения (по 3 на секунду), как при пакетной записи в 1C"""
+    start = datetime(2025, 1, 1)
+    rows = [
+        {
+            SEEK_FIELD: (start + timedelta(seconds=i // 3)).strftime("%Y-%m-%dT%H:%M:%S"),
+            "Ref_Key": str(uuid.UUID(int=i + 1)),
+        }
+        for i in range(count)
+    ]
+    rows.sort(key=lambda r: (r[SEEK_FIELD], r["Ref_Key"]))
+    return rows
+
+
+class FakeOData:
+    """Минимальный OData: $filter=<field> ge datetime'...', $orderby, $top, $skip"""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+        self.returned = 0
+        self.scanned = 0
+        self.requests = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        params = {k: v[0] for k, v in parse_qs(urlsplit(str(request.url)).query).items()}
+        top = int(params.get("$top", "1000"))
+        skip = int(params.get("$skip", "0"))
+
+        candidates = self.rows
+        if "$filter" in params:
+            match = FILTER_RE.match(params["$filter"])
+            if not match:
+                return httpx.Response(400, text=f"unsupported filter: {params['$filter']}")
+            field, bound = match.groups()
+            # Поиск нижней границы по индексу — строки до нее не читаются
+            candidates = [r for r in self.rows if r[field] >= bound]
+
+        page = candidates[skip:skip + top]
+        self.requests += 1
+        self.returned += len(page)
+        self.scanned += min(len(candidates), skip + top)
+        return httpx.Response(200, json={"value": page})
+
+
+async def run_skip(rows: List[Dict[str, Any]], page_size: int) -> FakeOData:
+    server = FakeOData(rows)
+    async with ODataClient(base_url=ENTITY_URL, auth=("bench", "bench")) as odata:
+        odata._client = httpx.AsyncClient(transport=httpx.MockTransport(server))
+        skip = 0
+        while True:
+            resp = await odata.get(
+                f"{ENTITY_URL}?$format=json"
+                f"&$filter={SEEK_FIELD} ge datetime'2025-01-01T00:00:00'"
+                f"&$orderby={SEEK_FIELD} asc, Ref_Key asc"
+                f"&$top={page_size}&$skip={skip}"
+            )
+            batch = resp.json()["value"]
+            if len(batch) < page_size:
+                break
+            skip += page_size
+    return server
+
+
+async def run_keyset(rows: List[Dict[str, Any]], page_size: int) -> FakeOData:
+    server = FakeOData(rows)
+    paginator = ODataKeysetPaginator(
+        entity_url=ENTITY_URL,
+        seek_field=SEEK_FIELD,
+        start_value="2025-01-01T00:00:00",
+        page_size=page_size,
+    )
+    async with ODataClient(base_url=ENTITY_URL, auth=("bench", "bench")) as odata:
+        odata._client = httpx.AsyncClient(transport=httpx.MockTransport(server))
+        while not paginator.exhausted:
+            resp = await odata.get(paginator.next_url())
+            paginator.advance(resp.json()["value"])
+    return server
+
+
+async def main(sizes: List[int], page_size: int):
+    print(f"page_size={page_size}")
+    print(f"{'backlog':>9} | {'mode':>6} | {'requests':>8} | {'returned':>9} | {'scanned':>12} | {'scanned/row':>11}")
+    print("-" * 72)
+    for size in sizes:
+        rows = make_rows(size)
+        for mode, runner in (("skip", run_skip), ("keyset", run_keyset)):
+            server = await runner(rows, page_size)
+            assert server.returned == size, f"{mode}: returned {server.returned} of {size}"
+            print(
+                f"{size:>9} | {mode:>6} | {server.requests:>8} | {server.returned:>9} | "
+                f"{server.scanned:>12} | {server.scanned / max(size, 1):>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OData $skip vs keyset pagination benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000, 50000])
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.page_size))
@@ -0,0 +1,125 @@
+"""
+Нагрузочный тест рассылки WebSocket: тысячи локальных клиентов на одну консультацию.
+
+Скрипт поднимает uvicorn с настоящим роутером /ws/consultations (начальное состояние
+подменено, БД не нужна), открывает --clients соединений, из них --slow не читают
+сообщения, и публикует --messages обновлений через consultation_event_hub — тот же
+путь, что и NOTIFY consultation_updates. Считает:
+    - время подключения всех клиентов;
+    - задержку доставки обновления до читающих клиентов (p50/p95/max);
+    - сколько медленных клиентов отключено (очередь WS_SEND_QUEUE_SIZE переполнена).
+
+Запуск:
+    python -m benchmarks.bench_ws_broadcast
+    python -m benchmarks.bench_ws_broadcast --clients 5000 --slow 50 --messages 200
+
+ВАЖНО: на тысячи соединений нужен лимит файловых дескрипторов (ulimit -n 20000).
+Клиенты и сервер работают в одном event loop, поэтому задержки — оценка сверху.
+"""
+import argparse
+import asyncio
+import json
+import secrets
+import statistics
+import time
+from contextlib import asynccontextmanager
+from typing import List
+from unittest.mock import patch
+
+import uvicorn
+import websockets
+from fastapi import FastAPI
+
+from FastAPI.routers import websocket as ws
+from FastAPI.services.consultation_events import consultation_event_hub
+
+CONS_ID = "bench-1"
+
+
+@asynccontextmanager
+async def _no_db():
+    yield None
+
+
+async def _initial_state(db, cons_ids):
+    return {cons_id: {"consultation": {"cons_id": cons_id}} for cons_id in cons_ids}
+
+
+async def _fast_client(uri: str, expected: int, latencies: List[float], ready: asyncio.Event):
+    async with websockets.connect(uri, max_size=None, compression=None) as conn:
+        await conn.recv()  # initial
+        ready.set()
+        received = 0
+        while received < expected:
+            message = json.loads(await conn.recv())
+            latencies.append(time.perf_counter() - message["data"]["sent_at"])
+            received += 1
+
+
+async def _slow_client(uri: str, done: asyncio.Event):
+    async with websockets.connect(uri, max_size=None, max_queue=1, compression=None) as conn:
+        await conn.recv()
+        await done.wait()  # не читаем: буферы заполняются, сервер отключает клиента
+
+
+async def main(clients: int, slow: int, messages: int, payload_bytes: int, port: int, interval: float):
+    app = FastAPI()
+    app.include_router(ws.router, prefix="/ws/consultations")
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", ws="websockets"))
+
+    with patch.object(ws, "AsyncSessionLocal", _no_db), patch.object(ws, "load_consultation_updates", _initial_state):
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+
+        uri = f"ws://127.0.0.1:{port}/ws/consultations/{CONS_ID}"
+        latencies: List[float] = []
+        done = asyncio.Event()
+        ready_events = [asyncio.Event() for _ in range(clients - slow)]
+
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(_fast_client(uri, messages, latencies, ev)) for ev in ready_events]
+        tasks += [asyncio.create_task(_slow_client(uri, done)) for _ in range(slow)]
+        await asyncio.gather(*(ev.wait() for ev in ready_events))
+        while len(ws.manager.active_connections.get(CONS_ID, {})) < clients:
+            await asyncio.sleep(0.05)
+        connect_seconds = time.perf_counter() - started
+
+        for n in range(messages):
+            padding = secrets.token_hex(payload_bytes // 2)  # несжимаемые данные
+            consultation_event_hub.deliver(CONS_ID, {
+                "has_updates": True,
+                "consultation": {"cons_id": CONS_ID, "n": n, "sent_at": time.perf_counter(), "padding": padding},
+                "updated_at": f"2025-01-10T09:00:00.{n:06d}+00:00",
+            })
+            await asyncio.sleep(interval)
+
+        await asyncio.gather(*tasks[:clients - slow])
+        total_seconds = time.perf_counter() - started
+        done.set()
+        await asyncio.gather(*tasks[clients - slow:], return_exceptions=True)
+
+        server.should_exit = True
+        await server_task
+
+    latencies_ms = sorted(x * 1000 for x in latencies)
+    print(f"clients={clients} (slow={slow}) messages={messages} payload={payload_bytes}B")
+    print(f"connect all:        {connect_seconds:8.2f} s")
+    print(f"total:              {total_seconds:8.2f} s")
+    print(f"deliveries:         {len(latencies_ms):8d}")
+    print(f"latency p50:        {statistics.median(latencies_ms):8.1f} ms")
+    print(f"latency p95:        {latencies_ms[int(len(latencies_ms) * 0.95) - 1]:8.1f} ms")
+    print(f"latency max:        {latencies_ms[-1]:8.1f} ms")
+    print(f"slow disconnects:   {ws.manager.slow_disconnects:8d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket broadcast load test")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--slow", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--payload-bytes", type=int, default=8192)
+    parser.add_argument("--interval", type=float, default=0.05, help="Пауза между обновлениями (сек)")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.slow, args.messages, args.payload_bytes, args.port, args.interval))
@@ -10,37 +10,47 @@
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 
+TEST_ENV = {
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_NAME": "test_db",
+    "DB_USER": "test_user",
+    "DB_PASS": "test_pass",
+    "ENV": "test",
+    "DEBUG": "false",
+    "FRONT_SECRET": "test-secret-key",
+    "FRONT_BEARER_TOKEN": "test-bearer-token",
+    "CHATWOOT_API_URL": "https://chatwoot.test.local",
+    "CHATWOOT_API_TOKEN": "test-chatwoot-token",
+    "CHATWOOT_ACCOUNT_ID": "1",
+    "CHATWOOT_INBOX_ID": "1",
+    "CHATWOOT_INBOX_IDENTIFIER": "test-inbox-identifier",
+    "ODATA_BASE_URL": "https://odata.test.local",
+    "ODATA_BASEURL_CL": "https://odata.test.local",
+    "ODATA_USER": "test_odata_user",
+    "ODATA_PASSWORD": "test_odata_pass",
+    "TELEGRAM_BOT_TOKEN": "123456789:TEST_TOKEN_FOR_TESTING",
+    "TELEGRAM_WEBHOOK_URL": "https://webhook.test.local/telegram",
+    "RATE_LIMIT_PER_MINUTE": "10000",
+    "RATE_LIMIT_CREATE_PER_MINUTE": "1000",
+}
+
+
+def pytest_configure(config):
+    """
+    Test environment before collection: FastAPI.config builds settings on first
+    import, and a test module importing FastAPI at module level must not depend
+    on collection order.
+    """
+    os.environ.update(TEST_ENV)
+
+
 @pytest.fixture(scope="session", autouse=True)
 def setup_test_environment():
     """Setup test environment variables."""
-    test_env = {
-        "DB_HOST": "localhost",
-        "DB_PORT": "5432",
-        "DB_NAME": "test_db",
-        "DB_USER": "test_user",
-        "DB_PASS": "test_pass",
-        "ENV": "test",
-        "DEBUG": "false",
-        "FRONT_SECRET": "test-secret-key",
-        "FRONT_BEARER_TOKEN": "test-bearer-token",
-        "CHATWOOT_API_URL": "https://chatwoot.test.local",
-        "CHATWOOT_API_TOKEN": "test-chatwoot-token",
-        "CHATWOOT_ACCOUNT_ID": "1",
-        "CHATWOOT_INBOX_ID": "1",
-        "CHATWOOT_INBOX_IDENTIFIER": "test-inbox-identifier",
-        "ODATA_BASE_URL": "https://odata.test.local",
-        "ODATA_BASEURL_CL": "https://odata.test.local",
-        "ODATA_USER": "test_odata_user",
-        "ODATA_PASSWORD": "test_odata_pass",
-        "TELEGRAM_BOT_TOKEN": "123456789:TEST_TOKEN_FOR_TESTING",
-        "TELEGRAM_WEBHOOK_URL": "https://webhook.test.local/telegram",
-        "RATE_LIMIT_PER_MINUTE": "10000",
-        "RATE_LIMIT_CREATE_PER_MINUTE": "1000",
-    }
-    for key, value in test_env.items():
-        os.environ[key] = value
+    os.environ.update(TEST_ENV)
     yield
-    for key in test_env:
+    for key in TEST_ENV:
         os.environ.pop(key, None)
 
 
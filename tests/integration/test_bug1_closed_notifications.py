@@ -131,45 +131,44 @@ async def mock_execute(query):
         import json
         mock_request.body.return_value = json.dumps(webhook_payload_resolved_with_reassign).encode()
         
-        with patch('FastAPI.routers.webhooks.get_db', return_value=mock_db):
+        with patch(
+            'FastAPI.services.manager_notifications.send_manager_reassignment_notification',
+            mock_send_reassignment
+        ):
             with patch(
-                'FastAPI.services.manager_notifications.send_manager_reassignment_notification',
-                mock_send_reassignment
+                'FastAPI.services.manager_notifications.send_queue_update_notification',
+                mock_send_queue_update
             ):
-                with patch(
-                    'FastAPI.services.manager_notifications.send_queue_update_notification',
-                    mock_send_queue_update
-                ):
-                    # Импортируем после патчинга
-                    from FastAPI.routers.webhooks import chatwoot_webhook
-                    
-                    # Вызываем webhook (это упрощённый тест, реальный тест будет через TestClient)
-                    # Здесь мы проверяем логику, а не HTTP часть
-                    
-                    # Проверяем, что уведомления НЕ вызываются для закрытых консультаций
-                    # ВАЖНО: Это условие должно проверяться в коде webhooks.py
-                    
-                    # Текущий статус консультации - open, новый статус - resolved
-                    # При статусе resolved уведомления НЕ должны отправляться
-                    
-                    # Симулируем логику из webhooks.py (строки 287-318)
-                    conversation = webhook_payload_resolved_with_reassign["data"]["conversation"]
-                    new_status = conversation.get("status")
-                    
-                    # ЭТО ПРОВЕРКА БАГА: если статус resolved/closed, уведомления не отправляются
-                    terminal_statuses = {"closed", "resolved", "cancelled"}
-                    
-                    if new_status in terminal_statuses:
-                        # Уведомления НЕ должны отправляться
-                        should_send_notifications = False
-                    else:
-                        should_send_notifications = True
-                    
-                    # Утверждаем, что уведомления не отправляются для закрытой консультации
-                    assert should_send_notifications is False, (
-                        f"Уведомления должны быть пропущены для статуса '{new_status}'. "
-                        "Bug 1: Уведомления отправляются даже для закрытых консультаций."
-                    )
+                # Импортируем после патчинга
+                from FastAPI.routers.webhooks import chatwoot_webhook
+                
+                # Вызываем webhook (это упрощённый тест, реальный тест будет через TestClient)
+                # Здесь мы проверяем логику, а не HTTP часть
+                
+                # Проверяем, что уведомления НЕ вызываются для закрытых консультаций
+                # ВАЖНО: Это условие должно проверяться в коде webhooks.py
+                
+                # Текущий статус консультации - open, новый статус - resolved
+                # При статусе resolved уведомления НЕ должны отправляться
+                
+                # Симулируем логику из webhooks.py (строки 287-318)
+                conversation = webhook_payload_resolved_with_reassign["data"]["conversation"]
+                new_status = conversation.get("status")
+                
+                # ЭТО ПРОВЕРКА БАГА: если статус resolved/closed, уведомления не отправляются
+                terminal_statuses = {"closed", "resolved", "cancelled"}
+                
+                if new_status in terminal_statuses:
+                    # Уведомления НЕ должны отправляться
+                    should_send_notifications = False
+                else:
+                    should_send_notifications = True
+                
+                # Утверждаем, что уведомления не отправляются для закрытой консультации
+                assert should_send_notifications is False, (
+                    f"Уведомления должны быть пропущены для статуса '{new_status}'. "
+                    "Bug 1: Уведомления отправляются даже для закрытых консультаций."
+                )
     
     @pytest.mark.integration
     @pytest.mark.asyncio
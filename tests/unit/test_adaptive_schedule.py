@@ -0,0 +1,116 @@
+"""
+Тесты адаптивного расписания ETL и срочного запуска по вебхуку 1C.
+
+Проверяем:
+    - backoff интервала на пустых прогонах и сокращение при изменениях (в пределах min/max)
+    - перепланирование задачи планировщика по результату прогона
+    - срочный запуск: перенос ближайшего запуска или повтор после текущего прогона
+    - NOTIFY из вебхука
+"""
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from FastAPI import scheduler as etl_scheduler
+from FastAPI.utils.adaptive_schedule import AdaptiveInterval
+from FastAPI.utils.etl_triggers import ETL_TRIGGER_CHANNEL, jobs_for_webhook_event, request_etl_run
+
+
+class TestAdaptiveInterval:
+
+    @pytest.mark.unit
+    def test_empty_runs_back_off_up_to_max(self):
+        policy = AdaptiveInterval(base_seconds=60, min_seconds=30, max_seconds=300)
+
+        intervals = [policy.record(0) for _ in range(5)]
+
+        assert intervals == [120, 240, 300, 300, 300]
+        assert policy.empty_runs == 5
+
+    @pytest.mark.unit
+    def test_changes_shrink_down_to_min(self):
+        policy = AdaptiveInterval(base_seconds=60, min_seconds=30, max_seconds=300)
+        policy.record(0)
+        policy.record(0)
+
+        assert policy.record(10) == 120
+        assert policy.record(5) == 60
+        assert policy.record(1) == 30
+        assert policy.record(1) == 30
+        assert policy.empty_runs == 0
+
+    @pytest.mark.unit
+    def test_unknown_or_failed_run_keeps_interval(self):
+        policy = AdaptiveInterval(base_seconds=60, min_seconds=30, max_seconds=300)
+
+        assert policy.record(None) == 60
+        assert policy.record(0, success=False) == 60
+
+
+class TestSchedulerAdaptiveJobs:
+
+    @pytest.fixture(autouse=True)
+    def clean_state(self, monkeypatch):
+        monkeypatch.setattr(etl_scheduler, "adaptive_intervals", {})
+        monkeypatch.setattr(etl_scheduler, "job_started_at", {})
+        monkeypatch.setattr(etl_scheduler, "job_triggered_at", {})
+        monkeypatch.setattr(etl_scheduler, "running_tasks", set())
+        monkeypatch.setattr(etl_scheduler, "ETL_ADAPTIVE_SCHEDULING", True)
+
+    @pytest.mark.unit
+    def test_empty_run_reschedules_job(self):
+        etl_scheduler.register_adaptive_job("pull_calls_cl", 1)
+        with patch.object(etl_scheduler, "scheduler") as sched:
+            etl_scheduler.job_finished("pull_calls_cl", changes=0)
+
+        trigger = sched.reschedule_job.call_args.kwargs["trigger"]
+        assert trigger.interval.total_seconds() == 120
+
+    @pytest.mark.unit
+    def test_trigger_moves_next_run_to_now(self):
+        job = MagicMock()
+        with patch.object(etl_scheduler, "scheduler") as sched:
+            sched.running = True
+            sched.get_job.return_value = job
+            assert etl_scheduler.trigger_etl_job("pull_clients_then_cons") is True
+
+        assert job.modify.call_args.kwargs["next_run_time"] is not None
+
+    @pytest.mark.unit
+    def test_trigger_during_run_reruns_after_completion(self):
+        job = MagicMock()
+        with patch.object(etl_scheduler, "scheduler") as sched:
+            sched.running = True
+            sched.get_job.return_value = job
+            etl_scheduler.job_started("pull_calls_cl")
+            etl_scheduler.running_tasks.add("pull_calls_cl")
+            etl_scheduler.trigger_etl_job("pull_calls_cl")
+            job.modify.assert_not_called()
+
+            etl_scheduler.running_tasks.discard("pull_calls_cl")
+            etl_scheduler.job_finished("pull_calls_cl", changes=3)
+
+        job.modify.assert_called_once()
+
+
+class TestWebhookTrigger:
+
+    @pytest.mark.unit
+    def test_event_to_jobs(self):
+        assert jobs_for_webhook_event("consultation.updated") == ["pull_clients_then_cons"]
+        assert "pull_cons_redate_cl" in jobs_for_webhook_event("consultation.rescheduled")
+        assert jobs_for_webhook_event(None) == ["pull_clients_then_cons"]
+
+    @pytest.mark.unit
+    async def test_request_sends_notify_in_transaction(self):
+        db = MagicMock()
+        db.execute = AsyncMock()
+        nested = MagicMock()
+        nested.__aenter__ = AsyncMock()
+        nested.__aexit__ = AsyncMock(return_value=False)
+        db.begin_nested.return_value = nested
+
+        await request_etl_run(db, ["pull_clients_then_cons", "pull_cons_redate_cl", "pull_clients_then_cons"])
+
+        params = db.execute.call_args.args[1]
+        assert params == {"channel": ETL_TRIGGER_CHANNEL, "payload": "pull_clients_then_cons,pull_cons_redate_cl"}
@@ -0,0 +1,158 @@
+"""
+Тесты известных контактов Chatwoot (services.chatwoot_contacts).
+
+Проверяем:
+    - LRU: вытеснение и сброс по ID контакта
+    - недавно проверенный контакт используется без запросов к Chatwoot
+    - устаревший контакт проверяется одним GET, удаленный — ищется заново
+    - вебхуки contact.* обновляют и удаляют записи
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+
+from FastAPI.routers import consultations
+from FastAPI.services import chatwoot_contacts
+from FastAPI.services.chatwoot_contacts import (
+    CONTACT_DELETED,
+    CONTACT_UPDATED,
+    ChatwootContactCache,
+    ContactRef,
+    apply_contact_event,
+    chatwoot_contact_cache,
+    verify_contact,
+)
+
+CLIENT_ID = uuid.uuid4()
+
+
+def ref(contact_id=7, source_id="src-7", age_seconds=0, client_id=CLIENT_ID):
+    verified_at = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+    return ContactRef(str(client_id), contact_id, source_id, "pubsub-7", verified_at)
+
+
+def make_client():
+    return SimpleNamespace(
+        client_id=CLIENT_ID, email="ivan@example.com", phone_number="+79991234567",
+        source_id=None, chatwoot_pubsub_token=None, name="Иван", contact_name=None,
+    )
+
+
+def not_found():
+    request = httpx.Request("GET", "http://chatwoot/api/v1/accounts/1/contacts/7")
+    return httpx.HTTPStatusError("404", request=request, response=httpx.Response(404, request=request))
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    chatwoot_contact_cache.clear()
+    yield
+    chatwoot_contact_cache.clear()
+
+
+class TestContactCache:
+
+    @pytest.mark.unit
+    def test_lru_eviction_and_discard(self):
+        cache = ChatwootContactCache(max_size=2)
+        first, second, third = (ref(contact_id=i, client_id=uuid.uuid4()) for i in (1, 2, 2))
+        cache.put(first)
+        cache.put(second)
+        cache.get(first.client_id)
+        cache.put(third)
+
+        assert cache.get(second.client_id) is None
+        assert cache.get(first.client_id) == first
+
+        cache.discard(contact_id=2)
+        assert len(cache) == 1
+
+    @pytest.mark.unit
+    async def test_verify_contact_single_get(self):
+        chatwoot = MagicMock()
+        chatwoot.get_contact = AsyncMock(return_value={"payload": {"id": 7, "contact_inboxes": [{"source_id": "src-7"}]}})
+        old = ref(age_seconds=3600)
+
+        verified = await verify_contact(chatwoot, old)
+        assert verified.verified_at > old.verified_at
+
+        chatwoot.get_contact.return_value = {"payload": {"id": 7, "contact_inboxes": [{"source_id": "other"}]}}
+        assert await verify_contact(chatwoot, old) is None
+        chatwoot.get_contact.side_effect = not_found()
+        assert await verify_contact(chatwoot, old) is None
+
+
+class TestResolveContact:
+
+    @pytest.mark.unit
+    async def test_fresh_known_contact_skips_chatwoot(self):
+        chatwoot_contact_cache.put(ref())
+        chatwoot = MagicMock()
+        db = MagicMock()
+        db.flush = AsyncMock()
+        client = make_client()
+
+        with patch.object(consultations, "_search_chatwoot_contact", AsyncMock()) as search:
+            result = await consultations._resolve_chatwoot_contact(db, chatwoot, client, client)
+
+        assert result == (7, "src-7", "pubsub-7")
+        assert client.source_id == "src-7" and client.chatwoot_pubsub_token == "pubsub-7"
+        search.assert_not_awaited()
+        assert not chatwoot.method_calls
+
+    @pytest.mark.unit
+    async def test_deleted_contact_is_forgotten_and_searched(self):
+        chatwoot_contact_cache.put(ref(age_seconds=86400))
+        chatwoot = MagicMock()
+        chatwoot.get_contact = AsyncMock(side_effect=not_found())
+        db = MagicMock()
+        client = make_client()
+
+        with patch.object(consultations, "_search_chatwoot_contact", AsyncMock(return_value=(9, "src-9", None))) as search, \
+                patch.object(consultations, "forget_contact", AsyncMock()) as forget, \
+                patch.object(consultations, "remember_contact", AsyncMock()) as remember:
+            result = await consultations._resolve_chatwoot_contact(db, chatwoot, client, client)
+
+        assert result == (9, "src-9", None)
+        chatwoot.get_contact.assert_awaited_once_with(7)
+        forget.assert_awaited_once_with(db, 7)
+        search.assert_awaited_once()
+        remembered = remember.await_args.args[1]
+        assert (remembered.contact_id, remembered.source_id) == (9, "src-9")
+        assert remember.await_args.kwargs == {"email": "ivan@example.com", "phone": "+79991234567"}
+
+
+class TestContactWebhooks:
+
+    @pytest.mark.unit
+    async def test_deleted_contact(self):
+        chatwoot_contact_cache.put(ref())
+        db = MagicMock()
+        db.execute = AsyncMock()
+
+        assert await apply_contact_event(db, CONTACT_DELETED, {"id": 7}) == "forgotten"
+        assert len(chatwoot_contact_cache) == 0
+        db.execute.assert_awaited_once()
+
+    @pytest.mark.unit
+    async def test_updated_contact_with_identifier(self):
+        db = MagicMock()
+        db.execute = AsyncMock()
+        contact = {
+            "id": 7,
+            "identifier": str(CLIENT_ID),
+            "email": "new@example.com",
+            "contact_inboxes": [{"source_id": "src-7", "inbox": {"id": 1}}],
+        }
+
+        with patch.object(chatwoot_contacts, "remember_contact", AsyncMock()) as remember:
+            assert await apply_contact_event(db, CONTACT_UPDATED, contact) == "remembered"
+            assert await apply_contact_event(db, CONTACT_UPDATED, {**contact, "identifier": None}) == "updated"
+
+        remembered = remember.await_args.args[1]
+        assert remembered.client_id == str(CLIENT_ID) and remembered.source_id == "src-7"
+        assert remember.await_count == 1
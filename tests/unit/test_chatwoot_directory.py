@@ -0,0 +1,122 @@
+"""
+Тесты справочника Chatwoot (services.chatwoot_directory).
+
+Проверяем:
+    - раздел загружается одним запросом и ищется по email, имени, custom_attributes
+    - промах перезагружает раздел не чаще CHATWOOT_DIRECTORY_MISS_REFRESH_SECONDS
+    - ошибка перезагрузки — отдаются прежние данные
+    - подсказка вебхука с неизвестной командой перезагружает раздел
+    - ChatwootClient: метки и команды — без GET на каждый вызов
+"""
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from FastAPI.config import settings
+from FastAPI.services.chatwoot_client import ChatwootClient
+from FastAPI.services.chatwoot_directory import AGENTS, TEAMS, ChatwootDirectory, chatwoot_directory
+
+AGENT = {
+    "id": 5,
+    "name": "Иван  Петров",
+    "available_name": "Ваня",
+    "email": "Ivan@Example.com",
+    "custom_attributes": {"cl_ref_key": "ref-5"},
+}
+
+
+def fake_client(agents=None, teams=None):
+    client = MagicMock()
+    client.get_agents = AsyncMock(return_value={"payload": agents if agents is not None else [AGENT]})
+    client.get_teams = AsyncMock(return_value=teams or [])
+    return client
+
+
+@pytest.fixture
+def chatwoot_settings(monkeypatch):
+    monkeypatch.setattr(settings, "CHATWOOT_API_URL", "https://chatwoot.test")
+    monkeypatch.setattr(settings, "CHATWOOT_API_TOKEN", "token")
+    monkeypatch.setattr(settings, "CHATWOOT_ACCOUNT_ID", "1")
+
+
+@pytest.fixture(autouse=True)
+def clean_directory():
+    chatwoot_directory.clear()
+    yield
+    chatwoot_directory.clear()
+
+
+class TestChatwootDirectory:
+
+    @pytest.mark.unit
+    async def test_single_load_indexed_lookups(self):
+        directory = ChatwootDirectory(ttl_seconds=600, miss_refresh_seconds=60)
+        client = fake_client()
+
+        assert await directory.find(client, AGENTS, "email", "ivan@example.com") == AGENT
+        assert await directory.find(client, AGENTS, "name", "иван петров") == AGENT
+        assert await directory.find(client, AGENTS, "name", "ваня") == AGENT
+        assert await directory.find(client, AGENTS, "attribute", ("cl_ref_key", "ref-5")) == AGENT
+        assert await directory.find(client, AGENTS, "id", 5) == AGENT
+        # Промах сразу после загрузки не перезагружает раздел
+        assert await directory.find(client, AGENTS, "email", "nobody@example.com") is None
+
+        client.get_agents.assert_awaited_once()
+
+    @pytest.mark.unit
+    async def test_miss_refresh_and_failed_refresh(self):
+        directory = ChatwootDirectory(ttl_seconds=600, miss_refresh_seconds=0)
+        client = fake_client(agents=[])
+        assert await directory.find(client, AGENTS, "id", 5) is None
+
+        client.get_agents.return_value = [AGENT]
+        assert await directory.find(client, AGENTS, "id", 5) == AGENT
+
+        client.get_agents.side_effect = RuntimeError("chatwoot down")
+        directory.invalidate(AGENTS)
+        assert await directory.find(client, AGENTS, "email", "ivan@example.com") == AGENT
+
+    @pytest.mark.unit
+    async def test_webhook_hint_with_unknown_team(self):
+        directory = ChatwootDirectory(ttl_seconds=600, miss_refresh_seconds=600)
+        client = fake_client(teams=[{"id": 1, "name": "Бухгалтерия"}])
+        await directory.list_items(client, TEAMS)
+
+        directory.note_webhook({"conversation": {"meta": {"team": {"id": 1, "name": "Бухгалтерия"}}}})
+        await directory.list_items(client, TEAMS)
+        assert client.get_teams.await_count == 1
+
+        client.get_teams.return_value = [{"id": 1, "name": "Бухгалтерия"}, {"id": 2, "name": "Новая"}]
+        directory.note_webhook({"meta": {"team": {"id": 2, "name": "Новая"}}})
+        assert (await directory.find(client, TEAMS, "name", "новая"))["id"] == 2
+        assert client.get_teams.await_count == 2
+
+
+class TestChatwootClientDirectory:
+
+    @pytest.mark.unit
+    async def test_labels_loaded_once_and_created_labels_remembered(self, chatwoot_settings):
+        client = ChatwootClient()
+
+        async def request(method, endpoint, **kwargs):
+            if method == "GET":
+                return {"payload": [{"id": 1, "title": "рус"}]}
+            return {"id": 2, "title": kwargs["data"]["title"]}
+
+        client._request = AsyncMock(side_effect=request)
+
+        for label in ("рус", "тг", "тг", "рус"):
+            assert await client.ensure_label_exists(label) is True
+
+        methods = [call.args[0] for call in client._request.await_args_list]
+        assert methods == ["GET", "POST"]
+
+    @pytest.mark.unit
+    async def test_team_lookup_uses_directory(self, chatwoot_settings):
+        client = ChatwootClient()
+        client._request = AsyncMock(return_value=[{"id": 3, "name": "Техническая поддержка"}])
+
+        for _ in range(3):
+            assert await client.find_team_by_name("техническая поддержка", expected_name="Техническая поддержка") == 3
+
+        client._request.assert_awaited_once()
@@ -0,0 +1,235 @@
+"""
+Тесты outbox побочных эффектов Chatwoot (FastAPI/services/chatwoot_outbox.py).
+
+Проверяем:
+    - схлопывание событий одной conversation (последний статус, слияние custom_attributes)
+    - ограничение параллельности доставки
+    - retry с backoff и перевод в failed
+    - claim: новая запись conversation не обгоняет старую, которая ждет повтора
+    - сообщение в чат — последним: сбой уведомления о менеджере не дублирует его при повторе
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import pytest
+from sqlalchemy import event, insert, update
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.ext.compiler import compiles
+
+from FastAPI.models import ChatwootOutbox
+
+from FastAPI.services.chatwoot_outbox import (
+    EVENT_CUSTOM_ATTRIBUTES,
+    EVENT_MANAGER_CHANGE,
+    EVENT_STATUS,
+    ChatwootOutboxDispatcher,
+    coalesce_events,
+    is_retryable_error,
+)
+
+
+def _row(row_id, conversation_id, event_type, payload, attempts=1):
+    return {
+        "id": row_id,
+        "conversation_id": conversation_id,
+        "event_type": event_type,
+        "payload": payload,
+        "attempts": attempts,
+    }
+
+
+@compiles(JSONB, "sqlite")
+def _jsonb_as_json(type_, compiler, **kw):
+    return "JSON"
+
+
+@pytest.fixture
+async def outbox_sessions(tmp_path):
+    """sys.chatwoot_outbox в SQLite: проверяем выборку claim без PostgreSQL"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'outbox.db'}")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def attach_sys_schema(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE '{tmp_path / 'sys.db'}' AS sys")
+        dbapi_connection.create_function("hashtext", 1, hash)
+        dbapi_connection.create_function("pg_try_advisory_xact_lock", 1, lambda key: True)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(ChatwootOutbox.__table__.create)
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+def _session_factory(db):
+    session = MagicMock()
+    session.__aenter__ = AsyncMock(return_value=db)
+    session.__aexit__ = AsyncMock(return_value=False)
+    return lambda: session
+
+
+def _dispatcher(rows, chatwoot, **kwargs):
+    db = MagicMock()
+    db.execute = AsyncMock()
+    db.commit = AsyncMock()
+    dispatcher = ChatwootOutboxDispatcher(
+        session_factory=_session_factory(db),
+        chatwoot_client=chatwoot,
+        batch_size=100,
+        **kwargs,
+    )
+    dispatcher.claim = AsyncMock(return_value=rows)
+    return dispatcher, db
+
+
+class TestCoalesceEvents:
+
+    @pytest.mark.unit
+    def test_last_status_wins_and_attributes_merge(self):
+        rows = [
+            _row(1, "42", EVENT_STATUS, {"status": "pending"}),
+            _row(2, "42", EVENT_CUSTOM_ATTRIBUTES, {"custom_attributes": {"number_con": "1", "con_end": "a"}}),
+            _row(3, "42", EVENT_STATUS, {"status": "resolved", "message": "Заявка была закрыта."}),
+            _row(4, "42", EVENT_CUSTOM_ATTRIBUTES, {"custom_attributes": {"con_end": "b"}}),
+            _row(5, "43", EVENT_STATUS, {"status": "open"}),
+        ]
+
+        plans = {p.conversation_id: p for p in coalesce_events(rows)}
+
+        assert plans["42"].row_ids == [1, 2, 3, 4]
+        assert plans["42"].status_event == (EVENT_STATUS, {"status": "resolved", "message": "Заявка была закрыта."})
+        assert plans["42"].custom_attributes == {"number_con": "1", "con_end": "b"}
+        assert plans["43"].row_ids == [5]
+
+
+class TestChatwootOutboxDispatcher:
+
+    @pytest.mark.unit
+    async def test_coalesced_events_make_one_call_per_kind(self):
+        chatwoot = MagicMock()
+        chatwoot.toggle_conversation_status = AsyncMock()
+        chatwoot.update_conversation = AsyncMock()
+        chatwoot.update_conversation_custom_attributes = AsyncMock()
+        chatwoot.send_message = AsyncMock()
+        rows = [
+            _row(1, "42", EVENT_STATUS, {"status": "pending"}),
+            _row(2, "42", EVENT_CUSTOM_ATTRIBUTES, {"custom_attributes": {"number_con": "1"}}),
+            _row(3, "42", EVENT_STATUS, {"status": "resolved", "message": "Заявка была закрыта."}),
+            _row(4, "42", EVENT_CUSTOM_ATTRIBUTES, {"custom_attributes": {"number_con": "2"}}),
+        ]
+        dispatcher, _ = _dispatcher(rows, chatwoot)
+
+        stats = await dispatcher.run_once()
+
+        assert stats["delivered"] == 4
+        chatwoot.update_conversation.assert_not_awaited()
+        chatwoot.toggle_conversation_status.assert_awaited_once_with(conversation_id="42", status="resolved")
+        chatwoot.update_conversation_custom_attributes.assert_awaited_once_with(
+            conversation_id="42", custom_attributes={"number_con": "2"}
+        )
+        chatwoot.send_message.assert_awaited_once()
+
+    @pytest.mark.unit
+    async def test_message_is_sent_after_manager_notifications(self):
+        chatwoot = MagicMock()
+        chatwoot.toggle_conversation_status = AsyncMock()
+        chatwoot.send_message = AsyncMock()
+        rows = [
+            _row(1, "42", EVENT_STATUS, {"status": "resolved", "message": "Заявка была закрыта."}),
+            _row(2, "42", EVENT_MANAGER_CHANGE, {"new_manager_key": "m-2"}),
+        ]
+        dispatcher, _ = _dispatcher(rows, chatwoot)
+        dispatcher._notify_manager_change = AsyncMock(side_effect=RuntimeError("db down"))
+
+        stats = await dispatcher.run_once()
+
+        assert stats["retried"] == 2
+        chatwoot.send_message.assert_not_awaited()
+
+    @pytest.mark.unit
+    async def test_concurrency_is_bounded(self):
+        in_flight = 0
+        peak = 0
+
+        async def slow_update(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        chatwoot = MagicMock()
+        chatwoot.update_conversation_custom_attributes = AsyncMock(side_effect=slow_update)
+        rows = [
+            _row(i, str(100 + i), EVENT_CUSTOM_ATTRIBUTES, {"custom_attributes": {"number_con": str(i)}})
+            for i in range(10)
+        ]
+        dispatcher, _ = _dispatcher(rows, chatwoot, concurrency=3)
+
+        stats = await dispatcher.run_once()
+
+        assert stats["conversations"] == 10
+        assert stats["delivered"] == 10
+        assert peak == 3
+
+    @pytest.mark.unit
+    async def test_transient_error_is_retried_then_failed(self):
+        chatwoot = MagicMock()
+        chatwoot.update_conversation_custom_attributes = AsyncMock(side_effect=httpx.ConnectError("down"))
+        payload = {"custom_attributes": {"number_con": "1"}}
+
+        dispatcher, _ = _dispatcher([_row(1, "42", EVENT_CUSTOM_ATTRIBUTES, payload, attempts=1)], chatwoot, max_attempts=3)
+        stats = await dispatcher.run_once()
+        assert stats["retried"] == 1
+        assert stats["failed"] == 0
+
+        dispatcher, _ = _dispatcher([_row(1, "42", EVENT_CUSTOM_ATTRIBUTES, payload, attempts=3)], chatwoot, max_attempts=3)
+        stats = await dispatcher.run_once()
+        assert stats["retried"] == 0
+        assert stats["failed"] == 1
+
+    @pytest.mark.unit
+    def test_client_errors_are_not_retried(self):
+        request = httpx.Request("POST", "https://chatwoot.test")
+
+        def status_error(code):
+            return httpx.HTTPStatusError("error", request=request, response=httpx.Response(code, request=request))
+
+        assert not is_retryable_error(status_error(404))
+        assert is_retryable_error(status_error(429))
+        assert is_retryable_error(status_error(503))
+        assert is_retryable_error(httpx.ReadTimeout("timeout"))
+
+
+class TestClaim:
+
+    @pytest.mark.unit
+    async def test_newer_event_waits_for_retrying_one(self, outbox_sessions):
+        # SQLite: now() — CURRENT_TIMESTAMP, UTC без зоны
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        rows = [
+            # conversation 1: статус ждет повтора, за ним в очереди смена атрибутов
+            dict(id=1, conversation_id="1", event_type=EVENT_STATUS, next_attempt_at=now + timedelta(minutes=5)),
+            dict(id=2, conversation_id="1", event_type=EVENT_CUSTOM_ATTRIBUTES, next_attempt_at=now - timedelta(seconds=5)),
+            dict(id=3, conversation_id="2", event_type=EVENT_STATUS, next_attempt_at=now - timedelta(seconds=5)),
+        ]
+        async with outbox_sessions() as db:
+            await db.execute(insert(ChatwootOutbox), [dict(row, payload={}, status="pending", attempts=0) for row in rows])
+            await db.commit()
+        dispatcher = ChatwootOutboxDispatcher(session_factory=outbox_sessions, chatwoot_client=MagicMock(), batch_size=10)
+
+        claimed = await dispatcher.claim()
+
+        assert [row["id"] for row in claimed] == [3]
+
+        # conversation 2 доставлена; срок повтора наступил — conversation 1 забирается целиком
+        async with outbox_sessions() as db:
+            await db.execute(update(ChatwootOutbox).where(ChatwootOutbox.id == 3).values(status="done"))
+            await db.execute(
+                update(ChatwootOutbox).where(ChatwootOutbox.id == 1).values(next_attempt_at=now - timedelta(seconds=1))
+            )
+            await db.commit()
+
+        assert sorted(row["id"] for row in await dispatcher.claim()) == [1, 2]
@@ -0,0 +1,102 @@
+"""
+Тесты pub/sub обновлений консультаций для SSE (services.consultation_events).
+
+Проверяем:
+    - ID консультаций режутся на payload NOTIFY в пределах лимита
+    - отстающий подписчик теряет самое старое сообщение, а не блокирует остальных
+    - уведомления без локальных подписчиков не читают БД, пачка склеивается в один запрос
+    - уведомление, пришедшее во время загрузки, доставляется без следующего NOTIFY
+"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from FastAPI.services import consultation_events
+from FastAPI.services.consultation_events import ConsultationEventHub, _notify_payloads
+
+
+class TestNotifyPayloads:
+
+    @pytest.mark.unit
+    def test_payloads_fit_limit_and_deduplicate(self):
+        cons_ids = [f"{i:010d}" for i in range(2000)] + ["0000000001", ""]
+
+        payloads = _notify_payloads(cons_ids)
+
+        assert len(payloads) > 1
+        assert all(len(p.encode()) <= consultation_events.NOTIFY_PAYLOAD_LIMIT for p in payloads)
+        assert ",".join(payloads).split(",") == [f"{i:010d}" for i in range(2000)]
+
+
+class TestConsultationEventHub:
+
+    @pytest.mark.unit
+    def test_slow_subscriber_drops_oldest(self):
+        hub = ConsultationEventHub(queue_size=2)
+        slow = hub.subscribe("c1")
+        other = hub.subscribe("c2")
+
+        for n in range(3):
+            hub.deliver("c1", {"n": n})
+
+        assert [slow.get_nowait()["n"] for _ in range(slow.qsize())] == [1, 2]
+        assert other.empty()
+
+        hub.unsubscribe("c1", slow)
+        assert hub.subscriber_count == 1
+
+    @pytest.mark.unit
+    async def test_notifications_are_filtered_and_coalesced(self):
+        hub = ConsultationEventHub()
+        queue = hub.subscribe("c1")
+        load = AsyncMock(return_value={"c1": {"has_updates": True, "updated_at": "2025-01-10T09:00:00+00:00"}})
+
+        with patch.object(consultation_events, "load_consultation_updates", load), \
+                patch("FastAPI.database.AsyncSessionLocal") as session_factory:
+            session_factory.return_value.__aenter__ = AsyncMock(return_value="db")
+            session_factory.return_value.__aexit__ = AsyncMock(return_value=False)
+
+            hub.handle_notification("c9,c10")
+            assert hub._flush_task is None
+
+            hub.handle_notification("c1,c9")
+            hub.handle_notification("c1")
+            await hub._flush_task
+
+        load.assert_awaited_once_with("db", ["c1"])
+        assert queue.get_nowait()["has_updates"] is True
+        assert queue.empty()
+
+        await hub.stop()
+
+    @pytest.mark.unit
+    async def test_notification_during_slow_load_is_delivered(self):
+        hub = ConsultationEventHub()
+        first = hub.subscribe("c1")
+        second = hub.subscribe("c2")
+        loading = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_load(db, cons_ids):
+            if not loading.is_set():
+                loading.set()
+                await release.wait()
+            return {c: {"has_updates": True, "cons_id": c} for c in cons_ids}
+
+        with patch.object(consultation_events, "load_consultation_updates", AsyncMock(side_effect=slow_load)) as load, \
+                patch("FastAPI.database.AsyncSessionLocal") as session_factory:
+            session_factory.return_value.__aenter__ = AsyncMock(return_value="db")
+            session_factory.return_value.__aexit__ = AsyncMock(return_value=False)
+
+            hub.handle_notification("c1")
+            await loading.wait()
+            hub.handle_notification("c2")
+            release.set()
+            await asyncio.wait_for(hub._flush_task, timeout=1)
+
+        assert [call.args[1] for call in load.await_args_list] == [["c1"], ["c2"]]
+        assert first.get_nowait()["cons_id"] == "c1"
+        assert second.get_nowait()["cons_id"] == "c2"
+
+        await hub.stop()
@@ -0,0 +1,219 @@
+"""
+Тесты асинхронного создания консультации (services.consultation_saga).
+
+Проверяем:
+    - асинхронный режим включается только заголовком Prefer и работающим воркером
+    - повтор саги продолжает с первого незавершенного шага
+    - ошибка шага откладывает сагу, исчерпанные попытки — шаг failed, сага идет дальше
+    - SagaAbort откатывает выполненные шаги и отменяет консультацию
+    - неидемпотентный шаг: in_flight до вызова, без повтора после неясной ошибки
+"""
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+
+from FastAPI.models import ChatwootOutbox, Consultation, ConsultationCreateSaga
+from FastAPI.services import consultation_saga
+from FastAPI.services.consultation_saga import (
+    CONSULTATION_SAGA_STEPS,
+    SAGA_COMPENSATED,
+    SAGA_DONE,
+    SAGA_PENDING,
+    STEP_IN_FLIGHT,
+    ConsultationSagaDispatcher,
+    SagaAbort,
+    SagaStep,
+)
+
+
+class FakeSession:
+    """Сессия поверх общего хранилища: get по (модель, ключ), add и commit"""
+
+    def __init__(self, store):
+        self.store = store
+        self.added = []
+        self.commit = AsyncMock()
+        self.rollback = AsyncMock()
+
+    async def get(self, model, key):
+        return self.store.get((model, key))
+
+    def add(self, obj):
+        self.added.append(obj)
+
+    async def flush(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def make_dispatcher(steps, max_attempts=3):
+    saga_id = uuid.uuid4()
+    saga = SimpleNamespace(
+        id=saga_id, cons_id="c-1", status=SAGA_PENDING, steps={}, context={},
+        last_error=None, next_attempt_at=None, completed_at=None, result=None,
+    )
+    consultation = SimpleNamespace(cons_id="c-1", status="open")
+    store = {(ConsultationCreateSaga, saga_id): saga, (Consultation, "c-1"): consultation}
+    sessions = []
+
+    def session_factory():
+        sessions.append(FakeSession(store))
+        return sessions[-1]
+
+    dispatcher = ConsultationSagaDispatcher(
+        session_factory=session_factory,
+        chatwoot_client=object(),
+        onec_client=object(),
+        steps=steps,
+        max_attempts=max_attempts,
+        result_builder=AsyncMock(return_value={"ok": True}),
+    )
+    return dispatcher, saga, consultation, sessions
+
+
+class TestPreferRespondAsync:
+
+    @pytest.mark.unit
+    def test_requires_header_and_worker(self):
+        with patch.object(consultation_saga.settings, "CONSULTATION_SAGA_POLL_SECONDS", 1.0):
+            assert consultation_saga.prefers_respond_async("respond-async")
+            assert consultation_saga.prefers_respond_async("wait=10, Respond-Async")
+            assert not consultation_saga.prefers_respond_async("return=minimal")
+            assert not consultation_saga.prefers_respond_async(None)
+        with patch.object(consultation_saga.settings, "CONSULTATION_SAGA_POLL_SECONDS", 0):
+            assert not consultation_saga.prefers_respond_async("respond-async")
+
+    @pytest.mark.unit
+    def test_conversation_is_created_before_binding(self):
+        names = [step.name for step in CONSULTATION_SAGA_STEPS]
+        assert names.index("chatwoot_conversation") < names.index("bind_conversation") < names.index("onec_consultation")
+
+
+class TestConsultationSagaDispatcher:
+
+    @pytest.mark.unit
+    async def test_resumes_from_checkpoint(self):
+        first = AsyncMock(return_value={"contact_id": 5})
+        second = AsyncMock(return_value=None)
+        dispatcher, saga, _, _ = make_dispatcher([SagaStep("first", first), SagaStep("second", second)])
+        saga.steps = {"first": {"status": "done"}}
+        saga.context = {"contact_id": 5}
+
+        outcome = await dispatcher.run_saga(saga.id)
+
+        assert outcome == SAGA_DONE
+        first.assert_not_awaited()
+        second.assert_awaited_once()
+        assert saga.steps["second"]["status"] == "done"
+        assert saga.status == SAGA_DONE and saga.result == {"ok": True}
+
+    @pytest.mark.unit
+    async def test_failure_defers_saga(self):
+        after = AsyncMock()
+        dispatcher, saga, _, _ = make_dispatcher([
+            SagaStep("flaky", AsyncMock(side_effect=RuntimeError("chatwoot down"))),
+            SagaStep("after", after),
+        ])
+
+        outcome = await dispatcher.run_saga(saga.id)
+
+        assert outcome == SAGA_PENDING
+        after.assert_not_awaited()
+        assert saga.steps["flaky"]["attempts"] == 1
+        assert saga.next_attempt_at is not None
+        assert "chatwoot down" in saga.last_error
+
+    @pytest.mark.unit
+    async def test_exhausted_step_fails_and_saga_continues(self):
+        after = AsyncMock(return_value=None)
+        dispatcher, saga, _, _ = make_dispatcher([
+            SagaStep("flaky", AsyncMock(side_effect=RuntimeError("chatwoot down"))),
+            SagaStep("after", after),
+        ], max_attempts=2)
+        saga.steps = {"flaky": {"status": SAGA_PENDING, "attempts": 1}}
+
+        outcome = await dispatcher.run_saga(saga.id)
+
+        assert outcome == SAGA_DONE
+        assert saga.steps["flaky"]["status"] == "failed"
+        after.assert_awaited_once()
+
+    @pytest.mark.unit
+    async def test_abort_compensates_done_steps(self):
+        async def open_conversation(run):
+            return {"conversation_id": "77"}
+
+        dispatcher, saga, consultation, sessions = make_dispatcher([
+            SagaStep("chatwoot_conversation", open_conversation, compensate=consultation_saga._close_conversation),
+            SagaStep("onec_consultation", AsyncMock(side_effect=SagaAbort("limit exceeded"))),
+        ])
+
+        outcome = await dispatcher.run_saga(saga.id)
+
+        assert outcome == SAGA_COMPENSATED
+        assert saga.status == SAGA_COMPENSATED and saga.result is None
+        assert consultation.status == "cancelled"
+        outbox = [obj for session in sessions for obj in session.added if isinstance(obj, ChatwootOutbox)]
+        assert len(outbox) == 1
+        assert outbox[0].conversation_id == "77"
+        assert outbox[0].payload == {"status": "resolved", "message": "limit exceeded"}
+
+
+class TestNonIdempotentStep:
+
+    @pytest.mark.unit
+    def test_create_steps_are_not_idempotent(self):
+        steps = {step.name: step for step in CONSULTATION_SAGA_STEPS}
+        assert not steps["chatwoot_conversation"].idempotent
+        assert not steps["onec_consultation"].idempotent
+        assert steps["bind_conversation"].idempotent
+
+    @pytest.mark.unit
+    async def test_ambiguous_error_fails_without_retry(self):
+        seen = []
+
+        async def create(run):
+            # Контрольная точка in_flight зафиксирована до внешнего вызова
+            seen.append((run.saga.steps["create"]["status"], run.db.commit.await_count))
+            raise httpx.ReadTimeout("no response")
+
+        after = AsyncMock(return_value=None)
+        dispatcher, saga, _, _ = make_dispatcher([SagaStep("create", create, idempotent=False), SagaStep("after", after)])
+
+        outcome = await dispatcher.run_saga(saga.id)
+
+        assert seen == [(STEP_IN_FLIGHT, 1)]
+        assert outcome == SAGA_DONE
+        assert saga.steps["create"]["status"] == "failed" and saga.steps["create"]["attempts"] == 1
+        after.assert_awaited_once()
+
+    @pytest.mark.unit
+    async def test_request_not_sent_is_retried(self):
+        create = AsyncMock(side_effect=httpx.ConnectError("refused"))
+        dispatcher, saga, _, _ = make_dispatcher([SagaStep("create", create, idempotent=False)])
+
+        outcome = await dispatcher.run_saga(saga.id)
+
+        assert outcome == SAGA_PENDING
+        assert saga.steps["create"]["status"] == SAGA_PENDING
+
+    @pytest.mark.unit
+    async def test_in_flight_checkpoint_is_not_repeated(self):
+        create = AsyncMock(return_value={"conversation_id": "77"})
+        dispatcher, saga, _, _ = make_dispatcher([SagaStep("create", create, idempotent=False)])
+        saga.steps = {"create": {"status": STEP_IN_FLIGHT}}
+
+        outcome = await dispatcher.run_saga(saga.id)
+
+        assert outcome == SAGA_DONE
+        create.assert_not_awaited()
+        assert saga.steps["create"]["status"] == "failed"
+        assert "unknown" in saga.last_error
@@ -0,0 +1,147 @@
+"""
+Тесты коротких транзакций вокруг внешних вызовов (utils.db_phases).
+
+Проверяем:
+    - пул из одного соединения обслуживает параллельные запросы с медленными
+      внешними вызовами, соединение удерживается только на время DB-фаз
+    - запрос к БД внутри внешней фазы считается
+    - сессия без коротких транзакций (саги, ETL) external_phase не меняет
+    - create_redate фиксирует перенос до вызовов 1C и Chatwoot
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, insert, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from FastAPI.routers import consultations
+from FastAPI.utils.db_phases import (
+    external_phase,
+    instrument_pool,
+    pool_metrics_snapshot,
+    pool_stats,
+    reset_pool_metrics,
+    use_short_transactions,
+)
+
+EXTERNAL_SECONDS = 0.3
+
+metadata = MetaData()
+notes = Table("notes", metadata, Column("id", Integer, primary_key=True), Column("text", String))
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'phases.db'}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=EXTERNAL_SECONDS / 2,
+    )
+    capacity = pool_stats.capacity
+    instrument_pool(engine, capacity=1)
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    reset_pool_metrics()
+    yield async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+    await engine.dispose()
+    pool_stats.capacity = capacity
+    reset_pool_metrics()
+
+
+async def handle_request(factory, number):
+    """Обработчик как в routers.consultations: запись, медленный внешний вызов, запись"""
+    async with factory() as db:
+        use_short_transactions(db)
+        await db.execute(insert(notes).values(id=number, text="created"))
+        async with external_phase(db, "slow_api"):
+            await asyncio.sleep(EXTERNAL_SECONDS)
+        await db.execute(notes.update().where(notes.c.id == number).values(text="synced"))
+        await db.commit()
+
+
+class TestShortTransactions:
+
+    @pytest.mark.unit
+    async def test_pool_is_free_during_slow_external_calls(self, session_factory):
+        started = time.perf_counter()
+        requests = asyncio.gather(*(handle_request(session_factory, n) for n in range(5)))
+
+        # Пока все обработчики ждут внешний API, соединение доступно другим запросам
+        await asyncio.sleep(EXTERNAL_SECONDS / 3)
+        async with session_factory() as db:
+            probe_started = time.perf_counter()
+            assert (await db.execute(text("SELECT 1"))).scalar() == 1
+            assert time.perf_counter() - probe_started < EXTERNAL_SECONDS / 2
+
+        await requests
+        # Внешние вызовы шли параллельно, а не по очереди за единственным соединением
+        assert time.perf_counter() - started < EXTERNAL_SECONDS * 3
+
+        async with session_factory() as db:
+            rows = (await db.execute(select(notes.c.text))).scalars().all()
+        assert rows == ["synced"] * 5
+
+        pool = pool_metrics_snapshot()
+        assert pool["capacity"] == 1 and pool["peak"] == 1 and pool["checked_out"] == 0
+        assert pool["hold"]["max_ms"] < EXTERNAL_SECONDS * 1000 / 2
+        assert pool["external_phase_queries"] == {}
+
+    @pytest.mark.unit
+    async def test_query_inside_external_phase_is_counted(self, session_factory):
+        async with session_factory() as db:
+            use_short_transactions(db)
+            await db.execute(text("SELECT 1"))
+            async with external_phase(db, "slow_api"):
+                assert not db.in_transaction()
+                await db.execute(text("SELECT 1"))
+
+        assert pool_metrics_snapshot()["external_phase_queries"] == {"slow_api": 1}
+
+    @pytest.mark.unit
+    async def test_regular_session_keeps_transaction(self, session_factory):
+        async with session_factory() as db:
+            await db.execute(insert(notes).values(id=1, text="created"))
+            async with external_phase(db, "slow_api"):
+                assert db.in_transaction()
+            await db.rollback()
+
+            assert (await db.execute(select(notes.c.id))).scalars().all() == []
+
+
+class TestConsultationHandlers:
+
+    @pytest.mark.unit
+    async def test_create_redate_commits_before_external_calls(self):
+        events = []
+        db = MagicMock()
+        db.info = {}
+        db.in_transaction = MagicMock(return_value=True)
+        db.flush = AsyncMock(side_effect=lambda: events.append("flush"))
+        db.commit = AsyncMock(side_effect=lambda: events.append("commit"))
+        db.refresh = AsyncMock()
+
+        consultation = SimpleNamespace(
+            cl_ref_key="cons-ref", client_key="client-ref", client_id=None,
+            consultation_type="Консультация по ведению учёта",
+            manager="11111111-2222-3333-4444-555555555555", start_date=None,
+        )
+        onec = MagicMock()
+        onec.create_redate_odata = AsyncMock(side_effect=lambda **kwargs: events.append("onec"))
+        onec.update_consultation_odata = AsyncMock(return_value={})
+        chatwoot = MagicMock()
+        chatwoot.send_bot_message = AsyncMock(side_effect=lambda **kwargs: events.append("chatwoot"))
+        payload = SimpleNamespace(manager_key=None, new_date=None, comment=None)
+
+        with patch.object(consultations, "_get_consultation_or_404", AsyncMock(return_value=consultation)), \
+                patch.object(consultations, "OneCClient", return_value=onec), \
+                patch.object(consultations, "ChatwootClient", return_value=chatwoot), \
+                patch.object(consultations, "_process_onec_response", AsyncMock()):
+            await consultations.create_redate("12345", payload, db)
+
+        assert events == ["flush", "commit", "onec", "chatwoot", "commit"]
@@ -0,0 +1,102 @@
+"""
+Тесты кэша справочников /api/dicts (services.dict_cache).
+
+Проверяем:
+    - ответ отдается из кэша готовыми байтами с ETag, If-None-Match дает 304
+    - смена версии справочников сбрасывает кэш
+    - размер кэша ограничен
+"""
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from FastAPI.database import get_db
+from FastAPI.dependencies.security import verify_front_secret
+from FastAPI.routers import dicts
+from FastAPI.services.dict_cache import DictCache
+
+
+class FakeVersion:
+
+    def __init__(self):
+        self.version = 1
+
+    async def __call__(self):
+        return self.version
+
+
+@pytest.fixture
+def version():
+    return FakeVersion()
+
+
+@pytest.fixture
+def cache(version):
+    fresh = DictCache(max_entries=2, check_seconds=0, version_loader=version)
+    with patch.object(dicts, "dict_cache", fresh):
+        yield fresh
+
+
+@pytest.fixture
+def db():
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = [
+        SimpleNamespace(ref_key="k1", description="Бухгалтерия"),
+        SimpleNamespace(ref_key="k2", description="Розница"),
+    ]
+    session = MagicMock()
+    session.execute = AsyncMock(return_value=result)
+    return session
+
+
+@pytest.fixture
+def client(db):
+    app = FastAPI()
+    app.include_router(dicts.router, prefix="/api/dicts")
+
+    async def override_db():
+        yield db
+
+    async def allow():
+        return None
+
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[verify_front_secret] = allow
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+class TestDictCache:
+
+    @pytest.mark.unit
+    async def test_etag_and_not_modified(self, cache, client, db):
+        async with client:
+            first = await client.get("/api/dicts/po-types")
+            second = await client.get("/api/dicts/po-types", headers={"If-None-Match": first.headers["etag"]})
+            third = await client.get("/api/dicts/po-types")
+
+        assert first.status_code == 200
+        assert first.json() == [{"ref_key": "k1", "description": "Бухгалтерия"}, {"ref_key": "k2", "description": "Розница"}]
+        assert second.status_code == 304 and second.content == b""
+        assert third.content == first.content and third.headers["etag"] == first.headers["etag"]
+        db.execute.assert_awaited_once()
+
+    @pytest.mark.unit
+    async def test_version_bump_invalidates(self, cache, client, db, version):
+        async with client:
+            await client.get("/api/dicts/interference")
+            version.version = 2
+            await client.get("/api/dicts/interference")
+
+        assert db.execute.await_count == 2
+
+    @pytest.mark.unit
+    async def test_bounded(self, cache):
+        await cache.ensure_version()
+        for n in range(5):
+            cache.put(f"k{n}", b"[]")
+
+        assert len(cache) == 2
+        assert cache.get("k4") is not None and cache.get("k0") is None
@@ -0,0 +1,78 @@
+"""
+Тесты конвейера предзагрузки страниц ETL (FastAPI/utils/etl_pipeline.py).
+
+Проверяем:
+    - скачивание следующей страницы параллельно с обработкой текущей
+    - backpressure: producer не уходит вперед больше чем на depth страниц
+    - проброс ошибки producer'а потребителю
+    - остановку producer'а при досрочном выходе
+"""
+import asyncio
+import time
+
+import pytest
+
+from FastAPI.utils.etl_pipeline import PagePrefetcher
+
+
+async def _pages(count, delay=0.0, produced=None, fail_at=None):
+    for i in range(count):
+        if fail_at is not None and i == fail_at:
+            raise RuntimeError("1C unavailable")
+        if delay:
+            await asyncio.sleep(delay)
+        if produced is not None:
+            produced.append(i)
+        yield [i]
+
+
+class TestPagePrefetcher:
+
+    @pytest.mark.unit
+    async def test_yields_pages_in_order(self):
+        async with PagePrefetcher(_pages(5), depth=2) as pages:
+            result = [batch async for batch in pages]
+
+        assert result == [[0], [1], [2], [3], [4]]
+        assert pages.pages == 5
+
+    @pytest.mark.unit
+    async def test_download_overlaps_processing(self):
+        """Время ≈ max(сеть, БД) * N, а не их сумма"""
+        started = time.monotonic()
+        async with PagePrefetcher(_pages(5, delay=0.05), depth=2) as pages:
+            async for _ in pages:
+                await asyncio.sleep(0.05)
+        elapsed = time.monotonic() - started
+
+        # Последовательно было бы 5 * (0.05 + 0.05) = 0.5 сек
+        assert elapsed < 0.4
+
+    @pytest.mark.unit
+    async def test_backpressure_limits_read_ahead(self):
+        produced = []
+        async with PagePrefetcher(_pages(20, produced=produced), depth=2) as pages:
+            await pages.__anext__()
+            await asyncio.sleep(0.05)
+            # 1 отдана потребителю + 2 в очереди + 1 ждет на queue.put
+            assert len(produced) <= 4
+
+    @pytest.mark.unit
+    async def test_producer_error_is_raised_to_consumer(self):
+        received = []
+        with pytest.raises(RuntimeError, match="1C unavailable"):
+            async with PagePrefetcher(_pages(5, fail_at=3), depth=2) as pages:
+                async for batch in pages:
+                    received.append(batch)
+
+        # Страницы до ошибки обработаны
+        assert received == [[0], [1], [2]]
+
+    @pytest.mark.unit
+    async def test_early_exit_cancels_producer(self):
+        async with PagePrefetcher(_pages(100), depth=2) as pages:
+            async for _ in pages:
+                break
+            task = pages._task
+
+        assert task.done()
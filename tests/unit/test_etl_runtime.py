@@ -0,0 +1,129 @@
+"""
+Тесты in-process запуска ETL (FastAPI/utils/etl_runtime.py).
+
+Проверяем:
+    - sys.exit() и исключения скрипта не выходят за пределы прогона
+    - таймаут прогона
+    - setup скрипта выполняется один раз за процесс
+    - общий engine и пул HTTP не закрываются скриптами
+"""
+import asyncio
+import sys
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import pytest
+
+from FastAPI.services.odata_client import ODataClient
+from FastAPI.utils import etl_runtime
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    fake = MagicMock()
+    fake._setup_done = set()
+    fake.engine = MagicMock()
+    fake.engine.dispose = AsyncMock()
+    fake.odata_http = MagicMock(spec=httpx.AsyncClient)
+    monkeypatch.setattr(etl_runtime, "_runtime", fake)
+    return fake
+
+
+def _register(monkeypatch, entry, setup=None, kwargs=None):
+    monkeypatch.setattr(etl_runtime, "resolve_etl_job", lambda name: (entry, setup, kwargs or {}))
+
+
+class TestRunEtlJobInprocess:
+
+    @pytest.mark.unit
+    async def test_success_and_setup_runs_once(self, runtime, monkeypatch):
+        entry = AsyncMock()
+        setup = AsyncMock()
+        _register(monkeypatch, entry, setup, {"mode": "open_update"})
+
+        assert (await etl_runtime.run_etl_job_inprocess("job")).ok
+        assert (await etl_runtime.run_etl_job_inprocess("job")).ok
+
+        setup.assert_awaited_once()
+        entry.assert_awaited_with(mode="open_update")
+        assert entry.await_count == 2
+
+    @pytest.mark.unit
+    async def test_sys_exit_does_not_escape(self, runtime, monkeypatch):
+        async def failing_script():
+            sys.exit(1)
+
+        _register(monkeypatch, failing_script)
+
+        assert not (await etl_runtime.run_etl_job_inprocess("job")).ok
+        # event loop жив, следующая задача выполняется
+        await asyncio.sleep(0)
+
+    @pytest.mark.unit
+    async def test_exception_is_isolated(self, runtime, monkeypatch):
+        _register(monkeypatch, AsyncMock(side_effect=RuntimeError("1C unavailable")))
+
+        assert not (await etl_runtime.run_etl_job_inprocess("job")).ok
+
+    @pytest.mark.unit
+    async def test_timeout_cancels_job(self, runtime, monkeypatch):
+        cancelled = asyncio.Event()
+
+        async def hanging_script():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        _register(monkeypatch, hanging_script)
+
+        assert not (await etl_runtime.run_etl_job_inprocess("job", timeout=0.05)).ok
+        assert cancelled.is_set()
+
+    @pytest.mark.unit
+    async def test_changes_reported_by_script(self, runtime, monkeypatch):
+        async def script():
+            etl_runtime.report_etl_changes(3)
+            etl_runtime.report_etl_changes(2)
+
+        _register(monkeypatch, script)
+        assert (await etl_runtime.run_etl_job_inprocess("job")).changes == 5
+
+        _register(monkeypatch, AsyncMock())
+        assert (await etl_runtime.run_etl_job_inprocess("job")).changes is None
+
+    @pytest.mark.unit
+    def test_jobs_point_to_existing_entry_points(self):
+        for name in etl_runtime.ETL_JOBS:
+            entry, setup, _ = etl_runtime.resolve_etl_job(name)
+            assert asyncio.iscoroutinefunction(entry), name
+            assert setup is None or asyncio.iscoroutinefunction(setup), name
+
+
+class TestSharedResources:
+
+    @pytest.mark.unit
+    async def test_shared_engine_is_not_disposed_by_script(self, runtime):
+        engine = etl_runtime.create_etl_engine("postgresql+asyncpg://u:p@h/db", pool_size=2)
+        await etl_runtime.dispose_etl_engine(engine)
+
+        assert engine is runtime.engine
+        runtime.engine.dispose.assert_not_awaited()
+
+    @pytest.mark.unit
+    async def test_odata_client_uses_shared_pool(self, runtime):
+        async with ODataClient(base_url="https://odata.test", auth=("u", "p"), user_agent="ETL-Test/1.0") as odata:
+            assert odata._client is runtime.odata_http
+            assert odata._request_options()["headers"] == {"User-Agent": "ETL-Test/1.0"}
+
+        runtime.odata_http.aclose.assert_not_called()
+
+    @pytest.mark.unit
+    async def test_odata_client_owns_pool_outside_runtime(self, monkeypatch):
+        monkeypatch.setattr(etl_runtime, "_runtime", None)
+        async with ODataClient(base_url="https://odata.test", auth=("u", "p")) as odata:
+            client = odata._client
+            assert odata._request_options() == {}
+
+        assert client.is_closed
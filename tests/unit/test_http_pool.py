@@ -0,0 +1,87 @@
+"""
+Тесты общего пула HTTP соединений и метрик задержек (utils.http_pool).
+
+Проверяем:
+    - ChatwootClient ходит через общий пул, если он запущен
+    - без пула используется одноразовый клиент (ETL скрипты, тесты)
+    - метки мест вызова не зависят от ID в пути
+"""
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from FastAPI.utils import http_pool
+from FastAPI.utils.http_pool import (
+    CHATWOOT,
+    call_site,
+    close_http_clients,
+    get_chatwoot_http,
+    http_metrics_snapshot,
+    reset_http_metrics,
+    send_request,
+)
+
+
+@pytest.fixture(autouse=True)
+def _clean_pool():
+    reset_http_metrics()
+    yield
+    http_pool._clients.clear()
+    reset_http_metrics()
+
+
+class TestCallSite:
+
+    @pytest.mark.unit
+    def test_ids_are_replaced(self):
+        assert call_site("post", "/api/v1/accounts/1/conversations/12345/messages") == \
+            "POST /api/v1/accounts/{id}/conversations/{id}/messages"
+        assert call_site("GET", "/contacts/cl_abc?page=2") == "GET /contacts/{id}"
+
+
+class TestSharedChatwootPool:
+
+    @pytest.mark.unit
+    async def test_client_uses_shared_pool_and_records_latency(self, monkeypatch):
+        from FastAPI.config import settings
+        monkeypatch.setattr(settings, "CHATWOOT_API_URL", "https://chatwoot.test")
+        monkeypatch.setattr(settings, "CHATWOOT_API_TOKEN", "token")
+        monkeypatch.setattr(settings, "CHATWOOT_ACCOUNT_ID", "1")
+        seen = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            seen.append(request.url.path)
+            return httpx.Response(200, json={"id": 1})
+
+        shared = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        http_pool._clients[CHATWOOT] = shared
+
+        from FastAPI.services.chatwoot_client import ChatwootClient
+
+        client = ChatwootClient()
+        with patch("httpx.AsyncClient", side_effect=AssertionError("per-call client must not be created")):
+            await client.send_message(conversation_id="77", content="a")
+            await client.send_message(conversation_id="78", content="b")
+
+        assert len(seen) == 2
+        stats = http_metrics_snapshot()[CHATWOOT]
+        site = "POST /api/v1/accounts/{id}/conversations/{id}/messages"
+        assert stats[site]["count"] == 2
+        assert stats[site]["errors"] == 0
+
+        await close_http_clients()
+        assert shared.is_closed
+        assert get_chatwoot_http() is None
+
+    @pytest.mark.unit
+    async def test_without_pool_falls_back_to_one_shot_client(self):
+        transport = httpx.MockTransport(lambda request: httpx.Response(503))
+        real_client = httpx.AsyncClient
+
+        with patch("httpx.AsyncClient", side_effect=lambda **kw: real_client(transport=transport)) as factory:
+            response = await send_request(CHATWOOT, get_chatwoot_http(), "GET", "https://chatwoot.test/api/v1/profile")
+
+        assert response.status_code == 503
+        factory.assert_called_once()
+        assert http_metrics_snapshot()[CHATWOOT]["GET /api/v1/profile"]["errors"] == 1
@@ -0,0 +1,104 @@
+"""
+Тесты idempotency keys (utils.idempotency).
+
+Проверяем:
+    - LRU завершенных ответов: вытеснение и истечение
+    - повтор с завершенным ключом обслуживается из LRU без запросов к БД
+    - резервирование — один запрос к БД, конкурирующий резерв дает in_progress
+    - проверка ключа больше не удаляет истекшие ключи перед поиском
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from FastAPI.utils import idempotency
+from FastAPI.utils.idempotency import IdempotencyCache, check_idempotency_key, reserve_idempotency_key
+
+LATER = datetime.now(timezone.utc) + timedelta(hours=1)
+
+
+@pytest.fixture
+def cache():
+    fresh = IdempotencyCache(max_size=2)
+    with patch.object(idempotency, "idempotency_cache", fresh):
+        yield fresh
+
+
+def _engine(row):
+    conn = MagicMock()
+    result = MagicMock()
+    result.first.return_value = row
+    conn.execute = AsyncMock(return_value=result)
+
+    @asynccontextmanager
+    async def begin():
+        yield conn
+
+    return SimpleNamespace(begin=begin), conn
+
+
+class TestIdempotencyCache:
+
+    @pytest.mark.unit
+    def test_lru_eviction_and_expiry(self, cache):
+        cache.put("k1", "op", "h", {"n": 1}, LATER)
+        cache.put("k2", "op", "h", {"n": 2}, LATER)
+        assert cache.get("k1", "op") == ("h", {"n": 1})
+
+        cache.put("k3", "op", "h", {"n": 3}, LATER)  # вытесняет k2 (k1 недавно читали)
+        assert cache.get("k2", "op") is None
+        assert len(cache) == 2
+
+        cache.put("old", "op", "h", {"n": 0}, datetime.now(timezone.utc) - timedelta(seconds=1))
+        assert cache.get("old", "op") is None
+
+
+class TestReserveIdempotencyKey:
+
+    @pytest.mark.unit
+    async def test_completed_key_served_from_cache(self, cache):
+        cache.put("k1", "create_consultation", "h1", {"client_id": "c"}, LATER)
+        engine, conn = _engine(None)
+
+        with patch("FastAPI.database.engine", engine):
+            same = await reserve_idempotency_key("k1", "create_consultation", "h1")
+            other = await reserve_idempotency_key("k1", "create_consultation", "h2")
+
+        assert same.status == "completed" and same.response_data == {"client_id": "c"}
+        assert other.status == "mismatch"
+        conn.execute.assert_not_awaited()
+
+    @pytest.mark.unit
+    async def test_reserve_is_single_round_trip(self, cache):
+        cases = [
+            (SimpleNamespace(reserved=True, request_hash=None, response_data=None), "reserved"),
+            (SimpleNamespace(reserved=False, request_hash="h1", response_data=None), "in_progress"),
+            (SimpleNamespace(reserved=False, request_hash="h1", response_data={"ok": 1}), "completed"),
+            (None, "in_progress"),
+        ]
+        for row, expected in cases:
+            engine, conn = _engine(row)
+            with patch("FastAPI.database.engine", engine):
+                reservation = await reserve_idempotency_key("k1", "create_consultation", "h1")
+            assert reservation.status == expected
+            conn.execute.assert_awaited_once()
+
+
+class TestCheckIdempotencyKey:
+
+    @pytest.mark.unit
+    async def test_lookup_does_not_delete(self, cache):
+        record = SimpleNamespace(request_hash="h1", response_data={"ok": 1}, expires_at=LATER)
+        result = MagicMock()
+        result.scalar_one_or_none.return_value = record
+        db = MagicMock()
+        db.execute = AsyncMock(return_value=result)
+
+        assert await check_idempotency_key(db, "k1", "op", "h1") == {"ok": 1}
+        assert await check_idempotency_key(db, "k1", "op", "h1") == {"ok": 1}
+
+        db.execute.assert_awaited_once()
+        assert str(db.execute.await_args.args[0]).lstrip().upper().startswith("SELECT")
@@ -0,0 +1,95 @@
+"""
+Тесты обслуживания партиций журналов (services.log_partitions).
+
+Проверяем:
+    - создаются недостающие помесячные партиции, в том числе через границу года
+    - не пересекаются с уже покрытым диапазоном (партиция *_legacy)
+    - удаляются только партиции, целиком старше срока хранения
+    - запись изменения консультации не делает flush на каждое изменение
+"""
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from FastAPI.services.log_partitions import drop_expired_partitions, ensure_partitions
+from FastAPI.utils.change_log import log_consultation_change
+
+
+def bound(lower, upper):
+    return f"FOR VALUES FROM ({lower}) TO ('{upper} 00:00:00+00')"
+
+
+class FakeConn:
+
+    def __init__(self, partitions):
+        self.partitions = [SimpleNamespace(name=name, bound=b) for name, b in partitions]
+        self.ddl = []
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        result = MagicMock()
+        if "pg_inherits" in sql:
+            result.all.return_value = self.partitions
+        else:
+            self.ddl.append(" ".join(sql.split()))
+        return result
+
+
+class TestLogPartitions:
+
+    @pytest.mark.unit
+    async def test_creates_missing_months(self):
+        conn = FakeConn([
+            ("webhook_log_p2025_12", bound("'2025-12-01 00:00:00+00'", "2026-01-01")),
+        ])
+
+        created = await ensure_partitions(
+            conn, "log.webhook_log", 2, today=date(2025, 12, 15), compression="lz4", payload_column="payload"
+        )
+
+        assert created == ["webhook_log_p2026_01", "webhook_log_p2026_02"]
+        assert conn.ddl[0] == (
+            "CREATE TABLE IF NOT EXISTS log.webhook_log_p2026_01 PARTITION OF log.webhook_log "
+            "FOR VALUES FROM ('2026-01-01 00:00:00+00') TO ('2026-02-01 00:00:00+00')"
+        )
+        assert conn.ddl[1] == "ALTER TABLE log.webhook_log_p2026_01 ALTER COLUMN payload SET COMPRESSION lz4"
+
+    @pytest.mark.unit
+    async def test_skips_range_covered_by_legacy(self):
+        conn = FakeConn([
+            ("consultation_change_log_legacy", bound("MINVALUE", "2026-02-01")),
+        ])
+
+        created = await ensure_partitions(conn, "log.consultation_change_log", 1, today=date(2026, 1, 20))
+
+        assert created == ["consultation_change_log_p2026_02"]
+        assert len(conn.ddl) == 1
+
+    @pytest.mark.unit
+    async def test_drops_only_fully_expired(self):
+        conn = FakeConn([
+            ("consultation_change_log_legacy", bound("MINVALUE", "2025-08-01")),
+            ("consultation_change_log_p2025_08", bound("'2025-08-01 00:00:00+00'", "2025-09-01")),
+            ("consultation_change_log_p2026_02", "FOR VALUES FROM ('2026-02-01 00:00:00+00') TO (MAXVALUE)"),
+        ])
+
+        dropped = await drop_expired_partitions(
+            conn, "log.consultation_change_log", 30, now=datetime(2025, 9, 15, tzinfo=timezone.utc)
+        )
+
+        assert dropped == ["consultation_change_log_legacy"]
+        assert conn.ddl == ["DROP TABLE IF EXISTS log.consultation_change_log_legacy"]
+        assert await drop_expired_partitions(conn, "log.consultation_change_log", 0) == []
+
+    @pytest.mark.unit
+    async def test_change_log_is_not_flushed_per_row(self):
+        db = MagicMock()
+        db.flush = AsyncMock()
+
+        await log_consultation_change(db, "1", "status", "open", "closed", "CHATWOOT")
+        await log_consultation_change(db, "1", "manager", None, "m-1", "CHATWOOT")
+
+        assert db.add.call_count == 2
+        db.flush.assert_not_awaited()
@@ -0,0 +1,136 @@
+"""
+Тесты in-memory индекса загрузки менеджеров (services.manager_load).
+
+Проверяем:
+    - инкрементальные обновления идемпотентны и переносят консультацию между очередями
+    - изменения Consultation в ORM сессии применяются только после commit
+    - незагруженные (expired) поля не убирают консультацию из очереди
+    - ManagerSelector читает очереди из свежего индекса без запросов к БД
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from FastAPI.models import Consultation
+from FastAPI.services import manager_load
+from FastAPI.services.manager_load import ConsultationLoadSnapshot, ManagerLoadIndex
+from FastAPI.services.manager_selector import ManagerSelector
+
+
+@pytest.fixture
+def index():
+    fresh = ManagerLoadIndex()
+    fresh.ready = True
+    fresh.refreshed_at = time.monotonic()
+    with patch.object(manager_load, "manager_load_index", fresh):
+        yield fresh
+
+
+class TestManagerLoadIndex:
+
+    @pytest.mark.unit
+    def test_status_and_manager_changes_move_queue(self, index):
+        index.observe(ConsultationLoadSnapshot("c1", "m1", "open", False))
+        index.observe(ConsultationLoadSnapshot("c1", "m1", "open", False))
+        index.observe(ConsultationLoadSnapshot("c2", "m1", "pending", False))
+
+        assert index.queue_counts(["m1", "m2"]) == {"m1": 2, "m2": 0}
+
+        index.observe(ConsultationLoadSnapshot("c1", "m2", "open", False))
+        index.observe(ConsultationLoadSnapshot("c2", "m1", "closed", False))
+
+        assert index.queue_counts(["m1", "m2"]) == {"m1": 0, "m2": 1}
+
+        index.observe(ConsultationLoadSnapshot("c1", "m2", "open", True))  # denied не в очереди
+        assert index.queue_count("m2") == 0
+
+    @pytest.mark.unit
+    def test_recent_assignments_and_resolution(self, index):
+        now = datetime.now(timezone.utc)
+        index.observe(ConsultationLoadSnapshot("c1", "m1", "open", False, now - timedelta(minutes=10)))
+        index.observe(ConsultationLoadSnapshot("c2", "m1", "open", False, now - timedelta(hours=3)))
+        index.observe(ConsultationLoadSnapshot(
+            "c3", "m1", "closed", False, now - timedelta(hours=3),
+            now - timedelta(hours=2), now - timedelta(hours=2) + timedelta(minutes=30),
+        ))
+
+        assert index.recent_assignment_counts(["m1"], now - timedelta(hours=1)) == {"m1": 1}
+        assert index.avg_resolution(["m1"])["m1"] == {"avg_resolution_minutes": 30.0, "consultations_count": 1}
+
+
+def _persistent(session, **values):
+    """Консультация, загруженная из БД (все отслеживаемые поля загружены)"""
+    fields = {"create_date": datetime.now(timezone.utc) - timedelta(days=1), "start_date": None, "end_date": None}
+    consultation = Consultation(**{**fields, **values})
+    make_transient_to_detached(consultation)
+    session.add(consultation)
+    return consultation
+
+
+class TestConsultationTracking:
+
+    @pytest.mark.unit
+    def test_orm_changes_apply_after_commit_only(self, index):
+        session = Session()
+        existing = _persistent(session, cons_id="c1", manager="m1", status="open", denied=False)
+        index.observe(ConsultationLoadSnapshot("c1", "m1", "open", False))
+
+        existing.manager = "m2"
+        session.add(Consultation(cons_id="c2", manager="m2", status="pending", denied=False))
+        manager_load._after_flush(session, None)
+
+        assert index.queue_counts(["m1", "m2"]) == {"m1": 1, "m2": 0}
+
+        manager_load._after_commit(session)
+        assert index.queue_counts(["m1", "m2"]) == {"m1": 0, "m2": 2}
+
+        existing.status = "closed"
+        manager_load._after_flush(session, None)
+        manager_load._after_rollback(session)
+        manager_load._after_commit(session)
+        assert index.queue_count("m2") == 2
+
+    @pytest.mark.unit
+    def test_unloaded_fields_do_not_drop_consultation(self, index):
+        session = Session()
+        existing = _persistent(session, cons_id="c1", manager="m1", status="open", denied=False)
+        index.observe(ConsultationLoadSnapshot("c1", "m1", "open", False))
+
+        # Объект загружен частично (load_only / expire отдельных полей), меняется только manager
+        session.expire(existing, ["status", "denied"])
+        existing.manager = "m2"
+        manager_load._after_flush(session, None)
+        manager_load._after_commit(session)
+
+        # Снимок пропущен: консультация остается в очереди до сверки с БД
+        assert index.queue_counts(["m1", "m2"]) == {"m1": 1, "m2": 0}
+
+
+class TestSelectorUsesIndex:
+
+    @pytest.mark.unit
+    async def test_queue_counts_come_from_fresh_index(self, index):
+        index.observe(ConsultationLoadSnapshot("c1", "m1", "open", False))
+        db = MagicMock()
+        db.execute = AsyncMock()
+
+        counts = await ManagerSelector(db).get_managers_queue_counts(["m1", "m2"])
+
+        assert counts == {"m1": 1, "m2": 0}
+        db.execute.assert_not_awaited()
+
+    @pytest.mark.unit
+    async def test_stale_index_falls_back_to_db(self, index):
+        index.refreshed_at = time.monotonic() - 3600
+        result = MagicMock()
+        result.all.return_value = [("m1", 4)]
+        db = MagicMock()
+        db.execute = AsyncMock(return_value=result)
+
+        counts = await ManagerSelector(db).get_managers_queue_counts(["m1"])
+
+        assert counts == {"m1": 4}
+        db.execute.assert_awaited_once()
@@ -0,0 +1,102 @@
+"""
+Тесты батчевого выбора менеджера (ManagerSelector).
+
+Проверяем:
+    - число запросов к БД не зависит от числа менеджеров
+    - закрытая очередь, навыки и загрузка учитываются как раньше
+    - правила навыков для "Консультация по ведению учёта"
+"""
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from FastAPI.services.manager_selector import ManagerSelector, filter_managers_by_skills
+
+NOW = datetime(2025, 1, 10, 9, 0, tzinfo=timezone.utc)
+
+
+def _manager(key, con_limit=10, ru=True, uz=False):
+    return SimpleNamespace(cl_ref_key=key, con_limit=con_limit, ru=ru, uz=uz)
+
+
+def _scalars(rows):
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = rows
+    return result
+
+
+def _rows(rows):
+    result = MagicMock()
+    result.all.return_value = rows
+    return result
+
+
+class TestSelectManagerBatched:
+
+    @pytest.mark.unit
+    async def test_constant_queries_and_same_choice(self):
+        managers = [_manager(f"m{i}") for i in range(100)]
+        skills = [(f"m{i}", "cat-1" if i % 2 == 0 else "cat-2") for i in range(100)]
+        # m0 — закрыта очередь; у четных менеджеров по 5 в очереди, у m2 — 1
+        queue = [(f"m{i}", 5) for i in range(0, 100, 2) if i != 2] + [("m2", 1)]
+
+        db = MagicMock()
+        db.execute = AsyncMock(side_effect=[
+            _scalars(managers),      # пользователи
+            _rows([("m0",)]),        # закрытия очереди на сегодня
+            _rows(skills),           # навыки
+            _rows(queue),            # очереди GROUP BY manager
+        ])
+
+        selected = await ManagerSelector(db).select_manager_for_consultation(
+            category_key="cat-1", current_time=NOW, consultation_type="Техническая поддержка",
+        )
+
+        assert selected == "m2"
+        assert db.execute.await_count == 4
+
+    @pytest.mark.unit
+    async def test_tie_is_broken_by_recent_assignments_in_one_query(self):
+        managers = [_manager("a"), _manager("b"), _manager("c")]
+        db = MagicMock()
+        db.execute = AsyncMock(side_effect=[
+            _scalars(managers),
+            _rows([]),                          # нет закрытых очередей
+            _rows([]),                          # пустые очереди
+            _rows([("a", 3), ("c", 1)]),        # назначения за последний час
+        ])
+
+        selected = await ManagerSelector(db).select_manager_for_consultation(current_time=NOW)
+
+        assert selected == "b"
+        assert db.execute.await_count == 4
+
+
+class TestFilterManagersBySkills:
+
+    @pytest.mark.unit
+    def test_accounting_requires_exact_skill_and_language(self):
+        ru_skilled = _manager("ru")
+        uz_skilled = _manager("uz", ru=False, uz=True)
+        universal = _manager("universal")
+        skills = {"ru": {"cat-1"}, "uz": {"cat-1"}, "universal": set()}
+
+        result = filter_managers_by_skills(
+            [ru_skilled, uz_skilled, universal], skills,
+            category_key="cat-1", consultation_type="Консультация по ведению учёта", language="ru",
+        )
+
+        assert result == [ru_skilled]
+
+    @pytest.mark.unit
+    def test_universal_managers_go_last_for_other_types(self):
+        universal = _manager("universal")
+        skilled = _manager("skilled")
+        other = _manager("other")
+        skills = {"skilled": {"cat-1"}, "other": {"cat-2"}}
+
+        result = filter_managers_by_skills([universal, skilled, other], skills, category_key="cat-1")
+
+        assert result == [skilled, universal]
@@ -0,0 +1,233 @@
+"""
+Тесты общего асинхронного OData-клиента для ETL (FastAPI/services/odata_client.py).
+
+Проверяем:
+    - разбор Retry-After (секунды и HTTP-дата)
+    - backoff с jitter и ограничением сверху
+    - retry на 429/503 без блокировки event loop (asyncio.sleep)
+    - отсутствие retry на 4xx
+    - keyset пагинацию без растущего $skip
+    - битую страницу как ошибку получения страницы (PAGE_FETCH_ERRORS)
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import pytest
+
+from FastAPI.services.odata_client import (
+    PAGE_FETCH_ERRORS,
+    ODataClient,
+    ODataKeysetPaginator,
+    compute_backoff,
+    odata_string,
+    parse_retry_after,
+)
+
+
+def _install_transport(odata: ODataClient, handler):
+    odata._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class TestRetryAfter:
+
+    @pytest.mark.unit
+    def test_parse_seconds(self):
+        assert parse_retry_after("7") == 7.0
+
+    @pytest.mark.unit
+    def test_parse_http_date(self):
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        delay = parse_retry_after(format_datetime(retry_at, usegmt=True))
+        assert 25 <= delay <= 30
+
+    @pytest.mark.unit
+    def test_parse_invalid(self):
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("soon") is None
+
+
+class TestBackoff:
+
+    @pytest.mark.unit
+    def test_retry_after_wins_but_is_capped(self):
+        assert compute_backoff(0, retry_after=5) == 5
+        assert compute_backoff(0, retry_after=600, cap=60) == 60
+
+    @pytest.mark.unit
+    def test_jitter_within_window(self):
+        for attempt in range(10):
+            window = min(60, 2 ** attempt)
+            delay = compute_backoff(attempt)
+            assert window / 2 <= delay <= window
+
+
+class TestODataClientGet:
+
+    @pytest.mark.unit
+    async def test_retries_503_with_retry_after(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) < 3:
+                return httpx.Response(503, headers={"Retry-After": "2"})
+            return httpx.Response(200, json={"value": [{"Ref_Key": "a"}]})
+
+        sleeps = []
+
+        async def fake_sleep(delay):
+            sleeps.append(delay)
+
+        async with ODataClient(base_url="https://odata.test/", auth=("u", "p")) as odata:
+            _install_transport(odata, handler)
+            with patch("FastAPI.services.odata_client.asyncio.sleep", fake_sleep):
+                resp = await odata.get("https://odata.test/Catalog_X?$format=json")
+
+        assert resp.json()["value"][0]["Ref_Key"] == "a"
+        assert len(calls) == 3
+        assert sleeps == [2.0, 2.0]
+
+    @pytest.mark.unit
+    async def test_client_error_is_not_retried(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(400, text="bad filter")
+
+        async with ODataClient(base_url="https://odata.test/", auth=("u", "p")) as odata:
+            _install_transport(odata, handler)
+            with pytest.raises(httpx.HTTPStatusError) as exc_info:
+                await odata.get("https://odata.test/Catalog_X?$format=json")
+
+        assert exc_info.value.response.status_code == 400
+        assert len(calls) == 1
+
+    @pytest.mark.unit
+    async def test_backoff_does_not_block_event_loop(self):
+        """Во время ожидания между попытками другие корутины продолжают работать"""
+        attempts = []
+
+        def handler(request):
+            attempts.append(request)
+            if len(attempts) == 1:
+                return httpx.Response(429, headers={"Retry-After": "0.2"})
+            return httpx.Response(200, json={"value": []})
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        async with ODataClient(base_url="https://odata.test/", auth=("u", "p")) as odata:
+            _install_transport(odata, handler)
+            task = asyncio.create_task(ticker())
+            await odata.get("https://odata.test/Catalog_X?$format=json")
+            task.cancel()
+
+        assert len(attempts) == 2
+        assert ticks >= 5
+
+
+class TestKeysetPaginator:
+
+    @staticmethod
+    def _params(url):
+        return {k: v[0] for k, v in parse_qs(urlsplit(url).query).items()}
+
+    @pytest.mark.unit
+    def test_first_page_has_no_skip(self):
+        paginator = ODataKeysetPaginator(
+            entity_url="https://odata.test/Catalog_Контрагенты",
+            seek_field="Code",
+            start_value="000000001",
+            literal=odata_string,
+            page_size=2,
+        )
+        params = self._params(paginator.next_url())
+
+        assert params["$filter"] == "Code ge '000000001'"
+        assert params["$orderby"] == "Code asc, Ref_Key asc"
+        assert params["$top"] == "2"
+        assert "$skip" not in params
+
+    @pytest.mark.unit
+    def test_bound_moves_to_last_row(self):
+        paginator = ODataKeysetPaginator(
+            entity_url="https://odata.test/X", seek_field="Period",
+            start_value="2025-01-01T00:00:00", page_size=3,
+        )
+        paginator.advance([
+            {"Period": "2025-01-01T00:00:00"},
+            {"Period": "2025-01-02T00:00:00"},
+            {"Period": "2025-01-02T00:00:00"},
+        ])
+        params = self._params(paginator.next_url())
+
+        assert params["$filter"] == "Period ge datetime'2025-01-02T00:00:00'"
+        # Пропускаются только уже полученные строки с той же датой
+        assert params["$skip"] == "2"
+        assert not paginator.exhausted
+
+    @pytest.mark.unit
+    async def test_full_pass_returns_each_row_once(self):
+        """Группа одинаковых дат больше страницы не теряется и не дублируется"""
+        rows = [
+            {"ДатаИзменения": f"2025-01-01T00:00:{i // 5:02d}", "Ref_Key": f"{i:08d}"}
+            for i in range(23)
+        ]
+        scanned = 0
+
+        def handler(request):
+            nonlocal scanned
+            params = self._params(str(request.url))
+            bound = params["$filter"].split("'")[1]
+            candidates = [r for r in rows if r["ДатаИзменения"] >= bound]
+            skip = int(params.get("$skip", "0"))
+            top = int(params["$top"])
+            scanned += min(len(candidates), skip + top)
+            return httpx.Response(200, json={"value": candidates[skip:skip + top]})
+
+        paginator = ODataKeysetPaginator(
+            entity_url="https://odata.test/Document_ТелефонныйЗвонок",
+            seek_field="ДатаИзменения",
+            start_value="2025-01-01T00:00:00",
+            page_size=3,
+        )
+        seen = []
+        async with ODataClient(base_url="https://odata.test/", auth=("u", "p")) as odata:
+            _install_transport(odata, handler)
+            while not paginator.exhausted:
+                resp = await odata.get(paginator.next_url())
+                batch = resp.json()["value"]
+                seen.extend(item["Ref_Key"] for item in batch)
+                paginator.advance(batch)
+
+        assert seen == [r["Ref_Key"] for r in rows]
+        assert paginator.rows_fetched == len(rows)
+        # Без растущего $skip 1C читает не больше, чем страница + хвост одинаковых дат
+        assert scanned < 2 * len(rows)
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("response", [
+        httpx.Response(200, text="<html>Service Unavailable</html>"),
+        httpx.Response(200, json={"odata.error": {"code": "-1"}, "value": None}),
+        httpx.Response(200, json=[{"Ref_Key": "1"}]),
+    ])
+    async def test_malformed_page_is_fetch_error(self, response):
+        """Битая страница — ошибка из PAGE_FETCH_ERRORS: ETL логирует ее и завершает проход"""
+        paginator = ODataKeysetPaginator(
+            entity_url="https://odata.test/X", seek_field="Code", start_value="0", page_size=3,
+        )
+        async with ODataClient(base_url="https://odata.test/", auth=("u", "p")) as odata:
+            _install_transport(odata, lambda request: response)
+            with pytest.raises(PAGE_FETCH_ERRORS):
+                async for _ in odata.iter_pages(paginator):
+                    pass
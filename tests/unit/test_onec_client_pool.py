@@ -0,0 +1,75 @@
+"""
+Тесты OneCClient._odata_request на общем пуле соединений.
+
+Проверяем:
+    - запросы идут через общий пул (utils.http_pool), повторы — по тому же пулу
+    - тела запросов не сериализуются, пока DEBUG выключен
+    - метрики пишутся по месту вызова без GUID в метке
+"""
+import logging
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+
+from FastAPI.services import onec_client
+from FastAPI.services.onec_client import OneCClient
+from FastAPI.utils import http_pool
+from FastAPI.utils.http_pool import ONEC, http_metrics_snapshot, reset_http_metrics
+from FastAPI.utils.structured_logging import LazyJson
+
+
+@pytest.fixture
+def shared_onec():
+    calls = []
+    statuses = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        status = statuses.pop(0) if statuses else 200
+        return httpx.Response(status, json={"Ref_Key": "k"})
+
+    reset_http_metrics()
+    http_pool._clients[ONEC] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    yield calls, statuses
+    http_pool._clients.clear()
+    reset_http_metrics()
+
+
+class TestOneCSharedPool:
+
+    @pytest.mark.unit
+    async def test_retry_reuses_shared_pool(self, shared_onec):
+        calls, statuses = shared_onec
+        statuses.extend([503, 200])
+        client = OneCClient()
+        client.odata_base_url = "https://1c.test/odata"
+
+        with patch("httpx.AsyncClient", side_effect=AssertionError("per-call client must not be created")), \
+                patch.object(onec_client.asyncio, "sleep", AsyncMock()):
+            result = await client._odata_request(
+                "PATCH", "Document_ТелефонныйЗвонок(guid'0b1c-22')", data={"Описание": "x"}
+            )
+
+        assert result == {"Ref_Key": "k"}
+        assert len(calls) == 2
+        assert calls[0].headers["authorization"].startswith("Basic ")
+        stats = http_metrics_snapshot()[ONEC]["PATCH /Document_ТелефонныйЗвонок({key})"]
+        assert stats["count"] == 2
+        assert stats["errors"] == 1
+
+    @pytest.mark.unit
+    async def test_request_body_is_not_serialized_at_info(self, shared_onec, caplog):
+        client = OneCClient()
+        client.odata_base_url = "https://1c.test/odata"
+        caplog.set_level(logging.INFO, logger=onec_client.logger.name)
+
+        with patch.object(LazyJson, "__str__", side_effect=AssertionError("body must not be built")):
+            await client._odata_request("POST", "Document_ТелефонныйЗвонок", data={"Описание": "x" * 10000})
+
+    @pytest.mark.unit
+    def test_lazy_json_truncates(self):
+        text = str(LazyJson({"a": "x" * 100}, limit=20))
+
+        assert text.startswith('{"a": "xxxxxxxxxxxxx')
+        assert "(+" in text
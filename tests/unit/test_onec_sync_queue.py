@@ -0,0 +1,182 @@
+"""
+Тесты очереди синхронизации с 1C:ЦЛ (services.onec_sync_queue).
+
+Проверяем:
+    - задачи одной консультации схлопываются: уходит последний статус и менеджер
+    - одна консультация — один PATCH, параллельность ограничена
+    - результат: done + synced_to_1c, повтор с backoff, failed для 4xx
+    - synced_to_1c покрывает запись лога, сделанную в транзакции вебхука после ее начала
+"""
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+
+from FastAPI.services.onec_sync_queue import (
+    JOB_MANAGER,
+    JOB_STATUS,
+    ConsultationSyncPlan,
+    OneCSyncDispatcher,
+    coalesce_jobs,
+    enqueue_onec_sync,
+)
+from FastAPI.utils.change_log import log_consultation_change
+
+CREATED = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def job(job_id, cons_id, job_type, payload, attempts=1):
+    return {
+        "id": job_id,
+        "cons_id": cons_id,
+        "cl_ref_key": f"ref-{cons_id}",
+        "job_type": job_type,
+        "payload": payload,
+        "attempts": attempts,
+        "created_at": CREATED,
+    }
+
+
+class FakeSession:
+
+    def __init__(self):
+        self.statements = []
+        self.commit = AsyncMock()
+
+    async def execute(self, statement, params=None):
+        self.statements.append(statement)
+        return MagicMock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def change_log_bounds(session):
+    """Граница created_at из UPDATE log.consultation_change_log"""
+    bounds = []
+    for stmt in session.statements:
+        if getattr(stmt, "table", None) is not None and stmt.table.name == "consultation_change_log":
+            params = stmt.compile().params
+            bounds.append(next(value for name, value in params.items() if name.startswith("created_at")))
+    return bounds
+
+
+def job_values(session):
+    """Значения UPDATE sys.onec_sync_jobs из выполненных запросов"""
+    return [
+        {col.name: bind.value for col, bind in stmt._values.items()}
+        for stmt in session.statements
+        if stmt.table.name == "onec_sync_jobs"
+    ]
+
+
+class TestCoalesceJobs:
+
+    @pytest.mark.unit
+    def test_last_value_wins(self):
+        rows = [
+            job(3, "100", JOB_STATUS, {"status": "closed"}),
+            job(1, "100", JOB_STATUS, {"status": "new"}),
+            job(2, "100", JOB_MANAGER, {"manager_key": "m-1"}),
+            job(4, "200", JOB_MANAGER, {"manager_key": "m-2"}, attempts=3),
+        ]
+
+        plans = {plan.cons_id: plan for plan in coalesce_jobs(rows)}
+
+        assert plans["100"].job_ids == [1, 2, 3]
+        assert plans["100"].status == "closed" and plans["100"].manager_key == "m-1"
+        assert set(plans["100"].fields) == {"status", "manager"}
+        assert plans["200"].status is None and plans["200"].attempts == 3
+
+
+class TestOneCSyncDispatcher:
+
+    @pytest.mark.unit
+    async def test_one_patch_per_consultation(self):
+        active = 0
+        peak = 0
+
+        async def patch(**kwargs):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+        onec = MagicMock()
+        onec.update_consultation_odata = AsyncMock(side_effect=patch)
+        session = FakeSession()
+        dispatcher = OneCSyncDispatcher(session_factory=lambda: session, onec_client=onec, concurrency=2)
+        rows = [job(1, "100", JOB_STATUS, {"status": "new"}), job(2, "100", JOB_MANAGER, {"manager_key": "m-1"})]
+        rows += [job(10 + n, str(n), JOB_STATUS, {"status": "closed"}) for n in range(4)]
+        dispatcher.claim = AsyncMock(return_value=rows)
+
+        stats = await dispatcher.run_once()
+
+        assert stats == {"jobs": 6, "consultations": 5, "synced": 5, "retried": 0, "failed": 0}
+        assert onec.update_consultation_odata.await_count == 5
+        onec.update_consultation_odata.assert_any_await(ref_key="ref-100", status="new", manager_key="m-1")
+        assert peak == 2
+        assert all(values["status"] == "done" for values in job_values(session))
+        session.commit.assert_awaited_once()
+
+    @pytest.mark.unit
+    async def test_retry_then_failed(self):
+        session = FakeSession()
+        dispatcher = OneCSyncDispatcher(session_factory=lambda: session, onec_client=MagicMock(), max_attempts=3)
+        request = httpx.Request("PATCH", "http://1c/odata")
+        results = [
+            (ConsultationSyncPlan("1", "ref-1", job_ids=[1], attempts=1), httpx.ConnectError("down")),
+            (ConsultationSyncPlan("2", "ref-2", job_ids=[2], attempts=3), httpx.ConnectError("down")),
+            (
+                ConsultationSyncPlan("3", "ref-3", job_ids=[3], attempts=1),
+                httpx.HTTPStatusError("bad", request=request, response=httpx.Response(400, request=request)),
+            ),
+        ]
+
+        stats = await dispatcher._finish(results)
+
+        assert stats == {"synced": 0, "retried": 1, "failed": 2}
+        retried, exhausted, rejected = job_values(session)
+        assert "status" not in retried and retried["next_attempt_at"] > datetime.now(timezone.utc)
+        assert exhausted["status"] == "failed" and rejected["status"] == "failed"
+
+    @pytest.mark.unit
+    async def test_change_logged_in_webhook_transaction_is_synced(self):
+        # Порядок как в webhooks.py: транзакция началась (now() задачи), затем
+        # log_consultation_change и enqueue_onec_sync, commit; потом воркер
+        transaction_started = datetime.now(timezone.utc)
+        webhook_db = MagicMock()
+        webhook_db.sync_session = MagicMock()
+        with patch("FastAPI.services.onec_sync_queue.event.listen"):
+            await log_consultation_change(webhook_db, "100", "status", "open", "closed", "CHATWOOT")
+            enqueue_onec_sync(webhook_db, "100", "ref-100", JOB_STATUS, {"status": "closed"})
+        change_log, queued = [call.args[0] for call in webhook_db.add.call_args_list]
+        assert queued.job_type == JOB_STATUS and change_log.created_at >= transaction_started
+
+        session = FakeSession()
+        claimed = dict(job(1, "100", JOB_STATUS, {"status": "closed"}), created_at=transaction_started)
+        claim_result = MagicMock()
+        claim_result.mappings.return_value.all.return_value = [claimed]
+        execute = session.execute
+
+        async def execute_claim(statement, params=None):
+            if params is not None:
+                return claim_result
+            return await execute(statement, params)
+
+        session.execute = execute_claim
+        onec = MagicMock()
+        onec.update_consultation_odata = AsyncMock()
+        dispatcher = OneCSyncDispatcher(session_factory=lambda: session, onec_client=onec)
+
+        stats = await dispatcher.run_once()
+
+        assert stats["synced"] == 1
+        [bound] = change_log_bounds(session)
+        assert bound >= change_log.created_at
@@ -0,0 +1,124 @@
+"""
+Тесты проверенных владельцев 1C:ЦЛ (services.owner_verification).
+
+Проверяем:
+    - недавно проверенный владелец не ищется в 1C
+    - проверка запоминается по (code_abonent, org_inn) для дубля владельца
+    - устаревший маркер — владелец проверяется в 1C заново
+    - Parent_Key не CLOBUS — маркер сбрасывается, создается дубль
+    - ETL: маркер ставится только клиентам из папки CLOBUS без пометки удаления
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from FastAPI.models import Client
+from FastAPI.routers.consultations import _ensure_owner_synced_with_cl
+from FastAPI.services.owner_verification import (
+    CLOBUS_PARENT_KEY,
+    onec_item_verifies_owner,
+    owner_verification_cache,
+)
+
+
+def make_owner(verified_seconds_ago=None, **fields):
+    verified_at = None
+    if verified_seconds_ago is not None:
+        verified_at = datetime.now(timezone.utc) - timedelta(seconds=verified_seconds_ago)
+    defaults = dict(
+        client_id=uuid.uuid4(),
+        code_abonent="10240",
+        org_inn="303045154",
+        cl_ref_key="ref-1" if verified_at else None,
+        parent_key=CLOBUS_PARENT_KEY if verified_at else None,
+        cl_verified_at=verified_at,
+        name="ООО Топ Агро",
+    )
+    defaults.update(fields)
+    return Client(**defaults)
+
+
+def make_db(verified_row=None):
+    db = MagicMock()
+    db.flush = AsyncMock()
+    result = MagicMock()
+    result.first.return_value = verified_row
+    db.execute = AsyncMock(return_value=result)
+    return db
+
+
+def make_onec(found=None, created=None):
+    onec = MagicMock()
+    onec.find_client_by_code_and_inn = AsyncMock(return_value=found)
+    onec.create_client_odata = AsyncMock(return_value=created)
+    return onec
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    owner_verification_cache.clear()
+    yield
+    owner_verification_cache.clear()
+
+
+class TestOwnerVerification:
+
+    @pytest.mark.unit
+    async def test_fresh_marker_skips_onec(self):
+        owner = make_owner(verified_seconds_ago=60)
+        db = make_db()
+        onec = make_onec()
+
+        assert await _ensure_owner_synced_with_cl(db, owner, onec) is owner
+
+        onec.find_client_by_code_and_inn.assert_not_awaited()
+        db.execute.assert_not_awaited()
+
+    @pytest.mark.unit
+    async def test_verification_shared_by_code_and_inn(self):
+        onec = make_onec(found={"Ref_Key": "ref-7", "Parent_Key": CLOBUS_PARENT_KEY})
+        first = make_owner()
+        await _ensure_owner_synced_with_cl(make_db(), first, onec)
+
+        assert first.cl_ref_key == "ref-7" and first.cl_verified_at is not None
+
+        duplicate = make_owner()
+        await _ensure_owner_synced_with_cl(make_db(), duplicate, onec)
+
+        assert duplicate.cl_ref_key == "ref-7" and duplicate.parent_key == CLOBUS_PARENT_KEY
+        assert duplicate.cl_verified_at == first.cl_verified_at
+        onec.find_client_by_code_and_inn.assert_awaited_once()
+
+    @pytest.mark.unit
+    async def test_stale_marker_rechecks_onec(self):
+        owner = make_owner(verified_seconds_ago=10 * 86400)
+        db = make_db(verified_row=None)
+        onec = make_onec(found={"Ref_Key": "ref-1", "Parent_Key": CLOBUS_PARENT_KEY})
+
+        await _ensure_owner_synced_with_cl(db, owner, onec)
+
+        db.execute.assert_awaited_once()
+        onec.find_client_by_code_and_inn.assert_awaited_once()
+        assert datetime.now(timezone.utc) - owner.cl_verified_at < timedelta(minutes=1)
+
+    @pytest.mark.unit
+    async def test_wrong_parent_creates_duplicate(self):
+        owner = make_owner()
+        onec = make_onec(
+            found={"Ref_Key": "ref-old", "Parent_Key": str(uuid.uuid4())},
+            created={"Ref_Key": "ref-new"},
+        )
+
+        await _ensure_owner_synced_with_cl(make_db(), owner, onec)
+
+        onec.create_client_odata.assert_awaited_once()
+        assert owner.cl_ref_key == "ref-new" and owner.parent_key == CLOBUS_PARENT_KEY
+        assert owner.cl_verified_at is not None
+
+    @pytest.mark.unit
+    def test_etl_item_marks_only_clobus_owners(self):
+        assert onec_item_verifies_owner({"Parent_Key": CLOBUS_PARENT_KEY, "DeletionMark": False})
+        assert not onec_item_verifies_owner({"Parent_Key": CLOBUS_PARENT_KEY, "DeletionMark": True})
+        assert not onec_item_verifies_owner({"Parent_Key": str(uuid.uuid4())})
@@ -0,0 +1,221 @@
+"""
+Тесты batch-режима pull_cons_cl (process_consultation_batch).
+
+Проверяем:
+    - число запросов к БД не зависит от размера страницы
+    - правила слияния строки (терминальный статус, пустые поля не затирают заполненные)
+    - побочные эффекты вычисляются из diff до/после
+    - существующие строки обновляются только по изменившимся колонкам
+"""
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from FastAPI.catalog_scripts import pull_cons_cl
+from FastAPI.catalog_scripts.pull_cons_cl import (
+    apply_consultation_side_effects,
+    build_q_and_a_rows,
+    diff_consultation_row,
+    merge_consultation_row,
+    process_consultation_batch,
+)
+
+
+def _item(ref_key="ref-1", **overrides):
+    item = {
+        "Ref_Key": ref_key,
+        "Number": "0001",
+        "Абонент_Key": "client-1",
+        "Менеджер_Key": "manager-1",
+        "ДатаСоздания": "2025-01-10T10:00:00",
+        "ДатаКонсультации": "2025-01-10T11:00:00",
+        "ДатаИзменения": "2025-01-10T12:00:00",
+        "Конец": "0001-01-01T00:00:00",
+        "ВидОбращения": "КонсультацияИТС",
+        "Описание": "Вопрос по отчету",
+        "КонсультацииИТС": [{"LineNumber": "1", "НаличиеПомех_Key": "block-1"}],
+        "ВопросыИОтветы": [{"LineNumber": "1", "Вопрос": "q", "Ответ": "a"}],
+    }
+    item.update(overrides)
+    return item
+
+
+def _empty_result():
+    result = MagicMock()
+    result.all.return_value = []
+    result.mappings.return_value.all.return_value = []
+    return result
+
+
+def _mappings_result(rows):
+    result = _empty_result()
+    result.mappings.return_value.all.return_value = rows
+    return result
+
+
+def _existing_page_db(before, q_and_a_rows):
+    """БД, в которой документ уже есть: клиенты, cons.cons, cons.calls, cons.q_and_a, далее записи"""
+    existing = [{"cons_ref_key": row["cons_ref_key"], **row} for row in q_and_a_rows]
+    results = iter([_empty_result(), _mappings_result([before]), _empty_result(), _mappings_result(existing)])
+    db = MagicMock()
+    db.execute = AsyncMock(side_effect=lambda *a, **kw: next(results, _empty_result()))
+    return db
+
+
+def _upsert_set_columns(stmt):
+    return {getattr(key, "key", key) for key, _ in stmt._post_values_clause.update_values_to_set}
+
+
+class TestMergeConsultationRow:
+
+    @pytest.mark.unit
+    def test_new_row_gets_temporary_cons_id(self):
+        row = merge_consultation_row(_item(), None, ("uuid-1", "123456789"), None)
+
+        assert row["cons_id"] == "cl_ref-1"
+        assert row["source"] == "1C_CL"
+        assert row["org_inn"] == "123456789"
+        assert row["con_blocks"] == "block-1"
+
+    @pytest.mark.unit
+    def test_terminal_status_is_kept(self):
+        before = merge_consultation_row(_item(), None, None, None)
+        before.update(cons_id="42", status="closed")
+
+        after = merge_consultation_row(_item(), before, None, None)
+
+        assert after["status"] == "closed"
+        assert after["cons_id"] == "42"
+
+    @pytest.mark.unit
+    def test_empty_values_do_not_erase_existing(self):
+        before = merge_consultation_row(_item(), None, None, None)
+        after = merge_consultation_row(_item(Менеджер_Key=None, Описание="", Вопрос=None), before, None, None)
+
+        assert after["manager"] == "manager-1"
+        assert after["comment"] == "Вопрос по отчету"
+        assert diff_consultation_row(before, after) == set()
+
+    @pytest.mark.unit
+    def test_q_and_a_rows_keep_line_numbers(self):
+        rows = build_q_and_a_rows(_item(), "42")
+
+        assert [r["line_number"] for r in rows] == [1, 1]
+        assert {r["cons_id"] for r in rows} == {"42"}
+        assert len({tuple(sorted(r)) for r in rows}) == 1  # одинаковый набор колонок для multi-VALUES
+
+
+class TestProcessConsultationBatch:
+
+    @pytest.mark.unit
+    async def test_round_trips_do_not_grow_with_page_size(self):
+        db = MagicMock()
+        db.execute = AsyncMock(side_effect=lambda *a, **kw: _empty_result())
+
+        small = await process_consultation_batch(db, [_item(f"ref-{i}") for i in range(5)])
+        small_calls = db.execute.await_count
+        db.execute.reset_mock()
+        large = await process_consultation_batch(db, [_item(f"ref-{i}") for i in range(400)])
+
+        assert small["created"] == 5
+        assert large["created"] == 400
+        assert len(large["processed_at"]) == 400
+        # 4 SELECT + UPSERT cons + DELETE q_and_a + INSERT q_and_a
+        assert small_calls == 7
+        # На 400 строк (800 строк q_and_a) добавляется только еще один чанк INSERT
+        assert db.execute.await_count == 8
+
+    @pytest.mark.unit
+    async def test_items_without_ref_key_are_skipped(self):
+        db = MagicMock()
+        db.execute = AsyncMock(side_effect=lambda *a, **kw: _empty_result())
+
+        stats = await process_consultation_batch(db, [{"Number": "1"}])
+
+        assert stats["skipped"] == 1
+        db.execute.assert_not_awaited()
+
+    @pytest.mark.unit
+    async def test_existing_row_updates_only_changed_columns(self):
+        """manager/comment/con_calls, записанные API после чтения снимка, не затираются"""
+        before = merge_consultation_row(_item(), None, None, None)
+        before.update(cons_id="42", status="open")
+        db = _existing_page_db(before, build_q_and_a_rows(_item(), "42"))
+
+        with patch.object(pull_cons_cl, "apply_consultation_side_effects", new=AsyncMock()), \
+                patch.object(pull_cons_cl, "publish_consultation_updates", new=AsyncMock()):
+            stats = await process_consultation_batch(db, [_item(Менеджер_Key="manager-2")])
+
+        assert stats["updated"] == 1
+        # 4 SELECT + UPSERT cons; q_and_a не изменились — без DELETE/INSERT
+        assert db.execute.await_count == 5
+        upsert = db.execute.await_args_list[4].args[0]
+        assert _upsert_set_columns(upsert) == {"manager", "updated_at"}
+
+    @pytest.mark.unit
+    async def test_changed_q_and_a_is_rebuilt_for_that_document_only(self):
+        before = merge_consultation_row(_item(), None, None, None)
+        before.update(cons_id="42", status="open")
+        db = _existing_page_db(before, build_q_and_a_rows(_item(), "42"))
+        item = _item(ВопросыИОтветы=[{"LineNumber": "1", "Вопрос": "q", "Ответ": "новый ответ"}])
+
+        with patch.object(pull_cons_cl, "apply_consultation_side_effects", new=AsyncMock()), \
+                patch.object(pull_cons_cl, "publish_consultation_updates", new=AsyncMock()):
+            stats = await process_consultation_batch(db, [item])
+
+        assert stats["unchanged"] == 1
+        # 4 SELECT + DELETE q_and_a + INSERT q_and_a; шапка не изменилась — без UPSERT
+        assert db.execute.await_count == 6
+        delete_params = db.execute.await_args_list[4].args[1]
+        assert delete_params == {"keys": ["ref-1"]}
+
+
+class TestSideEffectsFromDiff:
+
+    @pytest.mark.unit
+    async def test_status_and_manager_change_trigger_side_effects(self):
+        before = merge_consultation_row(_item(), None, None, None)
+        before.update(cons_id="42", status="open")
+        after = merge_consultation_row(_item(Конец="2025-01-10T11:30:00", Менеджер_Key="manager-2"), before, None, None)
+        changed = diff_consultation_row(before, after)
+
+        consultation = MagicMock(cons_id="42")
+        result = MagicMock()
+        result.scalars.return_value.all.return_value = [consultation]
+        db = MagicMock()
+        db.execute = AsyncMock(return_value=result)
+
+        with patch.object(pull_cons_cl, "sync_status_to_chatwoot") as status_sync, \
+                patch.object(pull_cons_cl, "sync_fields_to_chatwoot") as fields_sync, \
+                patch.object(pull_cons_cl, "notify_manager_change") as manager_notify:
+            await apply_consultation_side_effects(db, [(before, after, changed)])
+
+        status_sync.assert_called_once_with(db, consultation, "open", "closed")
+        fields_sync.assert_called_once_with(db, consultation)
+        manager_notify.assert_called_once_with(db, consultation, "manager-1")
+
+    @pytest.mark.unit
+    async def test_side_effects_are_written_to_outbox_not_sent(self):
+        """Изменение статуса пишет событие в outbox в той же сессии, без HTTP вызова"""
+        consultation = MagicMock(cons_id="42", start_date=None, end_date=None)
+        db = MagicMock()
+
+        pull_cons_cl.sync_status_to_chatwoot(db, consultation, "open", "cancelled")
+
+        outbox_row = db.add.call_args.args[0]
+        assert outbox_row.conversation_id == "42"
+        assert outbox_row.event_type == "status"
+        assert outbox_row.payload["status"] == "resolved"
+        assert outbox_row.payload["custom_attributes"] == {"closed_without_con": True}
+
+    @pytest.mark.unit
+    async def test_unchanged_row_has_no_side_effects(self):
+        before = merge_consultation_row(_item(), None, None, None)
+        before.update(cons_id="42", status="open")
+        after = merge_consultation_row(_item(), before, None, None)
+
+        db = MagicMock()
+        db.execute = AsyncMock()
+        await apply_consultation_side_effects(db, [(before, after, diff_consultation_row(before, after))])
+
+        db.execute.assert_not_awaited()
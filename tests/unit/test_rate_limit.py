@@ -0,0 +1,123 @@
+"""
+Тесты rate limiting (middleware.rate_limit).
+
+Проверяем:
+    - token bucket: всплеск до емкости, затем отказ с временем до следующего токена
+    - простаивающие (наполнившиеся) корзины удаляются
+    - middleware: 429 + Retry-After, отдельная группа для создания консультаций, вебхуки без лимита
+    - вебхуки под /api (/api/telegram/webhook, /api/telegram/webhook/chatwoot) исключены по маршруту
+"""
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from FastAPI.middleware import rate_limit
+from FastAPI.middleware.rate_limit import InMemoryRateLimitStore, RateLimitMiddleware, route_group
+from FastAPI.routers import telegram
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    fake = FakeClock()
+    with patch.object(rate_limit.time, "monotonic", fake):
+        yield fake
+
+
+class TestInMemoryStore:
+
+    @pytest.mark.unit
+    async def test_burst_then_refill(self, clock):
+        store = InMemoryRateLimitStore()
+        key = ("create", "10.0.0.1")
+
+        results = [await store.take(key, 3, 0.5) for _ in range(4)]
+
+        assert [allowed for allowed, _, _ in results] == [True, True, True, False]
+        assert results[-1][2] == pytest.approx(2.0)
+
+        clock.now += 2.0
+        assert (await store.take(key, 3, 0.5))[0] is True
+        assert (await store.take(key, 3, 0.5))[0] is False
+
+    @pytest.mark.unit
+    async def test_sweep_drops_full_buckets(self, clock):
+        store = InMemoryRateLimitStore()
+        await store.take(("default", "a"), 100, 100 / 60)
+        clock.now += rate_limit.SWEEP_INTERVAL_SECONDS - 5
+        await store.take(("default", "b"), 100, 100 / 60)
+
+        clock.now += 5
+        await store.take(("default", "c"), 100, 100 / 60)
+
+        assert len(store) == 2  # "a" наполнилась и удалена, "b" еще нет
+
+
+class TestRateLimitMiddleware:
+
+    @pytest.mark.unit
+    def test_route_groups(self):
+        assert route_group("POST", "/api/consultations/create") == "create"
+        assert route_group("GET", "/api/consultations/123") == "default"
+        assert route_group("POST", "/webhook/chatwoot") is None
+        assert route_group("GET", "/api/health") is None
+
+    @pytest.mark.unit
+    async def test_returns_429_with_retry_after(self, clock):
+        app = FastAPI()
+
+        @app.post("/api/consultations/create")
+        async def create():
+            return {"ok": True}
+
+        @app.get("/api/dicts/categories")
+        async def categories():
+            return []
+
+        @app.post("/webhook/chatwoot")
+        async def webhook():
+            return {"ok": True}
+
+        app.add_middleware(RateLimitMiddleware, store=InMemoryRateLimitStore(), limits={"default": 100, "create": 2})
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            statuses = [(await client.post("/api/consultations/create")).status_code for _ in range(3)]
+            limited = await client.post("/api/consultations/create")
+            other = await client.get("/api/dicts/categories")
+            webhooks = [(await client.post("/webhook/chatwoot")).status_code for _ in range(5)]
+
+        assert statuses == [200, 200, 429]
+        assert limited.status_code == 429
+        assert limited.headers["retry-after"] == "30"
+        assert other.status_code == 200
+        assert webhooks == [200] * 5
+
+    @pytest.mark.unit
+    async def test_telegram_webhooks_are_exempt(self, clock):
+        app = FastAPI()
+        app.include_router(telegram.router, prefix="/api/telegram")
+
+        @app.get("/api/dicts/categories")
+        async def categories():
+            return []
+
+        app.add_middleware(RateLimitMiddleware, store=InMemoryRateLimitStore(), limits={"default": 1})
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            updates = [(await client.post("/api/telegram/webhook", json={})).status_code for _ in range(3)]
+            chatwoot = [(await client.post("/api/telegram/webhook/chatwoot", json={})).status_code for _ in range(3)]
+            other = [(await client.get("/api/dicts/categories")).status_code for _ in range(2)]
+
+        # Бот не инициализирован — 503, но не 429
+        assert 429 not in updates and 429 not in chatwoot
+        assert other == [200, 429]
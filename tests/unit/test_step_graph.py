@@ -0,0 +1,101 @@
+"""
+Тесты графа асинхронных шагов (utils.step_graph) и шагов create_consultation.
+
+Проверяем:
+    - независимые шаги выполняются одновременно, зависимый получает их результаты
+    - ошибка шага отменяет незавершенные шаги, готовые результаты сохраняются
+    - длительности шагов и графа попадают в метрики
+    - поиск команды Chatwoot по типу консультации
+"""
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from FastAPI.routers.consultations import _find_chatwoot_team, _select_manager_key
+from FastAPI.utils.step_graph import Step, reset_step_timings, run_step_graph, step_timings_snapshot
+
+
+@pytest.fixture(autouse=True)
+def clean_timings():
+    reset_step_timings()
+    yield
+    reset_step_timings()
+
+
+class TestStepGraph:
+
+    @pytest.mark.unit
+    async def test_independent_steps_overlap(self):
+        running = []
+        overlap = []
+
+        async def slow(name):
+            running.append(name)
+            await asyncio.sleep(0.01)
+            overlap.append(len(running))
+            running.remove(name)
+            return name
+
+        results = await run_step_graph("flow", [
+            Step("a", lambda results: slow("a")),
+            Step("b", lambda results: slow("b")),
+            Step("c", lambda results: asyncio.sleep(0, result=results["a"] + results["b"]), after=("a", "b")),
+        ], name="graph")
+
+        assert results == {"a": "a", "b": "b", "c": "ab"}
+        assert max(overlap) == 2
+        assert set(step_timings_snapshot()["flow"]) == {"a", "b", "c", "graph"}
+
+    @pytest.mark.unit
+    async def test_failure_cancels_pending_steps(self):
+        cancelled = asyncio.Event()
+
+        async def hang(results):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def fail(results):
+            await asyncio.sleep(0)
+            raise RuntimeError("chatwoot down")
+
+        results = {}
+        with pytest.raises(RuntimeError, match="chatwoot down"):
+            await run_step_graph("flow", [
+                Step("contact", lambda results: asyncio.sleep(0, result="contact-1")),
+                Step("team", fail),
+                Step("slow", hang),
+                Step("conversation", AsyncMock(), after=("contact", "team")),
+            ], results=results, name="graph")
+
+        assert cancelled.is_set()
+        assert results == {"contact": "contact-1"}
+        timings = step_timings_snapshot()["flow"]
+        assert timings["team"]["errors"] == 1 and timings["graph"]["errors"] == 1
+        assert "conversation" not in timings
+
+    @pytest.mark.unit
+    async def test_rejects_unknown_dependency(self):
+        with pytest.raises(ValueError):
+            await run_step_graph("flow", [Step("b", AsyncMock(), after=("a",)), Step("a", AsyncMock())])
+
+
+class TestCreateConsultationSteps:
+
+    @pytest.mark.unit
+    async def test_team_lookup_by_consultation_type(self):
+        chatwoot = AsyncMock()
+        chatwoot.find_team_by_name.return_value = 3
+
+        assert await _find_chatwoot_team(chatwoot, "Техническая поддержка") == 3
+        assert await _find_chatwoot_team(chatwoot, "Другое") is None
+        chatwoot.find_team_by_name.assert_awaited_once_with(
+            team_name="техническая поддержка", expected_name="техническая поддержка"
+        )
+
+    @pytest.mark.unit
+    async def test_no_manager_selection_for_support(self):
+        assert await _select_manager_key(None, "Техническая поддержка") is None
@@ -0,0 +1,260 @@
+"""
+Тесты двухэтапного приема вебхуков (services.webhook_inbox, routers.webhooks).
+
+Проверяем:
+    - прием: подпись до записи в очередь, ответ без обработки события, дубликаты
+    - ключ порядка и ключ дедупликации при записи в очередь
+    - без id доставки отправителя повтор того же тела принимается (статус A→B→A)
+    - обработка: события одного разговора по порядку, после ошибки — ждут повтора
+    - исчерпанные попытки переводят событие в failed и не блокируют разговор
+    - завершенные события пишутся в log.webhook_log одним запросом, ошибка журнала не мешает очереди
+"""
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from FastAPI.routers import webhooks
+from FastAPI.services import webhook_inbox
+from FastAPI.services.webhook_inbox import SOURCE_CHATWOOT, WebhookInboxDispatcher, _Registration
+
+
+class FakeSession:
+
+    def __init__(self, fail_inserts=False):
+        self.statements = []
+        self.commit = AsyncMock()
+        self.fail_inserts = fail_inserts
+
+    async def execute(self, statement, params=None):
+        if self.fail_inserts and getattr(statement, "is_insert", False):
+            raise RuntimeError("no partition for created_at")
+        self.statements.append(statement)
+        return MagicMock()
+
+    def begin_nested(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeEngine:
+
+    def __init__(self, inserted):
+        self.inserted = inserted
+        self.params = []
+
+    def begin(self):
+        engine = self
+
+        class Conn:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            async def execute(self, statement, params):
+                engine.params.append(params)
+                result = MagicMock()
+                result.scalar_one_or_none.return_value = engine.inserted
+                return result
+
+        return Conn()
+
+
+def event(event_id, key, attempts=1):
+    return {
+        "id": event_id,
+        "source": SOURCE_CHATWOOT,
+        "event_type": "conversation.updated",
+        "ordering_key": key,
+        "payload": {"n": event_id},
+        "attempts": attempts,
+    }
+
+
+def inbox_updates(session):
+    """(id из WHERE, значения) для UPDATE sys.webhook_inbox"""
+    updates = []
+    for stmt in session.statements:
+        if not getattr(stmt, "is_update", False):
+            continue
+        values = {col.name: getattr(bind, "value", bind) for col, bind in stmt._values.items()}
+        updates.append((stmt.whereclause.right.value, values))
+    return updates
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(webhooks.router, prefix="/webhook")
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+class TestWebhookAccept:
+
+    @pytest.mark.unit
+    async def test_acknowledges_without_processing(self, client):
+        ingest = AsyncMock(side_effect=[True, False])
+        with patch.object(webhooks, "ingest_webhook", ingest), \
+                patch.object(webhooks, "process_chatwoot_event", AsyncMock()) as process:
+            async with client:
+                body = b'{"event": "conversation.updated", "data": {"conversation": {"id": 7}}}'
+                first = await client.post("/webhook/chatwoot", content=body)
+                second = await client.post("/webhook/chatwoot", content=body)
+
+        assert first.json() == {"status": "ok", "message": "Queued conversation.updated"}
+        assert second.json() == {"status": "ok", "message": "Duplicate conversation.updated"}
+        process.assert_not_awaited()
+
+    @pytest.mark.unit
+    async def test_signature_checked_before_enqueue(self, client):
+        ingest = AsyncMock(return_value=True)
+        with patch.object(webhooks, "ingest_webhook", ingest), \
+                patch.object(webhooks.settings, "CHATWOOT_API_TOKEN", "secret"):
+            async with client:
+                response = await client.post(
+                    "/webhook/chatwoot", content=b'{"event": "x"}', headers={"X-Chatwoot-Signature": "bad"}
+                )
+
+        assert response.status_code == 401
+        ingest.assert_not_awaited()
+
+    @pytest.mark.unit
+    async def test_ingest_keys(self):
+        engine = FakeEngine(inserted=None)
+        body = b'{"event": "message.created", "data": {"message": {"conversation_id": 42}}}'
+
+        queued = await webhook_inbox.ingest_webhook(SOURCE_CHATWOOT, body, {
+            "event": "message.created", "data": {"message": {"conversation_id": 42}},
+        }, delivery_id="d-1", engine=engine)
+
+        params = engine.params[0]
+        assert queued is False
+        assert params["ordering_key"] == "CHATWOOT:42"
+        assert params["event_id"] == "delivery:d-1"
+        assert params["payload"] == body.decode()
+
+    @pytest.mark.unit
+    async def test_repeated_payload_without_delivery_id_is_accepted(self, client):
+        # Статус open → resolved → open: первое и третье тела совпадают байт в байт
+        engine = FakeEngine(inserted=1)
+        opened = b'{"event": "conversation_status_changed", "data": {"conversation": {"id": 7, "status": "open"}}}'
+        resolved = opened.replace(b'"open"', b'"resolved"')
+
+        with patch("FastAPI.database.engine", engine), \
+                patch.object(webhook_inbox.webhook_inbox_worker, "wake"):
+            async with client:
+                for body in (opened, resolved, opened):
+                    response = await client.post("/webhook/chatwoot", content=body)
+                    assert response.json()["message"] == "Queued conversation_status_changed"
+                await client.post("/webhook/chatwoot", content=opened, headers={"X-Chatwoot-Delivery": "d-1"})
+
+        event_ids = [params["event_id"] for params in engine.params]
+        assert len(set(event_ids[:3])) == 3
+        assert event_ids[3] == "delivery:d-1"
+
+
+class TestWebhookInboxDispatcher:
+
+    @pytest.mark.unit
+    async def test_failure_holds_later_events_of_same_conversation(self):
+        calls = []
+
+        async def handler(db, payload):
+            calls.append(payload["n"])
+            if payload["n"] == 1:
+                raise RuntimeError("db busy")
+
+        session = FakeSession()
+        dispatcher = WebhookInboxDispatcher(
+            session_factory=lambda: session,
+            handlers={SOURCE_CHATWOOT: _Registration(handler, lambda p: None)},
+            max_attempts=3,
+        )
+        rows = [event(2, "CHATWOOT:a"), event(1, "CHATWOOT:a"), event(3, "CHATWOOT:b")]
+        dispatcher.claim = AsyncMock(return_value=rows)
+
+        stats = await dispatcher.run_once()
+
+        assert sorted(calls) == [1, 3]
+        assert stats["processed"] == 1 and stats["retried"] == 1 and stats["deferred"] == 1
+        assert not any(values.get("status") == "failed" for _, values in inbox_updates(session))
+
+    @pytest.mark.unit
+    async def test_exhausted_event_fails_and_unblocks(self):
+        calls = []
+
+        async def handler(db, payload):
+            calls.append(payload["n"])
+            if payload["n"] == 1:
+                raise RuntimeError("bad payload")
+
+        session = FakeSession()
+        dispatcher = WebhookInboxDispatcher(
+            session_factory=lambda: session,
+            handlers={SOURCE_CHATWOOT: _Registration(handler, lambda p: None)},
+            max_attempts=3,
+        )
+        dispatcher.claim = AsyncMock(return_value=[event(1, "CHATWOOT:a", attempts=3), event(2, "CHATWOOT:a")])
+
+        stats = await dispatcher.run_once()
+
+        assert calls == [1, 2]
+        assert stats["processed"] == 1 and stats["failed"] == 1 and stats["deferred"] == 0
+        failed = [values for _, values in inbox_updates(session) if values.get("status") == "failed"]
+        assert failed and "bad payload" in failed[0]["last_error"]
+
+
+def audit_inserts(session):
+    return [stmt for stmt in session.statements if getattr(stmt, "is_insert", False)]
+
+
+class TestWebhookAudit:
+
+    @staticmethod
+    def _dispatcher(session):
+        async def handler(db, payload):
+            if payload["n"] in (2, 3):
+                raise RuntimeError("bad payload")
+
+        return WebhookInboxDispatcher(
+            session_factory=lambda: session,
+            handlers={SOURCE_CHATWOOT: _Registration(handler, lambda p: None)},
+            max_attempts=3,
+        )
+
+    @pytest.mark.unit
+    async def test_finished_events_are_logged_in_one_insert(self):
+        session = FakeSession()
+        dispatcher = self._dispatcher(session)
+        # 1 — done, 2 — failed (попытки исчерпаны), 3 — будет повторено и в журнал пока не попадает
+        dispatcher.claim = AsyncMock(return_value=[
+            event(1, "CHATWOOT:a"), event(2, "CHATWOOT:b", attempts=3), event(3, "CHATWOOT:c"),
+        ])
+
+        await dispatcher.run_once()
+
+        inserts = audit_inserts(session)
+        assert len(inserts) == 1
+        assert inserts[0].table.fullname == "log.webhook_log"
+        ids = inserts[0].select.whereclause.right.value
+        assert sorted(ids) == [1, 2]
+
+    @pytest.mark.unit
+    async def test_audit_error_does_not_block_queue(self):
+        session = FakeSession(fail_inserts=True)
+        dispatcher = self._dispatcher(session)
+        dispatcher.claim = AsyncMock(return_value=[event(1, "CHATWOOT:a")])
+
+        stats = await dispatcher.run_once()
+
+        assert stats["processed"] == 1
+        assert [values["status"] for _, values in inbox_updates(session)] == ["done"]
+        session.commit.assert_awaited()
@@ -0,0 +1,155 @@
+"""
+Тесты рассылки WebSocket (routers.websocket.ConnectionManager).
+
+Проверяем:
+    - медленный клиент не задерживает остальных и отключается при переполнении очереди
+    - сообщение сериализуется один раз на рассылку
+    - обновления из consultation_event_hub доходят до клиентов без повторов
+    - NOTIFY, пришедший во время загрузки обновлений hub, доходит до клиента
+    - ответ на ping идет через очередь клиента
+"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from FastAPI.routers import websocket as ws
+from FastAPI.services import consultation_events
+from FastAPI.services.consultation_events import ConsultationEventHub
+
+
+class FakeWebSocket:
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+@pytest.fixture
+def hub():
+    fresh = ConsultationEventHub()
+    with patch.object(ws, "consultation_event_hub", fresh):
+        yield fresh
+
+
+async def _drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestConnectionManager:
+
+    @pytest.mark.unit
+    async def test_slow_client_is_disconnected_without_blocking_others(self, hub):
+        manager = ws.ConnectionManager(queue_size=2, send_timeout=5)
+        fast, slow = FakeWebSocket(), FakeWebSocket(delay=3600)
+        await manager.connect(fast, "c1")
+        await manager.connect(slow, "c1")
+
+        for n in range(4):
+            await manager.broadcast_to_consultation("c1", {"n": n})
+            await _drain()
+
+        assert len(fast.sent) == 4
+        assert slow not in manager.active_connections["c1"]
+        assert slow.closed_with == ws.SLOW_CONSUMER_CLOSE_CODE
+        assert manager.slow_disconnects == 1
+
+        manager.disconnect(fast, "c1")
+        await _drain()
+        assert "c1" not in manager.active_connections
+        assert hub.subscriber_count == 0
+
+    @pytest.mark.unit
+    async def test_message_serialized_once_per_broadcast(self, hub):
+        manager = ws.ConnectionManager(queue_size=4, send_timeout=5)
+        clients = [FakeWebSocket() for _ in range(50)]
+        for client in clients:
+            await manager.connect(client, "c1")
+
+        with patch.object(ws, "serialize_message", wraps=ws.serialize_message) as serialize:
+            await manager.broadcast_to_consultation("c1", {"type": "update"})
+            await _drain()
+
+        assert serialize.call_count == 1
+        assert all(client.sent == ['{"type": "update"}'] for client in clients)
+
+        for client in clients:
+            manager.disconnect(client, "c1")
+
+    @pytest.mark.unit
+    async def test_send_text_goes_through_client_queue(self, hub):
+        manager = ws.ConnectionManager(queue_size=4, send_timeout=5)
+        client = FakeWebSocket()
+        await manager.connect(client, "c1")
+
+        assert manager.send_text("c1", client, "pong") is True
+        await _drain()
+        assert client.sent == ["pong"]
+
+        manager.disconnect(client, "c1")
+        assert manager.send_text("c1", client, "pong") is False
+
+    @pytest.mark.unit
+    async def test_hub_updates_are_relayed_once(self, hub):
+        manager = ws.ConnectionManager(queue_size=4, send_timeout=5)
+        client = FakeWebSocket()
+        await manager.connect(client, "c1")
+        await _drain()
+        update = {"has_updates": True, "consultation": {"cons_id": "c1"}, "updated_at": "2025-01-10T09:00:00+00:00"}
+
+        hub.deliver("c1", update)
+        hub.deliver("c1", dict(update))
+        await _drain()
+
+        assert client.sent == ['{"type": "update", "data": {"cons_id": "c1"}}']
+        manager.disconnect(client, "c1")
+
+    @pytest.mark.unit
+    async def test_notification_during_hub_load_reaches_client(self, hub):
+        manager = ws.ConnectionManager(queue_size=4, send_timeout=5)
+        first, second = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(first, "c1")
+        await manager.connect(second, "c2")
+        loading = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_load(db, cons_ids):
+            if not loading.is_set():
+                loading.set()
+                await release.wait()
+            return {
+                c: {"has_updates": True, "consultation": {"cons_id": c}, "updated_at": "2025-01-10T09:00:00+00:00"}
+                for c in cons_ids
+            }
+
+        with patch.object(consultation_events, "load_consultation_updates", AsyncMock(side_effect=slow_load)), \
+                patch("FastAPI.database.AsyncSessionLocal") as session_factory:
+            session_factory.return_value.__aenter__ = AsyncMock(return_value="db")
+            session_factory.return_value.__aexit__ = AsyncMock(return_value=False)
+
+            hub.handle_notification("c1")
+            await loading.wait()
+            hub.handle_notification("c2")
+            release.set()
+            await asyncio.wait_for(hub._flush_task, timeout=1)
+            await _drain()
+
+        assert first.sent == ['{"type": "update", "data": {"cons_id": "c1"}}']
+        assert second.sent == ['{"type": "update", "data": {"cons_id": "c2"}}']
+
+        manager.disconnect(first, "c1")
+        manager.disconnect(second, "c2")
+        await hub.stop()